@@ -0,0 +1,3 @@
+
+""" Performance benchmarks for simple_reactions_lib. Each module can be run with "python -m benchmarks.<module_name>" from the repository root """
+
@@ -0,0 +1,64 @@
+
+""" Compares two result files written by benchmarks.suite
+
+Usage:
+	python -m benchmarks.compare old.json new.json [--threshold 1.2] [--key minSec]
+
+Prints the new/old time ratio for every benchmark present in both files, and exits with status 1 if any ratio is above threshold (i.e. a regression)
+
+"""
+
+import argparse
+import json
+import sys
+
+
+def loadResults(inpPath):
+	""" Returns (metadata, {name:result}) for a file written by benchmarks.suite """
+	with open(inpPath, "r") as inpFile:
+		inpDict = json.load(inpFile)
+	return inpDict["metadata"], {x["name"]:x for x in inpDict["results"]}
+
+
+def getComparison(oldResults, newResults, key="minSec"):
+	""" Gets [name, oldTime, newTime, newTime/oldTime] for every benchmark in both dicts (see loadResults), ordered by name """
+	outRows = list()
+	for name in sorted( set(oldResults.keys()) & set(newResults.keys()) ):
+		oldTime, newTime = oldResults[name][key], newResults[name][key]
+		outRows.append( [name, oldTime, newTime, newTime/oldTime] )
+	return outRows
+
+
+def getRegressions(comparison, threshold=1.2):
+	""" Gets the rows of getComparison output where the time ratio is above threshold """
+	return [x for x in comparison if x[3] > threshold]
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+	parser.add_argument("oldPath")
+	parser.add_argument("newPath")
+	parser.add_argument("--threshold", type=float, default=1.2, help="Ratio (new/old) above which a benchmark counts as a regression")
+	parser.add_argument("--key", default="minSec", choices=["minSec", "medianSec", "meanSec"])
+	args = parser.parse_args(argv)
+
+	oldMetadata, oldResults = loadResults(args.oldPath)
+	newMetadata, newResults = loadResults(args.newPath)
+	for label in ["gitCommit", "platform", "python", "numpy", "scipy", "quick"]:
+		if oldMetadata.get(label) != newMetadata.get(label):
+			print("{}: {} -> {}".format(label, oldMetadata.get(label), newMetadata.get(label)))
+
+	comparison = getComparison(oldResults, newResults, key=args.key)
+	regressions = getRegressions(comparison, threshold=args.threshold)
+	for name, oldTime, newTime, ratio in comparison:
+		flag = " <-- REGRESSION" if ratio > args.threshold else ""
+		print("{:<70} {:>10.3f} {:>10.3f} ms {:>6.2f}x{}".format(name, oldTime*1e3, newTime*1e3, ratio, flag))
+
+	onlyOne = set(oldResults.keys()) ^ set(newResults.keys())
+	if len(onlyOne) > 0:
+		print("Not in both files: {}".format(", ".join(sorted(onlyOne))))
+	sys.exit( int(len(regressions) > 0) )
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,103 @@
+
+""" Reaction networks used by the benchmarks. Parameters are copied from the notebooks """
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.core_units as unitHelp
+import simple_reactions_lib.standard.mg_reactions as taylorReactHelp
+import simple_reactions_lib.standard.my_mg_reactions_net_rates as netReactHelp
+
+
+PLANCKS_CONSTANT_EV = 4.135667696e-15
+
+
+class BenchmarkNetwork():
+	""" Simple container for everything needed to run a reaction network
+
+	Attributes:
+		reactions: (list of ChemReactionTemplate objects)
+		startReactants: (list of ChemSpeciesStd objects)
+		variableConcSpecies: (list of str) Names of species whose concentrations are allowed to vary
+		temperature: (float)
+		potential: (float)
+		pH: (float)
+
+	"""
+	def __init__(self, reactions, startReactants, variableConcSpecies, temperature=300, potential=0, pH=0):
+		self.reactions = reactions
+		self.startReactants = startReactants
+		self.variableConcSpecies = variableConcSpecies
+		self.temperature = temperature
+		self.potential = potential
+		self.pH = pH
+
+	@property
+	def fixedConcReactants(self):
+		return [x for x in self.startReactants if x.name not in self.variableConcSpecies]
+
+
+def createNetRatesNetwork(potential=0):
+	""" The 7-reaction network from notebooks/my_model_attempt_1.ipynb (using my_mg_reactions_net_rates) """
+	prefactor = (unitHelp.BOLTZ_EV*300) / PLANCKS_CONSTANT_EV
+	reactions = [ netReactHelp.TafelReactionNet(1.26, prefactor, 0.23),
+	              netReactHelp.Heyrovsky_waterAssistedNet(0.28, prefactor, -1.07),
+	              netReactHelp.VolmerReactionNet(0.66, prefactor, -1.37),
+	              netReactHelp.OHAssistedDissolutionReaction_twoElectronXferNet(1.6, prefactor, -2.0),
+	              netReactHelp.WaterAssistReaction_twoElectronXferNet(1.6, prefactor, -2.0),
+	              netReactHelp.HydrogenBulkDiffusionNet(0.53, prefactor, 0.15),
+	              netReactHelp.CathodicOHDesorption(0.9+0.4, prefactor, 0.9) ]
+
+	pH = 7
+	protonConc = 10**(-1*pH)
+	startConcs = [ ["free",1.0], ["h_ads",0.0], ["oh_ads",0.0], ["mg2+",2e-5], ["h+",protonConc],
+	               ["oh-",1e-14/protonConc], ["h2",1e-5], ["h_diffused",1e-5] ]
+	startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in startConcs]
+	return BenchmarkNetwork(reactions, startReactants, ["free", "h_ads", "oh_ads"], temperature=300, potential=potential)
+
+
+def createTaylor2016Network(potential=-1.4):
+	""" The 4-reaction network from notebooks/taylor_2016_model.ipynb (using mg_reactions) """
+	reactions = [ taylorReactHelp.TafelReaction(1.04, 1e14),
+	              taylorReactHelp.VolmerReaction(1.06, 1e13),
+	              taylorReactHelp.CathodicOHDesorption(1.9, 1e13, 0.5, -0.83),
+	              taylorReactHelp.OHAssistedDissolution_Taylor2016(1.51, 1e13, 0.5, -2.38) ]
+	startConcs = [ ["free",1.0], ["h_ads",0.0], ["oh_ads",0.0], ["fixed_mg_2+",2e-5] ]
+	startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in startConcs]
+	return BenchmarkNetwork(reactions, startReactants, ["free", "h_ads", "oh_ads"], temperature=298, potential=potential, pH=11)
+
+
+def createSyntheticNetwork(nAdsorbates=20, nReactionsPerAdsorbate=3, seed=0, potential=-0.2):
+	""" A random surface network for scaling tests. Each adsorbate "x{i}" is made by proton-coupled adsorption onto a free site (free + h+ <-> x{i}); the remaining reactions are random isomerisations (x{i} <-> x{j}) and bimolecular exchanges (x{i} + x{j} <-> x{k} + free). Every reaction conserves surface sites, and barriers (0.5-0.9 eV) are drawn from a seeded generator, so the same arguments always give the same network
+
+	Args:
+		nAdsorbates: (int) Number of adsorbed species; there are nAdsorbates+1 variable species including "free"
+		nReactionsPerAdsorbate: (int) Number of surface reactions per adsorbate (in addition to its adsorption reaction)
+		seed: (int) Seed for the random barriers and reaction choices
+		potential: (float)
+
+	Returns
+		network: (BenchmarkNetwork)
+
+	"""
+	rng = np.random.default_rng(seed)
+	prefactor = 1e13
+	adsNames = ["x{}".format(idx) for idx in range(nAdsorbates)]
+
+	def _getNetReaction(reactants, products, nElecTransfer=0):
+		forwardBarrier, backwardBarrier = rng.uniform(0.5, 0.9, size=2)
+		forward = coreHelp.BetterReactionTemplate(reactants, products, forwardBarrier, prefactor, nElecTransfer=nElecTransfer)
+		backward = coreHelp.BetterReactionTemplate(products, reactants, backwardBarrier, prefactor, nElecTransfer=-1*nElecTransfer)
+		return coreHelp.NetReactionTemplate(forward, backward)
+
+	reactions = [_getNetReaction(["free","h+"], [name], nElecTransfer=1) for name in adsNames]
+	for unused in range(nAdsorbates*nReactionsPerAdsorbate):
+		idxA, idxB, idxC = rng.choice(nAdsorbates, size=3, replace=False)
+		if rng.random() < 0.5:
+			reactions.append( _getNetReaction([adsNames[idxA]], [adsNames[idxB]]) )
+		else:
+			reactions.append( _getNetReaction([adsNames[idxA],adsNames[idxB]], [adsNames[idxC],"free"]) )
+
+	startConcs = [["free",1.0]] + [[name,0.0] for name in adsNames] + [["h+",1e-7]]
+	startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in startConcs]
+	return BenchmarkNetwork(reactions, startReactants, ["free"]+adsNames, temperature=300, potential=potential)
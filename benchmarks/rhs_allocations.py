@@ -0,0 +1,66 @@
+
+""" Measures the cost of one call to the function ConcsPropagatorTemplate.getFunctToPropagate returns (i.e. the RHS every solve_ivp step evaluates) for the standard and compiled rate calculators.
+
+Reported per call:
+	timeMicroSec: Wall time
+	retainedBlocks: Memory blocks still alive after the call (i.e. the returned derivative; a small numpy array is 2 blocks)
+	peakTransientBytes: Peak extra memory allocated during the call (e.g. deep-copied reactants)
+
+"""
+
+import timeit
+import tracemalloc
+
+import numpy as np
+
+import simple_reactions_lib.core.improved_controller as contrHelp
+
+from . import networks as networkHelp
+
+
+def getRHSCallStats(rateCalculator, network, nCalls=2000):
+	""" Returns a dict of per-call stats for the RHS built from rateCalculator """
+	propagator = contrHelp.ConcsPropagatorTemplate(rateCalculator, network.variableConcSpecies)
+	rhsFunct = propagator.getFunctToPropagate(network.startReactants, network.temperature, network.potential)
+	startConcs = np.array([x.conc for x in network.startReactants if x.name in network.variableConcSpecies])
+	rhsFunct(0, startConcs) #Warm up any caches
+
+	timePerCall = min( timeit.repeat(lambda: rhsFunct(0, startConcs), number=nCalls, repeat=3) ) / nCalls
+	retainedBlocks, peakBytes = _getMemoryStatsPerCall(lambda: rhsFunct(0, startConcs), nCalls)
+	baseBlocks, basePeakBytes = _getMemoryStatsPerCall(lambda: None, nCalls) #Overhead of the measuring loop itself
+	return {"timeMicroSec": timePerCall*1e6,
+	        "retainedBlocks": retainedBlocks - baseBlocks,
+	        "peakTransientBytes": peakBytes - basePeakBytes}
+
+
+def _getMemoryStatsPerCall(funct, nCalls):
+	#Keep the outputs alive so only the temporaries get freed
+	outputs = list()
+	tracemalloc.start()
+	startSnapshot = tracemalloc.take_snapshot()
+	peakMemories = list()
+	for idx in range(nCalls):
+		currMemory, unused = tracemalloc.get_traced_memory()
+		tracemalloc.reset_peak()
+		outputs.append( funct() )
+		unused, currPeak = tracemalloc.get_traced_memory()
+		peakMemories.append(currPeak-currMemory)
+	endSnapshot = tracemalloc.take_snapshot()
+	tracemalloc.stop()
+
+	retainedBlocks = sum( [x.count_diff for x in endSnapshot.compare_to(startSnapshot, "lineno")] )
+	return retainedBlocks/nCalls, sum(peakMemories)/nCalls
+
+
+def main():
+	network = networkHelp.createNetRatesNetwork()
+	calculators = [ ["RateCalculatorStandard", contrHelp.RateCalculatorStandard(network.reactions)],
+	                ["CompiledRateCalculator", contrHelp.CompiledRateCalculator(network.reactions)] ]
+	for label, calculator in calculators:
+		stats = getRHSCallStats(calculator, network)
+		print("{}: time={:.2f}us, retainedBlocks={:.2f}, peakTransientBytes={:.0f}".format(label, stats["timeMicroSec"], stats["retainedBlocks"], stats["peakTransientBytes"]))
+
+
+if __name__ == '__main__':
+	main()
+
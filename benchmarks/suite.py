@@ -0,0 +1,212 @@
+
+""" Benchmark suite covering rate evaluation, propagation, steady-state solves and potential sweeps. Results are written as JSON (see compare.py for comparing two result files)
+
+Usage:
+	python -m benchmarks.suite --out results.json [--quick] [--filter moveForwardByT]
+
+Each result has a unique "name" (workload/network/variant) and per-call wall times in seconds ("minSec", "medianSec", "meanSec"). The minimum over repeats is the least noisy value to compare between commits; the median is kept to show spread
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import numpy as np
+import scipy
+
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.propagators as propHelp
+import simple_reactions_lib.standard.drive_reactions as driveHelp
+import simple_reactions_lib.standard.sweeps as sweepHelp
+
+from . import networks as networkHelp
+
+
+FORMAT_VERSION = 1
+
+#Time moved forward per moveForwardByT call. The explicit (standard) propagator needs one step per ~10% concentration change, so its horizon is kept short
+PROPAGATION_TIMES = {"ConcsPropagatorStandard":1e-4, "DOP853":1e-4, "Radau":1.0, "BDF":1.0, "Auto":1.0}
+SOLVER_OPTIONS = {"rtol":1e-6, "atol":1e-12}
+SWEEP_POTENTIALS = np.linspace(-1.6, -0.4, 13)
+
+
+def getNetworks(quick=False):
+	""" Gets a dict of label:BenchmarkNetwork; quick leaves out the largest synthetic network """
+	outDict = {"taylor2016": networkHelp.createTaylor2016Network(),
+	           "netRates": networkHelp.createNetRatesNetwork(),
+	           "synthetic20": networkHelp.createSyntheticNetwork(nAdsorbates=20)}
+	if not quick:
+		outDict["synthetic100"] = networkHelp.createSyntheticNetwork(nAdsorbates=100)
+	return outDict
+
+
+def getTimings(funct, nCalls=1, nRepeats=5, setupFunct=None):
+	""" Times funct() (called nCalls times per repeat); setupFunct() is called untimed before each repeat
+
+	Returns
+		timings: (dict) "minSec", "medianSec" and "meanSec" per call, plus "nCalls" and "nRepeats"
+
+	"""
+	perCallTimes = list()
+	for unused in range(nRepeats):
+		if setupFunct is not None:
+			setupFunct()
+		startTime = time.perf_counter()
+		for unusedB in range(nCalls):
+			funct()
+		perCallTimes.append( (time.perf_counter()-startTime) / nCalls )
+	return {"minSec":min(perCallTimes), "medianSec":statistics.median(perCallTimes), "meanSec":statistics.mean(perCallTimes),
+	        "nCalls":nCalls, "nRepeats":nRepeats}
+
+
+def benchmarkGetRates(networks, quick=False):
+	""" Throughput of getRates for the standard and compiled rate calculators """
+	outResults = list()
+	calculatorClasses = [contrHelp.RateCalculatorStandard, contrHelp.CompiledRateCalculator]
+	for label, network in networks.items():
+		for calcClass in calculatorClasses:
+			calculator = calcClass(network.reactions)
+			currKwargs = {"temperature":network.temperature, "potential":network.potential}
+			timings = getTimings(lambda: calculator.getRates(network.startReactants, **currKwargs), nCalls=20 if quick else 200)
+			timings["callsPerSec"] = 1/timings["minSec"]
+			outResults.append( _getResult("getRates", label, calcClass.__name__, timings) )
+	return outResults
+
+
+def benchmarkMoveForwardByT(networks, quick=False):
+	""" Latency of ReactionControllerImproved.moveForwardByT (from the start reactants) for each propagator """
+	outResults = list()
+	for label, network in networks.items():
+		for propLabel in PROPAGATION_TIMES.keys():
+			if (propLabel == "ConcsPropagatorStandard") and label.startswith("synthetic"):
+				continue #Far too slow to be useful
+			controller = contrHelp.ReactionControllerImproved(_createPropagator(propLabel, network), network.startReactants,
+			                                                  temperature=network.temperature, potential=network.potential)
+			timeStep = PROPAGATION_TIMES[propLabel]
+			timings = getTimings(lambda: controller.moveForwardByT(timeStep), nRepeats=3 if quick else 5, setupFunct=controller.reset)
+			timings["simulatedTime"] = timeStep
+			outResults.append( _getResult("moveForwardByT", label, propLabel, timings) )
+	return outResults
+
+
+def benchmarkSteadyState(networks, quick=False):
+	""" Time-to-solution for steady states; by direct solve (solveSteadyState) and by integrating (runUntilSteadyState) """
+	outResults = list()
+	for label, network in networks.items():
+		controller = _createController(network, "BDF")
+		timings = getTimings(lambda: driveHelp.solveSteadyState(controller), nRepeats=3 if quick else 5, setupFunct=controller.reset)
+		outResults.append( _getResult("steadyState", label, "solveSteadyState", timings) )
+
+		timings = getTimings(lambda: driveHelp.runUntilSteadyState(controller), nRepeats=1 if quick else 3, setupFunct=controller.reset)
+		outResults.append( _getResult("steadyState", label, "runUntilSteadyState_BDF", timings) )
+	return outResults
+
+
+def benchmarkPotentialSweeps(networks, quick=False):
+	""" Time for a full sweep over SWEEP_POTENTIALS; independent steady-state solves, continuation from one point to the next and a fixed-time ensemble integration """
+	outResults = list()
+	potentials = SWEEP_POTENTIALS[::4] if quick else SWEEP_POTENTIALS
+	nRepeats = 1 if quick else 3
+	for label, network in networks.items():
+		conditions = sweepHelp.getConditionGrid(potentials, temperatures=[network.temperature], pHs=[network.pH])
+		runner = sweepHelp.SweepRunner(network.reactions, network.startReactants, network.variableConcSpecies, nWorkers=1)
+		timings = getTimings(lambda: runner.run(conditions), nRepeats=nRepeats)
+		outResults.append( _getResult("potentialSweep", label, "SweepRunner.run", timings, nPoints=len(potentials)) )
+
+		timings = getTimings(lambda: runner.runForTime(conditions, 1.0, solverOptions=SOLVER_OPTIONS), nRepeats=nRepeats)
+		outResults.append( _getResult("potentialSweep", label, "SweepRunner.runForTime", timings, nPoints=len(potentials)) )
+
+		controller = _createController(network, "BDF")
+		def _runContinuation():
+			controller.reset()
+			driveHelp.solveSteadyState(controller)
+			driveHelp.getSteadyStatesAlongParam(controller, potentials)
+		timings = getTimings(_runContinuation, nRepeats=nRepeats)
+		outResults.append( _getResult("potentialSweep", label, "getSteadyStatesAlongParam", timings, nPoints=len(potentials)) )
+	return outResults
+
+
+WORKLOADS = {"getRates":benchmarkGetRates, "moveForwardByT":benchmarkMoveForwardByT,
+             "steadyState":benchmarkSteadyState, "potentialSweep":benchmarkPotentialSweeps}
+
+
+def runSuite(quick=False, workloads=None):
+	""" Runs the benchmarks and returns a JSON-serialisable dict
+
+	Args:
+		quick: (bool) Use fewer repeats and smaller networks/grids; useful as a smoke test, but too noisy to compare timings
+		workloads: (Optional, iter of str) Keys of WORKLOADS to run; default is all
+
+	Returns
+		outDict: (dict) "metadata" (see getMetadata) and "results" (list of dicts, one per benchmark)
+
+	"""
+	workloads = list(WORKLOADS.keys()) if workloads is None else list(workloads)
+	networks = getNetworks(quick=quick)
+	outResults = list()
+	for key in workloads:
+		outResults.extend( WORKLOADS[key](networks, quick=quick) )
+	return {"metadata":getMetadata(quick=quick), "results":outResults}
+
+
+def getMetadata(quick=False):
+	""" Information needed to decide whether two result files are comparable """
+	return {"formatVersion":FORMAT_VERSION, "timestamp":datetime.datetime.now(datetime.timezone.utc).isoformat(),
+	        "gitCommit":_getGitCommit(), "quick":quick, "python":platform.python_version(), "numpy":np.__version__,
+	        "scipy":scipy.__version__, "platform":platform.platform(), "processor":platform.processor(), "cpuCount":os.cpu_count()}
+
+
+def _getResult(workload, networkLabel, variant, timings, **kwargs):
+	outDict = {"name":"/".join([workload, networkLabel, variant]), "workload":workload, "network":networkLabel, "variant":variant}
+	outDict.update(timings)
+	outDict.update(kwargs)
+	return outDict
+
+
+def _createPropagator(propLabel, network):
+	if propLabel == "ConcsPropagatorStandard":
+		concChangesFinder = contrHelp.ConcChangesFinderStandard(contrHelp.RateCalculatorStandard(network.reactions), network.variableConcSpecies)
+		return contrHelp.ConcsPropagatorStandard(concChangesFinder)
+
+	rateCalculator = contrHelp.CompiledRateCalculator(network.reactions)
+	if propLabel == "DOP853":
+		return propHelp.ConcsPropagator_DOP853(rateCalculator, network.variableConcSpecies, aTol=SOLVER_OPTIONS["atol"], rTol=SOLVER_OPTIONS["rtol"])
+	propClass = {"Radau":propHelp.ConcsPropagator_Radau, "BDF":propHelp.ConcsPropagator_BDF, "Auto":propHelp.ConcsPropagator_Auto}[propLabel]
+	return propClass(rateCalculator, network.variableConcSpecies, solverOptions=SOLVER_OPTIONS)
+
+
+def _createController(network, propLabel):
+	propagator = _createPropagator(propLabel, network)
+	return contrHelp.ReactionControllerImproved(propagator, network.startReactants, temperature=network.temperature, potential=network.potential)
+
+
+def _getGitCommit():
+	try:
+		repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+		return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repoDir, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Run the simple_reactions_lib benchmark suite")
+	parser.add_argument("--out", default="benchmark_results.json", help="Path of the JSON file to write")
+	parser.add_argument("--quick", action="store_true", help="Fewer repeats and smaller problems (smoke test only)")
+	parser.add_argument("--filter", nargs="*", choices=list(WORKLOADS.keys()), help="Workloads to run; default is all")
+	args = parser.parse_args(argv)
+
+	outDict = runSuite(quick=args.quick, workloads=args.filter)
+	with open(args.out, "w") as outFile:
+		json.dump(outDict, outFile, indent=1)
+	for result in outDict["results"]:
+		print("{:<70} {:>12.3f} ms".format(result["name"], result["minSec"]*1e3))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,81 @@
+
+""" Compares SweepRunner.run in this process (nWorkers=1) against a process pool, to check the pool actually pays for itself once worker start-up and shipping the network to each worker (_initWorker) are included.
+
+Reported per worker count:
+	minSec: Wall time for the whole grid (best of nRepeats); includes creating the pool each time, as run() does
+	speedup: Serial minSec divided by this minSec
+
+Also reported:
+	perConditionSec: Serial time per grid point
+	poolOverheadSec: Extra time for a one-point grid in a 2-worker pool over the same grid in-process (i.e. pool start-up plus _initWorker)
+
+Usage:
+	python -m benchmarks.sweep_scaling [--nPoints 48] [--workers 1 2 4]
+
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+import simple_reactions_lib.standard.sweeps as sweepHelp
+
+from . import networks as networkHelp
+from . import suite as suiteHelp
+
+
+def getSweepScaling(network, potentials, workerCounts, nRepeats=3):
+	""" Times SweepRunner.run over potentials for each worker count
+
+	Args:
+		network: (BenchmarkNetwork)
+		potentials: (iter of float) Grid points; temperature and pH are taken from network
+		workerCounts: (iter of int) Values of nWorkers to time. Should include 1, which speedups are relative to
+		nRepeats: (int) Number of times to run each sweep
+
+	Returns
+		outDict: (dict) "results" is a list of dicts (nWorkers, minSec, medianSec, speedup); also has perConditionSec, poolOverheadSec and cpuCount
+
+	"""
+	conditions = sweepHelp.getConditionGrid(potentials, temperatures=[network.temperature], pHs=[network.pH])
+	outResults = list()
+	for nWorkers in workerCounts:
+		runner = sweepHelp.SweepRunner(network.reactions, network.startReactants, network.variableConcSpecies, nWorkers=nWorkers)
+		timings = suiteHelp.getTimings(lambda: runner.run(conditions), nRepeats=nRepeats)
+		outResults.append( {"nWorkers":nWorkers, "minSec":timings["minSec"], "medianSec":timings["medianSec"]} )
+
+	serialTime = [x["minSec"] for x in outResults if x["nWorkers"]==1][0]
+	for result in outResults:
+		result["speedup"] = serialTime / result["minSec"]
+
+	return {"results":outResults, "perConditionSec":serialTime/len(conditions),
+	        "poolOverheadSec":_getPoolOverhead(network, conditions[:1], nRepeats=nRepeats), "cpuCount":os.cpu_count()}
+
+
+def _getPoolOverhead(network, conditions, nRepeats=3):
+	args = [network.reactions, network.startReactants, network.variableConcSpecies]
+	serialRunner, pooledRunner = sweepHelp.SweepRunner(*args, nWorkers=1), sweepHelp.SweepRunner(*args, nWorkers=2)
+	serialTime = suiteHelp.getTimings(lambda: serialRunner.run(conditions), nRepeats=nRepeats)["minSec"]
+	pooledTime = suiteHelp.getTimings(lambda: pooledRunner.run(conditions), nRepeats=nRepeats)["minSec"]
+	return pooledTime - serialTime
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Compare serial and process-pool SweepRunner.run")
+	parser.add_argument("--nPoints", type=int, default=48, help="Number of potentials in the sweep")
+	parser.add_argument("--workers", type=int, nargs="*", default=[1,2,4], help="Worker counts to time; must include 1")
+	args = parser.parse_args(argv)
+
+	potentials = np.linspace(-1.6, -0.4, args.nPoints)
+	networks = {"taylor2016":networkHelp.createTaylor2016Network(), "netRates":networkHelp.createNetRatesNetwork()}
+	for label, network in networks.items():
+		outDict = getSweepScaling(network, potentials, args.workers)
+		print("{} ({} points, cpuCount={}): perCondition={:.2f} ms, poolOverhead={:.1f} ms".format(label, args.nPoints, outDict["cpuCount"],
+		      outDict["perConditionSec"]*1e3, outDict["poolOverheadSec"]*1e3))
+		for result in outDict["results"]:
+			print("\tnWorkers={:<3} {:>10.1f} ms  speedup={:.2f}".format(result["nWorkers"], result["minSec"]*1e3, result["speedup"]))
+
+
+if __name__ == '__main__':
+	main()
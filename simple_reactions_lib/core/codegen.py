@@ -0,0 +1,201 @@
+
+""" Generates straight-line Python source for the rates of change (and dense Jacobian) of a CompiledReactionNetwork. For the small, stiff networks we integrate many times this avoids the per-call overhead of NumPy operations on very short vectors
+
+The source only depends on the network structure, so it is compiled once per structure and cached on a hash of it. Rate constants and fixed-species concentrations are folded into one constant per channel when binding to a set of conditions (see getGeneratedFunctions) """
+
+import collections
+import hashlib
+
+import numpy as np
+
+try:
+	import numba
+except ImportError:
+	numba = None
+
+
+BACKENDS = ("python", "numba", "auto")
+
+_FACTORY_CACHE = dict()
+
+
+def isNumbaAvailable():
+	return numba is not None
+
+
+def getGeneratedFunctions(network, varIndices, rateConsts, concs, backend="python"):
+	""" Gets f(time, varConcs)->d[varConcs]/dt and its Jacobian, specialised for a network and set of conditions
+
+	Args:
+		network: (CompiledReactionNetwork)
+		varIndices: (iter of int) Network index of each variable species; defines the order of varConcs
+		rateConsts: (float array) Rate constant for each channel
+		concs: (float array) Concentrations of all network species (e.g. a work buffer); only fixed species values are used, and are treated as constants
+		backend: (str) "python" (exec-compiled source), "numba" (the same source jit-compiled; needs numba) or "auto" (numba if available)
+
+	Returns
+		ratesFunct: f(time, varConcs)->(nVar float array)
+		jacFunct: f(time, varConcs)->(nVar x nVar float array)
+
+	Raises:
+		ValueError: If backend is unknown, or is "numba" and numba is not installed
+
+	"""
+	backend = _getResolvedBackend(backend)
+	varIndices = [int(x) for x in varIndices]
+	factory = _getFactory(network, varIndices, backend)
+	foldedConsts = getFoldedRateConstants(network, varIndices, rateConsts, concs)
+	return factory(foldedConsts)
+
+
+def getFoldedRateConstants(network, varIndices, rateConsts, concs):
+	""" Gets rateConst * (product of fixed reactant concentrations) for each channel; i.e. the constant part of each channel rate when only varIndices species vary """
+	workBuffer = network.createWorkBuffer(concs[:network.nSpecies])
+	workBuffer[list(varIndices)] = 1
+	return np.asarray(rateConsts, dtype=float) * np.prod(workBuffer[network.reactantIndices], axis=1)
+
+
+def getNetworkHash(network, varIndices):
+	""" Gets a hash of everything the generated source depends on (stoichiometry, reactant orders and which species vary) """
+	hashObj = hashlib.sha1()
+	hashObj.update( repr( (network.nSpecies, network.nChannels, tuple(varIndices)) ).encode() )
+	hashObj.update( np.ascontiguousarray(network.stoichMatrix, dtype=float).tobytes() )
+	hashObj.update( np.ascontiguousarray(network.reactantIndices, dtype=np.int64).tobytes() )
+	return hashObj.hexdigest()
+
+
+def generateSource(network, varIndices, backend="python"):
+	""" Gets the source code of a factory function, makeFunctions(foldedConsts)->(ratesFunct, jacFunct), for the network. See getGeneratedFunctions """
+	termInfo = _getChannelTerms(network, varIndices)
+	nVar = len(varIndices)
+	if backend == "numba":
+		return _generateNumbaSource(network, varIndices, termInfo, nVar)
+	return _generatePythonSource(network, varIndices, termInfo, nVar)
+
+
+def _getResolvedBackend(backend):
+	if backend not in BACKENDS:
+		raise ValueError("backend must be one of {}, not {}".format(BACKENDS, backend))
+	if backend == "auto":
+		return "numba" if isNumbaAvailable() else "python"
+	if backend == "numba" and not isNumbaAvailable():
+		raise ValueError('backend="numba" needs numba installed')
+	return backend
+
+
+def _getFactory(network, varIndices, backend):
+	key = (getNetworkHash(network, varIndices), backend)
+	if key not in _FACTORY_CACHE:
+		source = generateSource(network, varIndices, backend=backend)
+		namespace = {"np":np, "numba":numba}
+		exec(compile(source, "<generated_rates_{}>".format(key[0][:12]), "exec"), namespace)
+		_FACTORY_CACHE[key] = namespace["makeFunctions"]
+	return _FACTORY_CACHE[key]
+
+
+def _getChannelTerms(network, varIndices):
+	""" For each channel affecting a variable species: (channelIdx, {varPosition:power}). Channels which change no variable species are dropped """
+	varPositions = {netIdx:pos for pos,netIdx in enumerate(varIndices)}
+	varStoich = network.stoichMatrix[list(varIndices)]
+	outTerms = list()
+	for cIdx in range(network.nChannels):
+		if not np.any(varStoich[:,cIdx] != 0):
+			continue
+		powers = collections.Counter( [varPositions[x] for x in network.reactantIndices[cIdx] if x in varPositions] )
+		outTerms.append( (cIdx, dict(powers)) )
+	return outTerms
+
+
+def _getProductExpr(constName, powers):
+	factors = [constName]
+	for pos in sorted(powers.keys()):
+		factors += ["x{}".format(pos)]*powers[pos]
+	return "*".join(factors)
+
+
+def _getSumExpr(coeffsAndNames):
+	""" Gets e.g. "-r0 +2*r3" from [(-1,"r0"), (2,"r3")]; "0.0" if empty """
+	parts = list()
+	for coeff, name in coeffsAndNames:
+		if coeff == 1:
+			parts.append("+{}".format(name))
+		elif coeff == -1:
+			parts.append("-{}".format(name))
+		else:
+			parts.append("{:+.17g}*{}".format(coeff, name))
+	return " ".join(parts) if len(parts) > 0 else "0.0"
+
+
+def _getBodyLines(network, varIndices, termInfo, nVar, indent):
+	""" Lines computing every channel rate (r{c}) and rate derivative (d{c}_{pos}), followed by expressions for each d[X]/dt and Jacobian element """
+	varStoich = network.stoichMatrix[list(varIndices)]
+	rateLines, derivLines = list(), list()
+	derivNames = dict() #(cIdx, pos) -> name
+	for cIdx, powers in termInfo:
+		rateLines.append("{}r{} = {}".format(indent, cIdx, _getProductExpr("k{}".format(cIdx), powers)))
+		for pos, power in powers.items():
+			otherPowers = dict(powers)
+			otherPowers[pos] -= 1
+			expr = _getProductExpr("k{}".format(cIdx), otherPowers)
+			expr = expr if power == 1 else "{}*{}".format(power, expr)
+			derivNames[(cIdx,pos)] = "d{}_{}".format(cIdx, pos)
+			derivLines.append("{}{} = {}".format(indent, derivNames[(cIdx,pos)], expr))
+
+	rateExprs = list()
+	for row in range(nVar):
+		rateExprs.append( _getSumExpr( [(varStoich[row,cIdx], "r{}".format(cIdx)) for cIdx,powers in termInfo if varStoich[row,cIdx] != 0] ) )
+
+	jacExprs = list()
+	for row in range(nVar):
+		rowExprs = list()
+		for col in range(nVar):
+			terms = [(varStoich[row,cIdx], derivNames[(cIdx,col)]) for cIdx,powers in termInfo if (varStoich[row,cIdx] != 0) and ((cIdx,col) in derivNames)]
+			rowExprs.append( _getSumExpr(terms) )
+		jacExprs.append(rowExprs)
+
+	return rateLines, derivLines, rateExprs, jacExprs
+
+
+def _getUnpackLine(nVar, indent):
+	if nVar == 0:
+		return "{}pass".format(indent)
+	names = ", ".join(["x{}".format(x) for x in range(nVar)])
+	return "{}{}, = y.tolist()".format(indent, names) if nVar == 1 else "{}{} = y.tolist()".format(indent, names)
+
+
+def _generatePythonSource(network, varIndices, termInfo, nVar):
+	rateLines, derivLines, rateExprs, jacExprs = _getBodyLines(network, varIndices, termInfo, nVar, "\t\t")
+	outLines = ["def makeFunctions(foldedConsts):"]
+	outLines += ["\tk{} = float(foldedConsts[{}])".format(cIdx,cIdx) for cIdx,powers in termInfo]
+	outLines += ["", "\tdef rates(time, y):", _getUnpackLine(nVar, "\t\t")]
+	outLines += rateLines
+	outLines += ["\t\treturn np.array(({},), dtype=float)".format(", ".join(rateExprs)) if nVar > 0 else "\t\treturn np.zeros(0)"]
+	outLines += ["", "\tdef jacobian(time, y):", _getUnpackLine(nVar, "\t\t")]
+	outLines += derivLines
+	jacRows = ["({},)".format(", ".join(x)) for x in jacExprs]
+	outLines += ["\t\treturn np.array(({},), dtype=float)".format(", ".join(jacRows)) if nVar > 0 else "\t\treturn np.zeros((0,0))"]
+	outLines += ["", "\treturn rates, jacobian", ""]
+	return "\n".join(outLines)
+
+
+def _generateNumbaSource(network, varIndices, termInfo, nVar):
+	""" Same maths as _generatePythonSource, but the inner functions take the folded constants as an argument (so are only jit-compiled once per network) and fill preallocated outputs """
+	rateLines, derivLines, rateExprs, jacExprs = _getBodyLines(network, varIndices, termInfo, nVar, "\t")
+	unpackLines = ["\tx{} = y[{}]".format(x,x) for x in range(nVar)]
+	constLines = ["\tk{} = kc[{}]".format(cIdx,cIdx) for cIdx,powers in termInfo]
+
+	outLines = ["@numba.njit(cache=False)", "def _rates(y, kc):"] + unpackLines + constLines + rateLines
+	outLines += ["\tout = np.empty({})".format(nVar)]
+	outLines += ["\tout[{}] = {}".format(idx,expr) for idx,expr in enumerate(rateExprs)]
+	outLines += ["\treturn out", ""]
+
+	outLines += ["@numba.njit(cache=False)", "def _jacobian(y, kc):"] + unpackLines + constLines + derivLines
+	outLines += ["\tout = np.empty(({},{}))".format(nVar,nVar)]
+	outLines += ["\tout[{},{}] = {}".format(row,col,expr) for row,rowExprs in enumerate(jacExprs) for col,expr in enumerate(rowExprs)]
+	outLines += ["\treturn out", ""]
+
+	outLines += ["def makeFunctions(foldedConsts):", "\tkc = np.array(foldedConsts, dtype=np.float64)", ""]
+	outLines += ["\tdef rates(time, y):", "\t\treturn _rates(np.asarray(y, dtype=np.float64), kc)", ""]
+	outLines += ["\tdef jacobian(time, y):", "\t\treturn _jacobian(np.asarray(y, dtype=np.float64), kc)", ""]
+	outLines += ["\treturn rates, jacobian", ""]
+	return "\n".join(outLines)
@@ -0,0 +1,637 @@
+
+import collections
+import types
+
+import numpy as np
+import scipy.sparse as sparseHelp
+
+from . import core_classes as coreHelp
+from . import core_units as unitHelp
+
+
+class CompiledReactionNetwork():
+	""" Array-based form of a list of reactions. The stoichiometry matrix and reactant-order index arrays are built once on creation; rates of change are then a few NumPy operations on a concentration vector
+
+	Attributes:
+		reactions: (list of ChemReactionTemplate) The reactions this network was compiled from
+		channels: (list of ChemReactionTemplate) One-directional ("elementary") reactions. NetReactionTemplate objects get split into their forward and backward reactions
+		channelReactionIndices: (int array) For each channel, the index of the reaction in self.reactions it came from
+		channelSigns: (float array) +1 for forward channels and -1 for backward channels; net flux of a reaction is sum(sign*channelRate) over its channels
+		speciesNames: (tuple of str) Every species appearing in any reaction; this defines the ordering of all concentration vectors
+		speciesIndices: (mapping) Immutable map of species name to index in concentration vectors
+		stoichMatrix: (nSpecies x nChannels float array) Net amount of each species created per unit of each channel
+		reactantIndices: (nChannels x maxOrder int array) Index of each reactant of each channel (repeated for higher orders). Padded with nSpecies, which always points at a concentration of 1
+		usesReactantDependentRateConstants: (bool) True if any channel may have a rate constant depending on concentrations (e.g. a Nernst-shifted Tafel factor). BetterReactionTemplate channels never do
+
+	"""
+
+	def __init__(self, reactions):
+		""" Initializer
+
+		Args:
+			reactions: (iter of ChemReactionTemplate/NetReactionTemplate objects)
+
+		"""
+		self.reactions = list(reactions)
+		self._createChannels()
+		self._createSpeciesMap()
+		self._createStoichMatrix()
+		self._createReactantIndices()
+		self.usesReactantDependentRateConstants = any( [not isinstance(x, coreHelp.BetterReactionTemplate) for x in self.channels] )
+		self._createWorkArrays()
+
+	def _createWorkArrays(self):
+		self._extConcs = np.ones( len(self.speciesNames)+1 )
+		self._reactantIndicesT = np.ascontiguousarray(self.reactantIndices.T)
+		self._concFactors = np.ones( self._reactantIndicesT.shape )
+		self._concFactorRows = tuple( [x for x in self._concFactors] )
+		self._channelRates = np.zeros( len(self.channels) )
+		self._stateIndicesCache = dict()
+		self._fillPlanCache = dict()
+
+	def _createChannels(self):
+		self.channels, reactionIndices, signs = list(), list(), list()
+		for idx,reaction in enumerate(self.reactions):
+			for channel,sign in _getElementaryChannels(reaction):
+				self.channels.append(channel)
+				reactionIndices.append(idx)
+				signs.append(sign)
+		self.channelReactionIndices = np.array(reactionIndices, dtype=int)
+		self.channelSigns = np.array(signs, dtype=float)
+
+	def _createSpeciesMap(self):
+		outNames = list()
+		for channel in self.channels:
+			for name in list(channel.reactants) + list(channel.products):
+				if name not in outNames:
+					outNames.append(name)
+		self.speciesNames = tuple(outNames)
+		self._speciesIndices = {name:idx for idx,name in enumerate(outNames)}
+		self.speciesIndices = types.MappingProxyType(self._speciesIndices)
+
+	def _createStoichMatrix(self):
+		self.stoichMatrix = np.zeros( (len(self.speciesNames), len(self.channels)) )
+		for cIdx, channel in enumerate(self.channels):
+			for name in channel.reactants:
+				self.stoichMatrix[self.speciesIndices[name], cIdx] -= 1
+			for name in channel.products:
+				self.stoichMatrix[self.speciesIndices[name], cIdx] += 1
+
+	def _createReactantIndices(self):
+		nSpecies = len(self.speciesNames)
+		maxOrder = max( [len(x.reactants) for x in self.channels] + [1] )
+		self.reactantIndices = np.full( (len(self.channels), maxOrder), nSpecies, dtype=int )
+		for cIdx, channel in enumerate(self.channels):
+			for oIdx, name in enumerate(channel.reactants):
+				self.reactantIndices[cIdx, oIdx] = self.speciesIndices[name]
+
+	@property
+	def nSpecies(self):
+		return len(self.speciesNames)
+
+	@property
+	def nChannels(self):
+		return len(self.channels)
+
+	def getRateConstants(self, temperature, potential=0, pH=0, inputReactants=None, logSpace=False):
+		""" Gets the mass-action rate constant (k0*tafelFactor) for every channel
+
+		Args:
+			temperature: (float) in Kelvin
+			potential: (float)
+			pH: (float)
+			inputReactants: (iter of ChemSpeciesStd) Passed to any Tafel factor which depends on (fixed) concentrations
+			logSpace: (bool) If True each rate constant is exp(ln(prefactor) - barrier/kT + tafelExponent), i.e. one exponential per channel (see self.getLogRateConstants) rather than a product of separate Arrhenius and Tafel factors
+
+		Returns
+			rateConsts: (float array) One value per channel
+
+		"""
+		currArgs = [inputReactants, temperature]
+		currKwargs = {"pH":pH, "potential":potential}
+		if logSpace:
+			return np.exp( self.getLogRateConstants(temperature, potential=potential, pH=pH, inputReactants=inputReactants) )
+		return np.array( [x.getRateConstant(*currArgs, **currKwargs) for x in self.channels], dtype=float )
+
+	def getLogRateConstants(self, temperature, potential=0, pH=0, inputReactants=None):
+		""" Gets ln(rateConstant) for every channel; same arguments as getRateConstants. Values stay finite even when the rate constants would under/overflow """
+		currArgs = [inputReactants, temperature]
+		currKwargs = {"pH":pH, "potential":potential}
+		return np.array( [x.getLogRateConstant(*currArgs, **currKwargs) for x in self.channels], dtype=float )
+
+	def getChannelRates(self, concs, rateConsts, out=None):
+		""" Gets the rate of every channel, i.e. rateConst*[A]*[B]*...
+
+		Args:
+			concs: (float array) Concentrations in the order of self.speciesNames
+			rateConsts: (float array) Output of self.getRateConstants
+			out: (Optional, float array) Buffer to write the rates into
+
+		Returns
+			channelRates: (float array) One value per channel
+
+		"""
+		out = np.empty(self.nChannels) if out is None else out
+		self._extConcs[:-1] = concs
+		return self.getChannelRatesFromWorkBuffer(self._extConcs, rateConsts, out)
+
+	def getRatesOfChange(self, concs, rateConsts, out=None):
+		""" Gets d[X]/dt for every species in self.speciesNames
+
+		Args:
+			concs: (float array) Concentrations in the order of self.speciesNames
+			rateConsts: (float array) Output of self.getRateConstants
+			out: (Optional, float array) Buffer to write the rates of change into
+
+		Returns
+			ratesOfChange: (float array) One value per species
+
+		"""
+		out = np.empty(self.nSpecies) if out is None else out
+		self.getChannelRates(concs, rateConsts, out=self._channelRates)
+		return np.dot(self.stoichMatrix, self._channelRates, out)
+
+	def createWorkBuffer(self, concs=None):
+		""" Creates a buffer for the *FromWorkBuffer methods. This holds concentrations (ordered as self.speciesNames) followed by a trailing 1, which padded entries of self.reactantIndices point at. Writing concentrations straight into one of these avoids any copying when evaluating rates
+
+		Args:
+			concs: (Optional, float array) Initial concentrations; default is all 1
+
+		Returns
+			workBuffer: (float array) Length nSpecies+1
+
+		"""
+		outBuffer = np.ones(self.nSpecies+1)
+		if concs is not None:
+			outBuffer[:-1] = concs
+		return outBuffer
+
+	def fillWorkBuffer(self, inputReactants, workBuffer):
+		""" Writes concentrations from inputReactants into a buffer made by self.createWorkBuffer. Same conventions as getConcsFromReactants (missing species are given a concentration of 1), but the name-to-index mapping is cached on the names in inputReactants, so nothing is looked up per species
+
+		Args:
+			inputReactants: (iter of ChemSpeciesStd or SpeciesState)
+			workBuffer: (float array) Created by self.createWorkBuffer; modified in place
+
+		Returns
+			workBuffer: (float array) The input buffer
+
+		"""
+		if isinstance(inputReactants, coreHelp.SpeciesState):
+			names, concs = inputReactants.names, inputReactants.concs
+		else:
+			names, concs = tuple([x.name for x in inputReactants]), [x.conc for x in inputReactants]
+		netIndices, stateIndices, coversNetwork, usesAllInputs = self._getFillPlan(names)
+		if not coversNetwork:
+			workBuffer.fill(1)
+		workBuffer[netIndices] = concs if usesAllInputs else np.asarray(concs, dtype=float)[stateIndices]
+		return workBuffer
+
+	def _getFillPlan(self, names):
+		try:
+			return self._fillPlanCache[names]
+		except KeyError:
+			netIndices, stateIndices = self.getIndicesForState(names)
+			coversNetwork = len(set(netIndices.tolist())) == self.nSpecies
+			usesAllInputs = len(stateIndices) == len(names)
+			self._fillPlanCache[names] = (netIndices, stateIndices, coversNetwork, usesAllInputs)
+			return self._fillPlanCache[names]
+
+	def getChannelRatesFromWorkBuffer(self, workBuffer, rateConsts, out):
+		""" Same as getChannelRates, but reads concentrations from a buffer made by self.createWorkBuffer and requires an output buffer (so nothing is allocated) """
+		#Multiplying row-by-row (rather than np.prod) means numpy never allocates a reduction buffer
+		workBuffer.take(self._reactantIndicesT, None, self._concFactors, "clip") #"clip" stops numpy buffering a copy when out is given
+		np.multiply(self._concFactorRows[0], rateConsts, out)
+		rowIdx, nRows = 1, len(self._concFactorRows)
+		while rowIdx < nRows:
+			np.multiply(out, self._concFactorRows[rowIdx], out)
+			rowIdx += 1
+		return out
+
+	def getRatesOfChangeFromWorkBuffer(self, workBuffer, rateConsts, out):
+		""" Same as getRatesOfChange, but reads concentrations from a buffer made by self.createWorkBuffer and requires an output buffer (so nothing is allocated) """
+		self.getChannelRatesFromWorkBuffer(workBuffer, rateConsts, self._channelRates)
+		return np.dot(self.stoichMatrix, self._channelRates, out)
+
+	def getChannelRateDerivativeTerms(self, workBuffer, rateConsts):
+		""" Gets d(channelRate)/d[conc] split into one term per reactant slot. Entry [p,j] is the derivative of channel j's rate with respect to the concentration of its p-th reactant (i.e. species self.reactantIndices[j,p]); repeated reactants (e.g. [H]^2) give one term per repeat, which sum to the correct derivative
+
+		Args:
+			workBuffer: (float array) Created by self.createWorkBuffer
+			rateConsts: (float array) Output of self.getRateConstants
+
+		Returns
+			derivTerms: (maxOrder x nChannels float array)
+
+		"""
+		workBuffer.take(self._reactantIndicesT, None, self._concFactors, "clip")
+		outTerms = np.empty(self._concFactors.shape)
+		for pIdx in range(len(self._concFactorRows)):
+			outTerms[pIdx] = rateConsts
+			for qIdx, row in enumerate(self._concFactorRows):
+				if qIdx != pIdx:
+					outTerms[pIdx] *= row
+		return outTerms
+
+	def getJacobian(self, concs, rateConsts):
+		""" Gets the (dense) Jacobian d(d[X_i]/dt)/d[X_k] for all species in self.speciesNames """
+		jacCalculator = JacobianCalculator(self, range(self.nSpecies))
+		return jacCalculator.getJacobianFromWorkBuffer(self.createWorkBuffer(concs), rateConsts)
+
+	def getReactionFluxes(self, concs, rateConsts):
+		""" Gets the net rate of every reaction in self.reactions (forward minus backward for net reactions) """
+		channelRates = self.getChannelRates(concs, rateConsts)
+		return np.bincount( self.channelReactionIndices, weights=self.channelSigns*channelRates, minlength=len(self.reactions) )
+
+	def getConcsFromReactants(self, inputReactants):
+		""" Gets a concentration vector (ordered as self.speciesNames) from an iter of ChemSpeciesStd or a SpeciesState. Species missing from inputReactants are given a concentration of 1; this matches ChemReactionTemplate._getReactantConcRateFactor, which ignores them """
+		if isinstance(inputReactants, coreHelp.SpeciesState):
+			outConcs = np.ones(self.nSpecies)
+			netIndices, stateIndices = self.getIndicesForState(inputReactants.names)
+			outConcs[netIndices] = inputReactants.concs[stateIndices]
+			return outConcs
+
+		outConcs = [1.0 for x in self.speciesNames]
+		getIdx = self._speciesIndices.get
+		for reactant in inputReactants:
+			idx = getIdx(reactant.name)
+			if idx is not None:
+				outConcs[idx] = reactant.conc
+		return np.array(outConcs, dtype=float)
+
+	def getIndicesForState(self, stateNames):
+		""" Gets index arrays mapping a SpeciesState onto network concentration vectors (i.e. netConcs[netIndices] = state.concs[stateIndices]). Cached on stateNames
+
+		Args:
+			stateNames: (tuple of str) The SpeciesState.names attribute
+
+		Returns
+			netIndices: (int array) Indices in self.speciesNames
+			stateIndices: (int array) Indices in stateNames
+
+		"""
+		if stateNames not in self._stateIndicesCache:
+			pairs = [ [self._speciesIndices[name], idx] for idx,name in enumerate(stateNames) if name in self._speciesIndices ]
+			netIndices = np.array([x[0] for x in pairs], dtype=int)
+			stateIndices = np.array([x[1] for x in pairs], dtype=int)
+			self._stateIndicesCache[stateNames] = (netIndices, stateIndices)
+		return self._stateIndicesCache[stateNames]
+
+
+class ReducedReactionNetwork(CompiledReactionNetwork):
+	""" A CompiledReactionNetwork restricted to a subset of (variable) species. Every other species is a reservoir held at a fixed concentration, so its concentration factor is folded into the rate constant of each channel it takes part in (e.g. k*[H+]*[A] becomes k'*[A], with k' = k*[H+]). Channels which change no variable species are dropped. Work buffers, rates of change and Jacobians then only cover the variable species, and reactant orders only count variable reactants
+
+	The structure depends only on which species vary, so one of these can be reused for any reservoir concentrations; pass rate constants through getFoldedRateConstants whenever those concentrations (or conditions) change
+
+	Attributes (in addition to CompiledReactionNetwork; speciesNames, channels, stoichMatrix and reactantIndices describe the reduced system):
+		parentNetwork: (CompiledReactionNetwork)
+		varIndices: (int array) Index in parentNetwork.speciesNames of each species kept
+		channelIndices: (int array) Index in parentNetwork.channels of each channel kept
+		reservoirIndices: (nChannels x maxReservoirOrder int array) Index in parentNetwork.speciesNames of each reservoir reactant of each channel kept; padded with parentNetwork.nSpecies (a concentration of 1 in parent work buffers)
+
+	NOTE:
+		getRateConstants/getLogRateConstants give folded values, taking reservoir concentrations from inputReactants (1 for any missing). getReactionFluxes only includes the channels kept
+
+	"""
+
+	def __init__(self, parentNetwork, varIndices):
+		""" Initializer
+
+		Args:
+			parentNetwork: (CompiledReactionNetwork)
+			varIndices: (iter of int) Index in parentNetwork.speciesNames of each variable species; defines the species order of the reduced network
+
+		"""
+		self.parentNetwork = parentNetwork
+		self.varIndices = np.array(varIndices, dtype=int)
+		self.reactions = parentNetwork.reactions
+		varStoich = parentNetwork.stoichMatrix[self.varIndices]
+		self.channelIndices = np.nonzero( np.any(varStoich!=0, axis=0) )[0]
+		self.channels = [parentNetwork.channels[x] for x in self.channelIndices.tolist()]
+		self.channelReactionIndices = parentNetwork.channelReactionIndices[self.channelIndices]
+		self.channelSigns = parentNetwork.channelSigns[self.channelIndices]
+		self.speciesNames = tuple([parentNetwork.speciesNames[x] for x in self.varIndices.tolist()])
+		self._speciesIndices = {name:idx for idx,name in enumerate(self.speciesNames)}
+		self.speciesIndices = types.MappingProxyType(self._speciesIndices)
+		self.stoichMatrix = np.ascontiguousarray(varStoich[:, self.channelIndices])
+		self._createReducedReactantIndices()
+		self.usesReactantDependentRateConstants = any( [not isinstance(x, coreHelp.BetterReactionTemplate) for x in self.channels] )
+		self._createWorkArrays()
+
+	def _createReducedReactantIndices(self):
+		varPositions = {netIdx:pos for pos,netIdx in enumerate(self.varIndices.tolist())}
+		varRows, reservoirRows = list(), list()
+		for parentRow in self.parentNetwork.reactantIndices[self.channelIndices].tolist():
+			parentRow = [x for x in parentRow if x != self.parentNetwork.nSpecies]
+			varRows.append( [varPositions[x] for x in parentRow if x in varPositions] )
+			reservoirRows.append( [x for x in parentRow if x not in varPositions] )
+		self.reactantIndices = _getPaddedIndices(varRows, self.nSpecies)
+		self.reservoirIndices = _getPaddedIndices(reservoirRows, self.parentNetwork.nSpecies)
+
+	def getFoldedRateConstants(self, parentRateConsts, parentConcs, out=None):
+		""" Gets the rate constants of the reduced network
+
+		Args:
+			parentRateConsts: (float array) Rate constant for each channel of parentNetwork
+			parentConcs: (float array) Concentrations ordered as parentNetwork.speciesNames (a parent work buffer is also fine); only reservoir species values are used
+			out: (Optional, float array) Buffer to write into
+
+		Returns
+			rateConsts: (float array) One value per (reduced) channel
+
+		"""
+		out = np.empty(self.nChannels) if out is None else out
+		reservoirConcs = np.append(np.asarray(parentConcs, dtype=float)[:self.parentNetwork.nSpecies], 1)
+		np.multiply( np.asarray(parentRateConsts)[self.channelIndices], np.prod(reservoirConcs[self.reservoirIndices], axis=1), out )
+		return out
+
+	def getFoldedLogRateConstants(self, parentLogRateConsts, parentLogConcs, out=None):
+		""" Log-space version of getFoldedRateConstants; takes ln(rateConstant) and ln(conc) values and returns ln(folded rate constant) """
+		out = np.empty(self.nChannels) if out is None else out
+		reservoirLogConcs = np.append(np.asarray(parentLogConcs, dtype=float)[:self.parentNetwork.nSpecies], 0)
+		np.add( np.asarray(parentLogRateConsts)[self.channelIndices], np.sum(reservoirLogConcs[self.reservoirIndices], axis=1), out )
+		return out
+
+	def getRateConstants(self, temperature, potential=0, pH=0, inputReactants=None, logSpace=False):
+		if logSpace:
+			return np.exp( self.getLogRateConstants(temperature, potential=potential, pH=pH, inputReactants=inputReactants) )
+		parentRateConsts = np.zeros(self.parentNetwork.nChannels)
+		currArgs = [inputReactants, temperature]
+		parentRateConsts[self.channelIndices] = [x.getRateConstant(*currArgs, pH=pH, potential=potential) for x in self.channels]
+		return self.getFoldedRateConstants(parentRateConsts, self._getParentConcs(inputReactants))
+
+	def getLogRateConstants(self, temperature, potential=0, pH=0, inputReactants=None):
+		parentLogRateConsts = np.zeros(self.parentNetwork.nChannels)
+		currArgs = [inputReactants, temperature]
+		parentLogRateConsts[self.channelIndices] = [x.getLogRateConstant(*currArgs, pH=pH, potential=potential) for x in self.channels]
+		with np.errstate(divide="ignore"):
+			parentLogConcs = np.log( self._getParentConcs(inputReactants) )
+		return self.getFoldedLogRateConstants(parentLogRateConsts, parentLogConcs)
+
+	def getLogConcOffsets(self, inputReactants=None):
+		""" Gets ln(folded rate constant) - ln(rate constant) for each channel; i.e. the sum of ln(reservoir concentration) over reservoir reactants """
+		with np.errstate(divide="ignore"):
+			parentLogConcs = np.log( self._getParentConcs(inputReactants) )
+		return self.getFoldedLogRateConstants(np.zeros(self.parentNetwork.nChannels), parentLogConcs)
+
+	def _getParentConcs(self, inputReactants):
+		if inputReactants is None:
+			return np.ones(self.parentNetwork.nSpecies)
+		return self.parentNetwork.getConcsFromReactants(inputReactants)
+
+
+class RateConstantCache():
+	""" Bounded LRU cache of rate-constant vectors for a CompiledReactionNetwork. Arrhenius and Tafel factors only depend on conditions (temperature, potential, pH and the concentrations of spectator species), so each channel's rate constant only needs calculating once per distinct set of these
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		maxSize: (int) Maximum number of conditions to keep; the least recently used is dropped first
+		logSpace: (bool) If True values are ln(rateConstant)
+		hits: (int) Number of lookups served from the cache
+		misses: (int) Number of lookups which needed rate constants calculating
+
+	NOTE:
+		Spectator species are those no reaction changes (including any not in the network, e.g. "fixed_mg_2+" in the Taylor2016 model). Their concentrations are only part of the key if some channel is not a BetterReactionTemplate (these never depend on concentrations)
+
+		Reaction parameters (barrier, prefactor etc.) are not part of the key. Instead every stored value is dropped whenever an attribute of any reaction object has been set since it was calculated (see core_classes.ChemReactionBase.parameterVersion), so changing e.g. reaction.barrier in place is picked up. Changes this cant see (e.g. modifying an array attribute in place) need an explicit clear()
+
+	"""
+
+	def __init__(self, network, maxSize=128, logSpace=False):
+		""" Initializer
+
+		Args:
+			network: (CompiledReactionNetwork)
+			maxSize: (int) Maximum number of conditions to keep
+			logSpace: (bool) If True the cache holds ln(rateConstant) values (see CompiledReactionNetwork.getLogRateConstants) rather than rate constants
+
+		"""
+		self.network = network
+		self.maxSize = maxSize
+		self.logSpace = logSpace
+		self.hits = 0
+		self.misses = 0
+		self._cache = collections.OrderedDict()
+		self._lastKey, self._lastVals = None, None #Most recent lookup; repeated lookups (the usual case) skip the LRU reordering
+		self._parameterVersion = coreHelp.ChemReactionBase.parameterVersion
+		self._spectatorMask = np.all(network.stoichMatrix==0, axis=1)
+		self._spectatorIndicesCache = dict()
+
+	def __len__(self):
+		return len(self._cache)
+
+	def clear(self):
+		self._dropValues()
+		self.hits, self.misses = 0, 0
+
+	def _dropValues(self):
+		self._cache.clear()
+		self._lastKey, self._lastVals = None, None
+		self._parameterVersion = coreHelp.ChemReactionBase.parameterVersion
+
+	def getStats(self):
+		""" Returns a dict with hits, misses, size and maxSize """
+		return {"hits":self.hits, "misses":self.misses, "size":len(self), "maxSize":self.maxSize}
+
+	def getRateConstants(self, temperature, potential=0, pH=0, inputReactants=None):
+		""" Same interface as CompiledReactionNetwork.getRateConstants, but values are looked up in the cache when possible. Returned arrays are read-only since they are shared """
+		if self._parameterVersion != coreHelp.ChemReactionBase.parameterVersion:
+			self._dropValues()
+		currKey = self.getConditionKey(temperature, potential=potential, pH=pH, inputReactants=inputReactants)
+		if currKey == self._lastKey:
+			self.hits += 1
+			return self._lastVals
+		try:
+			outVals = self._cache[currKey]
+		except KeyError:
+			self.misses += 1
+			getter = self.network.getLogRateConstants if self.logSpace else self.network.getRateConstants
+			outVals = getter(temperature, potential=potential, pH=pH, inputReactants=inputReactants)
+			outVals.setflags(write=False)
+			self._cache[currKey] = outVals
+			if len(self._cache) > self.maxSize:
+				self._cache.popitem(last=False)
+		else:
+			self.hits += 1
+			self._cache.move_to_end(currKey)
+		if currKey in self._cache:
+			self._lastKey, self._lastVals = currKey, outVals
+		return outVals
+
+	def getConditionKey(self, temperature, potential=0, pH=0, inputReactants=None):
+		""" Gets the (hashable) tuple of conditions rate constants depend on; (temperature, potential, pH) plus spectator concentrations if any channel needs them. Reaction parameters are handled separately (see class NOTE) """
+		if (not self.network.usesReactantDependentRateConstants) or (inputReactants is None):
+			return (temperature, potential, pH)
+
+		if isinstance(inputReactants, coreHelp.SpeciesState):
+			spectatorIndices = self._getSpectatorIndicesForState(inputReactants.names)
+			return (temperature, potential, pH, inputReactants.names, tuple(inputReactants.concs[spectatorIndices].tolist()))
+
+		spectatorConcs = list()
+		for reactant in inputReactants:
+			idx = self.network.speciesIndices.get(reactant.name)
+			if (idx is None) or (self._spectatorMask[idx]):
+				spectatorConcs.append( (reactant.name, reactant.conc) )
+		return (temperature, potential, pH, tuple(spectatorConcs))
+
+	def _getSpectatorIndicesForState(self, names):
+		if names not in self._spectatorIndicesCache:
+			networkIndices = [self.network.speciesIndices.get(x) for x in names]
+			spectatorIndices = [idx for idx,netIdx in enumerate(networkIndices) if (netIdx is None) or (self._spectatorMask[netIdx])]
+			self._spectatorIndicesCache[names] = np.array(spectatorIndices, dtype=int)
+		return self._spectatorIndicesCache[names]
+
+
+class PotentialRateConstants():
+	""" Rate constants of every channel as a function of potential, at fixed temperature/pH/spectator concentrations. ln(k) of BetterReactionTemplate channels is linear in potential, so these are found from one evaluation plus a slope (a single vector operation for any number of potentials); other channels are evaluated at each potential
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		temperature: (float)
+		pH: (float)
+		inputReactants: (iter of ChemSpeciesStd or None) Passed to Tafel factors of channels which are not BetterReactionTemplates
+		logIntercepts: (float array) ln(k) at zero potential for each linear channel (0 for the others)
+		logSlopes: (float array) dln(k)/d(potential) for each linear channel (0 for the others)
+		otherIndices: (int array) Channels evaluated at each potential
+		logConcOffsets: (float array) Added to every ln(k); reservoir concentration factors for a ReducedReactionNetwork (taken from inputReactants), else 0
+
+	"""
+
+	def __init__(self, network, temperature, pH=0, inputReactants=None):
+		self.network = network
+		self.temperature = temperature
+		self.pH = pH
+		self.inputReactants = inputReactants
+		isLinear = np.array([isinstance(x, coreHelp.BetterReactionTemplate) for x in network.channels], dtype=bool)
+		self.otherIndices = np.nonzero(~isLinear)[0]
+		self.logIntercepts, self.logSlopes = np.zeros(network.nChannels), np.zeros(network.nChannels)
+		self.logConcOffsets = network.getLogConcOffsets(inputReactants) if isinstance(network, ReducedReactionNetwork) else np.zeros(network.nChannels)
+		tafelConst = unitHelp.FARADAY_CONST / (temperature*unitHelp.IDEAL_GAS_R_JOULES)
+		for idx in np.nonzero(isLinear)[0]:
+			channel = network.channels[idx]
+			self.logIntercepts[idx] = channel.getLogRateConstant(inputReactants, temperature, pH=pH, potential=0) + self.logConcOffsets[idx]
+			self.logSlopes[idx] = -1*channel.nElecTransfer*channel.symFactor*tafelConst
+
+	def getLogRateConstants(self, potentials, out=None):
+		""" Gets ln(k) for every channel
+
+		Args:
+			potentials: (float or iter of float)
+			out: (Optional, float array) Buffer to write into; shape (nChannels,) for a float potential, else (nPotentials, nChannels)
+
+		Returns
+			logRateConsts: (float array) Shape (nChannels,) for a float potential, else (nPotentials, nChannels)
+
+		"""
+		potentials = np.asarray(potentials, dtype=float)
+		out = np.empty( potentials.shape + (self.network.nChannels,) ) if out is None else out
+		np.multiply.outer(potentials, self.logSlopes, out=out)
+		out += self.logIntercepts
+		currArgs = [self.inputReactants, self.temperature]
+		for idx in self.otherIndices:
+			channel = self.network.channels[idx]
+			otherVals = [channel.getLogRateConstant(*currArgs, pH=self.pH, potential=x) for x in potentials.ravel().tolist()]
+			out[...,idx] = np.reshape(otherVals, potentials.shape) + self.logConcOffsets[idx]
+		return out
+
+	def getRateConstants(self, potentials, out=None):
+		""" Same as getLogRateConstants, but for the rate constants themselves """
+		out = self.getLogRateConstants(potentials, out=out)
+		return np.exp(out, out=out)
+
+
+class JacobianCalculator():
+	""" Builds the analytic Jacobian of d[X]/dt for a subset of (variable) species of a CompiledReactionNetwork; all rates are mass-action, so this follows directly from the stoichiometry and reactant orders. Species outside the subset are treated as constant
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		varIndices: (int array) Network index of each variable species; defines the row/column order of the Jacobian
+		sparse: (bool) If True the Jacobian is returned as a scipy.sparse csc matrix, else as a dense array
+		sparsity: (scipy.sparse csc matrix) Non-zero pattern of the Jacobian; suitable for the solve_ivp jac_sparsity argument
+
+	"""
+
+	def __init__(self, network, varIndices, sparse=None, maxDenseSize=100):
+		""" Initializer
+		
+		Args:
+			network: (CompiledReactionNetwork)
+			varIndices: (iter of int) Network index of each variable species
+			sparse: (Optional, bool) Whether to return sparse matrices. Default is to use sparse matrices only when the number of variable species is above maxDenseSize
+			maxDenseSize: (int) Only used when sparse is None
+				 
+		"""
+		self.network = network
+		self.varIndices = np.array(varIndices, dtype=int)
+		self.sparse = (len(self.varIndices) > maxDenseSize) if sparse is None else sparse
+		self._createTermMaps()
+
+	def _createTermMaps(self):
+		nSpecies, nChannels = self.network.nSpecies, self.network.nChannels
+		varPositions = np.full(nSpecies+1, -1, dtype=int)
+		varPositions[self.varIndices] = np.arange(len(self.varIndices))
+
+		#Each derivative term (one per reactant slot) is kept only if it is with respect to a variable species
+		termCols = varPositions[self.network._reactantIndicesT].ravel()
+		termRows = np.tile( np.arange(nChannels), self.network._reactantIndicesT.shape[0] )
+		self._termMask = termCols >= 0
+		self._termRows, self._termCols = termRows[self._termMask], termCols[self._termMask]
+
+		self._varStoich = self.network.stoichMatrix[self.varIndices]
+		self._varStoichSparse = sparseHelp.csr_matrix(self._varStoich)
+		self._rateDerivShape = (nChannels, len(self.varIndices))
+
+	def getDerivativeTermMap(self):
+		""" Describes how the output of network.getChannelRateDerivativeTerms (flattened) maps onto this Jacobian
+
+		Returns
+			termMask: (bool array) True for each flattened term which is with respect to a variable species
+			channelIndices: (int array) Channel of each term kept by termMask
+			varPositions: (int array) Position (in self.varIndices) of the species each kept term is with respect to
+
+		"""
+		return self._termMask, self._termRows, self._termCols
+
+	@property
+	def sparsity(self):
+		ones = np.ones(len(self._termRows))
+		rateDerivPattern = sparseHelp.csr_matrix( (ones, (self._termRows, self._termCols)), shape=self._rateDerivShape )
+		outPattern = (abs(self._varStoichSparse) @ rateDerivPattern) != 0
+		return sparseHelp.csc_matrix(outPattern, dtype=float)
+
+	def getJacobianFromWorkBuffer(self, workBuffer, rateConsts):
+		""" Gets the Jacobian at the concentrations in workBuffer
+
+		Args:
+			workBuffer: (float array) Created by network.createWorkBuffer
+			rateConsts: (float array) Rate constant for each channel
+
+		Returns
+			jacobian: (nVar x nVar array or sparse matrix) Element [i,k] is d(d[X_i]/dt)/d[X_k] for variable species i and k
+
+		"""
+		derivTerms = self.network.getChannelRateDerivativeTerms(workBuffer, rateConsts).ravel()[self._termMask]
+		if self.sparse:
+			rateDerivs = sparseHelp.csr_matrix( (derivTerms, (self._termRows, self._termCols)), shape=self._rateDerivShape )
+			return sparseHelp.csc_matrix(self._varStoichSparse @ rateDerivs)
+
+		rateDerivs = np.zeros(self._rateDerivShape)
+		np.add.at(rateDerivs, (self._termRows, self._termCols), derivTerms)
+		return self._varStoich @ rateDerivs
+
+
+def _getElementaryChannels(reaction):
+	if isinstance(reaction, coreHelp.NetReactionTemplate):
+		outChannels = [ [x,sign] for x,sign in _getElementaryChannels(reaction.forwardReaction) ]
+		outChannels += [ [x,-1*sign] for x,sign in _getElementaryChannels(reaction.backwardReaction) ]
+		return outChannels
+	return [ [reaction,1] ]
+
+
+def _getPaddedIndices(rows, padVal):
+	""" Gets an (nRows x maxLength) int array from a list of index lists, padded with padVal; at least one column """
+	maxLength = max( [len(x) for x in rows] + [1] )
+	outArray = np.full( (len(rows), maxLength), padVal, dtype=int )
+	for rowIdx, row in enumerate(rows):
+		outArray[rowIdx, :len(row)] = row
+	return outArray
@@ -0,0 +1,237 @@
+
+import numpy as np
+
+from . import steady_state as steadyHelp
+
+
+class SteadyStateContinuation():
+	""" Follows steady states of a CompiledReactionNetwork as a scalar parameter (e.g. potential) changes. Each new point starts from the previous steady state plus a step along the tangent dX/dparam, so usually only a couple of Newton iterations are needed per point
+
+	Two modes are available:
+		solveAtParams: Natural-parameter continuation onto a given list of parameter values (e.g. a potential grid); steps are subdivided when Newton struggles
+		traceBranch: Pseudo-arclength continuation; the parameter is treated as an unknown, which means branches can be followed around folds (turning points)
+
+	Attributes:
+		steadyStateSolver: (SteadyStateSolver) Defines the network, variable species, conservation constraints and tolerances
+		rateConstsFunct: f(param)->rateConsts Gives the rate constant for every network channel at a parameter value
+		maxCorrectorIter: (int) Steps needing more Newton iterations than this are retried at half the step size
+		minStep: (float) Smallest step size allowed before giving up
+		maxStep: (float) Largest step size allowed for traceBranch
+		paramStep: (float) Step used for finite-difference derivatives with respect to the parameter
+
+	"""
+
+	def __init__(self, steadyStateSolver, rateConstsFunct, maxCorrectorIter=6, minStep=1e-8, maxStep=np.inf, paramStep=1e-6):
+		""" Initializer
+
+		Args:
+			steadyStateSolver: (SteadyStateSolver)
+			rateConstsFunct: f(param)->rateConsts Gives the rate constant for every network channel at a parameter value
+			maxCorrectorIter: (int) Steps needing more Newton iterations than this are retried at half the step size
+			minStep: (float) Smallest step size allowed before giving up
+			maxStep: (float) Largest step size allowed for traceBranch
+			paramStep: (float) Step used for finite-difference derivatives with respect to the parameter
+
+		"""
+		self.steadyStateSolver = steadyStateSolver
+		self.rateConstsFunct = rateConstsFunct
+		self.maxCorrectorIter = maxCorrectorIter
+		self.minStep = minStep
+		self.maxStep = maxStep
+		self.paramStep = paramStep
+
+	@property
+	def varIndices(self):
+		return self.steadyStateSolver.varIndices
+
+	def solveAtParams(self, concs, params):
+		""" Gets steady states at each parameter value in turn, using each as the starting point for the next
+
+		Args:
+			concs: (float array) Concentrations of all network species (ordered as network.speciesNames). Used as the starting guess for the first parameter value, and to set conserved totals
+			params: (iter of float) Parameter values; neighbouring values should be close for continuation to help
+
+		Returns
+			outConcs: (nParams x nSpecies float array) Steady-state concentrations at each parameter value. Rows are NaN after any point where no steady state could be found
+			info: (dict) "nNewtonIter" (total corrector iterations), "nSteps" (total steps including subdivisions), "converged" (bool array, one per parameter)
+
+		"""
+		params = np.array(params, dtype=float)
+		outConcs = np.full( (len(params), len(concs)), np.nan )
+		info = {"nNewtonIter":0, "nSteps":0, "converged":np.zeros(len(params), dtype=bool)}
+		if len(params) == 0:
+			return outConcs, info
+
+		currConcs, startInfo = self.steadyStateSolver.solve(concs, self.rateConstsFunct(params[0]))
+		if not startInfo["converged"]:
+			return outConcs, info
+		info["nNewtonIter"] += startInfo["nIter"]
+		totals = self.steadyStateSolver.getConservedTotals(currConcs)
+		outConcs[0], info["converged"][0] = currConcs, True
+
+		currParam, stepSize = params[0], None
+		for idx, targParam in enumerate(params[1:], start=1):
+			while currParam != targParam:
+				stepSize = abs(targParam-currParam) if stepSize is None else min(stepSize, abs(targParam-currParam))
+				nextParam = currParam + np.sign(targParam-currParam)*stepSize
+				nextParam = targParam if abs(targParam-nextParam) < self.minStep else nextParam
+				tangent = self._getNaturalTangent(currConcs, currParam, totals)
+				if tangent is None:
+					return outConcs, info
+				guessConcs = _getPositiveGuess(currConcs, (nextParam-currParam)*tangent, self.varIndices)
+				nextConcs, stepInfo = self.steadyStateSolver.solve(guessConcs, self.rateConstsFunct(nextParam), totals=totals)
+				info["nNewtonIter"] += stepInfo["nIter"]
+				info["nSteps"] += 1
+
+				if stepInfo["converged"] and (stepInfo["nIter"] <= self.maxCorrectorIter or stepSize <= self.minStep):
+					currConcs, currParam = nextConcs, nextParam
+					stepSize = 2*stepSize if stepInfo["nIter"] <= 2 else stepSize
+				elif stepSize > self.minStep:
+					stepSize = 0.5*stepSize
+				else:
+					return outConcs, info
+
+			outConcs[idx], info["converged"][idx] = currConcs, True
+
+		return outConcs, info
+
+	def traceBranch(self, concs, startParam, endParam, initialStep=None, maxPoints=1000):
+		""" Follows a branch of steady states from startParam towards endParam using pseudo-arclength continuation. The parameter is allowed to reverse direction, so folds in the branch are followed rather than jumped over
+
+		Args:
+			concs: (float array) Concentrations of all network species. Used as the starting guess at startParam, and to set conserved totals
+			startParam: (float) Parameter value to start at
+			endParam: (float) Stops once the branch passes this parameter value
+			initialStep: (Optional, float) Arclength of the first step. Default is 1% of the parameter range
+			maxPoints: (int) Maximum number of points to find
+
+		Returns
+			params: (float array) Parameter value of each point on the branch
+			outConcs: (nPoints x nSpecies float array) Steady-state concentrations at each point
+			info: (dict) "nNewtonIter", "nSteps" and "reachedEnd" (bool). The branch stops early if the step size falls below minStep or the tangent cant be found (singular Jacobian)
+
+		Raises:
+			ValueError: If no steady state could be found at startParam
+
+		"""
+		currConcs, startInfo = self.steadyStateSolver.solve(concs, self.rateConstsFunct(startParam))
+		if not startInfo["converged"]:
+			raise ValueError("No steady state found at parameter value {}".format(startParam))
+		totals = self.steadyStateSolver.getConservedTotals(currConcs)
+
+		direction = 1.0 if endParam >= startParam else -1.0
+		stepSize = 0.01*abs(endParam-startParam) if initialStep is None else initialStep
+		maxStep = min(self.maxStep, abs(endParam-startParam))
+		outParams, outConcs = [startParam], [currConcs]
+		info = {"nNewtonIter":startInfo["nIter"], "nSteps":0, "reachedEnd":False}
+
+		currParam = startParam
+		naturalTangent = self._getNaturalTangent(currConcs, currParam, totals)
+		naturalTangent = np.zeros(len(currConcs)) if naturalTangent is None else naturalTangent #Singular Jacobian; start along the parameter axis and let the corrector sort it out
+		tangent = direction*np.append(naturalTangent[self.varIndices], 1.0)
+		tangent /= np.linalg.norm(tangent)
+
+		while len(outParams) < maxPoints:
+			currPoint = np.append(currConcs[self.varIndices], currParam)
+			predPoint = currPoint + stepSize*tangent
+			converged, newPoint, nIter = self._correctArclength(currConcs, predPoint, tangent, totals)
+			info["nNewtonIter"] += nIter
+			info["nSteps"] += 1
+
+			if not converged:
+				stepSize *= 0.5
+				if stepSize < self.minStep:
+					break
+				continue
+
+			currConcs = np.array(currConcs)
+			currConcs[self.varIndices], currParam = newPoint[:-1], newPoint[-1]
+			tangent = self._getArclengthTangent(currConcs, currParam, totals, tangent)
+			outParams.append(currParam)
+			outConcs.append(currConcs)
+			if tangent is None:
+				break
+
+			if direction*(currParam-endParam) >= 0:
+				info["reachedEnd"] = True
+				break
+
+			if nIter <= 2:
+				stepSize = min(maxStep, 1.5*stepSize)
+			elif nIter > 4:
+				stepSize *= 0.5
+
+		return np.array(outParams), np.array(outConcs), info
+
+	def _correctArclength(self, concs, predPoint, tangent, totals):
+		""" Newton iterations on [steady-state residual; tangent.(point-predPoint)]. Returns converged, point, nIter """
+		solver = self.steadyStateSolver
+		currConcs, currPoint = np.array(concs), np.array(predPoint)
+		for nIter in range(1, self.maxCorrectorIter+1):
+			currConcs[self.varIndices] = currPoint[:-1]
+			rateConsts = self.rateConstsFunct(currPoint[-1])
+			residual = solver.getResidual(currConcs, rateConsts, totals)
+			sysMatrix = self._getAugmentedJacobian(currConcs, currPoint[-1], totals, tangent, rateConsts=rateConsts)
+			fullResidual = np.append(residual, np.dot(tangent, currPoint-predPoint))
+			try:
+				pointStep = np.linalg.solve(sysMatrix, -1*fullResidual)
+			except np.linalg.LinAlgError:
+				return False, currPoint, nIter
+			currPoint += pointStep
+
+			concScales = solver.aTol + solver.rTol*np.abs(currPoint[:-1])
+			paramScale = solver.rTol*(1+abs(currPoint[-1]))
+			if np.all(np.abs(pointStep[:-1]) <= concScales) and abs(pointStep[-1]) <= paramScale:
+				return _isPhysical(currPoint, solver.aTol), currPoint, nIter
+			if solver.isResidualNegligible(currConcs, rateConsts, residual) and abs(fullResidual[-1]) <= np.max(concScales):
+				currPoint -= pointStep
+				return _isPhysical(currPoint, solver.aTol), currPoint, nIter
+
+		return False, currPoint, self.maxCorrectorIter
+
+	def _getAugmentedJacobian(self, concs, param, totals, tangent, rateConsts=None):
+		rateConsts = self.rateConstsFunct(param) if rateConsts is None else rateConsts
+		outMatrix = np.zeros( (len(tangent), len(tangent)) )
+		outMatrix[:-1,:-1] = self.steadyStateSolver.getResidualJacobian(concs, rateConsts)
+		outMatrix[:-1,-1] = self._getParamDerivative(concs, param, totals)
+		outMatrix[-1] = tangent
+		return outMatrix
+
+	def _getArclengthTangent(self, concs, param, totals, prevTangent):
+		""" Unit tangent to the branch, oriented to agree with prevTangent. None if the augmented Jacobian is singular """
+		sysMatrix = self._getAugmentedJacobian(concs, param, totals, prevTangent)
+		rhs = np.zeros(len(prevTangent))
+		rhs[-1] = 1
+		try:
+			outTangent = np.linalg.solve(sysMatrix, rhs)
+		except np.linalg.LinAlgError:
+			return None
+		return outTangent / np.linalg.norm(outTangent)
+
+	def _getNaturalTangent(self, concs, param, totals):
+		""" dX/dparam along the branch (zero for fixed species), from the implicit function theorem. None if the Jacobian is singular """
+		jacobian = self.steadyStateSolver.getResidualJacobian(concs, self.rateConstsFunct(param))
+		outTangent = np.zeros(len(concs))
+		try:
+			outTangent[self.varIndices] = np.linalg.solve(jacobian, -1*self._getParamDerivative(concs, param, totals))
+		except np.linalg.LinAlgError:
+			return None
+		return outTangent
+
+	def _getParamDerivative(self, concs, param, totals):
+		""" d(residual)/d(param) by central differences """
+		stepSize = self.paramStep*max(1, abs(param))
+		upVals = self.steadyStateSolver.getResidual(concs, self.rateConstsFunct(param+stepSize), totals)
+		downVals = self.steadyStateSolver.getResidual(concs, self.rateConstsFunct(param-stepSize), totals)
+		return (upVals-downVals) / (2*stepSize)
+
+
+def _getPositiveGuess(concs, concStep, varIndices):
+	outConcs = np.array(concs, dtype=float)
+	outConcs[varIndices] = steadyHelp.getDampedConcs(outConcs[varIndices], concStep[varIndices])
+	return outConcs
+
+
+def _isPhysical(point, aTol):
+	return bool( np.all(point[:-1] >= -aTol) )
+
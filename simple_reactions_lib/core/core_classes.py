@@ -3,7 +3,12 @@
 import copy
 import itertools as it
 import math
+import types
+
+import numpy as np
+
 from . import core_units as unitHelp
+from . import observers as obsHelp
 
 class ChemSpeciesStd():
 	""" Simple class for holding the name and concentration of a chemical species
@@ -34,8 +39,120 @@ class ChemSpeciesStd():
 		return True
 
 
+class SpeciesState():
+	""" Holds concentrations of a set of chemical species in one contiguous float64 array, with an immutable name->index map. Can be used anywhere an iter of ChemSpeciesStd is expected; iterating gives ChemSpeciesStd-compatible views which read/write the array
+
+	Attributes:
+		names: (tuple of str) Names of each species, in the same order as concs
+		indices: (mapping) Immutable map of species name to index in concs
+		concs: (float64 array) Concentrations of every species
+
+	"""
+	def __init__(self, names, concs):
+		""" Initializer
+		
+		Args:
+			names: (iter of str) Name of each species; must be unique
+			concs: (iter of float) Concentration of each species
+				 
+		"""
+		self.names = tuple(names)
+		self.indices = types.MappingProxyType( {name:idx for idx,name in enumerate(self.names)} )
+		self.concs = np.array(concs, dtype=np.float64)
+		assert len(self.indices)==len(self.names)
+		assert self.concs.shape==(len(self.names),)
+
+	@classmethod
+	def fromSpecies(cls, species):
+		""" Create from an iter of ChemSpeciesStd objects """
+		species = list(species)
+		return cls([x.name for x in species], [x.conc for x in species])
+
+	def toSpeciesList(self):
+		""" Returns a list of (independent) ChemSpeciesStd objects with the current concentrations """
+		return [ChemSpeciesStd(name,conc) for name,conc in zip(self.names, self.concs.tolist())]
+
+	def getConc(self, name):
+		return self.concs[self.indices[name]]
+
+	def setConc(self, name, conc):
+		self.concs[self.indices[name]] = conc
+
+	def __len__(self):
+		return len(self.names)
+
+	def __iter__(self):
+		return (SpeciesStateView(self, idx) for idx in range(len(self.names)))
+
+	def __getitem__(self, key):
+		""" Gets a SpeciesStateView from a position (int) or species name (str); a slice gives a list of views, matching list slicing
+
+		Raises:
+			TypeError: If key is not an int, str or slice
+			IndexError/KeyError: If the position/name is not in this state
+
+		"""
+		if isinstance(key, str):
+			return SpeciesStateView(self, self.indices[key])
+		if isinstance(key, slice):
+			return [SpeciesStateView(self, idx) for idx in range(*key.indices(len(self.names)))]
+		if isinstance(key, (int, np.integer)) and not isinstance(key, bool):
+			return SpeciesStateView(self, range(len(self.names))[key])
+		raise TypeError("SpeciesState indices must be int, str or slice, not {}".format(type(key).__name__))
+
+	def __deepcopy__(self, memo):
+		outObj = self.__class__.__new__(self.__class__)
+		outObj.names, outObj.indices = self.names, self.indices
+		outObj.concs = self.concs.copy()
+		return outObj
+
+	def __eq__(self, other):
+		try:
+			otherSpecies = list(other)
+		except TypeError:
+			return NotImplemented
+		if len(otherSpecies) != len(self):
+			return False
+		return all( [a==b for a,b in zip(self, otherSpecies)] )
+
+	def __str__(self):
+		return "SpeciesState: " + ", ".join( ["{}={:.3g}".format(name,conc) for name,conc in zip(self.names, self.concs.tolist())] )
+
+
+class SpeciesStateView(ChemSpeciesStd):
+	""" ChemSpeciesStd-compatible view of one species in a SpeciesState; setting .conc writes straight into the state's array. Deep-copying gives a plain (independent) ChemSpeciesStd """
+
+	def __init__(self, state, idx, strConcFmt="{:.3g}"):
+		self._eqTol = 1e-5
+		self._state = state
+		self._idx = idx
+		self.strConcFmt = strConcFmt
+
+	@property
+	def name(self):
+		return self._state.names[self._idx]
+
+	@property
+	def conc(self):
+		return self._state.concs[self._idx]
+
+	@conc.setter
+	def conc(self, val):
+		self._state.concs[self._idx] = val
+
+	def __deepcopy__(self, memo):
+		return ChemSpeciesStd(self.name, float(self.conc), strConcFmt=self.strConcFmt)
+
+
 class ChemReactionBase():
 
+	#Incremented whenever an attribute of any reaction object is set (e.g. r.barrier = 0.6); caches of rate constants (compiled_network.RateConstantCache) compare against this to notice parameter changes
+	parameterVersion = 0
+
+	def __setattr__(self, name, value):
+		ChemReactionBase.parameterVersion += 1
+		super().__setattr__(name, value)
+
 	def getChangesInReactants(self, timeStep, inputReactants, temperature, potential=0, **kwargs):
 		raise NotImplementedError("")
 
@@ -91,16 +208,45 @@ class ChemReactionTemplate(ChemReactionBase):
 		concFactor = self._getReactantConcRateFactor(inputReactants)
 		return k0Val*tafelFactor*concFactor
 
+	def getRateConstant(self, inputReactants, temperature, pH=0, potential=0):
+		""" Gets the mass-action rate constant at input conditions; i.e. the reaction rate is this multiplied by the reactant concentration factor
+
+		Args:
+			inputReactants: (iter of ChemSpeciesStd) Only used by Tafel factors which depend on (fixed) concentrations
+			temperature: (float)
+			pH: (float)
+			potential: (float)
+
+		Returns
+			rateConstant: (float) k0*tafelFactor for this reaction
+
+		"""
+		return self._getk0(temperature)*self._getTafelFactor(inputReactants, temperature, pH, potential)
+
+	def getLogRateConstant(self, inputReactants, temperature, pH=0, potential=0):
+		""" Gets ln(rateConstant); same arguments as getRateConstant. Found as a sum of exponents, so stays finite when the rate constant itself would under/overflow """
+		return self._getLogk0(temperature) + math.log( self._getTafelFactor(inputReactants, temperature, pH, potential) )
+
 	#This is actually doable
 	def _getk0(self, temperature):
 		return self.prefactor*math.exp(  (-1*self.barrier)/(unitHelp.BOLTZ_EV*temperature) )
 
+	def _getLogk0(self, temperature):
+		return math.log(self.prefactor) - self.barrier/(unitHelp.BOLTZ_EV*temperature)
+
 	def _getTafelFactor(self, inputReactants, temperature, pH, potential):
 		raise NotImplementedError("")
 
 	def _getReactantConcRateFactor(self, inputReactants):
 		""" The factor in rate which comes from the reactant concentrations, e.g. for H + H -> H2 its [H]^2, where [] denotes concentration """
 		outFactor = 1
+		if isinstance(inputReactants, SpeciesState):
+			for reactant in self.reactants:
+				idx = inputReactants.indices.get(reactant)
+				if idx is not None:
+					outFactor *= inputReactants.concs[idx]
+			return outFactor
+
 		for reactant in self.reactants:
 			inpConcs = [x.conc for x in inputReactants if x.name==reactant]
 			assert len(inpConcs)<2
@@ -140,10 +286,18 @@ class BetterReactionTemplate(ChemReactionTemplate):
 		concFactor = self._getReactantConcRateFactor(inputReactants)
 		return k0Val*tafelFactor*concFactor
 
+	def getRateConstant(self, inputReactants, temperature, pH=0, potential=0):
+		return self._getk0(temperature)*self._getTafelFactor(temperature, potential)
+
+	def getLogRateConstant(self, inputReactants, temperature, pH=0, potential=0):
+		return self._getLogk0(temperature) + self._getLogTafelFactor(temperature, potential)
+
 	def _getTafelFactor(self, temperature, potential):
+		return math.exp( self._getLogTafelFactor(temperature, potential) )
+
+	def _getLogTafelFactor(self, temperature, potential):
 		overPotential = potential - self.refPot
-		expTerm = (-1*self.nElecTransfer*unitHelp.FARADAY_CONST*overPotential*self.symFactor) / (temperature*unitHelp.IDEAL_GAS_R_JOULES) #The -1 is because we define nElecTransfer to be +ve for cathodic processes
-		return math.exp(expTerm)
+		return (-1*self.nElecTransfer*unitHelp.FARADAY_CONST*overPotential*self.symFactor) / (temperature*unitHelp.IDEAL_GAS_R_JOULES) #The -1 is because we define nElecTransfer to be +ve for cathodic processes
 
 class NetReactionTemplate(ChemReactionTemplate):
 	""" Class representing both forward and backwards reactions simultaneously, with the interface of a single reaction """
@@ -191,24 +345,31 @@ class NetReactionTemplate(ChemReactionTemplate):
 
 
 
-#DEPRECATED; Implementation forces use of the Euler integration method in effect; this means its often very unstable
+#DEPRECATED; The default stepMode is the (explicit) Euler method, which is often very unstable. For stiff networks use stepMode="backwardEuler" or "trbdf2"
 class ReactionControllerStandard():
 
-	def __init__(self, startReactants, reactions, timeStep, temperature=300, pH=0, potential=0, callbackFunct=None, constantConcReactants=None):
+	def __init__(self, startReactants, reactions, timeStep, temperature=300, pH=0, potential=0, callbackFunct=None, constantConcReactants=None, useCompiledEngine=True, stepMode="euler"):
 		""" DEPRECATED CLASS: DO NOT USE
 		
 		Args:
-			startReactants: (iter of ChemSpeciesStd objects)
+			startReactants: (iter of ChemSpeciesStd objects) Can also be a SpeciesState, in which case concentrations are updated by index rather than by scanning
 			reactions: (iter of ChemReactionTemplate objects)
 			timeStep: (float) Timestep for updating concentrations
 			temperature: (float) Temperature to run at; higher temperature means faster rates (enters barriers via RT)
 			pH: (DEPRECATED) For the Taylor2016 model this sets the pH for the simulation. If using BetterReactionTemplate reactions then it does nothing (pH is handled in that case using the OH- and H+ concentrations/activities)
 			potential: (float) Potential to run at. Usually all input reactions have barriers defined at potential=0; in which case +ve potential means polarise anodically while -ve potential means polarise cathodically
-			callbackFunct: f(instance) Function called every step; useful for printing various intermediate states or logging every n-steps etc
+			callbackFunct: f(instance) Function called every step; useful for printing various intermediate states. For logging every n-steps (or every t of simulated time) use self.observers.add instead, which avoids a Python call on every step
 			constantConcReactants: (iter of ChemSpeciesStd objects) These should ALSO be present in startReactants. After every step the concentration of these species is set to their initial value. This is my way of making sure our system stays in equilibrium with a reservoir containig set concentrations of non-surface species (e.g. [H+], [Mg2+])
+			useCompiledEngine: (bool) If True (and all reactions are ChemReactionTemplate objects) steps are taken by a FixedStepEngine; this gives the same results, but currentReactants is only updated when observed (end of doNextNSteps, observers and callbackFunct). Rate constants are calculated once per uninterrupted run of steps. If any depend on the concentration of a species the reactions change (checked on first use), or callbackFunct is set, euler steps are instead taken one reaction at a time as with False; implicit stepModes then recalculate rate constants every step
+			stepMode: (str) "euler" (default), "backwardEuler" or "trbdf2". The implicit modes stay stable for much larger timeSteps, but need the compiled engine (see FixedStepEngine)
 	 
 		Raises:
 			Errors
+
+		Attributes (others match Args):
+			step: (int) Number of steps taken since the last reset
+			time: (float) Simulated time since the last reset
+			observers: (ObserverRegistry) Functions called f(instance) every n steps, every t of simulated time and/or when a predicate is true; see ObserverRegistry.add. Steps between observations run uninterrupted
 		"""
 		self.startReactants = startReactants
 		self.reactions = reactions
@@ -220,15 +381,88 @@ class ReactionControllerStandard():
 #		self.step = 0
 		self.callbackFunct = callbackFunct
 		self.constantConcReactants = constantConcReactants
+		self.observers = obsHelp.ObserverRegistry()
+		self.useCompiledEngine = useCompiledEngine
+		self.stepMode = stepMode
+		self._engine = None
+		self._concDependence = (None, None, None) #(engine, clamped names, value) of the last _hasConcDependentRateConstants check
 		self.reset()
 
 	def reset(self):
 		self.step = 0
+		self.time = 0.0
 		self.currentReactants = copy.deepcopy(self.startReactants)
+		self.observers.reset()
 
 	def doNextNSteps(self, n):
+		endStep = self.step + n
+		while self.step < endStep:
+			self.observers.notifyDue(self, step=self.step)
+			nSteps = min(endStep-self.step, self.observers.getStepsUntilDue(self.step, self.time, self.timeStep))
+			self._doUninterruptedSteps(nSteps)
+
+	def _doUninterruptedSteps(self, n):
+		engine = self._getEngine()
+		if engine is None:
+			for x in range(n):
+				self._doNextStep()
+			return None
+
+		if (self.callbackFunct is None) and (not self._hasConcDependentRateConstants(engine)):
+			self._doEngineSteps(engine, n)
+			return None
+
+		#The callback may change the state/conditions, and rate constants may depend on the state, so reload both every step
 		for x in range(n):
-			self._doNextStep()
+			if self.callbackFunct is not None:
+				self.callbackFunct(self)
+			self._doEngineSteps(engine, 1)
+
+	def _getEngine(self):
+		""" Gets the FixedStepEngine to take steps with, or None if steps should be taken reaction-by-reaction (_doNextStep). Euler steps only use the engine when it runs uninterrupted with fixed rate constants; with a per-step callback, or rate constants depending on concentrations the reactions change, the per-reaction path gives the same results without reloading the engine every step """
+		from . import fixed_step as fixedStepHelp #Imported here since fixed_step (via compiled_network) imports this module
+
+		canCompile = self.useCompiledEngine and all( [isinstance(x, ChemReactionTemplate) for x in self.reactions] )
+		if not canCompile:
+			if self.stepMode != "euler":
+				raise ValueError("stepMode={} needs useCompiledEngine=True and ChemReactionTemplate reactions".format(self.stepMode))
+			return None
+		if (self._engine is None) or (not self._engine.isCompiledFrom(self.reactions)):
+			self._engine = fixedStepHelp.FixedStepEngine(self.reactions)
+		self._engine.stepMode = self.stepMode
+		if (self.stepMode == "euler") and ( (self.callbackFunct is not None) or self._hasConcDependentRateConstants(self._engine) ):
+			return None
+		return self._engine
+
+	def _hasConcDependentRateConstants(self, engine):
+		""" True if any rate constant depends on the concentration of a species the reactions change (e.g. a Nernst-shifted Tafel factor reading a reacting species). The engine calculates rate constants once per run of steps, which would leave these stale. Found by perturbing those concentrations; checked once per engine and set of clamped species """
+		network = engine.network
+		if not network.usesReactantDependentRateConstants:
+			return False
+
+		clampedNames = frozenset( [x.name for x in self.constantConcReactants] ) if self.constantConcReactants is not None else frozenset()
+		lastEngine, lastClampedNames, lastVal = self._concDependence
+		if (lastEngine is engine) and (lastClampedNames == clampedNames):
+			return lastVal
+
+		changingNames = [name for name,row in zip(network.speciesNames, network.stoichMatrix) if (name not in clampedNames) and any(row!=0)]
+		baseReactants = [ChemSpeciesStd(x.name, float(x.conc)) for x in self.currentReactants]
+		probeReactants = [ChemSpeciesStd(x.name, 2*x.conc+0.5) if x.name in changingNames else x for x in baseReactants]
+		currKwargs = {"potential":self.potential, "pH":self.pH}
+		baseVals = network.getRateConstants(self.temperature, inputReactants=baseReactants, **currKwargs)
+		probeVals = network.getRateConstants(self.temperature, inputReactants=probeReactants, **currKwargs)
+		outVal = not np.array_equal(baseVals, probeVals)
+		self._concDependence = (engine, clampedNames, outVal)
+		return outVal
+
+	def _doEngineSteps(self, engine, n):
+		engine.loadState(self.currentReactants, self.constantConcReactants)
+		currKwargs = {"potential":self.potential, "pH":self.pH, "inputReactants":self.currentReactants}
+		rateConsts = engine.network.getRateConstants(self.temperature, **currKwargs)
+		engine.run(n, self.timeStep, rateConsts)
+		engine.syncToReactants(self.currentReactants)
+		self.step += n
+		self.time += n*self.timeStep
 
 	def _doNextStep(self):
 
@@ -238,6 +472,10 @@ class ReactionControllerStandard():
 
 
 		concChangeDict = self._getConcDiffs()
+		if isinstance(self.currentReactants, SpeciesState):
+			self._updateSpeciesState(concChangeDict)
+			return None
+
 		#Update the currentReactants accordingly
 		for key,val in concChangeDict.items():
 			for reactant in self.currentReactants:
@@ -246,6 +484,7 @@ class ReactionControllerStandard():
 
 		#Also update the step number
 		self.step += 1
+		self.time += self.timeStep
 
 		#Reset any concentrations we need to
 		if self.constantConcReactants is not None:
@@ -254,6 +493,22 @@ class ReactionControllerStandard():
 					if reactant.name==constSpecies.name:
 						reactant.conc = constSpecies.conc
 
+	def _updateSpeciesState(self, concChangeDict):
+		indices, concs = self.currentReactants.indices, self.currentReactants.concs
+		for key,val in concChangeDict.items():
+			idx = indices.get(key)
+			if idx is not None:
+				concs[idx] += val
+
+		self.step += 1
+		self.time += self.timeStep
+
+		if self.constantConcReactants is not None:
+			for constSpecies in self.constantConcReactants:
+				idx = indices.get(constSpecies.name)
+				if idx is not None:
+					concs[idx] = constSpecies.conc
+
 	def _getConcDiffs(self):
 		outList = list()
 		#Handle all the reactions
@@ -0,0 +1,135 @@
+
+import numpy as np
+import scipy.integrate as integrateHelp
+import scipy.sparse as sparseHelp
+
+from . import compiled_network as compiledHelp
+
+
+class EnsembleRatesFunction():
+	""" Rates of change for N copies ("members") of a CompiledReactionNetwork, each with its own rate constants (e.g. from a different potential or temperature) and fixed-species concentrations. The state is the (N x nVar) array of variable-species concentrations flattened member-by-member, which is the form scipy integrators expect. All members are evaluated in one set of NumPy operations, and the Jacobian is block diagonal (one nVar x nVar block per member)
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		varIndices: (int array) Network index of each variable species
+		rateConsts: (N x nChannels float array) Rate constants for each member
+		nMembers: (int)
+
+	"""
+
+	def __init__(self, network, varIndices, rateConsts, concs):
+		""" Initializer
+
+		Args:
+			network: (CompiledReactionNetwork)
+			varIndices: (iter of int) Network index of each variable species
+			rateConsts: (N x nChannels float array) Rate constants for each member
+			concs: (N x nSpecies float array) Concentrations of all network species for each member; only fixed species values are used
+
+		"""
+		self.network = network
+		self.varIndices = np.array(varIndices, dtype=int)
+		self.rateConsts = np.array(rateConsts, dtype=float).reshape(-1, network.nChannels)
+		self.nMembers = len(self.rateConsts)
+		self._fullConcs = np.ones( (self.nMembers, network.nSpecies+1) )
+		self._fullConcs[:,:-1] = np.array(concs, dtype=float).reshape(self.nMembers, network.nSpecies)
+		self._varStoichT = np.ascontiguousarray(network.stoichMatrix[self.varIndices].T)
+		self._createJacobianMaps()
+
+	def _createJacobianMaps(self):
+		""" Each derivative term (reactant slot p of channel j, with respect to variable species k) adds varStoich[i,j]*term to element [i,k] of a members Jacobian. self._termToJacobian maps all terms to the flattened nVar x nVar block in one matrix product """
+		jacCalculator = compiledHelp.JacobianCalculator(self.network, self.varIndices, sparse=False)
+		self._termMask, channelIndices, varPositions = jacCalculator.getDerivativeTermMap()
+		nVar = len(self.varIndices)
+		varStoich = self.network.stoichMatrix[self.varIndices]
+		self._termToJacobian = np.zeros( (len(channelIndices), nVar*nVar) )
+		for termIdx, (channelIdx, colIdx) in enumerate(zip(channelIndices, varPositions)):
+			self._termToJacobian[termIdx, np.arange(nVar)*nVar + colIdx] += varStoich[:,channelIdx]
+		self._blockIndices = np.arange(self.nMembers)
+		self._blockIndptr = np.arange(self.nMembers+1)
+
+	@property
+	def nVar(self):
+		return len(self.varIndices)
+
+	def getStateFromConcs(self, concs):
+		""" Gets the flattened state vector from an (N x nSpecies) array of concentrations """
+		concs = np.array(concs, dtype=float).reshape(self.nMembers, self.network.nSpecies)
+		return concs[:,self.varIndices].ravel()
+
+	def getConcsFromState(self, state):
+		""" Gets the (N x nSpecies) array of all concentrations for a flattened state vector """
+		outConcs = np.array(self._fullConcs[:,:-1])
+		outConcs[:,self.varIndices] = np.reshape(state, (self.nMembers, self.nVar))
+		return outConcs
+
+	def _getReactantFactors(self, state):
+		self._fullConcs[:,self.varIndices] = np.reshape(state, (self.nMembers, self.nVar))
+		return self._fullConcs[:, self.network._reactantIndicesT] #N x maxOrder x nChannels
+
+	def __call__(self, time, state):
+		factors = self._getReactantFactors(state)
+		channelRates = self.rateConsts * np.prod(factors, axis=1)
+		return (channelRates @ self._varStoichT).ravel()
+
+	def jacobian(self, time, state):
+		""" Block-diagonal Jacobian as a scipy.sparse bsr matrix """
+		factors = self._getReactantFactors(state)
+		nSlots = factors.shape[1]
+		derivTerms = np.empty(factors.shape)
+		for pIdx in range(nSlots):
+			derivTerms[:,pIdx] = self.rateConsts
+			for qIdx in range(nSlots):
+				if qIdx != pIdx:
+					derivTerms[:,pIdx] *= factors[:,qIdx]
+		usedTerms = derivTerms.reshape(self.nMembers, -1)[:, self._termMask]
+		blocks = (usedTerms @ self._termToJacobian).reshape(self.nMembers, self.nVar, self.nVar)
+		nTotal = self.nMembers*self.nVar
+		return sparseHelp.bsr_matrix( (blocks, self._blockIndices, self._blockIndptr), shape=(nTotal,nTotal) )
+
+
+class EnsembleIntegrator():
+	""" Integrates all members of an ensemble (see EnsembleRatesFunction) forward in time with one scipy solve_ivp call. Implicit methods get the block-diagonal analytic Jacobian, so each linear solve costs about N small factorisations rather than one large dense one. Error control is over the whole ensemble, so all members share one step size
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		varIndices: (int array) Network index of each variable species
+		method: (str) solve_ivp method
+		solverOptions: (dict) Extra keyword arguments for solve_ivp (e.g. rtol, atol)
+
+	"""
+
+	def __init__(self, network, varIndices, method="BDF", solverOptions=None):
+		self.network = network
+		self.varIndices = np.array(varIndices, dtype=int)
+		self.method = method
+		self.solverOptions = dict() if solverOptions is None else solverOptions
+
+	def integrate(self, concs, rateConsts, timeStep):
+		""" Moves every member forward by timeStep
+
+		Args:
+			concs: (N x nSpecies float array) Starting concentrations of all network species for each member. A single row (nSpecies) is used for all members
+			rateConsts: (N x nChannels float array) Rate constants for each member
+			timeStep: (float) Time to integrate for
+
+		Returns
+			outConcs: (N x nSpecies float array) Concentrations for each member after timeStep
+
+		Raises:
+			ValueError: If the integration fails
+
+		"""
+		rateConsts = np.array(rateConsts, dtype=float).reshape(-1, self.network.nChannels)
+		concs = np.broadcast_to( np.array(concs, dtype=float), (len(rateConsts), self.network.nSpecies) )
+		rateFunct = EnsembleRatesFunction(self.network, self.varIndices, rateConsts, concs)
+
+		solverOptions = dict(self.solverOptions)
+		if self.method in ("Radau", "BDF"):
+			solverOptions.setdefault("jac", rateFunct.jacobian)
+		startState = rateFunct.getStateFromConcs(concs)
+		result = integrateHelp.solve_ivp(rateFunct, [0, timeStep], startState, method=self.method, **solverOptions)
+		if not result.success:
+			raise ValueError("Ensemble integration failed: {}".format(result.message))
+		return rateFunct.getConcsFromState(result.y[:,-1])
+
@@ -0,0 +1,297 @@
+
+""" Array-based fixed-step engine used by ReactionControllerStandard. Concentrations are held in one NumPy vector between observations, and only written back to the ChemSpeciesStd objects when the controller is observed """
+
+import math
+
+import numpy as np
+import scipy.linalg as linAlgHelp
+import scipy.linalg.lapack as lapackHelp
+
+from . import compiled_network as compiledHelp
+from . import core_classes as coreHelp
+from . import steady_state as steadyHelp
+
+
+STEP_MODES = ("euler", "backwardEuler", "trbdf2")
+
+#TR-BDF2 constants; with this gamma both stages need the same Newton matrix (I - _TRBDF2_COEFF*h*J)
+_TRBDF2_GAMMA = 2 - math.sqrt(2)
+_TRBDF2_COEFF = _TRBDF2_GAMMA/2
+_TRBDF2_NEW_FACTOR = 1 / (_TRBDF2_GAMMA*(2-_TRBDF2_GAMMA))
+_TRBDF2_OLD_FACTOR = ((1-_TRBDF2_GAMMA)**2) / (_TRBDF2_GAMMA*(2-_TRBDF2_GAMMA))
+
+
+class FixedStepEngine():
+	""" Takes steps of fixed size for a compiled set of reactions. The default ("euler") mode gives the same update as ReactionControllerStandard._doNextStep, but as a few array operations per step
+
+	Implicit modes are "backwardEuler" (first order) and "trbdf2" (second order, L-stable). Both are stable for any step size on stiff networks; each step is solved by Newton iterations on the analytic Jacobian, with the LU factorisation reused between steps while it keeps converging quickly. Steps where Newton fails are split in two (up to maxSplits times). Clamped species are held at their current value during each step, then reset as in euler mode
+
+	Usage is loadState -> run (any number of times) -> syncToReactants. Between loadState and syncToReactants the input reactant objects are NOT updated
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		concs: (float array) Current concentrations (ordered as network.speciesNames) followed by a trailing 1. Species in the network but missing from the loaded reactants stay at 1, so (like ChemReactionTemplate) they are ignored in rates
+		stepMode: (str) One of STEP_MODES
+		rTol: (float) Relative tolerance on Newton updates (implicit modes only)
+		aTol: (float) Absolute tolerance on Newton updates (implicit modes only)
+		maxNewtonIter: (int) Maximum Newton iterations per implicit stage
+		maxSplits: (int) Maximum number of times a failed step is halved
+		nLU: (int) Number of LU factorisations done (implicit modes only)
+
+	"""
+
+	def __init__(self, reactions, stepMode="euler", rTol=1e-8, aTol=1e-14, maxNewtonIter=8, maxSplits=20):
+		""" Initializer
+
+		Args:
+			reactions: (iter of ChemReactionTemplate objects) Must all be mass-action (i.e. getReactionRate is rateConstant*concFactor)
+			stepMode: (str) One of STEP_MODES
+			rTol: (float) Relative tolerance on Newton updates (implicit modes only)
+			aTol: (float) Absolute tolerance on Newton updates (implicit modes only)
+			maxNewtonIter: (int) Maximum Newton iterations per implicit stage
+			maxSplits: (int) Maximum number of times a failed step is halved
+
+		"""
+		reactions = list(reactions)
+		self.network = compiledHelp.CompiledReactionNetwork(reactions)
+		self.stepMode = stepMode
+		self.rTol = rTol
+		self.aTol = aTol
+		self.maxNewtonIter = maxNewtonIter
+		self.maxSplits = maxSplits
+		self.nLU = 0
+		self.concs = self.network.createWorkBuffer()
+		self._reactionIds = tuple([id(x) for x in reactions])
+		self._channelRates = np.zeros(self.network.nChannels)
+		self._concChanges = np.zeros(self.network.nSpecies)
+		self._updateStoich = np.array(self.network.stoichMatrix)
+		self._clampIndices = np.zeros(0, dtype=int)
+		self._clampConcs = np.zeros(0)
+		self._extraClamps = list()
+		self._nStepsSinceLoad = 0
+		self._varIndices = np.zeros(0, dtype=int)
+		self._jacCalculators = dict()
+		self._reducedNetworks = dict()
+		self._ratesBuffer = np.zeros(self.network.nSpecies)
+		self._luRateConsts = None
+		self._resetNewtonMatrix()
+
+	@property
+	def stepMode(self):
+		return self._stepMode
+
+	@stepMode.setter
+	def stepMode(self, val):
+		if val not in STEP_MODES:
+			raise ValueError("stepMode must be one of {}, not {}".format(STEP_MODES, val))
+		self._stepMode = val
+
+	def isCompiledFrom(self, reactions):
+		""" True if this engine was compiled from exactly these reaction objects (in this order) """
+		return self._reactionIds == tuple([id(x) for x in reactions])
+
+	def loadState(self, inputReactants, constantConcReactants=None):
+		""" Copies concentrations from inputReactants into self.concs, and sets which species are clamped
+
+		Args:
+			inputReactants: (iter of ChemSpeciesStd or SpeciesState)
+			constantConcReactants: (Optional, iter of ChemSpeciesStd) After every step, species in both this and inputReactants are set to these concentrations
+
+		"""
+		self.concs[:-1] = self.network.getConcsFromReactants(inputReactants)
+		presentIndices = self._getPresentIndices(inputReactants)
+		self._updateStoich[:] = 0
+		self._updateStoich[presentIndices] = self.network.stoichMatrix[presentIndices]
+
+		names = set(_getReactantNames(inputReactants))
+		constantConcReactants = list() if constantConcReactants is None else constantConcReactants
+		clampPairs = [ [self.network.speciesIndices[x.name], x.conc] for x in constantConcReactants if (x.name in names) and (x.name in self.network.speciesIndices) ]
+		self._clampIndices = np.array([x[0] for x in clampPairs], dtype=int)
+		self._clampConcs = np.array([x[1] for x in clampPairs], dtype=float)
+		self._extraClamps = [x for x in constantConcReactants if (x.name in names) and (x.name not in self.network.speciesIndices)]
+		self._nStepsSinceLoad = 0
+
+		#Implicit steps only solve for species which reactions change and which arent clamped
+		changedMask = np.any(self.network.stoichMatrix[presentIndices]!=0, axis=1)
+		varIndices = np.setdiff1d(presentIndices[changedMask], self._clampIndices)
+		if not np.array_equal(varIndices, self._varIndices):
+			self._varIndices = varIndices
+			self._resetNewtonMatrix()
+
+	def run(self, nSteps, timeStep, rateConsts):
+		""" Takes nSteps steps (using self.stepMode), updating self.concs in place
+
+		Args:
+			nSteps: (int)
+			timeStep: (float)
+			rateConsts: (float array) Rate constant for each network channel; see CompiledReactionNetwork.getRateConstants
+
+		Raises:
+			ValueError: If an implicit step still fails after maxSplits halvings
+
+		"""
+		if self.stepMode == "euler":
+			self._runEuler(nSteps, timeStep, rateConsts)
+		else:
+			if not np.array_equal(rateConsts, self._luRateConsts):
+				self._resetNewtonMatrix()
+				self._luRateConsts = np.array(rateConsts)
+			for idx in range(nSteps):
+				self._takeImplicitStep(timeStep, rateConsts, self.maxSplits)
+		self._nStepsSinceLoad += nSteps
+
+	def _runEuler(self, nSteps, timeStep, rateConsts):
+		#Clamped species only take their clamped values after the first step, so that one uses the full network
+		if (nSteps > 0) and (not np.array_equal(self.concs[self._clampIndices], self._clampConcs)):
+			self._runFullEuler(1, timeStep, rateConsts)
+			nSteps -= 1
+		self._runReducedEuler(nSteps, timeStep, rateConsts)
+
+	def _runFullEuler(self, nSteps, timeStep, rateConsts):
+		concs, varConcs = self.concs, self.concs[:-1]
+		channelRates, concChanges = self._channelRates, self._concChanges
+		updateStoich, clampIndices, clampConcs = self._updateStoich, self._clampIndices, self._clampConcs
+		getChannelRates = self.network.getChannelRatesFromWorkBuffer
+		for idx in range(nSteps):
+			getChannelRates(concs, rateConsts, channelRates)
+			channelRates *= timeStep
+			np.dot(updateStoich, channelRates, concChanges)
+			varConcs += concChanges
+			concs[clampIndices] = clampConcs
+
+	def _runReducedEuler(self, nSteps, timeStep, rateConsts):
+		""" Euler steps on the variable species alone; every other species is constant over the run (clamped, unchanged by any reaction or missing), so its concentration is folded into the rate constants (see ReducedReactionNetwork) """
+		if (nSteps == 0) or (len(self._varIndices) == 0):
+			return None
+		reducedNetwork = self._getReducedNetwork()
+		foldedConsts = reducedNetwork.getFoldedRateConstants(rateConsts, self.concs)
+		varBuffer = reducedNetwork.createWorkBuffer(self.concs[self._varIndices])
+		varConcs, stoichMatrix = varBuffer[:-1], reducedNetwork.stoichMatrix
+		channelRates, concChanges = np.zeros(reducedNetwork.nChannels), np.zeros(reducedNetwork.nSpecies)
+		getChannelRates = reducedNetwork.getChannelRatesFromWorkBuffer
+		for idx in range(nSteps):
+			getChannelRates(varBuffer, foldedConsts, channelRates)
+			channelRates *= timeStep
+			np.dot(stoichMatrix, channelRates, concChanges)
+			varConcs += concChanges
+		self.concs[self._varIndices] = varConcs
+
+	def _takeImplicitStep(self, timeStep, rateConsts, nSplitsLeft):
+		startConcs = self.concs[self._varIndices]
+		if self._trySolveStep(startConcs, timeStep, rateConsts):
+			self.concs[self._clampIndices] = self._clampConcs
+			return None
+
+		self.concs[self._varIndices] = startConcs
+		if nSplitsLeft == 0:
+			raise ValueError("Implicit step of {} failed to converge after {} halvings".format(timeStep, self.maxSplits))
+		self._takeImplicitStep(0.5*timeStep, rateConsts, nSplitsLeft-1)
+		self._takeImplicitStep(0.5*timeStep, rateConsts, nSplitsLeft-1)
+
+	def _trySolveStep(self, startConcs, timeStep, rateConsts):
+		""" Tries the step, first with any stored LU factorisation then with a fresh one. Returns True on success (self.concs is then updated) """
+		for attempt in range(2):
+			usedStored = self._luFactors is not None
+			self.concs[self._varIndices] = startConcs
+			if self.stepMode == "backwardEuler":
+				isConverged = self._solveStage(startConcs, timeStep, timeStep, rateConsts)
+			else:
+				isConverged = self._solveTRBDF2Step(startConcs, timeStep, rateConsts)
+			if isConverged:
+				return True
+			self._resetNewtonMatrix()
+			if not usedStored:
+				return False
+		return False
+
+	def _solveTRBDF2Step(self, startConcs, timeStep, rateConsts):
+		coeffTimeStep = _TRBDF2_COEFF*timeStep
+		trapConst = startConcs + coeffTimeStep*self._getVarRates(rateConsts)
+		if not self._solveStage(trapConst, coeffTimeStep, timeStep, rateConsts):
+			return False
+		midConcs = self.concs[self._varIndices]
+		bdfConst = _TRBDF2_NEW_FACTOR*midConcs - _TRBDF2_OLD_FACTOR*startConcs
+		return self._solveStage(bdfConst, coeffTimeStep, timeStep, rateConsts)
+
+	def _solveStage(self, constPart, coeffTimeStep, timeStep, rateConsts):
+		""" Solves x = constPart + coeffTimeStep*f(x) for variable species by Newton iteration, starting from the values in self.concs. Returns True if converged """
+		varIndices = self._varIndices
+		if len(varIndices) == 0:
+			return True
+
+		if (self._luFactors is None) or (self._luKey != (coeffTimeStep, timeStep)):
+			self._factoriseNewtonMatrix(coeffTimeStep, timeStep, rateConsts)
+
+		for nIter in range(1, self.maxNewtonIter+1):
+			currConcs = self.concs[varIndices]
+			residual = constPart + coeffTimeStep*self._getVarRates(rateConsts) - currConcs
+			#Calling LAPACK directly; the checks in scipy.linalg.lu_solve cost more than the solve itself for small networks
+			concStep = lapackHelp.dgetrs(self._luFactors[0], self._luFactors[1], residual)[0]
+			if not np.isfinite(concStep).all():
+				return False
+			self.concs[varIndices] = steadyHelp.getDampedConcs(currConcs, concStep)
+			if (np.abs(concStep) <= self.aTol + self.rTol*np.abs(currConcs)).all():
+				#Slow convergence means the stored factorisation is out of date; refresh it on the next step
+				if nIter > 3:
+					self._resetNewtonMatrix()
+				return True
+		return False
+
+	def _factoriseNewtonMatrix(self, coeffTimeStep, timeStep, rateConsts):
+		varIndices = self._varIndices
+		jacobian = self._getJacCalculator().getJacobianFromWorkBuffer(self.concs, rateConsts)
+		newtonMatrix = np.eye(len(varIndices)) - coeffTimeStep*jacobian
+		self._luFactors = linAlgHelp.lu_factor(newtonMatrix, check_finite=False)
+		self._luKey = (coeffTimeStep, timeStep)
+		self.nLU += 1
+
+	def _resetNewtonMatrix(self):
+		self._luFactors, self._luKey = None, None
+
+	def _getReducedNetwork(self):
+		key = tuple(self._varIndices.tolist())
+		if key not in self._reducedNetworks:
+			self._reducedNetworks[key] = compiledHelp.ReducedReactionNetwork(self.network, self._varIndices)
+		return self._reducedNetworks[key]
+
+	def _getJacCalculator(self):
+		key = tuple(self._varIndices.tolist())
+		if key not in self._jacCalculators:
+			self._jacCalculators[key] = compiledHelp.JacobianCalculator(self.network, self._varIndices, sparse=False)
+		return self._jacCalculators[key]
+
+	def _getVarRates(self, rateConsts):
+		return self.network.getRatesOfChangeFromWorkBuffer(self.concs, rateConsts, self._ratesBuffer)[self._varIndices]
+
+	def syncToReactants(self, inputReactants):
+		""" Writes self.concs back into the objects passed to loadState """
+		if isinstance(inputReactants, coreHelp.SpeciesState):
+			netIndices, stateIndices = self.network.getIndicesForState(inputReactants.names)
+			inputReactants.concs[stateIndices] = self.concs[netIndices]
+			if self._nStepsSinceLoad > 0:
+				for constSpecies in self._extraClamps:
+					inputReactants.setConc(constSpecies.name, constSpecies.conc)
+			return None
+
+		getIdx = self.network.speciesIndices.get
+		for reactant in inputReactants:
+			idx = getIdx(reactant.name)
+			if idx is not None:
+				reactant.conc = float(self.concs[idx])
+
+		if self._nStepsSinceLoad > 0:
+			for constSpecies in self._extraClamps:
+				for reactant in inputReactants:
+					if reactant.name == constSpecies.name:
+						reactant.conc = constSpecies.conc
+
+	def _getPresentIndices(self, inputReactants):
+		getIdx = self.network.speciesIndices.get
+		outIndices = [getIdx(x) for x in _getReactantNames(inputReactants)]
+		return np.array(sorted(set([x for x in outIndices if x is not None])), dtype=int)
+
+
+def _getReactantNames(inputReactants):
+	if isinstance(inputReactants, coreHelp.SpeciesState):
+		return list(inputReactants.names)
+	return [x.name for x in inputReactants]
@@ -2,7 +2,15 @@
 import copy
 import itertools as it
 
+import numpy as np
+import scipy.linalg as linAlgHelp
+
+from . import codegen as codegenHelp
 from . import core_classes as coreHelp
+from . import compiled_network as compiledHelp
+from . import instrumentation as instrHelp
+from . import observers as obsHelp
+from . import waveforms as waveHelp
 
 class ReactionControllerBase():
 
@@ -19,7 +27,14 @@ class ReactionControllerBase():
 		raise NotImplementedError("")
 
 class ConcsPropagatorBase():
-	""" Job of this class is to take a list of current concentrations, and propagate it forward by a timestep; Modfying concentrations IN PLACE. See .propagate() for interface """
+	""" Job of this class is to take a list of current concentrations, and propagate it forward by a timestep; Modfying concentrations IN PLACE. See .propagate() for interface
+
+	Attributes:
+		instrumentation: (Instrumentation or None) If set, solver counters and timings are recorded for each propagate() call; see core.instrumentation.enableInstrumentation
+
+	"""
+
+	instrumentation = None
 
 	def propagate(self, inputReactants, timeStep, temperature=300, potential=0):
 		""" Given a dictionary of reactants/concs at t=t_init this UPDATES IN PLACE concentrations up to t=t_init + timeStep
@@ -34,6 +49,18 @@ class ConcsPropagatorBase():
 
 		raise NotImplementedError("")
 
+	def getLastRatesOfChange(self, inputReactants):
+		""" Gets d[X]/dt for the variable species, if the last propagate() call already calculated it at the current concentrations (e.g. the final right-hand-side evaluation of an explicit integrator). Lets callers monitor rates without an extra evaluation
+		
+		Args:
+			inputReactants: (iter of ChemSpeciesStd or SpeciesState) The reactants last passed to propagate()
+
+		Returns
+			ratesOfChange: (dict or None) Keys are species names, values are d[X]/dt. None if no up-to-date value is available
+ 
+		"""
+		return None
+
 class ConcChangesFinderBase():
 	""" The job of this class is to figure out the changes in concentration for a maximum timestep. Stability reasons mean its not gauranteed to move forward the requested time step (extrapolating current rates over a long timestep can lead to unphysical concentrations)
 
@@ -62,7 +89,13 @@ class ConcChangesFinderBase():
 class RateCalculatorBase():
 	""" Base class for calculating rates of change in reactants from their concentrations
 
+	Attributes:
+		instrumentation: (Instrumentation or None) If set, calculators which evaluate reactions one at a time record wall time per reaction class; see core.instrumentation.enableInstrumentation
+
 	"""
+
+	instrumentation = None
+
 	def getRates(self, inputReactants, temperature=300, potential=0):
 		""" Gets the rates of change (d[X]/dt) for each chemical species 
 		
@@ -88,7 +121,11 @@ class ReactionControllerImproved(ReactionControllerBase):
 			propagator: (ConcsPropagatorBase) Class specialising in moving concentrations forward by \delta T. This also implicitly contains all info on reactions
 			startReactants: (iter of ChemSpeciesStd objects) All the reactants and concentrations
 			temperature: (float) The temperature in Kelvin
-			potential: (float) Electric potential of the system in volts. Usually the zero value is defined under whatever conditions you have barriers/reaction energies calculated at 
+			potential: (float or PotentialWaveform) Electric potential of the system in volts. Usually the zero value is defined under whatever conditions you have barriers/reaction energies calculated at. A waveform (see core.waveforms) is evaluated against self.time inside the integration, and propagation is split at any jumps in it
+
+		Attributes (others match Args):
+			time: (float) Simulated time since the last reset
+			observers: (ObserverRegistry) Functions called f(instance) every t of simulated time and/or when a predicate is true; see ObserverRegistry.add. Propagation is split at observation times, but otherwise runs uninterrupted
 
 		"""
 		self.propagator = propagator
@@ -96,12 +133,42 @@ class ReactionControllerImproved(ReactionControllerBase):
 		self.currentReactants = copy.deepcopy(startReactants)
 		self.temperature = temperature
 		self.potential = potential
+		self.time = 0.0
+		self.observers = obsHelp.ObserverRegistry(allowStride=False)
 
 	def reset(self):
 		self.currentReactants = copy.deepcopy(self.startReactants)
+		self.time = 0.0
+		self.observers.reset()
 
 	def moveForwardByT(self, time):
-		self.propagator.propagate(self.currentReactants, time, temperature=self.temperature, potential=self.potential)
+		endTime = self.time + time
+		self.observers.notifyDue(self)
+		while True:
+			timeStep = min(endTime-self.time, self.observers.getTimeUntilDue(self.time), self._getTimeUntilPotentialJump())
+			self.propagator.propagate(self.currentReactants, timeStep, temperature=self.temperature, potential=self.getPropagationPotential())
+			if self.time + timeStep >= endTime:
+				self.time = endTime
+				break
+			self.time += timeStep
+			self.observers.notifyDue(self)
+
+	def getCurrentPotential(self):
+		""" Gets the potential (float) at self.time """
+		if isinstance(self.potential, waveHelp.PotentialWaveform):
+			return self.potential.getPotential(self.time)
+		return self.potential
+
+	def getPropagationPotential(self):
+		""" Gets the potential argument for the propagator; waveforms are shifted so their t=0 is self.time """
+		if isinstance(self.potential, waveHelp.PotentialWaveform):
+			return self.potential.getShifted(self.time)
+		return self.potential
+
+	def _getTimeUntilPotentialJump(self):
+		if not isinstance(self.potential, waveHelp.PotentialWaveform):
+			return np.inf
+		return _getTimeUntilJump(self.potential, self.time)
 
 
 #TODO: We need to adapt this to work with vectors as the changes in reactant concentrations when given a step in essence.
@@ -115,30 +182,72 @@ class ConcsPropagatorTemplate(ConcsPropagatorBase):
 
 	def propagate(self, inputReactants, timeStep, temperature=300, potential=0):
 		functToPropagate = self.getFunctToPropagate(inputReactants, temperature, potential)
-		startConcs = [x.conc for x in inputReactants if x.name in self.variableConcSpecies]
-		propagatedConcs = self._propagateVectorisedFunctionToNextTimeStep( startConcs, timeStep, functToPropagate )
-		
-		#Update input reactants in place
+		self._lastFunctPropagated = functToPropagate
+		startState = _getStateFromConcs(functToPropagate, self._getVariableConcs(inputReactants))
+		propagatedState = self._propagateVectorisedFunctionToNextTimeStep( startState, timeStep, functToPropagate )
+		self._setVariableConcs(inputReactants, _getConcsFromState(functToPropagate, propagatedState))
+
+	def getLastRatesOfChange(self, inputReactants):
+		lastFunct = getattr(self, "_lastFunctPropagated", None)
+		if not isinstance(lastFunct, CompiledRatesFunction):
+			return None
+		varConcs = np.asarray(self._getVariableConcs(inputReactants), dtype=float)
+		lastRates = lastFunct.getLastRates(varConcs)
+		if lastRates is None:
+			return None
+		varNames = _getReactantNames(inputReactants)
+		varNames = [x for x in varNames if x in self.variableConcSpecies]
+		return {name:val for name,val in zip(varNames, lastRates)}
+
+	def _getVariableConcs(self, inputReactants):
+		""" Gets concentrations of variable species (in the order they appear in inputReactants); a list for iters of ChemSpeciesStd, an array for a SpeciesState """
+		if isinstance(inputReactants, coreHelp.SpeciesState):
+			return inputReactants.concs[ self._getStateVarIndices(inputReactants) ]
+		return [x.conc for x in inputReactants if x.name in self.variableConcSpecies]
+
+	def _setVariableConcs(self, inputReactants, varConcs):
+		""" Update input reactants in place; varConcs is ordered as for self._getVariableConcs """
+		if isinstance(inputReactants, coreHelp.SpeciesState):
+			inputReactants.concs[ self._getStateVarIndices(inputReactants) ] = varConcs
+			return None
+
 		counter = 0
 		for reactant in inputReactants:
 			if reactant.name in self.variableConcSpecies:
-				reactant.conc = propagatedConcs[counter]
+				reactant.conc = varConcs[counter]
 				counter += 1
 
+	def _getStateVarIndices(self, inputReactants):
+		return [idx for idx,name in enumerate(inputReactants.names) if name in self.variableConcSpecies]
+
 	def getFunctToPropagate(self, inputReactants, temperature, potential):
 		""" Uses rate calculator to get f(step,startConcs)->[endConcs] where startConcs and endConcs are vectorised forms of the concentration of variable species """
 		
 		reactantOrder = [x.name for x in inputReactants if x.name in self.variableConcSpecies]
+		if isinstance(self.rateCalculator, CompiledRateCalculator):
+			return self.rateCalculator.getRatesFunction(inputReactants, reactantOrder, temperature, potential)
+
+		#One copy of the reactants is made here, then updated in place on each call
+		inpReactants = copy.deepcopy(inputReactants)
+		if isinstance(inpReactants, coreHelp.SpeciesState):
+			stateIndices = [inpReactants.indices[name] for name in reactantOrder]
+			def _setConcs(startConcs):
+				inpReactants.concs[stateIndices] = startConcs
+		else:
+			varReactants = [x for x in inpReactants if x.name in self.variableConcSpecies]
+			def _setConcs(startConcs):
+				for reactant,conc in zip(varReactants, startConcs):
+					reactant.conc = conc
+
+		isWaveform = isinstance(potential, waveHelp.PotentialWaveform)
 		def _outFunct(time, startConcs):
 			#startConcs-> input reactants
-			inpReactants = copy.deepcopy(inputReactants)
-			for reactant in inpReactants:
-				if reactant.name in reactantOrder:
-					reactant.conc = startConcs[ reactantOrder.index(reactant.name) ]
+			_setConcs(startConcs)
 
 
 			#Get d[X]/dt at t=0
-			rateDict = self.rateCalculator.getRates(inpReactants, temperature=temperature, potential=potential)
+			currPotential = potential.getPotential(time) if isWaveform else potential
+			rateDict = self.rateCalculator.getRates(inpReactants, temperature=temperature, potential=currPotential)
 			initRates = [rateDict[key] for key in reactantOrder]
 
 			return initRates #Pretty sure we just need d[conc]/dt for the current time
@@ -150,6 +259,278 @@ class ConcsPropagatorTemplate(ConcsPropagatorBase):
 		raise NotImplementedError("")
 
 
+class CompiledRatesFunction():
+	""" Callable f(time, concs)->d[concs]/dt for the variable species of a compiled reaction network; used as the function to propagate when the rate calculator is a CompiledRateCalculator.
+
+	Fixed species live in a preallocated work buffer and variable concentrations are written straight into it. Nothing is copied or created per call apart from the returned array; integrators keep references to the derivatives they are given, so that one buffer cannot be reused. The analytic Jacobian is available from .jacobian()
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		rateConsts: (float array) Rate constant for each channel in network
+		workBuffer: (float array) Created by network.createWorkBuffer; holds the concentrations of fixed species
+		varIndices: (int array) Index in network.speciesNames of each variable species, in the same order as concs passed when calling this
+		jacobianCalculator: (JacobianCalculator) Builds the Jacobian for the variable species
+
+	"""
+	def __init__(self, network, rateConsts, workBuffer, varIndices):
+		self.network = network
+		self.rateConsts = rateConsts
+		self.workBuffer = workBuffer
+		self.varIndices = np.array(varIndices, dtype=int)
+		self.jacobianCalculator = compiledHelp.JacobianCalculator(network, self.varIndices)
+		self._ratesOfChange = np.zeros(network.nSpecies)
+		self._lastConcs = np.full(len(self.varIndices), np.nan)
+		self._lastRates = None
+
+	@classmethod
+	def fromRateCalculator(cls, rateCalculator, inputReactants, variableSpeciesOrder, temperature, potential, **kwargs):
+		""" Alternative initializer
+
+		Args:
+			rateCalculator: (CompiledRateCalculator)
+			inputReactants: (iter of ChemSpeciesStd or SpeciesState) Sets the fixed species concentrations
+			variableSpeciesOrder: (iter of str) Names of the variable species, in the order they appear in the concs array
+			temperature: (float)
+			potential: (float)
+			kwargs: Passed to the initializer
+
+		"""
+		network = rateCalculator.network
+		rateConsts = rateCalculator.getRateConstants(inputReactants, temperature=temperature, potential=potential)
+		concs = network.getConcsFromReactants(inputReactants)
+		varIndices = [network.speciesIndices[name] for name in variableSpeciesOrder]
+		if rateCalculator.foldReservoirSpecies:
+			network = rateCalculator.getReducedNetwork(varIndices)
+			rateConsts, concs, varIndices = network.getFoldedRateConstants(rateConsts, concs), concs[varIndices], range(len(varIndices))
+		return cls(network, rateConsts, network.createWorkBuffer(concs), varIndices, **kwargs)
+
+	def __call__(self, time, concs):
+		self.workBuffer.put(self.varIndices, concs)
+		self.network.getRatesOfChangeFromWorkBuffer(self.workBuffer, self.rateConsts, self._ratesOfChange)
+		self._lastConcs[:] = concs
+		self._lastRates = self._ratesOfChange.take(self.varIndices)
+		return self._lastRates
+
+	def getLastRates(self, concs):
+		""" Gets the output of the most recent call if it was made at concs (integrators usually end on an evaluation at the final point), else None """
+		if (self._lastRates is None) or (not np.array_equal(self._lastConcs, concs)):
+			return None
+		return self._lastRates.copy()
+
+	def jacobian(self, time, concs):
+		""" Analytic Jacobian of this function; J[i,k] = d(d[X_i]/dt)/d[X_k]. Dense for small networks, a scipy.sparse matrix for large ones (see self.jacobianCalculator) """
+		self.workBuffer.put(self.varIndices, concs)
+		return self.jacobianCalculator.getJacobianFromWorkBuffer(self.workBuffer, self.rateConsts)
+
+	def getJacobianSolverOptions(self):
+		""" Gets the keyword arguments to pass this Jacobian to scipy.integrate.solve_ivp (jac and, for sparse Jacobians, jac_sparsity) """
+		outDict = {"jac":self.jacobian}
+		if self.jacobianCalculator.sparse:
+			outDict["jac_sparsity"] = self.jacobianCalculator.sparsity
+		return outDict
+
+	def getStateFromConcs(self, concs):
+		""" Converts variable species concentrations into the vector this function is defined on; the identity here, but see LogConcsRatesFunction """
+		return concs
+
+	def getConcsFromState(self, state):
+		""" Inverse of getStateFromConcs """
+		return state
+
+
+class GeneratedRatesFunction(CompiledRatesFunction):
+	""" Same interface as CompiledRatesFunction, but rates and the (dense) Jacobian come from straight-line code generated for this network (see core.codegen). Rate constants and fixed concentrations are folded in as constants, so later changes to rateConsts/workBuffer are NOT seen; create a new object for new conditions. Best for small networks, where NumPy overheads dominate
+
+	Attributes (in addition to CompiledRatesFunction):
+		backend: (str) Code generation backend; see codegen.getGeneratedFunctions
+
+	"""
+	def __init__(self, network, rateConsts, workBuffer, varIndices, backend="python"):
+		super().__init__(network, rateConsts, workBuffer, varIndices)
+		self.backend = backend
+		self._ratesFunct, self._jacFunct = codegenHelp.getGeneratedFunctions(network, self.varIndices, rateConsts, workBuffer, backend=backend)
+
+	def __call__(self, time, concs):
+		self._lastRates = self._ratesFunct(time, concs)
+		self._lastConcs[:] = concs
+		return self._lastRates
+
+	def jacobian(self, time, concs):
+		return self._jacFunct(time, concs)
+
+	def getJacobianSolverOptions(self):
+		return {"jac":self.jacobian}
+
+
+class LogConcsRatesFunction(CompiledRatesFunction):
+	""" Callable f(time, y)->dy/dt for a reduced state of the variable species in which most concentrations are stored as ln([X]). Coverages that collapse by tens of orders of magnitude (e.g. after a large potential step) then stay resolved, with tolerances acting on relative rather than absolute changes. The state is built so this costs no more integrator steps than the linear form:
+		- Each conserved quantity (e.g. total surface sites; a row of self.conservationMatrix) has one "pivot" species, calculated from the others rather than integrated. Totals are therefore exact, and round-off in large cancelling rates cannot drift along them (which otherwise stalls implicit solvers at strongly polarised potentials)
+		- Species below minConc (e.g. on an empty surface) are stored linearly, so they dont have to climb through every decade up from minConc
+
+	y holds the non-pivot species (ordered as in varIndices). getStateFromConcs chooses the basis (pivots and which species are logarithmic) from the concentrations it converts; propagators do this automatically, and move to a new basis when getBasisMargin goes negative. The Jacobian is always dense
+
+	Attributes (in addition to CompiledRatesFunction):
+		minConc: (float) Species below this concentration when the basis is chosen are stored linearly
+		pivotRatio: (float) getBasisMargin goes negative once a species contributes more than this multiple of its pivot to a conserved quantity
+		conservationMatrix: (float array) One row per conserved quantity; row @ concs is constant
+		pivots: (int array) Position (in varIndices) of the pivot for each row of conservationMatrix
+		freePositions: (int array) Position (in varIndices) of each species in y
+		logMask: (bool array) True for the entries of y which are ln([X])
+
+	"""
+	def __init__(self, network, rateConsts, workBuffer, varIndices, minConc=1e-30, pivotRatio=100):
+		super().__init__(network, rateConsts, workBuffer, varIndices)
+		self.jacobianCalculator = compiledHelp.JacobianCalculator(network, self.varIndices, sparse=False)
+		self.minConc = minConc
+		self.pivotRatio = pivotRatio
+		self.conservationMatrix = linAlgHelp.null_space(network.stoichMatrix[self.varIndices].T).T
+		self._setBasis( workBuffer.take(self.varIndices) )
+
+	def _setBasis(self, concs):
+		#Greedy choice of the largest concentrations which give linearly independent pivot columns
+		concs = np.array(concs, dtype=float)
+		pivots = list()
+		for pos in np.argsort(-concs, kind="stable").tolist():
+			if len(pivots) == len(self.conservationMatrix):
+				break
+			if np.linalg.matrix_rank(self.conservationMatrix[:,pivots+[pos]]) > len(pivots):
+				pivots.append(pos)
+
+		self.pivots = np.array(pivots, dtype=int)
+		self.freePositions = np.array([x for x in range(len(concs)) if x not in pivots], dtype=int)
+		pivotRows = np.linalg.solve(self.conservationMatrix[:,self.pivots], self.conservationMatrix) if len(pivots)>0 else self.conservationMatrix
+		self._freeWeights = pivotRows[:,self.freePositions]
+		self._totals = pivotRows @ concs
+		self.logMask = concs[self.freePositions] >= self.minConc
+
+	def __call__(self, time, state):
+		#Trial (Newton) states can put ln([X]) far beyond any real concentration; the non-finite rates that follow just make the solver cut its step
+		with np.errstate(over="ignore", invalid="ignore"):
+			concs = self.getConcsFromState(state)
+			outRates = super().__call__(time, concs)[self.freePositions]
+			outRates[self.logMask] /= concs[self.freePositions][self.logMask]
+		return outRates
+
+	def jacobian(self, time, state):
+		""" J[i,k] = d(dy_i/dt)/dy_k. Built from the concentration Jacobian, with pivot columns folded in through the conservation rows and log entries scaled by [X]. Each log entry also has -dy_i/dt on the diagonal """
+		with np.errstate(over="ignore", invalid="ignore"):
+			concs = self.getConcsFromState(state)
+			concJacobian = super().jacobian(time, concs)
+			freeJacobian = concJacobian[np.ix_(self.freePositions, self.freePositions)] - concJacobian[np.ix_(self.freePositions, self.pivots)] @ self._freeWeights
+			scales = np.where(self.logMask, concs[self.freePositions], 1)
+			outJacobian = freeJacobian * (scales[np.newaxis,:] / scales[:,np.newaxis])
+		outJacobian[np.diag_indices(len(scales))] -= np.where(self.logMask, self(time, state), 0)
+		return outJacobian
+
+	def getJacobianSolverOptions(self):
+		return {"jac":self.jacobian}
+
+	def getStateFromConcs(self, concs):
+		""" Converts variable species concentrations into y, first choosing the basis (see class docstring) to suit concs. States from before the call are only valid for the old basis """
+		self._setBasis(concs)
+		outState = np.array(concs, dtype=float)[self.freePositions]
+		outState[self.logMask] = np.log(outState[self.logMask])
+		return outState
+
+	def getConcsFromState(self, state):
+		freeConcs = np.array(state, dtype=float)
+		freeConcs[self.logMask] = np.exp(freeConcs[self.logMask])
+		outConcs = np.zeros(len(self.varIndices))
+		outConcs[self.freePositions] = freeConcs
+		outConcs[self.pivots] = self._totals - self._freeWeights @ freeConcs
+		return outConcs
+
+	def getBasisMargin(self, state):
+		""" Gets the smallest (over conserved quantities) value of pivotRatio*pivot concentration minus the largest contribution of any other species. Negative once a species has grown well past its pivot; the state should then be moved to a new basis (getStateFromConcs(getConcsFromState(state))) """
+		if len(self.pivots) == 0:
+			return np.inf
+		concs = self.getConcsFromState(state)
+		contributions = np.abs(self._freeWeights) * concs[self.freePositions]
+		return np.min( self.pivotRatio*concs[self.pivots] - np.max(contributions, axis=1, initial=0) )
+
+	def getStateTolerances(self, rtol, atol):
+		""" Converts solver tolerances on concentrations into ones for y. ln([X]) entries get an absolute tolerance of rtol, i.e. a relative tolerance on [X]; linear entries keep atol
+
+		Args:
+			rtol: (float) Relative tolerance
+			atol: (float or float array) Absolute tolerance; an array has one value per variable species
+
+		Returns
+			rtol: (float) Unchanged
+			atol: (float array) One value per entry of y
+
+		"""
+		outAtol = np.array( np.broadcast_to(atol, len(self.varIndices))[self.freePositions], dtype=float )
+		outAtol[self.logMask] = rtol
+		return rtol, outAtol
+
+
+class _PotentialWaveformMixin():
+	""" Makes a compiled rates function re-evaluate its rate constants at the potential of a waveform each time it is called (or its Jacobian is). Values are only recalculated when the time changes """
+
+	def _setWaveform(self, potentialRateConsts, waveform):
+		self.potentialRateConsts = potentialRateConsts
+		self.waveform = waveform
+		self._rateConstsTime = None
+
+	def _updateRateConsts(self, time):
+		if time != self._rateConstsTime:
+			self._rateConstsTime = time
+			self._writeRateConsts( self.waveform.getPotential(time) )
+
+	def __call__(self, time, state):
+		self._updateRateConsts(time)
+		return super().__call__(time, state)
+
+	def jacobian(self, time, state):
+		self._updateRateConsts(time)
+		return super().jacobian(time, state)
+
+
+class WaveformRatesFunction(_PotentialWaveformMixin, CompiledRatesFunction):
+	""" CompiledRatesFunction for a time-dependent potential; self.rateConsts are overwritten with their values at waveform.getPotential(time) on each call (one vector operation for BetterReactionTemplate channels; see compiled_network.PotentialRateConstants)
+
+	Attributes (in addition to CompiledRatesFunction):
+		potentialRateConsts: (PotentialRateConstants)
+		waveform: (PotentialWaveform) Evaluated at the time the integrator passes in
+
+	"""
+	def __init__(self, network, potentialRateConsts, waveform, workBuffer, varIndices):
+		super().__init__(network, np.zeros(network.nChannels), workBuffer, varIndices)
+		self._setWaveform(potentialRateConsts, waveform)
+		self._updateRateConsts(0)
+
+	@classmethod
+	def fromRateCalculator(cls, rateCalculator, inputReactants, variableSpeciesOrder, temperature, potential, **kwargs):
+		""" Alternative initializer; same arguments as CompiledRatesFunction.fromRateCalculator, except potential is a PotentialWaveform """
+		network, varIndices = _getNetworkForRatesFunction(rateCalculator, variableSpeciesOrder)
+		potentialRateConsts = compiledHelp.PotentialRateConstants(network, temperature, inputReactants=inputReactants)
+		workBuffer = network.createWorkBuffer( network.getConcsFromReactants(inputReactants) )
+		return cls(network, potentialRateConsts, potential, workBuffer, varIndices, **kwargs)
+
+	def _writeRateConsts(self, potential):
+		self.potentialRateConsts.getRateConstants(potential, out=self.rateConsts)
+
+
+class WaveformLogConcsRatesFunction(_PotentialWaveformMixin, LogConcsRatesFunction):
+	""" LogConcsRatesFunction for a time-dependent potential; self.rateConsts are overwritten on each call, as for WaveformRatesFunction """
+	def __init__(self, network, potentialRateConsts, waveform, workBuffer, varIndices, minConc=1e-30, pivotRatio=100):
+		super().__init__(network, np.zeros(network.nChannels), workBuffer, varIndices, minConc=minConc, pivotRatio=pivotRatio)
+		self._setWaveform(potentialRateConsts, waveform)
+		self._updateRateConsts(0)
+
+	@classmethod
+	def fromRateCalculator(cls, rateCalculator, inputReactants, variableSpeciesOrder, temperature, potential, **kwargs):
+		""" Alternative initializer; same arguments as WaveformRatesFunction.fromRateCalculator """
+		network, varIndices = _getNetworkForRatesFunction(rateCalculator, variableSpeciesOrder)
+		potentialRateConsts = compiledHelp.PotentialRateConstants(network, temperature, inputReactants=inputReactants)
+		workBuffer = network.createWorkBuffer( network.getConcsFromReactants(inputReactants) )
+		return cls(network, potentialRateConsts, potential, workBuffer, varIndices, **kwargs)
+
+	def _writeRateConsts(self, potential):
+		self.potentialRateConsts.getRateConstants(potential, out=self.rateConsts)
+
+
 #TODO: Could likely just merge this with ConcChangesFinderStandard and add a .propagte to THAT class...
 #Not sure theres ever going to be much varying configuration on this class?
 class ConcsPropagatorStandard(ConcsPropagatorBase):
@@ -169,21 +550,36 @@ class ConcsPropagatorStandard(ConcsPropagatorBase):
 	def propagate(self, inputReactants, timeStep, temperature=300, potential=0):
 		doneSteps = False
 		timeTaken, maxStep = 0, timeStep
+		nSteps = 0
+		startTime = None if self.instrumentation is None else self.instrumentation.getTime()
 
 
+		isWaveform = isinstance(potential, waveHelp.PotentialWaveform)
 		while doneSteps is False:
-			currStep, concChanges = self.concChangesFinder.getConcChangesForNextTimeStep(inputReactants, maxStep, temperature=temperature, potential=potential)
+			currPotential = potential.getPotential(timeTaken) if isWaveform else potential
+			currStep, concChanges = self.concChangesFinder.getConcChangesForNextTimeStep(inputReactants, maxStep, temperature=temperature, potential=currPotential)
 			timeTaken += currStep
 			maxStep -= currStep
+			nSteps += 1
 			self._updateConcs( inputReactants, concChanges )
 
 			if ( abs((timeTaken/timeStep)-1)< self.relTimeTolerance):
 				doneSteps = True
 			elif abs(timeTaken/timeStep) > 1:
 				doneSteps = True
-		
+
+		if self.instrumentation is not None:
+			stats = instrHelp.SolverStats(nfev=nSteps, nAcceptedSteps=nSteps)
+			self.instrumentation.recordSolverCall(type(self).__name__, startTime, self.instrumentation.getTime(), stats, method="euler", timeStep=timeStep)
 
 	def _updateConcs(self, reactants, concChanges):
+		if isinstance(reactants, coreHelp.SpeciesState):
+			for key,val in concChanges.items():
+				idx = reactants.indices.get(key)
+				if idx is not None:
+					reactants.concs[idx] += val
+			return None
+
 		for key in concChanges.keys():
 			for reactant in reactants:
 				if reactant.name==key:
@@ -249,8 +645,13 @@ class RateCalculatorStandard(RateCalculatorBase):
 	def getRates(self, inputReactants, temperature=300, potential=0):
 		outDict = dict()
 		dudTimeStep = 1 #We want the rate of change rather than the amount; hence we ALWAYS use a timestep of 1
+		instrumentation = self.instrumentation
 		for reaction in self.reactions:
+			if instrumentation is not None:
+				startTime = instrumentation.getTime()
 			currChanges = reaction.getChangesInReactants(dudTimeStep, inputReactants, temperature, potential=potential)
+			if instrumentation is not None:
+				instrumentation.recordReactionTime(type(reaction).__name__, instrumentation.getTime()-startTime)
 			for key in currChanges.keys():
 				if key in outDict:
 					outDict[key] += currChanges[key]
@@ -259,3 +660,123 @@ class RateCalculatorStandard(RateCalculatorBase):
 		return outDict
 
 
+class CompiledRateCalculator(RateCalculatorBase):
+	""" Rate calculator which compiles its reactions into a stoichiometry matrix and reactant-order index arrays once; d[X]/dt is then a single NumPy expression on a concentration vector. Rate constants are kept in an LRU cache keyed on conditions (see self.rateConstantCache) """
+
+	def __init__(self, reactions, maxCachedConditions=128, codegenBackend=None, logRateConstants=False, logConcs=False, minConc=1e-30, foldReservoirSpecies=True):
+		""" Initializer
+		
+		Args:
+			reactions: (iter of ChemReactionTemplate/NetReactionTemplate objects) Rates of all channels need to be mass-action (rateConstant * product of reactant concentrations); true for all the template classes
+			maxCachedConditions: (int) Maximum number of distinct conditions to hold rate constants for
+			codegenBackend: (Optional, str) If set, propagators integrate generated straight-line code (GeneratedRatesFunction) with this backend ("python", "numba" or "auto") rather than NumPy expressions. Worthwhile for small networks
+			logRateConstants: (bool) If True rate constants are evaluated in log space, with the Arrhenius and Tafel exponents fused into one exponential per channel
+			logConcs: (bool) If True propagators integrate a reduced state holding ln([X]) for most variable species (see LogConcsRatesFunction); solver tolerances on concentrations are converted to suit it. Implies logRateConstants
+			minConc: (float) Variable species below this concentration are integrated as [X] rather than ln([X]); only used if logConcs is True
+			foldReservoirSpecies: (bool) If True rates functions integrate a ReducedReactionNetwork (see self.getReducedNetwork); concentrations of every non-variable species are folded into pseudo-first-order rate constants each time a rates function is created, so rate evaluations and Jacobians only involve the variable species
+				 
+		Raises:
+			ValueError: If both codegenBackend and logConcs are set
+
+		NOTE:
+			Rate constants are cached on (temperature, potential, pH) and, if any channel is not a BetterReactionTemplate, the concentrations of species no reaction changes (e.g. "fixed_mg_2+" in the Taylor2016 model); see RateConstantCache.getConditionKey. Tafel factors depending on the concentration of a species which reactions DO change are therefore not supported
+
+			Setting a reaction parameter (e.g. reaction.barrier = 0.6) empties the cache, so it is picked up by the next call. Changes made without setting an attribute on a reaction (e.g. modifying an array attribute in place) are not seen; call self.clearRateConstantCache() after those. Rates functions already handed to a propagator keep the rate constants they were created with
+
+		"""
+		if (codegenBackend is not None) and logConcs:
+			raise ValueError("codegenBackend cannot be combined with logConcs")
+		self.reactions = reactions
+		self.network = compiledHelp.CompiledReactionNetwork(reactions)
+		self.logRateConstants = logRateConstants or logConcs
+		self.logConcs = logConcs
+		self.minConc = minConc
+		self.rateConstantCache = compiledHelp.RateConstantCache(self.network, maxSize=maxCachedConditions, logSpace=self.logRateConstants)
+		self.codegenBackend = codegenBackend
+		self.foldReservoirSpecies = foldReservoirSpecies
+		self._reducedNetworks = dict()
+		self._ratesWorkBuffer = self.network.createWorkBuffer()
+		self._ratesOfChange = np.zeros(self.network.nSpecies)
+
+	def clearRateConstantCache(self):
+		""" Forgets all cached rate constants (and the cache hit/miss counts), e.g. after changing reaction parameters in a way the cache cant detect """
+		self.rateConstantCache.clear()
+
+	def getReducedNetwork(self, varIndices):
+		""" Gets the ReducedReactionNetwork for the species at varIndices (indices in self.network.speciesNames). Cached on varIndices, since the structure only depends on which species vary """
+		key = tuple(varIndices)
+		if key not in self._reducedNetworks:
+			self._reducedNetworks[key] = compiledHelp.ReducedReactionNetwork(self.network, key)
+		return self._reducedNetworks[key]
+
+	def getRates(self, inputReactants, temperature=300, potential=0):
+		workBuffer = self.network.fillWorkBuffer(inputReactants, self._ratesWorkBuffer)
+		rateConsts = self.rateConstantCache.getRateConstants(temperature, potential=potential, inputReactants=inputReactants)
+		if self.logRateConstants:
+			rateConsts = np.exp(rateConsts)
+		self.network.getRatesOfChangeFromWorkBuffer(workBuffer, rateConsts, self._ratesOfChange)
+		return dict( zip(self.network.speciesNames, self._ratesOfChange.tolist()) )
+
+	def getRateConstants(self, inputReactants, temperature=300, potential=0):
+		""" Gets the rate constant for each channel in self.network; these are only calculated once for each distinct set of conditions """
+		outVals = self.rateConstantCache.getRateConstants(temperature, potential=potential, inputReactants=inputReactants)
+		return np.exp(outVals) if self.logRateConstants else outVals
+
+	def getLogRateConstants(self, inputReactants, temperature=300, potential=0):
+		""" Gets ln(rateConstant) for each channel in self.network; exact (rather than the log of a possibly under/overflowed value) if self.logRateConstants is True """
+		outVals = self.rateConstantCache.getRateConstants(temperature, potential=potential, inputReactants=inputReactants)
+		if self.logRateConstants:
+			return outVals
+		with np.errstate(divide="ignore"):
+			return np.log(outVals)
+
+	def getRatesFunction(self, inputReactants, variableSpeciesOrder, temperature=300, potential=0):
+		""" Gets the function propagators integrate for the variable species; a CompiledRatesFunction, GeneratedRatesFunction (if self.codegenBackend is set) or LogConcsRatesFunction (if self.logConcs is True). Concentrations of all other species are taken from inputReactants
+
+		If potential is a PotentialWaveform this is a WaveformRatesFunction (or WaveformLogConcsRatesFunction), which re-evaluates the rate constants at each time; codegenBackend is then ignored since generated code has the rate constants folded in
+		"""
+		args = [self, inputReactants, variableSpeciesOrder, temperature, potential]
+		if isinstance(potential, waveHelp.PotentialWaveform):
+			outClass = WaveformLogConcsRatesFunction if self.logConcs else WaveformRatesFunction
+			kwargs = {"minConc":self.minConc} if self.logConcs else dict()
+			return outClass.fromRateCalculator(*args, **kwargs)
+		if self.logConcs:
+			return LogConcsRatesFunction.fromRateCalculator(*args, minConc=self.minConc)
+		if self.codegenBackend is None:
+			return CompiledRatesFunction.fromRateCalculator(*args)
+		return GeneratedRatesFunction.fromRateCalculator(*args, backend=self.codegenBackend)
+
+
+def _getNetworkForRatesFunction(rateCalculator, variableSpeciesOrder):
+	""" Gets the network a rates function should use (the reduced one if rateCalculator.foldReservoirSpecies is set) and the index of each variable species in it """
+	network = rateCalculator.network
+	varIndices = [network.speciesIndices[name] for name in variableSpeciesOrder]
+	if rateCalculator.foldReservoirSpecies:
+		return rateCalculator.getReducedNetwork(varIndices), list(range(len(varIndices)))
+	return network, varIndices
+
+
+def _getStateFromConcs(functToPropagate, concs):
+	if isinstance(functToPropagate, CompiledRatesFunction):
+		return functToPropagate.getStateFromConcs(concs)
+	return concs
+
+
+def _getConcsFromState(functToPropagate, state):
+	if isinstance(functToPropagate, CompiledRatesFunction):
+		return functToPropagate.getConcsFromState(state)
+	return state
+
+
+def _getReactantNames(inputReactants):
+	if isinstance(inputReactants, coreHelp.SpeciesState):
+		return list(inputReactants.names)
+	return [x.name for x in inputReactants]
+
+
+def _getTimeUntilJump(waveform, time, relTol=1e-12):
+	""" Time from time until the next jump in waveform, ignoring any within float error of time (i.e. ones a step has just ended on) """
+	timeUntil = waveform.getTimeUntilDiscontinuity(time)
+	if timeUntil <= relTol*max(1, abs(time)):
+		timeUntil = waveform.getTimeUntilDiscontinuity(time + 2*relTol*max(1, abs(time)))
+	return timeUntil
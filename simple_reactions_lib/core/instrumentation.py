@@ -0,0 +1,265 @@
+
+""" Opt-in instrumentation for propagators and rate calculators: solver counters (RHS/Jacobian evaluations, LU factorisations, accepted/rejected steps), RHS and Jacobian wall time, and wall time per reaction class. Collected data can be exported as a summary dict/JSON or as a Chrome trace (load in chrome://tracing or https://ui.perfetto.dev)
+
+Propagators and rate calculators have an "instrumentation" attribute which is None by default; nothing is measured (beyond one "is None" check per call) unless it is set, e.g. with enableInstrumentation(propagator)
+
+"""
+
+import copy
+import json
+import time
+
+import scipy.integrate as integrateHelp
+
+
+#Relative tolerance when deciding whether the step an OdeSolver took was shorter than the one it proposed (i.e. whether it rejected a step)
+_STEP_TOL = 1e-10
+
+_INSTRUMENTED_SOLVER_CLASSES = dict()
+
+
+class SolverStats():
+	""" Counters for one integration (or part of one)
+
+	Attributes:
+		nfev: (int) Number of RHS evaluations
+		njev: (int) Number of Jacobian evaluations
+		nlu: (int) Number of LU factorisations
+		nAcceptedSteps: (int)
+		nRejectedSteps: (int) Accepted steps which were only taken after at least one rejected attempt (error test or Newton failure). None if the solver doesnt allow this to be found (e.g. LSODA)
+		rhsWallTime: (float) Time spent in the RHS (seconds). Excludes evaluations made while the solver is created
+		jacWallTime: (float) Time spent in the Jacobian function (seconds). Excludes evaluations made while the solver is created
+
+	"""
+
+	FIELDS = ("nfev", "njev", "nlu", "nAcceptedSteps", "nRejectedSteps", "rhsWallTime", "jacWallTime")
+
+	def __init__(self, nfev=0, njev=0, nlu=0, nAcceptedSteps=0, nRejectedSteps=0, rhsWallTime=0.0, jacWallTime=0.0):
+		self.nfev = nfev
+		self.njev = njev
+		self.nlu = nlu
+		self.nAcceptedSteps = nAcceptedSteps
+		self.nRejectedSteps = nRejectedSteps
+		self.rhsWallTime = rhsWallTime
+		self.jacWallTime = jacWallTime
+
+	def __add__(self, other):
+		outKwargs = dict()
+		for field in self.FIELDS:
+			currVal, otherVal = getattr(self, field), getattr(other, field)
+			outKwargs[field] = None if (currVal is None or otherVal is None) else currVal + otherVal
+		return SolverStats(**outKwargs)
+
+	def __sub__(self, other):
+		outKwargs = dict()
+		for field in self.FIELDS:
+			currVal, otherVal = getattr(self, field), getattr(other, field)
+			outKwargs[field] = None if (currVal is None or otherVal is None) else currVal - otherVal
+		return SolverStats(**outKwargs)
+
+	def toDict(self):
+		return {field:getattr(self, field) for field in self.FIELDS}
+
+
+class Instrumentation():
+	""" Collects solver counters and timings from any propagators/rate calculators it is attached to (see enableInstrumentation)
+
+	Attributes:
+		solverCalls: (list of dicts) One per propagate() call (one per integrator used for ConcsPropagator_Auto); keys are "label", "method", "startTime", "wallTime", "timeStep", "success" plus SolverStats.FIELDS
+		reactionClassTimes: (dict) Reaction class name to {"nCalls":int, "wallTime":float}; only filled by calculators evaluating reactions one at a time (RateCalculatorStandard)
+		maxTraceEvents: (int) Trace events beyond this many are dropped (counted in nDroppedEvents); summaries are unaffected
+		nDroppedEvents: (int)
+
+	"""
+
+	def __init__(self, maxTraceEvents=100000, clock=time.perf_counter):
+		""" Initializer
+
+		Args:
+			maxTraceEvents: (int) Maximum number of Chrome trace events to keep
+			clock: f()->float Clock (in seconds) used for all timings
+
+		"""
+		self.maxTraceEvents = maxTraceEvents
+		self.clock = clock
+		self.reset()
+
+	def reset(self):
+		self.solverCalls = list()
+		self.reactionClassTimes = dict()
+		self.nDroppedEvents = 0
+		self._traceEvents = list()
+		self._cumulativeCounts = {"nfev":0, "nRejectedSteps":0}
+		self._startTime = self.clock()
+
+	def getTime(self):
+		return self.clock()
+
+	def recordSolverCall(self, label, startTime, endTime, solverStats, method=None, timeStep=None, success=True):
+		""" Records one propagation
+
+		Args:
+			label: (str) Usually the propagator class name
+			startTime: (float) From self.getTime()
+			endTime: (float) From self.getTime()
+			solverStats: (SolverStats)
+			method: (Optional, str) Integration method
+			timeStep: (Optional, float) Simulated time covered
+			success: (bool) False if the integration failed
+
+		"""
+		outDict = {"label":label, "method":method, "startTime":startTime-self._startTime, "wallTime":endTime-startTime, "timeStep":timeStep, "success":success}
+		outDict.update( solverStats.toDict() )
+		self.solverCalls.append(outDict)
+
+		traceArgs = {key:val for key,val in outDict.items() if key not in ("label", "startTime", "wallTime")}
+		self.addTraceEvent(label, "propagate", startTime, endTime, args=traceArgs)
+		self._cumulativeCounts["nfev"] += solverStats.nfev
+		self._cumulativeCounts["nRejectedSteps"] += (solverStats.nRejectedSteps or 0)
+		self._addCounterEvent("solverCounts", endTime, dict(self._cumulativeCounts))
+
+	def recordReactionTime(self, className, wallTime):
+		""" Adds wallTime (seconds) to the total for one reaction class """
+		currEntry = self.reactionClassTimes.setdefault(className, {"nCalls":0, "wallTime":0.0})
+		currEntry["nCalls"] += 1
+		currEntry["wallTime"] += wallTime
+
+	def addTraceEvent(self, name, category, startTime, endTime, args=None):
+		""" Adds a complete ("X") event to the Chrome trace; times are from self.getTime() """
+		outEvent = {"name":name, "cat":category, "ph":"X", "ts":self._getTraceTime(startTime), "dur":(endTime-startTime)*1e6, "pid":0, "tid":0}
+		if args is not None:
+			outEvent["args"] = args
+		self._appendTraceEvent(outEvent)
+
+	def getSummary(self):
+		""" Gets totals over every recorded call
+
+		Returns
+			summary: (dict) "solvers" (label to totals of every solverCalls field plus "nCalls" and "nFailed"), "reactionClasses" (copy of self.reactionClassTimes) and "nDroppedEvents"
+
+		"""
+		solverTotals = dict()
+		for call in self.solverCalls:
+			defaultTotals = {"nCalls":0, "nFailed":0, "wallTime":0.0, "timeStep":0.0}
+			defaultTotals.update( SolverStats().toDict() )
+			currTotals = solverTotals.setdefault(call["label"], defaultTotals)
+			currTotals["nCalls"] += 1
+			currTotals["nFailed"] += int(not call["success"])
+			for key in ["wallTime", "timeStep"] + list(SolverStats.FIELDS):
+				if (call[key] is None) or (currTotals[key] is None):
+					currTotals[key] = None
+				else:
+					currTotals[key] += call[key]
+		return {"solvers":solverTotals, "reactionClasses":copy.deepcopy(self.reactionClassTimes), "nDroppedEvents":self.nDroppedEvents}
+
+	def getChromeTrace(self):
+		""" Gets the timeline as a Chrome trace-event dict (one "X" event per propagation, with counters as args, plus running totals as counter events) """
+		return {"traceEvents":list(self._traceEvents), "displayTimeUnit":"ms", "otherData":{"summary":self.getSummary()}}
+
+	def writeChromeTrace(self, outPath):
+		with open(outPath, "w") as outFile:
+			json.dump(self.getChromeTrace(), outFile)
+
+	def writeSummary(self, outPath):
+		with open(outPath, "w") as outFile:
+			json.dump(self.getSummary(), outFile, indent=1)
+
+	def _addCounterEvent(self, name, eventTime, values):
+		self._appendTraceEvent( {"name":name, "ph":"C", "ts":self._getTraceTime(eventTime), "pid":0, "args":values} )
+
+	def _appendTraceEvent(self, event):
+		if len(self._traceEvents) >= self.maxTraceEvents:
+			self.nDroppedEvents += 1
+			return None
+		self._traceEvents.append(event)
+
+	def _getTraceTime(self, inpTime):
+		return (inpTime-self._startTime)*1e6
+
+
+def enableInstrumentation(obj, instrumentation=None):
+	""" Attaches an Instrumentation to a propagator/rate calculator and any rate calculator it uses
+
+	Args:
+		obj: (ConcsPropagatorBase or RateCalculatorBase)
+		instrumentation: (Optional, Instrumentation) Default is a new one
+
+	Returns
+		instrumentation: (Instrumentation) The object attached
+
+	"""
+	instrumentation = Instrumentation() if instrumentation is None else instrumentation
+	for target in _getInstrumentationTargets(obj):
+		target.instrumentation = instrumentation
+	return instrumentation
+
+
+def disableInstrumentation(obj):
+	""" Detaches instrumentation from everything enableInstrumentation(obj) attached it to """
+	for target in _getInstrumentationTargets(obj):
+		target.instrumentation = None
+
+
+def _getInstrumentationTargets(obj):
+	outTargets = [obj]
+	concChangesFinder = getattr(obj, "concChangesFinder", None)
+	rateCalculator = getattr(obj, "rateCalculator", None) or getattr(concChangesFinder, "rateCalculator", None)
+	if rateCalculator is not None:
+		outTargets.append(rateCalculator)
+	return outTargets
+
+
+def getInstrumentedSolverClass(method):
+	""" Gets a subclass of a scipy OdeSolver which fills a SolverStats object as it integrates; pass this as the solve_ivp method, with solverStats=SolverStats() as an extra keyword argument
+
+	Args:
+		method: (str or OdeSolver class) e.g. "Radau"
+
+	Returns
+		solverClass: (OdeSolver class)
+
+	"""
+	baseClass = getattr(integrateHelp, method) if isinstance(method, str) else method
+	if baseClass not in _INSTRUMENTED_SOLVER_CLASSES:
+		className = "Instrumented{}".format(baseClass.__name__)
+		_INSTRUMENTED_SOLVER_CLASSES[baseClass] = type(className, (_InstrumentedSolverMixin, baseClass), dict())
+	return _INSTRUMENTED_SOLVER_CLASSES[baseClass]
+
+
+class _InstrumentedSolverMixin():
+
+	def __init__(self, *args, solverStats=None, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.solverStats = SolverStats() if solverStats is None else solverStats
+		self._startCounts = (self.solverStats.nfev, self.solverStats.njev, self.solverStats.nlu) #Non-zero if carrying on from a replaced solver
+		self._canCountRejections = hasattr(self, "h_abs")
+		if not self._canCountRejections:
+			self.solverStats.nRejectedSteps = None
+		self.fun = self._getTimedFunct(self.fun, "rhsWallTime")
+		if callable(getattr(self, "jac", None)):
+			self.jac = self._getTimedFunct(self.jac, "jacWallTime")
+		self._updateCounts()
+
+	def _getTimedFunct(self, funct, field):
+		solverStats, clock = self.solverStats, time.perf_counter
+		def _outFunct(*args):
+			startTime = clock()
+			outVal = funct(*args)
+			setattr(solverStats, field, getattr(solverStats, field) + clock() - startTime)
+			return outVal
+		return _outFunct
+
+	def _step_impl(self):
+		startTime = self.t
+		proposedStep = min(self.h_abs, self.max_step) if self._canCountRejections else None
+		success, message = super()._step_impl()
+		if success:
+			self.solverStats.nAcceptedSteps += 1
+			if (proposedStep is not None) and (self.t != self.t_bound) and (abs(self.t-startTime) < proposedStep*(1-_STEP_TOL)):
+				self.solverStats.nRejectedSteps += 1
+		self._updateCounts()
+		return success, message
+
+	def _updateCounts(self):
+		startNfev, startNjev, startNlu = self._startCounts
+		self.solverStats.nfev, self.solverStats.njev, self.solverStats.nlu = startNfev+int(self.nfev), startNjev+int(self.njev), startNlu+int(self.nlu) #LSODA counts are numpy ints
@@ -0,0 +1,581 @@
+
+""" Stochastic (kinetic Monte Carlo) simulation of a set of reactions on a finite system, e.g. a surface patch with a fixed number of sites. Concentrations of the variable species are converted to integer counts (count = conc*systemSize), and channels fire one event at a time rather than being integrated as mean-field ODEs
+
+Two methods are available:
+	"nextReaction": Exact; the Gibson-Bruck next reaction method. Each channel holds an absolute firing time in an indexed priority queue, and after each event only channels whose propensity depends on a changed species (see StochasticNetwork.dependencyGraph) are updated
+	"tauLeap": Approximate; many events per step, with the step size chosen so no propensity changes by more than about tauLeapTol (Cao, Gillespie and Petzold, J. Chem. Phys. 124, 044109 (2006)). Replicas are advanced together as arrays, each with its own clock, and fall back to short bursts of exact events whenever a leap would hold fewer than minLeapEvents events
+
+Species not in the variable species (e.g. solution species) act as reservoirs; their concentrations are folded into the propensity constants and never change
+
+"""
+
+import math
+
+import numpy as np
+
+from . import codegen as codegenHelp
+from . import compiled_network as compiledHelp
+from . import core_classes as coreHelp
+
+
+METHODS = ("nextReaction", "tauLeap")
+
+#Random numbers are drawn in blocks of this size for the exact method, since drawing one at a time dominates the cost of an event
+_RANDOM_BLOCK_SIZE = 4096
+
+#Number of exact events fired by a tau-leaping replica each time a leap would be too short to be worthwhile (as in Cao et al.)
+_EXACT_BURST_EVENTS = 100
+
+#Maximum number of times a tau-leap is halved (after leading to negative counts) before raising
+_MAX_LEAP_HALVINGS = 60
+
+
+class IndexedPriorityQueue():
+	""" Binary min-heap over the indices 0..n-1 where the key of any index can be changed in O(log n); as needed for the next reaction method
+
+	Attributes:
+		keys: (list of float) Current key for each index
+
+	"""
+
+	def __init__(self, keys):
+		self.keys = [float(x) for x in keys]
+		self._heap = sorted( range(len(self.keys)), key=self.keys.__getitem__ ) #A sorted list is a valid heap
+		self._positions = [0 for x in self._heap]
+		for pos,idx in enumerate(self._heap):
+			self._positions[idx] = pos
+
+	def __len__(self):
+		return len(self._heap)
+
+	def getMin(self):
+		""" Returns (index, key) for the index with the smallest key """
+		idx = self._heap[0]
+		return idx, self.keys[idx]
+
+	def update(self, idx, key):
+		""" Sets the key for idx and restores the heap order """
+		oldKey = self.keys[idx]
+		self.keys[idx] = key
+		if key < oldKey:
+			self._siftUp(self._positions[idx])
+		elif key > oldKey:
+			self._siftDown(self._positions[idx])
+
+	def _siftUp(self, pos):
+		heap, keys, positions = self._heap, self.keys, self._positions
+		idx = heap[pos]
+		key = keys[idx]
+		while pos > 0:
+			parentPos = (pos-1) >> 1
+			parentIdx = heap[parentPos]
+			if keys[parentIdx] <= key:
+				break
+			heap[pos] = parentIdx
+			positions[parentIdx] = pos
+			pos = parentPos
+		heap[pos] = idx
+		positions[idx] = pos
+
+	def _siftDown(self, pos):
+		heap, keys, positions = self._heap, self.keys, self._positions
+		nItems = len(heap)
+		idx = heap[pos]
+		key = keys[idx]
+		while True:
+			childPos = 2*pos + 1
+			if childPos >= nItems:
+				break
+			if (childPos+1 < nItems) and (keys[heap[childPos+1]] < keys[heap[childPos]]):
+				childPos += 1
+			childIdx = heap[childPos]
+			if key <= keys[childIdx]:
+				break
+			heap[pos] = childIdx
+			positions[childIdx] = pos
+			pos = childPos
+		heap[pos] = idx
+		positions[idx] = pos
+
+
+class StochasticNetwork():
+	""" Propensities (expected number of events per unit time) of every channel of a CompiledReactionNetwork, for integer counts of its variable species. A channel with rate rateConst*[A]*[B]... has propensity propensityConst*nA*nB..., where repeated reactants use falling factorials (e.g. nA*(nA-1) for 2A) and propensityConst = rateConst * (fixed species concentrations) * systemSize^(1-variableOrder)
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		varIndices: (int array) Network index of each variable species; defines the order of count vectors
+		systemSize: (float) Number of molecules (or sites) per unit concentration
+		varStoich: (nVar x nChannels int array) Change in each variable species count when each channel fires
+		channelReactantTerms: (list of tuples) For each channel, (varPosition, offset) for each variable reactant slot; its propensity is propensityConst*prod(counts[varPosition]-offset)
+		channelChanges: (list of tuples) For each channel, (varPosition, change) for each variable species it changes
+		dependencyGraph: (list of tuples) For each channel, every channel whose propensity may change when it fires (always including itself)
+
+	"""
+
+	def __init__(self, network, varIndices, systemSize):
+		""" Initializer
+
+		Args:
+			network: (CompiledReactionNetwork)
+			varIndices: (iter of int) Network index of each variable species
+			systemSize: (float) Number of molecules (or sites) per unit concentration
+
+		Raises:
+			ValueError: If any channel changes a variable species by a non-integer amount
+
+		"""
+		self.network = network
+		self.varIndices = np.array(varIndices, dtype=int)
+		self.systemSize = systemSize
+		varStoich = network.stoichMatrix[self.varIndices]
+		if np.any(varStoich != np.round(varStoich)):
+			raise ValueError("Stochastic simulation needs integer stoichiometries")
+		self.varStoich = np.round(varStoich).astype(np.int64)
+		self._createChannelTerms()
+		self._createDependencyGraph()
+		self._createArrayTerms()
+
+	@property
+	def nVar(self):
+		return len(self.varIndices)
+
+	def _createChannelTerms(self):
+		varPositions = {netIdx:pos for pos,netIdx in enumerate(self.varIndices.tolist())}
+		self.channelReactantTerms, self.channelChanges = list(), list()
+		for cIdx in range(self.network.nChannels):
+			currTerms, nSeen = list(), dict()
+			for netIdx in self.network.reactantIndices[cIdx].tolist():
+				if netIdx in varPositions:
+					pos = varPositions[netIdx]
+					currTerms.append( (pos, nSeen.get(pos,0)) )
+					nSeen[pos] = nSeen.get(pos,0) + 1
+			self.channelReactantTerms.append( tuple(currTerms) )
+			self.channelChanges.append( tuple([(pos, int(self.varStoich[pos,cIdx])) for pos in np.nonzero(self.varStoich[:,cIdx])[0].tolist()]) )
+		self.varOrders = np.array([len(x) for x in self.channelReactantTerms], dtype=int)
+
+	def _createDependencyGraph(self):
+		channelsPerSpecies = [set() for x in range(self.nVar)]
+		for cIdx, terms in enumerate(self.channelReactantTerms):
+			for pos, unused in terms:
+				channelsPerSpecies[pos].add(cIdx)
+
+		self.dependencyGraph = list()
+		for cIdx, changes in enumerate(self.channelChanges):
+			dependents = {cIdx}
+			for pos, unused in changes:
+				dependents.update( channelsPerSpecies[pos] )
+			self.dependencyGraph.append( tuple(sorted(dependents)) )
+
+	def _createArrayTerms(self):
+		""" Padded (nChannels x maxOrder) forms of channelReactantTerms for evaluating many count vectors at once; padded slots point at an extra count column fixed at 1 """
+		maxOrder = max( [len(x) for x in self.channelReactantTerms] + [1] )
+		self._slotPositions = np.full( (self.network.nChannels, maxOrder), self.nVar, dtype=int )
+		self._slotOffsets = np.zeros( (self.network.nChannels, maxOrder), dtype=np.int64 )
+		for cIdx, terms in enumerate(self.channelReactantTerms):
+			for slotIdx, (pos, offset) in enumerate(terms):
+				self._slotPositions[cIdx, slotIdx] = pos
+				self._slotOffsets[cIdx, slotIdx] = offset
+
+		#Highest order of any channel consuming each species; used in tau selection
+		self._highestOrders = np.zeros(self.nVar, dtype=int)
+		for cIdx, terms in enumerate(self.channelReactantTerms):
+			for pos, unused in terms:
+				self._highestOrders[pos] = max(self._highestOrders[pos], len(terms))
+
+	def getPropensityConstants(self, rateConsts, concs):
+		""" Gets the constant part of each channel propensity
+
+		Args:
+			rateConsts: (float array) Rate constant for each channel
+			concs: (float array) Concentrations of all network species; only fixed species values are used
+
+		Returns
+			propensityConsts: (float array) One value per channel
+
+		"""
+		foldedConsts = codegenHelp.getFoldedRateConstants(self.network, self.varIndices, rateConsts, concs)
+		return foldedConsts * np.power(float(self.systemSize), 1-self.varOrders)
+
+	def getPropensity(self, channelIdx, counts, propensityConsts):
+		""" Gets the propensity of one channel for a count vector (or list) """
+		outVal = propensityConsts[channelIdx]
+		for pos, offset in self.channelReactantTerms[channelIdx]:
+			outVal *= max(counts[pos]-offset, 0)
+		return outVal
+
+	def getPropensities(self, counts, propensityConsts):
+		""" Gets the propensity of every channel
+
+		Args:
+			counts: (... x nVar int array) Counts of the variable species; leading dimensions (e.g. replicas) are kept
+			propensityConsts: (float array) Output of self.getPropensityConstants
+
+		Returns
+			propensities: (... x nChannels float array)
+
+		"""
+		counts = np.asarray(counts)
+		extCounts = np.ones( counts.shape[:-1] + (self.nVar+1,), dtype=np.int64 )
+		extCounts[...,:-1] = counts
+		factors = np.maximum(extCounts[...,self._slotPositions] - self._slotOffsets, 0)
+		return propensityConsts * np.prod(factors, axis=-1, dtype=float)
+
+	def getLeapTimes(self, counts, propensities, tolerance):
+		""" Gets the largest tau-leap for each count vector over which no propensity is expected to change by more than about tolerance (Cao et al. 2006, using the highest reaction order for each species)
+
+		Args:
+			counts: (N x nVar int array)
+			propensities: (N x nChannels float array)
+			tolerance: (float) e.g. 0.03
+
+		Returns
+			leapTimes: (N float array) Infinite if nothing can happen
+
+		"""
+		meanChanges = propensities @ self.varStoich.T
+		changeVariances = propensities @ (self.varStoich**2).T
+		bounds = np.maximum( tolerance*counts/np.maximum(self._highestOrders,1), 1 )
+		with np.errstate(divide="ignore"):
+			meanLimits = np.where( meanChanges != 0, bounds/np.abs(meanChanges), np.inf )
+			varLimits = np.where( changeVariances != 0, (bounds**2)/changeVariances, np.inf )
+		limits = np.minimum(meanLimits, varLimits)
+		limits[:, self._highestOrders==0] = np.inf #Only reactant species limit the step
+		return np.min(limits, axis=1) if self.nVar > 0 else np.full(len(counts), np.inf)
+
+
+class StochasticTrajectory():
+	""" Counts of the variable species at a set of output times for one or more independent replicas
+
+	Attributes:
+		speciesNames: (list of str) Variable species; defines the last axis of counts
+		times: (float array) Output times
+		counts: (nReplicas x nTimes x nVar int array)
+		systemSize: (float) Molecules (or sites) per unit concentration
+		nEvents: (int array) Number of events fired in each replica
+
+	"""
+
+	def __init__(self, speciesNames, times, counts, systemSize, nEvents):
+		self.speciesNames = list(speciesNames)
+		self.times = np.array(times, dtype=float)
+		self.counts = np.array(counts, dtype=np.int64)
+		self.systemSize = systemSize
+		self.nEvents = np.array(nEvents, dtype=np.int64)
+
+	@property
+	def nReplicas(self):
+		return self.counts.shape[0]
+
+	def getConcs(self):
+		""" Gets counts/systemSize; (nReplicas x nTimes x nVar float array) """
+		return self.counts / self.systemSize
+
+	def getMeanConcs(self):
+		""" Gets the mean concentration over replicas; (nTimes x nVar float array) """
+		return np.mean(self.getConcs(), axis=0)
+
+	def getStdConcs(self):
+		""" Gets the standard deviation of concentrations over replicas; (nTimes x nVar float array) """
+		return np.std(self.getConcs(), axis=0)
+
+
+class StochasticSimulator():
+	""" Runs kinetic Monte Carlo simulations of a set of reactions. See the module docstring for the available methods
+
+	Attributes:
+		network: (CompiledReactionNetwork) NetReactionTemplate objects are split into their forward and backward channels
+		variableConcSpecies: (iter of str) Names of species whose counts change; all others are reservoirs
+		systemSize: (float) Number of molecules (or sites) per unit concentration
+		method: (str) One of METHODS
+		rng: (numpy Generator) Source of all random numbers
+		tauLeapTol: (float) Largest relative change in any propensity allowed over one leap ("tauLeap" only)
+		minLeapEvents: (float) Leaps expected to hold fewer events than this are replaced by a single exact event ("tauLeap" only)
+		rateConstantCache: (RateConstantCache)
+
+	"""
+
+	def __init__(self, reactions, variableConcSpecies, systemSize, method="nextReaction", seed=None, tauLeapTol=0.03, minLeapEvents=10):
+		""" Initializer
+
+		Args:
+			reactions: (iter of ChemReactionTemplate/NetReactionTemplate objects) Must all be mass-action
+			variableConcSpecies: (iter of str) Names of species whose counts change
+			systemSize: (float) Number of molecules (or sites) per unit concentration; e.g. the number of sites on a surface patch when concentrations are coverages
+			method: (str) One of METHODS
+			seed: (Optional, int or numpy Generator) Seed for self.rng
+			tauLeapTol: (float) See class docstring
+			minLeapEvents: (float) See class docstring
+
+		Raises:
+			ValueError: If method is unknown
+
+		"""
+		if method not in METHODS:
+			raise ValueError("method must be one of {}, not {}".format(METHODS, method))
+		self.network = compiledHelp.CompiledReactionNetwork(reactions)
+		self.variableConcSpecies = variableConcSpecies
+		self.systemSize = systemSize
+		self.method = method
+		self.rng = np.random.default_rng(seed)
+		self.tauLeapTol = tauLeapTol
+		self.minLeapEvents = minLeapEvents
+		self.rateConstantCache = compiledHelp.RateConstantCache(self.network)
+		self._stochNetworks = dict()
+
+	def getStochasticNetwork(self, inputReactants):
+		""" Gets the StochasticNetwork for the variable species present in inputReactants (cached on which species these are) """
+		varIndices = self._getVarIndices(inputReactants)
+		key = tuple(varIndices)
+		if key not in self._stochNetworks:
+			self._stochNetworks[key] = StochasticNetwork(self.network, varIndices, self.systemSize)
+		return self._stochNetworks[key]
+
+	def getCounts(self, inputReactants):
+		""" Gets the (rounded) count of each variable species, ordered as in getStochasticNetwork(inputReactants).varIndices """
+		stochNetwork = self.getStochasticNetwork(inputReactants)
+		concs = self.network.getConcsFromReactants(inputReactants)
+		return np.rint(concs[stochNetwork.varIndices]*self.systemSize).astype(np.int64)
+
+	def setCounts(self, inputReactants, counts):
+		""" Sets concentrations of the variable species in inputReactants (in place) to counts/systemSize """
+		stochNetwork = self.getStochasticNetwork(inputReactants)
+		concs = dict( zip([self.network.speciesNames[x] for x in stochNetwork.varIndices], (np.asarray(counts)/self.systemSize).tolist()) )
+		if isinstance(inputReactants, coreHelp.SpeciesState):
+			for name, conc in concs.items():
+				inputReactants.setConc(name, conc)
+			return None
+		for reactant in inputReactants:
+			if reactant.name in concs:
+				reactant.conc = concs[reactant.name]
+
+	def simulate(self, inputReactants, outputTimes, temperature=300, potential=0):
+		""" Runs one realisation starting from the concentrations in inputReactants (which are not modified)
+
+		Args:
+			inputReactants: (iter of ChemSpeciesStd or SpeciesState)
+			outputTimes: (iter of float) Sorted, non-negative times (from the start) at which to record counts; the simulation stops at the last
+			temperature: (float)
+			potential: (float)
+
+		Returns
+			trajectory: (StochasticTrajectory) With one replica
+
+		"""
+		return self.simulateReplicas(inputReactants, outputTimes, 1, temperature=temperature, potential=potential)
+
+	def simulateReplicas(self, inputReactants, outputTimes, nReplicas, temperature=300, potential=0):
+		""" Runs nReplicas independent realisations from the same starting concentrations. For "tauLeap" these are advanced together as arrays; for "nextReaction" one after another
+
+		Args:
+			inputReactants: (iter of ChemSpeciesStd or SpeciesState) Not modified
+			outputTimes: (iter of float) Sorted, non-negative times (from the start) at which to record counts
+			nReplicas: (int)
+			temperature: (float)
+			potential: (float)
+
+		Returns
+			trajectory: (StochasticTrajectory)
+
+		Raises:
+			ValueError: If outputTimes is empty, unsorted or contains negative times
+
+		"""
+		outputTimes = np.array(outputTimes, dtype=float).ravel()
+		if (len(outputTimes) == 0) or np.any(np.diff(outputTimes) < 0) or (outputTimes[0] < 0):
+			raise ValueError("outputTimes must be a non-empty, sorted list of non-negative times")
+
+		stochNetwork = self.getStochasticNetwork(inputReactants)
+		startCounts = self.getCounts(inputReactants)
+		rateConsts = self.rateConstantCache.getRateConstants(temperature, potential=potential, inputReactants=inputReactants)
+		propensityConsts = stochNetwork.getPropensityConstants(rateConsts, self.network.getConcsFromReactants(inputReactants))
+
+		if self.method == "tauLeap":
+			startCounts = np.tile(startCounts, (nReplicas,1))
+			outCounts, nEvents = runTauLeaping(stochNetwork, startCounts, propensityConsts, outputTimes, self.rng, tolerance=self.tauLeapTol, minLeapEvents=self.minLeapEvents)
+		else:
+			outCounts, nEvents = list(), list()
+			for unused in range(nReplicas):
+				currCounts, currEvents = runNextReaction(stochNetwork, startCounts, propensityConsts, outputTimes, self.rng)
+				outCounts.append(currCounts)
+				nEvents.append(currEvents)
+
+		speciesNames = [self.network.speciesNames[x] for x in stochNetwork.varIndices]
+		return StochasticTrajectory(speciesNames, outputTimes, outCounts, self.systemSize, nEvents)
+
+	def _getVarIndices(self, inputReactants):
+		presentNames = set(x.name for x in inputReactants) if not isinstance(inputReactants, coreHelp.SpeciesState) else set(inputReactants.names)
+		return [idx for idx,name in enumerate(self.network.speciesNames) if (name in self.variableConcSpecies) and (name in presentNames)]
+
+
+def runNextReaction(stochNetwork, startCounts, propensityConsts, outputTimes, rng):
+	""" Runs one realisation with the Gibson-Bruck next reaction method
+
+	Args:
+		stochNetwork: (StochasticNetwork)
+		startCounts: (nVar int array)
+		propensityConsts: (float array) From stochNetwork.getPropensityConstants
+		outputTimes: (float array) Sorted times at which to record counts; the simulation stops at the last
+		rng: (numpy Generator)
+
+	Returns
+		outCounts: (nTimes x nVar int array) Counts at each output time
+		nEvents: (int)
+
+	"""
+	outCounts = np.zeros( (len(outputTimes), stochNetwork.nVar), dtype=np.int64 )
+	nEvents, unused, unused, unused = _runNextReactionEvents(stochNetwork, startCounts, propensityConsts, 0.0, outputTimes, outCounts, rng)
+	return outCounts, nEvents
+
+
+def _runNextReactionEvents(stochNetwork, startCounts, propensityConsts, startTime, outputTimes, outCounts, rng, maxEvents=None):
+	""" Core of runNextReaction. Fires events from startTime until the last output time (or maxEvents events), writing counts at each output time reached into outCounts
+
+	Returns
+		nEvents: (int)
+		nOutputsReached: (int) Number of output times written to outCounts
+		endTime: (float) Time of the last event if maxEvents was reached, else the last output time
+		endCounts: (list of int) Counts at endTime
+
+	"""
+	counts = [int(x) for x in startCounts]
+	propConsts = [float(x) for x in propensityConsts]
+	reactantTerms, channelChanges, dependencyGraph = stochNetwork.channelReactantTerms, stochNetwork.channelChanges, stochNetwork.dependencyGraph
+	outputTimes = [float(x) for x in outputTimes]
+	nOutputs, outIdx = len(outputTimes), 0
+	maxEvents = math.inf if maxEvents is None else maxEvents
+	randomStream = _ExponentialStream(rng)
+	nextExp = randomStream.next
+
+	def _getPropensity(channelIdx):
+		outVal = propConsts[channelIdx]
+		for pos, offset in reactantTerms[channelIdx]:
+			outVal *= counts[pos]-offset
+		return outVal if outVal > 0 else 0.0 #counts[pos]-offset can go negative only once a factor is already zero
+
+	propensities = [_getPropensity(x) for x in range(len(propConsts))]
+	queue = IndexedPriorityQueue( [startTime + nextExp()/x if x > 0 else math.inf for x in propensities] )
+	queueKeys, updateQueue = queue.keys, queue.update
+	nEvents, eventTime = 0, startTime
+
+	while nEvents < maxEvents:
+		channelIdx, eventTime = queue.getMin()
+		while (outIdx < nOutputs) and (outputTimes[outIdx] < eventTime):
+			outCounts[outIdx] = counts
+			outIdx += 1
+		if outIdx == nOutputs:
+			return nEvents, outIdx, outputTimes[-1], counts
+
+		for pos, change in channelChanges[channelIdx]:
+			counts[pos] += change
+		nEvents += 1
+
+		for depIdx in dependencyGraph[channelIdx]:
+			oldProp, newProp = propensities[depIdx], _getPropensity(depIdx)
+			propensities[depIdx] = newProp
+			if newProp <= 0:
+				newTime = math.inf
+			elif (depIdx != channelIdx) and (oldProp > 0):
+				newTime = eventTime + (oldProp/newProp)*(queueKeys[depIdx]-eventTime) #Reuses the unfired waiting time
+			else:
+				newTime = eventTime + nextExp()/newProp
+			updateQueue(depIdx, newTime)
+
+	return nEvents, outIdx, eventTime, counts
+
+
+def runTauLeaping(stochNetwork, startCounts, propensityConsts, outputTimes, rng, tolerance=0.03, minLeapEvents=10):
+	""" Runs independent realisations with (Cao et al.) tau-leaping; every replica has its own clock and leap size, but all are advanced in the same array operations
+
+	Args:
+		stochNetwork: (StochasticNetwork)
+		startCounts: (nReplicas x nVar int array)
+		propensityConsts: (float array) From stochNetwork.getPropensityConstants
+		outputTimes: (float array) Sorted times at which to record counts; the simulation stops at the last
+		rng: (numpy Generator)
+		tolerance: (float) Largest relative change in any propensity allowed over one leap
+		minLeapEvents: (float) Replicas whose leap would hold fewer events than this fire a burst of (up to _EXACT_BURST_EVENTS) exact events instead
+
+	Returns
+		outCounts: (nReplicas x nTimes x nVar int array)
+		nEvents: (nReplicas int array)
+
+	Raises:
+		ValueError: If a leap keeps giving negative counts after being halved many times
+
+	"""
+	counts = np.array(startCounts, dtype=np.int64).reshape(-1, stochNetwork.nVar)
+	outputTimes = np.asarray(outputTimes, dtype=float)
+	nReplicas, nOutputs = len(counts), len(outputTimes)
+	outCounts = np.zeros( (nReplicas, nOutputs, stochNetwork.nVar), dtype=np.int64 )
+	times, outIndices = np.zeros(nReplicas), np.zeros(nReplicas, dtype=int)
+	nEvents, tauScales = np.zeros(nReplicas, dtype=np.int64), np.ones(nReplicas)
+	varStoichT = stochNetwork.varStoich.T
+
+	while True:
+		_recordOutputs(outCounts, counts, times, outIndices, outputTimes)
+		active = np.nonzero(outIndices < nOutputs)[0]
+		if len(active) == 0:
+			break
+
+		currCounts, currTimes = counts[active], times[active]
+		propensities = stochNetwork.getPropensities(currCounts, propensityConsts)
+		totalProps = np.sum(propensities, axis=1)
+		timeToOutput = outputTimes[outIndices[active]] - currTimes
+		leapTimes = stochNetwork.getLeapTimes(currCounts, propensities, tolerance) * tauScales[active]
+		capped = leapTimes >= timeToOutput
+		leapTimes = np.minimum(leapTimes, timeToOutput)
+		isExact = leapTimes*totalProps < minLeapEvents
+
+		#Bursts of exact events; the simulation is memoryless, so each burst can start from the replica's current time
+		for replicaIdx in active[isExact].tolist():
+			outIdx = outIndices[replicaIdx]
+			burstOutputs = outCounts[replicaIdx, outIdx:]
+			currEvents, nReached, endTime, endCounts = _runNextReactionEvents(stochNetwork, counts[replicaIdx], propensityConsts, times[replicaIdx], outputTimes[outIdx:], burstOutputs, rng, maxEvents=_EXACT_BURST_EVENTS)
+			counts[replicaIdx], times[replicaIdx] = endCounts, endTime
+			outIndices[replicaIdx] += nReached
+			nEvents[replicaIdx] += currEvents
+
+		#Leaps
+		leapIdx = np.nonzero(~isExact)[0]
+		if len(leapIdx) > 0:
+			nFired = rng.poisson( propensities[leapIdx] * leapTimes[leapIdx,None] )
+			newCounts = currCounts[leapIdx] + nFired @ varStoichT
+			accepted = np.all(newCounts >= 0, axis=1)
+			acceptIdx, rejectIdx = active[leapIdx[accepted]], active[leapIdx[~accepted]]
+			counts[acceptIdx] = newCounts[accepted]
+			times[acceptIdx] = np.where(capped[leapIdx[accepted]], outputTimes[outIndices[acceptIdx]], times[acceptIdx]+leapTimes[leapIdx[accepted]])
+			nEvents[acceptIdx] += np.sum(nFired[accepted], axis=1)
+			tauScales[acceptIdx] = 1
+			tauScales[rejectIdx] *= 0.5
+			if np.any(tauScales < 0.5**_MAX_LEAP_HALVINGS):
+				raise ValueError("Tau-leaping kept giving negative counts; try method='nextReaction'")
+
+	return outCounts, nEvents
+
+
+def _recordOutputs(outCounts, counts, times, outIndices, outputTimes):
+	""" Records counts for every output time each replica has reached, advancing outIndices """
+	nOutputs = len(outputTimes)
+	while True:
+		reached = np.nonzero( (outIndices < nOutputs) )[0]
+		reached = reached[ times[reached] >= outputTimes[outIndices[reached]] ]
+		if len(reached) == 0:
+			return None
+		outCounts[reached, outIndices[reached]] = counts[reached]
+		outIndices[reached] += 1
+
+
+class _ExponentialStream():
+	""" Standard exponential random numbers, drawn from rng in blocks """
+
+	def __init__(self, rng):
+		self.rng = rng
+		self._values = list()
+		self._idx = 0
+
+	def next(self):
+		if self._idx >= len(self._values):
+			self._values = self.rng.standard_exponential(_RANDOM_BLOCK_SIZE).tolist()
+			self._idx = 0
+		self._idx += 1
+		return self._values[self._idx-1]
@@ -0,0 +1,132 @@
+
+""" Observers are functions called on a reaction controller at scheduled points (every n steps, every t of simulated time, and/or when a predicate is true). Controllers use the schedule to run uninterrupted between observations """
+
+import math
+
+
+#Relative tolerance used when comparing simulated times to an observers schedule, so accumulated round-off in time doesnt delay observations by a step
+_TIME_TOL = 1e-9
+
+
+class ControllerObserver():
+	""" A function called on a controller at scheduled points; see ObserverRegistry.add
+
+	Attributes:
+		funct: f(controller) Function to call
+		stride: (int or None) Observe when controller.step is a multiple of this
+		timeInterval: (float or None) Observe the first state at/after each multiple of this in simulated time
+		predicate: (f(controller)->bool or None) If set, funct is only called at scheduled points where this returns True
+
+	"""
+
+	def __init__(self, funct, stride=None, timeInterval=None, predicate=None):
+		""" Initializer. If neither stride nor timeInterval is given the observer is scheduled at every point (every step for ReactionControllerStandard)
+
+		Raises:
+			ValueError: If both stride and timeInterval are set, or either is not positive
+		"""
+		if (stride is not None) and (timeInterval is not None):
+			raise ValueError("Only one of stride and timeInterval can be set")
+		if (stride is not None) and stride < 1:
+			raise ValueError("stride must be >=1, not {}".format(stride))
+		if (timeInterval is not None) and timeInterval <= 0:
+			raise ValueError("timeInterval must be >0, not {}".format(timeInterval))
+		self.funct = funct
+		self.stride = stride
+		self.timeInterval = timeInterval
+		self.predicate = predicate
+		self.reset()
+
+	def reset(self):
+		self._nextTime = 0.0
+
+	def isDue(self, step, time):
+		if self.stride is not None:
+			return step % self.stride == 0
+		if self.timeInterval is not None:
+			return time >= self._nextTime - _TIME_TOL*self.timeInterval
+		return True
+
+	def notify(self, controller, time):
+		if (self.predicate is None) or self.predicate(controller):
+			self.funct(controller)
+		if self.timeInterval is not None:
+			self._nextTime = (math.floor(time/self.timeInterval + _TIME_TOL) + 1)*self.timeInterval
+
+	def getStepsUntilDue(self, step, time, timeStep):
+		""" Number of fixed-size steps (>=1) until this is next due; assumes it isnt due at the current step """
+		if self.stride is not None:
+			return self.stride - (step % self.stride)
+		if self.timeInterval is not None:
+			return max(1, math.ceil( (self._nextTime-time)/timeStep - _TIME_TOL ))
+		return 1
+
+	def getTimeUntilDue(self, time):
+		""" Simulated time until this is next due; inf if it isnt time-scheduled """
+		if self.timeInterval is not None:
+			return max(0.0, self._nextTime - time)
+		return math.inf
+
+
+class ObserverRegistry():
+	""" Holds the observers for one controller
+
+	Attributes:
+		observers: (list of ControllerObserver)
+		allowStride: (bool) False for controllers without a step count (e.g. ReactionControllerImproved)
+
+	"""
+
+	def __init__(self, allowStride=True):
+		self.observers = list()
+		self.allowStride = allowStride
+
+	def __len__(self):
+		return len(self.observers)
+
+	def __iter__(self):
+		return iter(self.observers)
+
+	def add(self, funct, stride=None, timeInterval=None, predicate=None):
+		""" Registers f(controller) to be called at scheduled points
+
+		Args:
+			funct: f(controller) Function to call
+			stride: (Optional, int) Call when controller.step is a multiple of this
+			timeInterval: (Optional, float) Call at the first state at/after each multiple of this in simulated time (controller.time)
+			predicate: (Optional, f(controller)->bool) Only call funct if this returns True. This is checked at every scheduled point, so combine with a stride/timeInterval to avoid checking every step
+
+		Returns
+			observer: (ControllerObserver) Pass to remove() to unregister
+
+		Raises:
+			ValueError: If the schedule is invalid, or stride is given but not allowed
+
+		"""
+		if (stride is not None) and (not self.allowStride):
+			raise ValueError("stride observers need a controller with a step count; use timeInterval")
+		observer = ControllerObserver(funct, stride=stride, timeInterval=timeInterval, predicate=predicate)
+		self.observers.append(observer)
+		return observer
+
+	def remove(self, observer):
+		self.observers.remove(observer)
+
+	def reset(self):
+		""" Restarts all time schedules (e.g. when the controller is reset to time zero) """
+		for observer in self.observers:
+			observer.reset()
+
+	def notifyDue(self, controller, step=None):
+		""" Calls every observer that is due at controller.time (and step, if given) """
+		for observer in self.observers:
+			if observer.isDue(step, controller.time):
+				observer.notify(controller, controller.time)
+
+	def getStepsUntilDue(self, step, time, timeStep):
+		""" Number of steps the controller can take before any observer is due; inf if there are no observers """
+		return min( [x.getStepsUntilDue(step, time, timeStep) for x in self.observers], default=math.inf )
+
+	def getTimeUntilDue(self, time):
+		""" Simulated time until any time-scheduled observer is due; inf if there are none """
+		return min( [x.getTimeUntilDue(time) for x in self.observers], default=math.inf )
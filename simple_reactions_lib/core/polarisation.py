@@ -0,0 +1,172 @@
+
+""" Electrical currents from the reaction fluxes of a CompiledReactionNetwork, and polarisation curves (current against potential) with Tafel slopes
+
+Each channel carries nElecTransfer electrons per event (positive for cathodic processes, as in BetterReactionTemplate), so its current is -nElecTransfer*currentFactor*channelRate; anodic currents are positive. Channels without an nElecTransfer attribute carry no current
+
+Everything is evaluated for all potentials at once: rate constants come from compiled_network.PotentialRateConstants, and channel rates for every (potential, channel) pair come from one gather over the concentration array
+
+"""
+
+import numpy as np
+
+from . import compiled_network as compiledHelp
+from . import core_units as unitHelp
+
+
+class PolarisationCurve():
+	""" Net and partial currents at a series of potentials
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		potentials: (float array) One value per point
+		channelCurrents: (nPotentials x nChannels float array) Current carried by each channel at each potential. Rows are NaN where concentrations were NaN (e.g. no steady state found)
+
+	"""
+
+	def __init__(self, network, potentials, channelCurrents):
+		""" Initializer
+
+		Args:
+			network: (CompiledReactionNetwork)
+			potentials: (iter of float)
+			channelCurrents: (nPotentials x nChannels float array)
+
+		"""
+		self.network = network
+		self.potentials = np.array(potentials, dtype=float)
+		self.channelCurrents = np.array(channelCurrents, dtype=float)
+
+	@classmethod
+	def fromConcs(cls, network, potentials, concs, temperature, pH=0, inputReactants=None, currentFactor=unitHelp.FARADAY_CONST):
+		""" Alternative initializer from concentrations at each potential (e.g. steady states from getSteadyStatesAlongParam)
+
+		Args:
+			network: (CompiledReactionNetwork)
+			potentials: (iter of float)
+			concs: (nPotentials x nSpecies float array, or nSpecies float array) Concentrations ordered as network.speciesNames; a single vector is used at every potential
+			temperature: (float)
+			pH: (float)
+			inputReactants: (Optional, iter of ChemSpeciesStd) Passed to Tafel factors which depend on (fixed) concentrations
+			currentFactor: (float) Charge per electron per unit of rate; the default (Faraday constant) gives A/m^2 for rates in mol/m^2/s. Multiply by a site density for rates in coverage per second
+
+		Returns
+			polarisationCurve: (PolarisationCurve)
+
+		"""
+		rateConsts = getRateConstantsAlongPotential(network, potentials, temperature, pH=pH, inputReactants=inputReactants)
+		channelRates = getChannelRatesForConcs(network, concs, rateConsts)
+		channelCurrents = channelRates * getChannelCurrentFactors(network, currentFactor=currentFactor)
+		return cls(network, potentials, channelCurrents)
+
+	@property
+	def currents(self):
+		""" Net current at each potential """
+		return np.sum(self.channelCurrents, axis=1)
+
+	@property
+	def anodicCurrents(self):
+		""" Sum of the (positive) currents from channels which release electrons """
+		return np.sum(np.where(self.channelCurrents>0, self.channelCurrents, 0), axis=1)
+
+	@property
+	def cathodicCurrents(self):
+		""" Sum of the (negative) currents from channels which consume electrons """
+		return np.sum(np.where(self.channelCurrents<0, self.channelCurrents, 0), axis=1)
+
+	@property
+	def reactionCurrents(self):
+		""" Net current from each reaction in network.reactions; an nPotentials x nReactions float array """
+		outVals = np.zeros( (len(self.potentials), len(self.network.reactions)) )
+		np.add.at(outVals.T, self.network.channelReactionIndices, self.channelCurrents.T)
+		return outVals
+
+	def getCurrents(self, which="net"):
+		""" Gets one set of currents
+
+		Args:
+			which: (str or int) "net", "anodic", "cathodic" or an index into network.reactions
+
+		Returns
+			currents: (float array) One value per potential
+
+		Raises:
+			ValueError: If which is not recognised
+
+		"""
+		if isinstance(which, str):
+			outAttrs = {"net":"currents", "anodic":"anodicCurrents", "cathodic":"cathodicCurrents"}
+			if which not in outAttrs:
+				raise ValueError("which must be one of {} or a reaction index, not {}".format(list(outAttrs.keys()), which))
+			return getattr(self, outAttrs[which])
+		if not (0 <= which < len(self.network.reactions)):
+			raise ValueError("Reaction index {} out of range for {} reactions".format(which, len(self.network.reactions)))
+		return self.reactionCurrents[:,which]
+
+	def getTafelSlopes(self, which="net"):
+		""" Gets the local Tafel slope dE/dlog10|i| (V per decade) at each potential, from finite differences along the curve
+
+		Args:
+			which: (str or int) Which currents to use; see getCurrents
+
+		Returns
+			tafelSlopes: (float array) One value per potential. NaN where the current is zero (or NaN) at or next to a point, or if |i| does not change
+
+		Raises:
+			ValueError: If there are fewer than two potentials
+
+		"""
+		if len(self.potentials) < 2:
+			raise ValueError("At least two potentials are needed for Tafel slopes")
+		absCurrents = np.abs(self.getCurrents(which))
+		with np.errstate(divide="ignore", invalid="ignore"):
+			logCurrents = np.where(absCurrents>0, np.log10(absCurrents), np.nan)
+			logDerivs = np.gradient(logCurrents, self.potentials)
+			return np.where(logDerivs!=0, 1/logDerivs, np.nan)
+
+
+def getChannelElectronTransfers(network):
+	""" Gets nElecTransfer for each channel (0 for channels without the attribute) """
+	return np.array([getattr(x, "nElecTransfer", 0) for x in network.channels], dtype=float)
+
+
+def getChannelCurrentFactors(network, currentFactor=unitHelp.FARADAY_CONST):
+	""" Gets the current per unit rate of each channel; -nElecTransfer*currentFactor, so anodic currents are positive """
+	return -1*currentFactor*getChannelElectronTransfers(network)
+
+
+def getRateConstantsAlongPotential(network, potentials, temperature, pH=0, inputReactants=None):
+	""" Gets rate constants of every channel at every potential (see compiled_network.PotentialRateConstants)
+
+	Args:
+		network: (CompiledReactionNetwork)
+		potentials: (iter of float)
+		temperature: (float)
+		pH: (float)
+		inputReactants: (Optional, iter of ChemSpeciesStd) Passed to Tafel factors which depend on (fixed) concentrations
+
+	Returns
+		rateConsts: (nPotentials x nChannels float array)
+
+	"""
+	potentialRateConsts = compiledHelp.PotentialRateConstants(network, temperature, pH=pH, inputReactants=inputReactants)
+	return potentialRateConsts.getRateConstants( np.array(potentials, dtype=float).reshape(-1) )
+
+
+def getChannelRatesForConcs(network, concs, rateConsts):
+	""" Gets channel rates for many sets of concentrations and rate constants at once
+
+	Args:
+		network: (CompiledReactionNetwork)
+		concs: (nPoints x nSpecies float array, or nSpecies float array) Concentrations ordered as network.speciesNames; a single vector is broadcast over every point
+		rateConsts: (nPoints x nChannels float array, or nChannels float array)
+
+	Returns
+		channelRates: (nPoints x nChannels float array)
+
+	"""
+	concs, rateConsts = np.atleast_2d(concs), np.atleast_2d(rateConsts)
+	extConcs = np.ones( (concs.shape[0], network.nSpecies+1) )
+	extConcs[:,:-1] = concs
+	concFactors = np.prod(extConcs[:, network.reactantIndices], axis=2)
+	return rateConsts * concFactors
+
@@ -1,7 +1,17 @@
 
+import copy
+
+import numpy as np
 import scipy.integrate as integrateHelp
+import scipy.sparse as sparseHelp
 
 from . import improved_controller as contrHelp
+from . import instrumentation as instrHelp
+from . import kinetic_monte_carlo as kmcHelp
+from . import waveforms as waveHelp
+
+#scipy.integrate defaults; tolerances on concentrations are converted from these if not set
+_DEFAULT_RTOL, _DEFAULT_ATOL = 1e-3, 1e-6
 
 
 class ConcsPropagator_DOP853(contrHelp.ConcsPropagatorTemplate):
@@ -23,7 +33,7 @@ class ConcsPropagator_DOP853(contrHelp.ConcsPropagatorTemplate):
 		if self.rTol is not None:
 			solverOptions["rtol"] = self.rTol
 
-		outObj = integrateHelp.solve_ivp(vectorisedFunction, [t0,tEnd], y0, method="DOP853", **solverOptions)
+		outObj = _solveIVP(self, vectorisedFunction, [t0,tEnd], y0, "DOP853", solverOptions)
 		outVals = [y[-1] for y in outObj.y]
 
 		return outVals
@@ -38,7 +48,8 @@ class ConcsPropagator_Radau(contrHelp.ConcsPropagatorTemplate):
 
 	def _propagateVectorisedFunctionToNextTimeStep(self, startConcs, timeStep, vectorisedFunction):
 		t0,tEnd = 0,timeStep
-		outObj = integrateHelp.solve_ivp(vectorisedFunction, [t0,tEnd], startConcs, method="Radau", **self.solverOptions)
+		solverOptions = _getAnalyticJacobianOptions(vectorisedFunction, self.solverOptions)
+		outObj = _solveIVP(self, vectorisedFunction, [t0,tEnd], startConcs, "Radau", solverOptions)
 		outVals = [ y[-1] for y in outObj.y ]
 		assert (abs(outObj.t[-1]-timeStep)/timeStep)<0.01
 
@@ -54,9 +65,386 @@ class ConcsPropagator_BDF(contrHelp.ConcsPropagatorTemplate):
 
 	def _propagateVectorisedFunctionToNextTimeStep(self, startConcs, timeStep, vectorisedFunction):
 		t0,tEnd = 0,timeStep
-		outObj = integrateHelp.solve_ivp(vectorisedFunction, [t0,tEnd], startConcs, method="BDF", **self.solverOptions)
+		solverOptions = _getAnalyticJacobianOptions(vectorisedFunction, self.solverOptions)
+		outObj = _solveIVP(self, vectorisedFunction, [t0,tEnd], startConcs, "BDF", solverOptions)
 		outVals = [ y[-1] for y in outObj.y ]
 		assert (abs(outObj.t[-1]-timeStep)/timeStep)<0.01
 
 		return outVals
 
+
+class ConcsPropagator_Auto(contrHelp.ConcsPropagatorTemplate):
+	""" Propagator which picks between an explicit (cheap per step, e.g. DOP853) and an implicit (stable for stiff systems, e.g. Radau) integrator, so no tuning is needed when stiffness changes with potential or during a run
+
+	Stiffness is judged from the spectral radius, rho, of the Jacobian of the function being integrated (analytic for compiled rate calculators, else by finite differences). An explicit method is only stable for steps h with rho*h below its stability bound (about 6 for DOP853), so covering timeStep needs at least rho*timeStep/bound steps:
+		- Each propagate() call starts with the implicit method if that number is above maxExplicitSteps
+		- Otherwise the explicit method is used; after every maxExplicitSteps steps, the propagator switches to the implicit method for the rest of the step if the explicit step size has become limited by stability (rho*h above half the bound, with rho re-estimated at the current state). This catches stiffness which develops as concentrations change
+
+	Attributes:
+		lastMethod: (str or None) Method which finished the most recent propagation
+		nSwitches: (int) Number of times the explicit method was abandoned part way through a step
+
+	"""
+
+	#Approximate (real negative axis) stability bounds of scipy explicit methods, in units of rho*h
+	STABILITY_BOUNDS = {"DOP853":6.0, "RK45":3.3, "RK23":2.5}
+
+	def __init__(self, rateCalculator, variableConcSpecies, explicitMethod="DOP853", implicitMethod="Radau", maxExplicitSteps=100, solverOptions=None):
+		""" Initializer
+
+		Args:
+			rateCalculator: (RateCalculatorBase)
+			variableConcSpecies: (iter of str) Names of species for which concentration is allowed to vary
+			explicitMethod: (str) One of STABILITY_BOUNDS keys
+			implicitMethod: (str) scipy.integrate method for stiff steps; "Radau", "BDF" or "LSODA"
+			maxExplicitSteps: (int) Most explicit steps expected (or taken between stiffness checks) before the implicit method is used
+			solverOptions: (dict) Keyword arguments for both solvers (e.g. atol, rtol). Analytic Jacobians are added automatically for the implicit method
+
+		Raises:
+			ValueError: If explicitMethod is not in STABILITY_BOUNDS
+
+		"""
+		if explicitMethod not in self.STABILITY_BOUNDS:
+			raise ValueError("explicitMethod must be one of {}, not {}".format(sorted(self.STABILITY_BOUNDS.keys()), explicitMethod))
+		self.rateCalculator = rateCalculator
+		self.variableConcSpecies = variableConcSpecies
+		self.explicitMethod = explicitMethod
+		self.implicitMethod = implicitMethod
+		self.maxExplicitSteps = maxExplicitSteps
+		self.solverOptions = dict() if solverOptions is None else solverOptions
+		self.lastMethod = None
+		self.nSwitches = 0
+
+	def _propagateVectorisedFunctionToNextTimeStep(self, startConcs, timeStep, vectorisedFunction):
+		stabilityBound = self.STABILITY_BOUNDS[self.explicitMethod]
+		startState = np.array(startConcs, dtype=float)
+		spectralRadius = getSpectralRadius(vectorisedFunction, 0, startState)
+		if spectralRadius*timeStep > stabilityBound*self.maxExplicitSteps:
+			return self._runImplicit(vectorisedFunction, 0, startState, timeStep)
+
+		solver = _runSolverSteps(self, self.explicitMethod, vectorisedFunction, 0, startState, timeStep, self.solverOptions, maxSteps=self.maxExplicitSteps)
+		while solver.status == "running":
+			spectralRadius = getSpectralRadius(vectorisedFunction, solver.t, solver.y)
+			if spectralRadius*solver.h_abs > 0.5*stabilityBound:
+				self.nSwitches += 1
+				return self._runImplicit(vectorisedFunction, solver.t, solver.y, timeStep)
+			solver = _runSolverSteps(self, self.explicitMethod, vectorisedFunction, solver.t, solver.y, timeStep, self.solverOptions, maxSteps=self.maxExplicitSteps, solver=solver)
+
+		if solver.status == "failed":
+			self.nSwitches += 1
+			return self._runImplicit(vectorisedFunction, solver.t, solver.y, timeStep)
+		self.lastMethod = self.explicitMethod
+		return solver.y.copy()
+
+	def _runImplicit(self, vectorisedFunction, startTime, startState, endTime):
+		solverOptions = _getAnalyticJacobianOptions(vectorisedFunction, self.solverOptions)
+		solver = _runSolverSteps(self, self.implicitMethod, vectorisedFunction, startTime, startState, endTime, solverOptions)
+		if solver.status == "failed":
+			raise ValueError("Integration failed at t={} using {}".format(solver.t, self.implicitMethod))
+		self.lastMethod = self.implicitMethod
+		return solver.y.copy()
+
+
+class ConcsPropagator_Persistent(contrHelp.ConcsPropagatorTemplate):
+	""" Propagator which keeps one scipy OdeSolver alive across propagate() calls (see IntegratorSession). Moving forward in many small increments then continues a single integration, keeping its step size, Jacobian/LU factorisation and dense output, rather than warming up a new solve_ivp each time.
+
+	A new session is started whenever temperature, potential or the reactions change, or when the concentrations passed in are not the ones left by the previous call (e.g. after controller.reset()). A potential waveform counts as unchanged if it is the same waveform continuing from where the session left off; sessions never integrate across a jump in the waveform
+
+	"""
+
+	def __init__(self, rateCalculator, variableConcSpecies, method="Radau", solverOptions=None):
+		""" Initializer
+		
+		Args:
+			rateCalculator: (RateCalculatorBase)
+			variableConcSpecies: (iter of str) Names of species for which concentration is allowed to vary
+			method: (str) Name of the scipy.integrate OdeSolver class to use (e.g. "Radau", "BDF", "LSODA", "DOP853")
+			solverOptions: (dict) Keyword arguments for the solver (e.g. atol, rtol, max_step). Analytic Jacobians are added automatically for compiled rate calculators
+				 
+		"""
+		self.rateCalculator = rateCalculator
+		self.variableConcSpecies = variableConcSpecies
+		self.method = method
+		self.solverOptions = dict() if solverOptions is None else solverOptions
+		self.session = None
+
+	def resetSession(self):
+		self.session = None
+
+	def propagate(self, inputReactants, timeStep, temperature=300, potential=0):
+		startTime = None if self.instrumentation is None else self.instrumentation.getTime()
+		totalStats = instrHelp.SolverStats()
+
+		#Only more than one pass if a session ends on a jump in a potential waveform
+		remainingTime, currPotential = timeStep, potential
+		while True:
+			startSession = self.session
+			startStats = copy.copy(self.session.solverStats) if (self.session is not None) and (self.session.solverStats is not None) else None
+			conditionsKey = self._getConditionsKey(temperature, currPotential)
+			if not self._isSessionValid(inputReactants, conditionsKey, currPotential):
+				self.session = self._createSession(inputReactants, temperature, currPotential, conditionsKey)
+
+			currStep = min(remainingTime, self.session.getTimeUntilEnd())
+			propagatedState = self.session.advance(currStep)
+			self._setVariableConcs(inputReactants, contrHelp._getConcsFromState(self._lastFunctPropagated, propagatedState))
+			self.session.lastConcs = _getAllConcs(inputReactants)
+
+			if self.instrumentation is not None:
+				#A new session starts its counts from zero
+				startStats = startStats if (self.session is startSession) and (startStats is not None) else instrHelp.SolverStats()
+				currStats = self.session.solverStats if self.session.solverStats is not None else instrHelp.SolverStats()
+				totalStats = totalStats + (currStats-startStats)
+
+			remainingTime -= currStep
+			if remainingTime <= 1e-12*timeStep:
+				break
+			currPotential = potential.getShifted(timeStep-remainingTime)
+
+		if self.instrumentation is not None:
+			self.instrumentation.recordSolverCall(type(self).__name__, startTime, self.instrumentation.getTime(), totalStats, method=self.method, timeStep=timeStep)
+
+	def _getConditionsKey(self, temperature, potential):
+		reactions = getattr(self.rateCalculator, "reactions", list())
+		potentialKey = ("waveform", id(_getBaseWaveform(potential))) if isinstance(potential, waveHelp.PotentialWaveform) else potential
+		return (temperature, potentialKey, self.method, tuple([id(x) for x in reactions]), tuple(self.variableConcSpecies))
+
+	def _isSessionValid(self, inputReactants, conditionsKey, potential):
+		if self.session is None:
+			return False
+		if self.session.conditionsKey != conditionsKey:
+			return False
+		if isinstance(potential, waveHelp.PotentialWaveform):
+			#The waveform must carry on from the time the session reached, and the session must not have reached a jump
+			expOffset = self.session.timeOffset + self.session.time
+			if abs(_getWaveformOffset(potential)-expOffset) > 1e-12*max(1, abs(expOffset)):
+				return False
+			if self.session.solver.status != "running":
+				return False
+		return self.session.lastConcs == _getAllConcs(inputReactants)
+
+	def _createSession(self, inputReactants, temperature, potential, conditionsKey):
+		functToPropagate = self.getFunctToPropagate(inputReactants, temperature, potential)
+		startConcs = np.array( self._getVariableConcs(inputReactants), dtype=float )
+		startState = contrHelp._getStateFromConcs(functToPropagate, startConcs)
+		solverOptions = _getAnalyticJacobianOptions(functToPropagate, self.solverOptions)
+		if self.instrumentation is None:
+			solverClass = getattr(integrateHelp, self.method)
+		else:
+			solverClass = instrHelp.getInstrumentedSolverClass(self.method)
+			solverOptions["solverStats"] = instrHelp.SolverStats()
+		endTime, timeOffset = np.inf, 0
+		if isinstance(potential, waveHelp.PotentialWaveform):
+			endTime, timeOffset = contrHelp._getTimeUntilJump(potential, 0), _getWaveformOffset(potential)
+		solver = solverClass(functToPropagate, 0, startState, endTime, **_getStateSolverOptions(functToPropagate, solverOptions))
+		self._lastFunctPropagated = functToPropagate
+		return IntegratorSession(solver, conditionsKey, timeOffset=timeOffset, ratesFunction=functToPropagate, solverOptions=solverOptions)
+
+
+class IntegratorSession():
+	""" Wraps a scipy OdeSolver (integrating towards t=inf, or the next jump in a potential waveform) so a series of propagation steps continues the same integration. The solver is free to step past the requested time; the output there is interpolated from its dense output, and the next call carries on from where the solver actually is
+
+	Attributes:
+		solver: (scipy.integrate.OdeSolver)
+		conditionsKey: (tuple) The conditions this session is valid for
+		solverStats: (SolverStats or None) Running counts for the session if the solver is instrumented (see instrumentation.getInstrumentedSolverClass)
+		time: (float) The time the caller has been propagated to
+		lastConcs: (list of float) Concentrations of all reactants after the last propagation; used to check nothing else has modified them
+		timeOffset: (float) Waveform time at the start of the session (0 for a constant potential)
+		ratesFunction: (callable or None) The function being integrated; if a LogConcsRatesFunction, self.solver is replaced by one in a new basis when needed (see _getRebasedSolver)
+		solverOptions: (dict) Keyword arguments used to create self.solver, with tolerances on concentrations
+
+	"""
+
+	def __init__(self, solver, conditionsKey, timeOffset=0, ratesFunction=None, solverOptions=None):
+		self.solver = solver
+		self.conditionsKey = conditionsKey
+		self.timeOffset = timeOffset
+		self.ratesFunction = ratesFunction
+		self.solverOptions = dict() if solverOptions is None else solverOptions
+		self.solverStats = getattr(solver, "solverStats", None)
+		self.time = solver.t
+		self.lastConcs = None
+
+	def getTimeUntilEnd(self):
+		""" Time left before the solver reaches its end (inf unless the session stops at a jump in a potential waveform) """
+		return self.solver.t_bound - self.time
+
+	def advance(self, timeStep):
+		""" Move forward by timeStep and return the solver state (variable species concentrations, or whatever the function being integrated uses; see CompiledRatesFunction.getStateFromConcs) at the new time """
+		targTime = self.time + timeStep
+		while (self.solver.t < targTime) and (self.solver.status == "running"):
+			self.solver = _getRebasedSolver(self.solver, self.ratesFunction, self.solverOptions)
+			message = self.solver.step()
+			if self.solver.status == "failed":
+				raise ValueError("Integration failed at t={}: {}".format(self.solver.t, message))
+
+		self.time = targTime
+		if self.solver.t == targTime:
+			return self.solver.y.copy()
+		return self.solver.dense_output()(targTime)
+
+
+class ConcsPropagator_KMC(contrHelp.ConcsPropagatorBase):
+	""" Stochastic propagator; each propagate() call moves the variable species forward by one kinetic Monte Carlo realisation (see kinetic_monte_carlo.StochasticSimulator). Concentrations are rounded to counts of simulator.systemSize per unit concentration, so always come out as multiples of 1/systemSize """
+
+	def __init__(self, simulator):
+		""" Initializer
+
+		Args:
+			simulator: (StochasticSimulator)
+
+		"""
+		self.simulator = simulator
+
+	@classmethod
+	def fromReactions(cls, reactions, variableConcSpecies, systemSize, **kwargs):
+		""" Creates the propagator along with its StochasticSimulator; kwargs are passed to the StochasticSimulator initializer """
+		return cls( kmcHelp.StochasticSimulator(reactions, variableConcSpecies, systemSize, **kwargs) )
+
+	def propagate(self, inputReactants, timeStep, temperature=300, potential=0):
+		if isinstance(potential, waveHelp.PotentialWaveform):
+			raise ValueError("Kinetic Monte Carlo propagation needs a constant potential; propensities are not updated during a step")
+		startTime = None if self.instrumentation is None else self.instrumentation.getTime()
+		trajectory = self.simulator.simulate(inputReactants, [timeStep], temperature=temperature, potential=potential)
+		self.simulator.setCounts(inputReactants, trajectory.counts[0,-1])
+		if self.instrumentation is not None:
+			stats = instrHelp.SolverStats(nAcceptedSteps=int(trajectory.nEvents[0]))
+			self.instrumentation.recordSolverCall(type(self).__name__, startTime, self.instrumentation.getTime(), stats, method=self.simulator.method, timeStep=timeStep)
+
+
+def _solveIVP(propagator, vectorisedFunction, tSpan, y0, method, solverOptions):
+	""" solve_ivp, recording counters/timings to propagator.instrumentation if it is set. A LogConcsRatesFunction gets its own tolerances (see getStateTolerances), and the integration restarts in a new basis whenever its getBasisMargin goes negative; the output is then for the final segment only """
+	if not isinstance(vectorisedFunction, contrHelp.LogConcsRatesFunction):
+		return _solveIVPSegment(propagator, vectorisedFunction, tSpan, y0, method, solverOptions)
+
+	basisEvent = lambda time, state: vectorisedFunction.getBasisMargin(state)
+	basisEvent.terminal, basisEvent.direction = True, -1
+	startTime, startState = tSpan[0], y0
+	while True:
+		currOptions = _getStateSolverOptions(vectorisedFunction, solverOptions)
+		currOptions["events"] = basisEvent
+		outObj = _solveIVPSegment(propagator, vectorisedFunction, [startTime, tSpan[1]], startState, method, currOptions)
+		if outObj.status != 1:
+			return outObj
+		startTime, startState = outObj.t[-1], _getRebasedState(vectorisedFunction, outObj.y[:,-1])
+
+
+def _solveIVPSegment(propagator, vectorisedFunction, tSpan, y0, method, solverOptions):
+	instrumentation = propagator.instrumentation
+	if instrumentation is None:
+		return integrateHelp.solve_ivp(vectorisedFunction, tSpan, y0, method=method, **solverOptions)
+
+	solverStats = instrHelp.SolverStats()
+	startTime = instrumentation.getTime()
+	solverClass = instrHelp.getInstrumentedSolverClass(method)
+	outObj = integrateHelp.solve_ivp(vectorisedFunction, tSpan, y0, method=solverClass, solverStats=solverStats, **solverOptions)
+	currKwargs = {"method":method, "timeStep":tSpan[1]-tSpan[0], "success":outObj.success}
+	instrumentation.recordSolverCall(type(propagator).__name__, startTime, instrumentation.getTime(), solverStats, **currKwargs)
+	return outObj
+
+
+def getSpectralRadius(vectorisedFunction, time, state, stepSize=1e-8):
+	""" Estimates the largest magnitude eigenvalue of the Jacobian of vectorisedFunction (the inverse of the fastest timescale in the system)
+
+	Args:
+		vectorisedFunction: f(t,state) Function being integrated; its jacobian(t, state) method is used if it has one, else a forward-difference Jacobian is built (len(state) extra evaluations)
+		time: (float)
+		state: (float array)
+		stepSize: (float) Relative step for finite differences
+
+	Returns
+		spectralRadius: (float) Exact for dense Jacobians; for sparse ones the (Gershgorin) upper bound max_i sum_k |J[i,k]|
+
+	"""
+	if callable(getattr(vectorisedFunction, "jacobian", None)):
+		jacobian = vectorisedFunction.jacobian(time, state)
+	else:
+		state = np.asarray(state, dtype=float)
+		startVals = np.asarray(vectorisedFunction(time, state), dtype=float)
+		jacobian = np.zeros( (len(startVals), len(state)) )
+		for idx in range(len(state)):
+			currStep = stepSize*max(abs(state[idx]), 1)
+			currState = state.copy()
+			currState[idx] += currStep
+			jacobian[:,idx] = (np.asarray(vectorisedFunction(time, currState), dtype=float) - startVals) / currStep
+
+	if sparseHelp.issparse(jacobian):
+		return float( abs(jacobian).sum(axis=1).max() ) if jacobian.shape[0] > 0 else 0.0
+	if np.size(jacobian) == 0:
+		return 0.0
+	return float( np.max(np.abs(np.linalg.eigvals(jacobian))) )
+
+
+def _runSolverSteps(propagator, method, vectorisedFunction, startTime, startState, endTime, solverOptions, maxSteps=None, solver=None):
+	""" Steps an OdeSolver until it reaches endTime, fails or has taken maxSteps steps. solver is created if not given; recording counters/timings to propagator.instrumentation if it is set """
+	instrumentation = propagator.instrumentation
+	clockStart = None if instrumentation is None else instrumentation.getTime()
+	if solver is None:
+		stateOptions = _getStateSolverOptions(vectorisedFunction, solverOptions)
+		if instrumentation is None:
+			solver = getattr(integrateHelp, method)(vectorisedFunction, startTime, startState, endTime, **stateOptions)
+		else:
+			solverClass = instrHelp.getInstrumentedSolverClass(method)
+			solver = solverClass(vectorisedFunction, startTime, startState, endTime, solverStats=instrHelp.SolverStats(), **stateOptions)
+	startStats = None if instrumentation is None else copy.copy(solver.solverStats)
+
+	nSteps = 0
+	while (solver.status == "running") and ( (maxSteps is None) or (nSteps < maxSteps) ):
+		solver = _getRebasedSolver(solver, vectorisedFunction, solverOptions)
+		solver.step()
+		nSteps += 1
+
+	if instrumentation is not None:
+		currKwargs = {"method":method, "timeStep":solver.t-startTime, "success":solver.status!="failed"}
+		instrumentation.recordSolverCall(type(propagator).__name__, clockStart, instrumentation.getTime(), solver.solverStats-startStats, **currKwargs)
+	return solver
+
+
+def _getBaseWaveform(waveform):
+	return waveform.baseWaveform if isinstance(waveform, waveHelp.ShiftedWaveform) else waveform
+
+
+def _getWaveformOffset(waveform):
+	return waveform.timeOffset if isinstance(waveform, waveHelp.ShiftedWaveform) else 0
+
+
+def _getAllConcs(inputReactants):
+	if isinstance(inputReactants, contrHelp.coreHelp.SpeciesState):
+		return inputReactants.concs.tolist()
+	return [x.conc for x in inputReactants]
+
+
+def _getStateSolverOptions(vectorisedFunction, solverOptions):
+	""" Converts the tolerances in solverOptions (on concentrations; scipy defaults if not set) to ones on the state of vectorisedFunction if it is a LogConcsRatesFunction """
+	if not isinstance(vectorisedFunction, contrHelp.LogConcsRatesFunction):
+		return dict(solverOptions)
+	outOptions = dict(solverOptions)
+	rtol, atol = solverOptions.get("rtol", _DEFAULT_RTOL), solverOptions.get("atol", _DEFAULT_ATOL)
+	outOptions["rtol"], outOptions["atol"] = vectorisedFunction.getStateTolerances(rtol, atol)
+	return outOptions
+
+
+def _getRebasedState(vectorisedFunction, state):
+	return vectorisedFunction.getStateFromConcs( vectorisedFunction.getConcsFromState(state) )
+
+
+def _getRebasedSolver(solver, vectorisedFunction, solverOptions):
+	""" Gets a solver of the same class continuing from solver.t in a new basis if vectorisedFunction is a LogConcsRatesFunction whose getBasisMargin has gone negative; else returns solver. Any solverStats carry on accumulating """
+	if not isinstance(vectorisedFunction, contrHelp.LogConcsRatesFunction):
+		return solver
+	if vectorisedFunction.getBasisMargin(solver.y) >= 0:
+		return solver
+	startState = _getRebasedState(vectorisedFunction, solver.y)
+	stateOptions = _getStateSolverOptions(vectorisedFunction, solverOptions)
+	if hasattr(solver, "solverStats"):
+		stateOptions["solverStats"] = solver.solverStats
+	return type(solver)(vectorisedFunction, solver.t, startState, solver.t_bound, **stateOptions)
+
+
+def _getAnalyticJacobianOptions(vectorisedFunction, solverOptions):
+	""" Adds the analytic Jacobian to solverOptions if vectorisedFunction provides one and the user hasnt set "jac" themselves """
+	outOptions = dict(solverOptions)
+	if isinstance(vectorisedFunction, contrHelp.CompiledRatesFunction) and ("jac" not in outOptions):
+		outOptions.update( vectorisedFunction.getJacobianSolverOptions() )
+	return outOptions
+
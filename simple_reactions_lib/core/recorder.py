@@ -0,0 +1,242 @@
+
+""" Stream trajectories (time, concentrations and optionally reaction fluxes) to disk in fixed-size chunks, and read them back lazily as memory-mapped arrays """
+
+import json
+import os
+
+import numpy as np
+import numpy.lib.format as npyFormatHelp
+
+from . import core_classes as coreHelp
+from . import improved_controller as contrHelp
+
+
+_META_FILE_NAME = "meta.json"
+_TIMES_FILE_NAME = "times.npy"
+_CONCS_FILE_NAME = "concs.npy"
+_FLUXES_FILE_NAME = "fluxes.npy"
+
+
+class TrajectoryRecorder():
+	""" Records a trajectory into preallocated NumPy buffers, which are appended to .npy files in outDir each time they fill up. Memory use is therefore set by chunkSize, not by the length of the trajectory. The files are valid .npy files after every flush, so can be read (see loadTrajectory) while a run is still going
+
+	Can be used as a context manager (flushes on exit), or registered directly as a controller observer (e.g. controller.observers.add(recorder, stride=100))
+
+	Attributes:
+		outDir: (str) Directory holding the trajectory files
+		speciesNames: (tuple of str) Order of the concentration columns
+		nFluxes: (int) Number of flux columns; 0 means fluxes are not recorded
+		chunkSize: (int) Number of samples held in memory before writing to disk
+		nSamples: (int) Total number of samples recorded (on disk plus buffered)
+
+	"""
+
+	def __init__(self, outDir, speciesNames, nFluxes=0, chunkSize=65536):
+		""" Initializer. Any trajectory already in outDir is overwritten
+
+		Args:
+			outDir: (str) Directory to write to; created if needed
+			speciesNames: (iter of str) Order of the concentration columns
+			nFluxes: (int) Number of flux columns to record (e.g. one per reaction); 0 means no fluxes
+			chunkSize: (int) Number of samples held in memory before writing to disk
+
+		"""
+		self.outDir = outDir
+		self.speciesNames = tuple(speciesNames)
+		self.nFluxes = nFluxes
+		self.chunkSize = chunkSize
+		self.nSamples = 0
+		self._nFlushed = 0
+		self._timesBuffer = np.zeros(chunkSize)
+		self._concsBuffer = np.zeros( (chunkSize, len(self.speciesNames)) )
+		self._fluxesBuffer = np.zeros( (chunkSize, nFluxes) )
+		self._createFiles()
+
+	def _createFiles(self):
+		os.makedirs(self.outDir, exist_ok=True)
+		self._filePaths = {"times": os.path.join(self.outDir, _TIMES_FILE_NAME),
+		                   "concs": os.path.join(self.outDir, _CONCS_FILE_NAME)}
+		if self.nFluxes > 0:
+			self._filePaths["fluxes"] = os.path.join(self.outDir, _FLUXES_FILE_NAME)
+		else:
+			_removeFileIfPresent(os.path.join(self.outDir, _FLUXES_FILE_NAME))
+
+		for key, buffer in self._getBuffers().items():
+			with open(self._filePaths[key], "wb") as outFile:
+				_writeNpyHeader(outFile, buffer[:0].shape, buffer.dtype)
+		self._writeMetadata()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.flush()
+
+	def __call__(self, controller):
+		self.recordController(controller)
+
+	def record(self, time, concs, fluxes=None):
+		""" Adds one sample
+
+		Args:
+			time: (float)
+			concs: (float array) Concentrations, ordered as self.speciesNames
+			fluxes: (float array) Required if self.nFluxes>0; ignored otherwise
+
+		"""
+		bufferIdx = self.nSamples - self._nFlushed
+		self._timesBuffer[bufferIdx] = time
+		self._concsBuffer[bufferIdx] = concs
+		if self.nFluxes > 0:
+			self._fluxesBuffer[bufferIdx] = fluxes
+		self.nSamples += 1
+		if self.nSamples - self._nFlushed == self.chunkSize:
+			self.flush()
+
+	def recordController(self, controller, time=None):
+		""" Adds one sample for the current state of a reaction controller
+
+		Args:
+			controller: (ReactionControllerStandard or ReactionControllerImproved) currentReactants must contain every species in self.speciesNames
+			time: (Optional, float) Default is controller.time
+
+		"""
+		time = controller.time if time is None else time
+		concs = _getConcsFromReactants(controller.currentReactants, self.speciesNames)
+		fluxes = getReactionFluxes(controller) if self.nFluxes > 0 else None
+		self.record(time, concs, fluxes=fluxes)
+
+	def flush(self):
+		""" Writes all buffered samples to disk """
+		nBuffered = self.nSamples - self._nFlushed
+		if nBuffered == 0:
+			return None
+		for key, buffer in self._getBuffers().items():
+			_appendToNpyFile(self._filePaths[key], buffer[:nBuffered])
+		self._nFlushed = self.nSamples
+		self._writeMetadata()
+
+	def _getBuffers(self):
+		outDict = {"times":self._timesBuffer, "concs":self._concsBuffer}
+		if self.nFluxes > 0:
+			outDict["fluxes"] = self._fluxesBuffer
+		return outDict
+
+	def _writeMetadata(self):
+		outDict = {"speciesNames":list(self.speciesNames), "nFluxes":self.nFluxes, "nSamples":self._nFlushed}
+		with open(os.path.join(self.outDir, _META_FILE_NAME), "w") as outFile:
+			json.dump(outDict, outFile)
+
+
+class Trajectory():
+	""" A recorded trajectory; see loadTrajectory. All arrays are read-only memory maps, so nothing is read from disk until it is used and slices are views
+
+	Attributes:
+		times: (nSamples float array)
+		concs: (nSamples x nSpecies float array)
+		fluxes: (nSamples x nFluxes float array or None)
+		speciesNames: (tuple of str) Order of the concs columns
+
+	"""
+
+	def __init__(self, times, concs, speciesNames, fluxes=None):
+		self.times = times
+		self.concs = concs
+		self.speciesNames = tuple(speciesNames)
+		self.fluxes = fluxes
+
+	def __len__(self):
+		return len(self.times)
+
+	def getConcs(self, name):
+		""" Gets the (nSamples) concentrations of one species as a view """
+		return self.concs[:, self.speciesNames.index(name)]
+
+
+def loadTrajectory(inpDir):
+	""" Loads a trajectory written by TrajectoryRecorder, memory-mapping each array
+
+	Args:
+		inpDir: (str) Directory passed to TrajectoryRecorder
+
+	Returns
+		trajectory: (Trajectory) Contains everything flushed to disk so far
+
+	"""
+	with open(os.path.join(inpDir, _META_FILE_NAME), "r") as inpFile:
+		metaDict = json.load(inpFile)
+	nSamples = metaDict["nSamples"]
+
+	def _loadArray(fileName):
+		return np.load(os.path.join(inpDir, fileName), mmap_mode="r")[:nSamples]
+
+	fluxes = _loadArray(_FLUXES_FILE_NAME) if metaDict["nFluxes"] > 0 else None
+	return Trajectory(_loadArray(_TIMES_FILE_NAME), _loadArray(_CONCS_FILE_NAME), metaDict["speciesNames"], fluxes=fluxes)
+
+
+def getReactionFluxes(controller):
+	""" Gets the (net) rate of each reaction at the current state of a controller
+
+	For a ReactionControllerStandard these are controller.reactions. For a ReactionControllerImproved they are the reactions of its propagator's rate calculator (propagator.rateCalculator, or propagator.concChangesFinder.rateCalculator), at controller.getCurrentPotential()
+
+	Args:
+		controller: (ReactionControllerStandard or ReactionControllerImproved)
+
+	Returns
+		fluxes: (list of float) One value per reaction
+
+	Raises:
+		TypeError: If the reactions cannot be found from controller (e.g. a ReactionControllerImproved with a kinetic Monte Carlo propagator)
+
+	"""
+	if isinstance(controller, coreHelp.ReactionControllerStandard):
+		currKwargs = {"pH":controller.pH, "potential":controller.potential}
+		return [x.getReactionRate(controller.currentReactants, controller.temperature, **currKwargs) for x in controller.reactions]
+
+	rateCalculator = _getRateCalculator(controller)
+	currReactants, currKwargs = controller.currentReactants, {"temperature":controller.temperature, "potential":controller.getCurrentPotential()}
+	if isinstance(rateCalculator, contrHelp.CompiledRateCalculator):
+		network = rateCalculator.network
+		rateConsts = rateCalculator.getRateConstants(currReactants, **currKwargs)
+		return network.getReactionFluxes(network.getConcsFromReactants(currReactants), rateConsts).tolist()
+	return [x.getReactionRate(currReactants, currKwargs["temperature"], potential=currKwargs["potential"]) for x in rateCalculator.reactions]
+
+
+def _getRateCalculator(controller):
+	propagator = getattr(controller, "propagator", None)
+	rateCalculator = getattr(propagator, "rateCalculator", None)
+	if rateCalculator is None:
+		rateCalculator = getattr(getattr(propagator, "concChangesFinder", None), "rateCalculator", None)
+	if (rateCalculator is None) or (not hasattr(rateCalculator, "reactions")):
+		raise TypeError("Cannot get reaction fluxes from {}; its propagator has no rate calculator with reactions".format(type(controller).__name__))
+	return rateCalculator
+
+
+def _getConcsFromReactants(inputReactants, speciesNames):
+	concDict = {x.name:x.conc for x in inputReactants}
+	return [concDict[x] for x in speciesNames]
+
+
+#The .npy header (padded by numpy so the first axis can grow in place) is rewritten after each append, so files are always readable
+def _writeNpyHeader(outFile, shape, dtype):
+	headerDict = {"descr":npyFormatHelp.dtype_to_descr(np.dtype(dtype)), "fortran_order":False, "shape":tuple(shape)}
+	npyFormatHelp.write_array_header_1_0(outFile, headerDict)
+
+
+def _appendToNpyFile(filePath, array):
+	with open(filePath, "r+b") as outFile:
+		npyFormatHelp.read_magic(outFile)
+		shape = npyFormatHelp.read_array_header_1_0(outFile)[0]
+		dataStart = outFile.tell()
+		newShape = (shape[0]+len(array),) + shape[1:]
+		outFile.seek(0, os.SEEK_END)
+		outFile.write( np.ascontiguousarray(array).tobytes() )
+		outFile.seek(0)
+		_writeNpyHeader(outFile, newShape, array.dtype)
+		if outFile.tell() != dataStart:
+			raise ValueError("Header of {} changed length; file is corrupt".format(filePath))
+
+
+def _removeFileIfPresent(filePath):
+	if os.path.exists(filePath):
+		os.remove(filePath)
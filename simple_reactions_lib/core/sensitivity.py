@@ -0,0 +1,256 @@
+
+""" Sensitivities of steady states and transients of a CompiledReactionNetwork to reaction parameters, and Campbell degrees of rate control
+
+Everything is first found with respect to ln(rateConstant) of each channel; sensitivities to a channel parameter (barrier, prefactor or symFactor) then follow from the chain rule, since each parameter only changes its own channel's rate constant (see getLogRateConstantDerivatives)
+
+Steady-state sensitivities use the implicit function theorem on the SteadyStateSolver residual: d[X]/dln(k) = -J^-1 d(residual)/dln(k), with one LU factorisation of J shared by every channel. Transient sensitivities are integrated alongside the concentrations (forward sensitivity equations)
+
+"""
+
+import copy
+
+import numpy as np
+import scipy.integrate as integrateHelp
+import scipy.linalg as linAlgHelp
+import scipy.sparse as sparseHelp
+
+from . import compiled_network as compiledHelp
+from . import core_units as unitHelp
+
+
+PARAMETER_NAMES = ("barrier", "prefactor", "symFactor")
+
+#Step used for finite-difference derivatives with respect to symFactor; Tafel exponents are linear in it, so central differences are exact up to round-off
+_SYM_FACTOR_STEP = 1e-4
+
+
+class SensitivityResult():
+	""" Steady-state sensitivities to the rate constant of every channel (see getSteadyStateSensitivities)
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		varIndices: (int array) Network index of each variable species
+		concs: (float array) Steady-state concentrations of all network species
+		channelRates: (float array) Rate of each channel at the steady state
+		concLogSens: (nVar x nChannels float array) d[X]/dln(k) for each variable species and channel
+		rateLogSens: (nChannels x nChannels float array) Entry [c,d] is d(rate of channel c)/dln(k of channel d)
+		logRateConstDerivs: (dict) Parameter name to dln(k)/d(parameter) for each channel (see getLogRateConstantDerivatives); needed for sensitivities to parameters
+
+	"""
+
+	def __init__(self, network, varIndices, concs, channelRates, concLogSens, rateLogSens, logRateConstDerivs=None):
+		self.network = network
+		self.varIndices = np.array(varIndices, dtype=int)
+		self.concs = concs
+		self.channelRates = channelRates
+		self.concLogSens = concLogSens
+		self.rateLogSens = rateLogSens
+		self.logRateConstDerivs = dict() if logRateConstDerivs is None else logRateConstDerivs
+
+	def getConcSensitivities(self, paramName=None):
+		""" Gets d[X]/d(parameter) (nVar x nChannels); column c is for the parameter of channel c. paramName=None gives sensitivities to ln(k) """
+		return self.concLogSens * self._getChainFactors(paramName)
+
+	def getRateSensitivities(self, paramName=None):
+		""" Gets d(channel rate)/d(parameter) (nChannels x nChannels); entry [c,d] is for the rate of channel c and parameter of channel d. paramName=None gives sensitivities to ln(k) """
+		return self.rateLogSens * self._getChainFactors(paramName)
+
+	def getFlux(self, fluxWeights):
+		""" Gets the flux defined by fluxWeights (see getFluxWeights) """
+		return float(np.dot(fluxWeights, self.channelRates))
+
+	def getFluxSensitivities(self, fluxWeights, paramName=None):
+		""" Gets d(flux)/d(parameter) for the parameter of each channel; flux is defined by fluxWeights (see getFluxWeights) """
+		return np.dot(fluxWeights, self.getRateSensitivities(paramName))
+
+	def getDegreesOfRateControl(self, fluxWeights):
+		""" Gets the Campbell degree of rate control for each reaction in network.reactions, X_i = dln(flux)/dln(k_i) with the equilibrium constant of reaction i held fixed (i.e. forward and backward channels scaled together). NaN if the flux is zero """
+		logSens = self.getFluxSensitivities(fluxWeights)
+		reactionSens = sumOverReactions(self.network, logSens)
+		flux = self.getFlux(fluxWeights)
+		if flux == 0:
+			return np.full(len(reactionSens), np.nan)
+		return reactionSens / flux
+
+	def _getChainFactors(self, paramName):
+		if paramName is None:
+			return np.ones(self.network.nChannels)
+		if paramName not in self.logRateConstDerivs:
+			raise ValueError("No dln(k)/d({}) values; available are {}".format(paramName, list(self.logRateConstDerivs.keys())))
+		return self.logRateConstDerivs[paramName]
+
+
+def getSteadyStateSensitivities(steadyStateSolver, concs, rateConsts, logRateConstDerivs=None):
+	""" Gets sensitivities of a steady state to the rate constant of every channel, with conserved totals held fixed
+
+	Args:
+		steadyStateSolver: (SteadyStateSolver) Defines the network, variable species and conservation constraints
+		concs: (float array) Concentrations of all network species at a steady state (e.g. from steadyStateSolver.solve)
+		rateConsts: (float array) Rate constant for each channel
+		logRateConstDerivs: (Optional, dict) Parameter name to dln(k)/d(parameter) for each channel; see getLogRateConstantDerivatives
+
+	Returns
+		result: (SensitivityResult)
+
+	Raises:
+		ValueError: If the steady-state Jacobian is singular (e.g. at a fold)
+
+	"""
+	network, varIndices = steadyStateSolver.network, steadyStateSolver.varIndices
+	concs = np.array(concs, dtype=float)
+	channelRates = network.getChannelRates(concs, rateConsts)
+
+	jacobian = steadyStateSolver.getResidualJacobian(concs, rateConsts)
+	paramDerivs = steadyStateSolver.getResidualLogRateConstantDerivatives(concs, rateConsts)
+	if len(varIndices) > 0:
+		luFactors = linAlgHelp.lu_factor(jacobian, check_finite=False)
+		if np.any(np.diag(luFactors[0]) == 0):
+			raise ValueError("Steady-state Jacobian is singular")
+		concLogSens = linAlgHelp.lu_solve(luFactors, -1*paramDerivs, check_finite=False)
+	else:
+		concLogSens = np.zeros( (0, network.nChannels) )
+
+	rateJacobian = getChannelRateJacobian(network, varIndices, concs, rateConsts)
+	rateLogSens = np.diag(channelRates) + rateJacobian @ concLogSens
+	return SensitivityResult(network, varIndices, concs, channelRates, concLogSens, rateLogSens, logRateConstDerivs=logRateConstDerivs)
+
+
+def getTransientSensitivities(network, varIndices, concs, rateConsts, outputTimes, channelIndices=None, method="BDF", solverOptions=None):
+	""" Integrates concentrations together with their sensitivities to ln(k) of selected channels (the forward sensitivity equations dS/dt = J*S + df/dln(k), with S=0 at the start)
+
+	Args:
+		network: (CompiledReactionNetwork)
+		varIndices: (iter of int) Network index of each variable species; all others are held fixed
+		concs: (float array) Starting concentrations of all network species
+		rateConsts: (float array) Rate constant for each channel
+		outputTimes: (iter of float) Sorted times at which to return values; the integration runs from 0 to the last
+		channelIndices: (Optional, iter of int) Channels to find sensitivities for; default is all. Each adds nVar equations
+		method: (str) solve_ivp method. Implicit methods use a block-diagonal approximation of the Jacobian of the full system
+		solverOptions: (Optional, dict) Extra keyword arguments for solve_ivp (e.g. rtol, atol)
+
+	Returns
+		outConcs: (nTimes x nSpecies float array) Concentrations of all network species at each output time
+		concLogSens: (nTimes x nVar x nSelected float array) d[X]/dln(k) at each output time
+
+	Raises:
+		ValueError: If the integration fails
+
+	"""
+	varIndices = np.array(varIndices, dtype=int)
+	channelIndices = np.arange(network.nChannels) if channelIndices is None else np.array(channelIndices, dtype=int)
+	outputTimes = np.array(outputTimes, dtype=float)
+	nVar, nSens = len(varIndices), len(channelIndices)
+	workBuffer = network.createWorkBuffer(concs)
+	ratesBuffer, channelRates = np.zeros(network.nSpecies), np.zeros(network.nChannels)
+	jacCalculator = compiledHelp.JacobianCalculator(network, varIndices)
+	selectedStoich = network.stoichMatrix[np.ix_(varIndices, channelIndices)]
+
+	def _setConcs(state):
+		workBuffer[varIndices] = state[:nVar]
+
+	def _rates(time, state):
+		_setConcs(state)
+		outVals = np.empty(len(state))
+		outVals[:nVar] = network.getRatesOfChangeFromWorkBuffer(workBuffer, rateConsts, ratesBuffer)[varIndices]
+		jacobian = jacCalculator.getJacobianFromWorkBuffer(workBuffer, rateConsts)
+		network.getChannelRatesFromWorkBuffer(workBuffer, rateConsts, channelRates)
+		sensMatrix = state[nVar:].reshape(nSens, nVar).T #Stored one channel block after another
+		outSens = jacobian @ sensMatrix + selectedStoich*channelRates[channelIndices]
+		outVals[nVar:] = np.asarray(outSens).T.ravel()
+		return outVals
+
+	def _jacobian(time, state):
+		_setConcs(state)
+		jacobian = jacCalculator.getJacobianFromWorkBuffer(workBuffer, rateConsts)
+		return sparseHelp.kron( sparseHelp.identity(nSens+1), sparseHelp.csc_matrix(jacobian), format="csc" )
+
+	solverOptions = dict() if solverOptions is None else dict(solverOptions)
+	if method in ("Radau", "BDF", "LSODA"):
+		solverOptions.setdefault("jac", _jacobian)
+	startState = np.zeros( nVar*(nSens+1) )
+	startState[:nVar] = workBuffer[varIndices]
+	result = integrateHelp.solve_ivp(_rates, [0, outputTimes[-1]], startState, method=method, t_eval=outputTimes, **solverOptions)
+	if not result.success:
+		raise ValueError("Sensitivity integration failed: {}".format(result.message))
+
+	outConcs = np.tile(np.array(workBuffer[:-1]), (len(outputTimes),1))
+	outConcs[:,varIndices] = result.y[:nVar].T
+	concLogSens = result.y[nVar:].T.reshape(len(outputTimes), nSens, nVar).transpose(0,2,1)
+	return outConcs, concLogSens
+
+
+def getChannelRateJacobian(network, varIndices, concs, rateConsts):
+	""" Gets d(channel rate)/d[X] for every channel and variable species; an nChannels x nVar float array """
+	workBuffer = network.createWorkBuffer(np.asarray(concs, dtype=float)[:network.nSpecies])
+	derivTerms = network.getChannelRateDerivativeTerms(workBuffer, rateConsts)
+	fullJacobian = np.zeros( (network.nChannels, network.nSpecies+1) )
+	channelIndices = np.broadcast_to( np.arange(network.nChannels), derivTerms.shape )
+	np.add.at(fullJacobian, (channelIndices, network.reactantIndices.T), derivTerms)
+	return fullJacobian[:, np.array(varIndices, dtype=int)]
+
+
+def getLogRateConstantDerivatives(network, paramName, temperature, potential=0, pH=0, inputReactants=None):
+	""" Gets dln(k)/d(parameter) for each channel, where the parameter is that channels own barrier, prefactor or symFactor
+
+	Args:
+		network: (CompiledReactionNetwork)
+		paramName: (str) One of PARAMETER_NAMES
+		temperature: (float)
+		potential: (float)
+		pH: (float)
+		inputReactants: (Optional, iter of ChemSpeciesStd) Passed to Tafel factors which depend on (fixed) concentrations
+
+	Returns
+		derivs: (float array) One value per channel; NaN for channels without the parameter
+
+	Raises:
+		ValueError: If paramName is unknown
+
+	"""
+	if paramName not in PARAMETER_NAMES:
+		raise ValueError("paramName must be one of {}, not {}".format(PARAMETER_NAMES, paramName))
+	outVals = np.full(network.nChannels, np.nan)
+	currArgs, currKwargs = [inputReactants, temperature], {"pH":pH, "potential":potential}
+	for idx, channel in enumerate(network.channels):
+		if not hasattr(channel, paramName):
+			continue
+		if paramName == "barrier":
+			outVals[idx] = -1 / (unitHelp.BOLTZ_EV*temperature)
+		elif paramName == "prefactor":
+			outVals[idx] = 1 / channel.prefactor
+		else:
+			upChannel, downChannel = copy.copy(channel), copy.copy(channel)
+			upChannel.symFactor += _SYM_FACTOR_STEP
+			downChannel.symFactor -= _SYM_FACTOR_STEP
+			diffVal = upChannel.getLogRateConstant(*currArgs, **currKwargs) - downChannel.getLogRateConstant(*currArgs, **currKwargs)
+			outVals[idx] = diffVal / (2*_SYM_FACTOR_STEP)
+	return outVals
+
+
+def getFluxWeights(network, flux):
+	""" Gets the weights w for which a flux is w.dot(channelRates)
+
+	Args:
+		network: (CompiledReactionNetwork)
+		flux: (str or int) A species name gives its net rate of production (e.g. of a dissolved product); an int gives the net rate (forward minus backward) of network.reactions[flux]
+
+	Returns
+		fluxWeights: (float array) One value per channel
+
+	Raises:
+		ValueError: If flux is not a species in the network or a valid reaction index
+
+	"""
+	if isinstance(flux, str):
+		if flux not in network.speciesIndices:
+			raise ValueError("{} is not a species in the network".format(flux))
+		return np.array(network.stoichMatrix[network.speciesIndices[flux]])
+
+	if not (0 <= flux < len(network.reactions)):
+		raise ValueError("Reaction index {} out of range for {} reactions".format(flux, len(network.reactions)))
+	return np.where(network.channelReactionIndices==flux, network.channelSigns, 0.0)
+
+
+def sumOverReactions(network, channelValues):
+	""" Sums per-channel values (e.g. sensitivities) over the channels of each reaction in network.reactions """
+	return np.bincount(network.channelReactionIndices, weights=channelValues, minlength=len(network.reactions))
@@ -0,0 +1,236 @@
+
+import numpy as np
+import scipy.linalg as linAlgHelp
+
+from . import compiled_network as compiledHelp
+
+
+#Net rates smaller than this fraction of the gross flux through a species cannot be resolved in double precision
+_ROUND_OFF_FACTOR = 1e3*np.finfo(float).eps
+
+
+class SteadyStateSolver():
+	""" Finds steady states of a CompiledReactionNetwork by solving d[X]/dt=0 directly, rather than by integrating in time. Uses pseudo-transient continuation (i.e. implicit Euler steps with a pseudo-timestep that grows as the residual falls); once the pseudo-timestep is large this becomes Newton's method, and the LU factorisation is then reused across iterations while they converge quickly
+
+	Conserved quantities (e.g. total number of surface sites) make the steady-state Jacobian singular. These are found from the left null space of the stoichiometry matrix; each replaces one (linearly dependent) rate equation, so totals present in the starting concentrations are kept exactly
+
+	Attributes:
+		network: (CompiledReactionNetwork)
+		varIndices: (int array) Network index of each variable species. All other species are held fixed
+		conservationMatrix: (nConserved x nVar float array) Each row gives a linear combination of variable-species concentrations which no reaction changes
+		rTol: (float) Relative tolerance on the final Newton step
+		aTol: (float) Absolute tolerance on the final Newton step
+		maxIter: (int) Maximum number of iterations per call to solve()
+		maxContraction: (float) Factorisations are reused while each iteration reduces the residual by at least this factor
+		maxResidualGrowth: (float) Pseudo-transient steps which increase the residual by more than this factor are rejected
+		maxInitialNewtonStep: (float) Newton's method is used from the start if no concentration changes by more than this fraction on the first step; otherwise pseudo-transient continuation is used first
+
+	"""
+
+	def __init__(self, network, varIndices, rTol=1e-8, aTol=1e-15, maxIter=200, maxContraction=0.5, maxResidualGrowth=10, maxInitialNewtonStep=0.5):
+		""" Initializer
+
+		Args:
+			network: (CompiledReactionNetwork)
+			varIndices: (iter of int) Network index of each variable species
+			rTol: (float) Relative tolerance on the final Newton step
+			aTol: (float) Absolute tolerance on the final Newton step
+			maxIter: (int) Maximum number of iterations per call to solve()
+			maxContraction: (float) Factorisations are reused while each iteration reduces the residual by at least this factor
+			maxResidualGrowth: (float) Pseudo-transient steps which increase the residual by more than this factor are rejected
+			maxInitialNewtonStep: (float) Newton's method is used from the start if no concentration changes by more than this fraction on the first step; otherwise pseudo-transient continuation is used first
+
+		"""
+		self.network = network
+		self.varIndices = np.array(varIndices, dtype=int)
+		self.rTol = rTol
+		self.aTol = aTol
+		self.maxIter = maxIter
+		self.maxContraction = maxContraction
+		self.maxResidualGrowth = maxResidualGrowth
+		self.maxInitialNewtonStep = maxInitialNewtonStep
+		self._jacCalculator = compiledHelp.JacobianCalculator(network, self.varIndices, sparse=False)
+		self._createConservationRows()
+
+	def _createConservationRows(self):
+		varStoich = self.network.stoichMatrix[self.varIndices]
+		self._absVarStoich = np.abs(varStoich)
+		self.conservationMatrix = linAlgHelp.null_space(varStoich.T).T
+		nConserved = self.conservationMatrix.shape[0]
+
+		#Pivoted QR on the transpose puts linearly independent rate equations first; the rest get replaced by conservation rows
+		if len(self.varIndices) > 0:
+			pivots = linAlgHelp.qr(varStoich.T, mode="r", pivoting=True)[1]
+		else:
+			pivots = np.zeros(0, dtype=int)
+		self._rateRows = np.sort( pivots[:len(pivots)-nConserved] )
+		self._constraintRows = np.sort( pivots[len(pivots)-nConserved:] )
+
+	def solve(self, concs, rateConsts, totals=None):
+		""" Finds the steady state starting from concs
+
+		Args:
+			concs: (float array) Concentrations of all network species (ordered as network.speciesNames). Variable species values are the initial guess; all others are held fixed
+			rateConsts: (float array) Rate constant for each channel
+			totals: (Optional, float array) Value of each conserved quantity (see getConservedTotals). Default is to take them from concs
+
+		Returns
+			outConcs: (float array) Copy of concs with variable species set to the last iterate
+			info: (dict) "converged" (bool), "nIter", "nLU", "pseudoTime" (time covered by the pseudo-transient steps) and "timeScale" (1/largest Jacobian element; roughly the fastest relaxation time)
+
+		"""
+		workBuffer = self.network.createWorkBuffer(concs)
+		ratesBuffer = np.zeros(self.network.nSpecies)
+		currConcs = workBuffer[self.varIndices]
+		totals = self.conservationMatrix @ currConcs if totals is None else totals
+
+		def _getResidual(varConcs):
+			workBuffer[self.varIndices] = varConcs
+			outVals = self.network.getRatesOfChangeFromWorkBuffer(workBuffer, rateConsts, ratesBuffer)[self.varIndices]
+			outVals[self._constraintRows] = totals - self.conservationMatrix @ varConcs
+			return outVals
+
+		def _getNorm(residual, varConcs):
+			scales = np.abs(varConcs)
+			scales[self._constraintRows] = np.abs(self.conservationMatrix) @ scales
+			return np.sqrt( np.mean( (residual / (self.aTol + self.rTol*scales))**2 ) )
+
+		info = {"converged":False, "nIter":0, "nLU":0, "pseudoTime":0.0, "timeScale":np.inf}
+		residual = _getResidual(currConcs)
+		resNorm = _getNorm(residual, currConcs)
+		if len(currConcs) == 0 or resNorm == 0:
+			info["converged"] = True
+			return self._getOutConcs(concs, currConcs), info
+
+		#Start with a plain Newton step; this is kept only if it is small (e.g. when starting near a steady state)
+		luFactors, isFresh, timeStep = None, False, np.inf
+		while info["nIter"] < self.maxIter:
+			info["nIter"] += 1
+
+			if luFactors is None:
+				sysMatrix, jacNorm = self._getSystemJacobian(workBuffer, currConcs, rateConsts)
+				if jacNorm == 0:
+					break
+				info["timeScale"] = 1/jacNorm
+				if timeStep*jacNorm > 1e8:
+					timeStep = np.inf
+				if np.isfinite(timeStep):
+					sysMatrix[self._rateRows, self._rateRows] += 1/timeStep
+				luFactors, isFresh = linAlgHelp.lu_factor(sysMatrix, check_finite=False), True
+				info["nLU"] += 1
+
+			concStep = linAlgHelp.lu_solve(luFactors, residual, check_finite=False)
+			if info["nIter"] == 1 and not np.all( np.abs(concStep) <= self.maxInitialNewtonStep*(self.aTol + np.abs(currConcs)) ):
+				timeStep, luFactors = info["timeScale"], None
+				continue
+
+			newConcs = getDampedConcs(currConcs, concStep)
+			newResidual = _getResidual(newConcs)
+			newNorm = _getNorm(newResidual, newConcs)
+
+			#Newton steps must reduce the residual. Pseudo-transient steps are allowed to increase it a little, since the residual often grows while passing through fast transients
+			isNewtonStep = np.isinf(timeStep)
+			if isNewtonStep and np.all( np.abs(concStep) <= self.aTol + self.rTol*np.abs(currConcs) ):
+				info["converged"] = True
+				if newNorm < resNorm:
+					currConcs = newConcs
+				break
+
+			maxNorm = resNorm if isNewtonStep else self.maxResidualGrowth*resNorm
+			if not (newNorm < maxNorm):
+				if isNewtonStep and isFresh and self._isResidualNegligible(workBuffer, currConcs, residual, rateConsts):
+					info["converged"] = True
+					break
+				if isFresh:
+					timeStep = 0.1/jacNorm if np.isinf(timeStep) else 0.1*timeStep
+					if timeStep*jacNorm < 1e-12:
+						break
+				luFactors = None
+				continue
+
+			#Accept
+			isFresh = False
+			if not isNewtonStep:
+				info["pseudoTime"] += timeStep
+
+			contraction = newNorm / resNorm
+			currConcs, residual, resNorm = newConcs, newResidual, newNorm
+			if resNorm == 0:
+				info["converged"] = True
+				break
+
+			#Pseudo-timestep grows (faster as the residual falls); it changes every step so needs a new factorisation
+			if not isNewtonStep:
+				timeStep *= min(100, max(2, 1/contraction))
+				luFactors = None
+			elif contraction > self.maxContraction:
+				luFactors = None
+
+		return self._getOutConcs(concs, currConcs), info
+
+	def getConservedTotals(self, concs):
+		""" Gets the value of each conserved quantity (rows of self.conservationMatrix) for concs (ordered as network.speciesNames) """
+		return self.conservationMatrix @ np.asarray(concs, dtype=float)[self.varIndices]
+
+	def getResidual(self, concs, rateConsts, totals):
+		""" Gets the function solve() drives to zero: d[X]/dt for variable species, except that rows replaced by conservation constraints hold (totals - current totals)
+
+		Args:
+			concs: (float array) Concentrations of all network species
+			rateConsts: (float array) Rate constant for each channel
+			totals: (float array) Target value of each conserved quantity; see getConservedTotals
+
+		Returns
+			residual: (float array) One value per variable species
+
+		"""
+		varConcs = np.asarray(concs, dtype=float)[self.varIndices]
+		outVals = self.network.getRatesOfChange(concs, rateConsts)[self.varIndices]
+		outVals[self._constraintRows] = totals - self.conservationMatrix @ varConcs
+		return outVals
+
+	def getResidualJacobian(self, concs, rateConsts):
+		""" Gets d(residual)/d[X] (see getResidual) for variable species; an nVar x nVar float array """
+		workBuffer = self.network.createWorkBuffer(concs)
+		return -1*self._getSystemJacobian(workBuffer, workBuffer[self.varIndices], rateConsts)[0]
+
+	def getResidualLogRateConstantDerivatives(self, concs, rateConsts):
+		""" Gets d(residual)/dln(rateConst) (see getResidual) for every variable species and channel; an nVar x nChannels float array. Rows replaced by conservation constraints are zero, since totals do not depend on rate constants """
+		channelRates = self.network.getChannelRates(np.asarray(concs, dtype=float)[:self.network.nSpecies], rateConsts)
+		outMatrix = self.network.stoichMatrix[self.varIndices] * channelRates
+		outMatrix[self._constraintRows] = 0
+		return outMatrix
+
+	def isResidualNegligible(self, concs, rateConsts, residual):
+		""" True if every net rate of change in residual is at round-off level compared to the total flux through that species. Newton steps stop reducing the residual at this point, which can happen before step-size tests pass for very stiff networks """
+		workBuffer = self.network.createWorkBuffer(concs)
+		return self._isResidualNegligible(workBuffer, workBuffer[self.varIndices], residual, rateConsts)
+
+	def _getSystemJacobian(self, workBuffer, varConcs, rateConsts):
+		""" -1*d(residual)/d[X]; rows for the rate equations are -Jacobian, while conservation rows are the conservation matrix """
+		workBuffer[self.varIndices] = varConcs
+		jacobian = self._jacCalculator.getJacobianFromWorkBuffer(workBuffer, rateConsts)
+		jacNorm = np.max( np.abs(jacobian[self._rateRows]) ) if len(self._rateRows)>0 else 0
+		outMatrix = -1*jacobian
+		outMatrix[self._constraintRows] = self.conservationMatrix
+		return outMatrix, jacNorm
+
+	def _isResidualNegligible(self, workBuffer, varConcs, residual, rateConsts):
+		workBuffer[self.varIndices] = varConcs
+		channelRates = self.network.getChannelRates(workBuffer[:-1], rateConsts)
+		grossFluxes = self._absVarStoich @ channelRates
+		return np.all( np.abs(residual[self._rateRows]) <= _ROUND_OFF_FACTOR*grossFluxes[self._rateRows] )
+
+	def _getOutConcs(self, concs, varConcs):
+		outConcs = np.array(concs, dtype=float)
+		outConcs[self.varIndices] = varConcs
+		return outConcs
+
+
+def getDampedConcs(concs, concStep, maxDecrease=0.9):
+	""" Gets concs+concStep, except that positive concentrations can fall by at most a fraction maxDecrease (so never become negative). Damping each species separately means one nearly-depleted species cannot stall the step for all the others """
+	outConcs = concs + concStep
+	floorConcs = (1-maxDecrease)*concs
+	useFloor = (concs > 0) & (outConcs < floorConcs)
+	outConcs[useFloor] = floorConcs[useFloor]
+	return outConcs
@@ -45,6 +45,67 @@ class TestChemSpeciesBase(unittest.TestCase):
 		objB = self.testObjA
 		self.assertNotEqual(objA,objB)
 
+class TestSpeciesState(unittest.TestCase):
+
+	def setUp(self):
+		self.names = ["Mg", "H", "O"]
+		self.concs = [1, 0.5, 0.25]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.species = [tCode.ChemSpeciesStd(name,conc) for name,conc in zip(self.names, self.concs)]
+		self.testObjA = tCode.SpeciesState.fromSpecies(self.species)
+
+	def testComparesEqualToEquivalentSpecies(self):
+		self.assertEqual(self.species, self.testObjA)
+		self.assertEqual(self.testObjA, self.species)
+
+	def testViewsWriteToArray(self):
+		expConcs = [1, 3, 0.25]
+		views = [x for x in self.testObjA]
+		views[1].conc = 3
+		self.assertEqual(expConcs, self.testObjA.concs.tolist())
+
+	def testDeepCopyIsIndependent(self):
+		copiedObj = copy.deepcopy(self.testObjA)
+		copiedObj.setConc("O", 4)
+		self.assertEqual(self.concs[2], self.testObjA.getConc("O"))
+		self.assertEqual(4, copiedObj.getConc("O"))
+
+	def testIndicesImmutable(self):
+		with self.assertRaises(TypeError):
+			self.testObjA.indices["Mg"] = 2
+
+	def testIndexByPositionOrName(self):
+		self.assertEqual(self.species[-1], self.testObjA[-1])
+		self.assertEqual(self.species[1], self.testObjA["H"])
+		self.testObjA["O"].conc = 4
+		self.assertEqual(4, self.testObjA.getConc("O"))
+
+	def testSliceGivesListOfViews(self):
+		expSpecies = self.species[1:]
+		actSpecies = self.testObjA[1:]
+		self.assertEqual(expSpecies, actSpecies)
+		actSpecies[0].conc = 2
+		self.assertEqual(2, self.testObjA.getConc("H"))
+		self.assertEqual(self.species[::-2], self.testObjA[::-2])
+
+	def testBadKeysRaise(self):
+		with self.assertRaises(IndexError):
+			self.testObjA[3]
+		with self.assertRaises(KeyError):
+			self.testObjA["X"]
+		for key in [1.0, None, [0,1]]:
+			with self.assertRaises(TypeError):
+				self.testObjA[key]
+
+	def testConcFactorUsesStateIndices(self):
+		reaction = tCode.ChemReactionTemplate(["Mg","H","H","X"], ["O"], 1, 1)
+		expFactor = reaction._getReactantConcRateFactor(self.species)
+		actFactor = reaction._getReactantConcRateFactor(self.testObjA)
+		self.assertAlmostEqual(expFactor, actFactor)
+
+
 class TestStandardReactionTemplate(unittest.TestCase):
 
 	def setUp(self):
@@ -149,6 +210,14 @@ class TestReactionController(unittest.TestCase):
 		self.assertEqual(expStepNumber, actStepNumber)
 
 
+	def testExpectedNextStep_speciesState(self):
+		self.startReactants = tCode.SpeciesState.fromSpecies(self.startReactants)
+		self.createTestObjs()
+		expOutReactants = [tCode.ChemSpeciesStd(name,conc) for name,conc in zip(["Mg","H"], [1+0.2-0.3, 1-0.1+0.1])]
+		self.testObjA._doNextStep()
+		self.assertEqual(expOutReactants, self.testObjA.currentReactants)
+		self.assertEqual(1, self.testObjA.step)
+
 	def testSimpleTrackStepCallbackFunct(self):
 		nSteps = 3
 		expStepList = [x for x in range(nSteps)]
@@ -0,0 +1,125 @@
+
+import unittest
+import unittest.mock as mock
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.compiled_network as compiledHelp
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.propagators as propHelp
+import simple_reactions_lib.core.codegen as tCode
+
+
+class TestGeneratedFunctions(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.potential = 0.1
+		self.concs = [0.3, 0.6, 0.2, 0.5]
+		self.varIndices = [0,2,3]
+		self.backend = "python"
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B","B"], ["C"], 0.4, 20, nElecTransfer=-1)
+		reactionB = coreHelp.BetterReactionTemplate(["C","D"], ["A","A"], 0.5, 30, nElecTransfer=2)
+		reactionC = coreHelp.BetterReactionTemplate(["D"], ["B"], 0.45, 30)
+		self.network = compiledHelp.CompiledReactionNetwork([reactionA, reactionB, reactionC])
+		self.rateConsts = self.network.getRateConstants(self.temperature, potential=self.potential)
+
+	def _runTestFunct(self):
+		workBuffer = self.network.createWorkBuffer(self.concs)
+		ratesFunct, jacFunct = tCode.getGeneratedFunctions(self.network, self.varIndices, self.rateConsts, workBuffer, backend=self.backend)
+		varConcs = np.array(self.concs)[self.varIndices]
+		return ratesFunct(0, varConcs), jacFunct(0, varConcs)
+
+	def _checkMatchesCompiledNetwork(self):
+		workBuffer = self.network.createWorkBuffer(self.concs)
+		expRates = self.network.getRatesOfChange(np.array(self.concs), self.rateConsts)[self.varIndices]
+		expJacobian = compiledHelp.JacobianCalculator(self.network, self.varIndices).getJacobianFromWorkBuffer(workBuffer, self.rateConsts)
+		actRates, actJacobian = self._runTestFunct()
+		self.assertTrue( np.allclose(expRates, actRates, rtol=1e-14, atol=0) )
+		self.assertTrue( np.allclose(expJacobian, actJacobian, rtol=1e-14, atol=0) )
+
+	def testMatchesCompiledNetwork(self):
+		self._checkMatchesCompiledNetwork()
+
+	def testMatchesCompiledNetwork_allVariable(self):
+		self.varIndices = [3,1,0,2]
+		self._checkMatchesCompiledNetwork()
+
+	def testFixedConcsFoldedIn(self):
+		""" Only B varies, so everything except its concentration is folded into the rate constants """
+		rateConsts = np.array(self.rateConsts)
+		workBuffer = self.network.createWorkBuffer(self.concs)
+		expFolded = rateConsts*np.array([0.3, 0.2*0.5, 0.5])
+		actFolded = tCode.getFoldedRateConstants(self.network, [1], rateConsts, workBuffer)
+		self.assertTrue( np.allclose(expFolded, actFolded) )
+
+	def testSourceCachedOnStructure(self):
+		tCode._FACTORY_CACHE.clear()
+		self._runTestFunct()
+		self.rateConsts = self.rateConsts*2
+		self.concs = [0.1, 0.2, 0.3, 0.4]
+		with mock.patch("simple_reactions_lib.core.codegen.generateSource") as mockGenerate:
+			self._checkMatchesCompiledNetwork()
+			mockGenerate.assert_not_called()
+		self.assertEqual(1, len(tCode._FACTORY_CACHE))
+
+	def testUnknownBackendRaises(self):
+		self.backend = "fake_backend"
+		with self.assertRaises(ValueError):
+			self._runTestFunct()
+
+	@mock.patch("simple_reactions_lib.core.codegen.numba", None)
+	def testNumbaBackendRaisesWithoutNumba(self):
+		self.backend = "numba"
+		with self.assertRaises(ValueError):
+			self._runTestFunct()
+
+	@mock.patch("simple_reactions_lib.core.codegen.numba", None)
+	def testAutoBackendFallsBackToPython(self):
+		self.backend = "auto"
+		self._checkMatchesCompiledNetwork()
+
+	@unittest.skipIf(not tCode.isNumbaAvailable(), "numba not installed")
+	def testNumbaMatchesCompiledNetwork(self):
+		self.backend = "numba"
+		self._checkMatchesCompiledNetwork()
+
+
+class TestGeneratedRatesPropagation(unittest.TestCase):
+
+	def setUp(self):
+		self.timeStep = 0.5
+		self.temperature = 300
+		self.potential = 0.05
+		self.variableConcSpecies = ["A","C"]
+		self.solverOptions = {"rtol":1e-10, "atol":1e-14}
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.7, 1e13, nElecTransfer=1)
+		reactionB = coreHelp.BetterReactionTemplate(["C"], ["A","B"], 0.75, 1e13)
+		self.reactions = [reactionA, reactionB]
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C"], [1,0.5,0])]
+
+	def _runTestFunct(self, codegenBackend):
+		rateCalculator = contrHelp.CompiledRateCalculator(self.reactions, codegenBackend=codegenBackend)
+		testObj = propHelp.ConcsPropagator_Radau(rateCalculator, self.variableConcSpecies, solverOptions=self.solverOptions)
+		currReactants = [coreHelp.ChemSpeciesStd(x.name, x.conc) for x in self.startReactants]
+		testObj.propagate(currReactants, self.timeStep, temperature=self.temperature, potential=self.potential)
+		return testObj, currReactants
+
+	def testGeneratedFunctionUsed(self):
+		testObj, unused = self._runTestFunct("python")
+		functToPropagate = testObj.getFunctToPropagate(self.startReactants, self.temperature, self.potential)
+		self.assertTrue( isinstance(functToPropagate, contrHelp.GeneratedRatesFunction) )
+
+	def testMatchesDefaultRatesFunction(self):
+		unused, expReactants = self._runTestFunct(None)
+		unused, actReactants = self._runTestFunct("python")
+		for exp, act in zip(expReactants, actReactants):
+			self.assertAlmostEqual(exp.conc, act.conc, places=12)
+
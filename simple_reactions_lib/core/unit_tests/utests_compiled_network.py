@@ -0,0 +1,383 @@
+
+import itertools as it
+import unittest
+import unittest.mock as mock
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.core_units as unitHelp
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.compiled_network as tCode
+
+
+class TestCompiledReactionNetwork(unittest.TestCase):
+
+	def setUp(self):
+		self.prefactor = 10
+		self.temperature = 300
+		self.potential = 0.2
+		self.concs = {"H":0.4, "free":0.6, "H2":0.1}
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		kwargs = {"nElecTransfer":1, "refPot":0}
+		self.adsorbReaction = coreHelp.BetterReactionTemplate(["free"], ["H"], 0.5, self.prefactor, **kwargs)
+		forward = coreHelp.BetterReactionTemplate(["H","H"], ["free","free","H2"], 0.6, self.prefactor)
+		backward = coreHelp.BetterReactionTemplate(["free","free","H2"], ["H","H"], 0.7, self.prefactor)
+		self.netReaction = coreHelp.NetReactionTemplate(forward, backward)
+		self.reactions = [self.adsorbReaction, self.netReaction]
+		self.inpReactants = [coreHelp.ChemSpeciesStd(key,val) for key,val in self.concs.items()]
+		self.testObjA = tCode.CompiledReactionNetwork(self.reactions)
+
+	def testExpectedChannels(self):
+		expChannels = [self.adsorbReaction, self.netReaction.forwardReaction, self.netReaction.backwardReaction]
+		expReactionIndices, expSigns = [0,1,1], [1,1,-1]
+		self.assertEqual(expChannels, self.testObjA.channels)
+		self.assertEqual(expReactionIndices, self.testObjA.channelReactionIndices.tolist())
+		self.assertEqual(expSigns, self.testObjA.channelSigns.tolist())
+
+	def testExpectedStoichMatrix(self):
+		expNames = ("free", "H", "H2")
+		expMatrix = [ [-1, 2,-2],
+		              [ 1,-2, 2],
+		              [ 0, 1,-1] ]
+		self.assertEqual(expNames, self.testObjA.speciesNames)
+		self.assertEqual(expMatrix, self.testObjA.stoichMatrix.tolist())
+
+	def testReactantIndicesPaddedWithOnesSlot(self):
+		expIndices = [ [0,3,3],
+		               [1,1,3],
+		               [0,0,2] ]
+		self.assertEqual(expIndices, self.testObjA.reactantIndices.tolist())
+
+	def testSpeciesMapIsImmutable(self):
+		with self.assertRaises(TypeError):
+			self.testObjA.speciesIndices["new"] = 4
+
+	def testRatesOfChangeMatchUncompiledReactions(self):
+		expRates = contrHelp.RateCalculatorStandard(self.reactions).getRates(self.inpReactants, temperature=self.temperature, potential=self.potential)
+		concs = self.testObjA.getConcsFromReactants(self.inpReactants)
+		rateConsts = self.testObjA.getRateConstants(self.temperature, potential=self.potential)
+		actRates = self.testObjA.getRatesOfChange(concs, rateConsts)
+		for key in expRates.keys():
+			self.assertAlmostEqual( expRates[key], actRates[self.testObjA.speciesIndices[key]] )
+
+	def testGetReactionFluxes(self):
+		currArgs = [self.inpReactants, self.temperature]
+		currKwargs = {"potential":self.potential}
+		expFluxes = [x.getReactionRate(*currArgs, **currKwargs) for x in self.reactions]
+		concs = self.testObjA.getConcsFromReactants(self.inpReactants)
+		rateConsts = self.testObjA.getRateConstants(self.temperature, potential=self.potential)
+		actFluxes = self.testObjA.getReactionFluxes(concs, rateConsts)
+		for exp,act in it.zip_longest(expFluxes, actFluxes):
+			self.assertAlmostEqual(exp,act)
+
+	def testMissingSpeciesGivenUnitConc(self):
+		self.inpReactants = [x for x in self.inpReactants if x.name!="H2"]
+		expConcs = [self.concs["free"], self.concs["H"], 1]
+		actConcs = self.testObjA.getConcsFromReactants(self.inpReactants)
+		self.assertEqual(expConcs, actConcs.tolist())
+
+	def testFillWorkBufferMatchesConcsFromReactants(self):
+		workBuffer = self.testObjA.createWorkBuffer()
+		extraReactant = coreHelp.ChemSpeciesStd("X", 3)
+		for inpReactants in [self.inpReactants, [x for x in self.inpReactants if x.name!="H2"], self.inpReactants+[extraReactant]]:
+			expVals = self.testObjA.getConcsFromReactants(inpReactants).tolist() + [1]
+			actVals = self.testObjA.fillWorkBuffer(inpReactants, workBuffer)
+			self.assertEqual(expVals, actVals.tolist())
+
+
+class TestCompiledRateCalculator(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.potential = -0.3
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.4, 20, nElecTransfer=-1)
+		self.reactionB = coreHelp.BetterReactionTemplate(["C"], ["A"], 0.5, 30, nElecTransfer=2)
+		self.reactions = [self.reactionA, self.reactionB]
+		self.inpReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C","X"], [0.2,0.5,0.3,4])]
+		self.testObjA = contrHelp.CompiledRateCalculator(self.reactions)
+
+	def _runTestFunct(self):
+		return self.testObjA.getRates(self.inpReactants, temperature=self.temperature, potential=self.potential)
+
+	def testRatesMatchStandardCalculator(self):
+		expRates = contrHelp.RateCalculatorStandard(self.reactions).getRates(self.inpReactants, temperature=self.temperature, potential=self.potential)
+		actRates = self._runTestFunct()
+		self.assertEqual(expRates.keys(), actRates.keys())
+		for key in expRates.keys():
+			self.assertAlmostEqual(expRates[key], actRates[key])
+
+	def testBarrierChangedInPlaceIsPickedUp(self):
+		self._runTestFunct()
+		self.reactionA.barrier = 0.6
+		expRates = contrHelp.RateCalculatorStandard(self.reactions).getRates(self.inpReactants, temperature=self.temperature, potential=self.potential)
+		actRates = self._runTestFunct()
+		for key in expRates.keys():
+			self.assertAlmostEqual(expRates[key], actRates[key])
+
+	def testClearRateConstantCache(self):
+		self._runTestFunct()
+		self.testObjA.clearRateConstantCache()
+		self.assertEqual({"hits":0, "misses":0, "size":0}, {k:v for k,v in self.testObjA.rateConstantCache.getStats().items() if k!="maxSize"})
+
+	def testRatesFromSpeciesState(self):
+		expRates = self._runTestFunct()
+		self.inpReactants = coreHelp.SpeciesState.fromSpecies(self.inpReactants)
+		actRates = self._runTestFunct()
+		for key in expRates.keys():
+			self.assertAlmostEqual(expRates[key], actRates[key])
+
+	@mock.patch("simple_reactions_lib.core.compiled_network.CompiledReactionNetwork.getRateConstants")
+	def testRateConstantsOnlyCalculatedOnConditionChange(self, mockGetRateConsts):
+		mockGetRateConsts.side_effect = lambda *args,**kwargs: np.ones(2)
+		self._runTestFunct()
+		self._runTestFunct()
+		self.assertEqual(1, mockGetRateConsts.call_count)
+		self.potential += 0.1
+		self._runTestFunct()
+		self.assertEqual(2, mockGetRateConsts.call_count)
+
+	def testLogRateConstantsGiveSameRates(self):
+		expRates = self._runTestFunct()
+		self.testObjA = contrHelp.CompiledRateCalculator(self.reactions, logRateConstants=True)
+		actRates = self._runTestFunct()
+		for key in expRates.keys():
+			self.assertAlmostEqual(expRates[key], actRates[key], places=12)
+
+	def testLogRateConstantsFiniteWhenRateConstantsUnderflow(self):
+		self.reactions.append( coreHelp.BetterReactionTemplate(["A"], ["C"], 40, 1e13) )
+		self.testObjA = contrHelp.CompiledRateCalculator(self.reactions, logRateConstants=True)
+		expLogVal = np.log(1e13) - 40/(unitHelp.BOLTZ_EV*self.temperature)
+		actLogVals = self.testObjA.getLogRateConstants(self.inpReactants, temperature=self.temperature, potential=self.potential)
+		self.assertEqual(0, self.testObjA.getRateConstants(self.inpReactants, temperature=self.temperature, potential=self.potential)[-1])
+		self.assertAlmostEqual(expLogVal, actLogVals[-1])
+
+
+class _FixedConcTafelReaction(coreHelp.ChemReactionTemplate):
+	""" Tafel factor is simply the concentration of a spectator species "X" """
+
+	def _getTafelFactor(self, inputReactants, temperature, pH, potential):
+		return [x.conc for x in inputReactants if x.name=="X"][0]
+
+
+class TestReducedReactionNetwork(unittest.TestCase):
+	""" A and B vary; H, X and Y are reservoirs. H+X->Y changes no variable species so is dropped """
+
+	def setUp(self):
+		self.temperature = 300
+		self.potential = -0.1
+		self.varNames = ["B","A"]
+		self.concs = {"A":0.3, "H":0.2, "B":0.6, "X":3, "Y":0.5}
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","H","H"], ["B"], 0.4, 20, nElecTransfer=2)
+		reactionB = _FixedConcTafelReaction(["B"], ["A","H","H"], 0.5, 30)
+		reactionC = coreHelp.BetterReactionTemplate(["H","X"], ["Y"], 0.5, 30)
+		reactionD = coreHelp.BetterReactionTemplate(["B","Y"], ["A"], 0.45, 25, nElecTransfer=-1)
+		self.network = tCode.CompiledReactionNetwork([reactionA, reactionB, reactionC, reactionD])
+		self.inpReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in self.concs.items()]
+		self.varIndices = [self.network.speciesIndices[x] for x in self.varNames]
+		self.testObjA = tCode.ReducedReactionNetwork(self.network, self.varIndices)
+
+	def _getFullValues(self):
+		concs = self.network.getConcsFromReactants(self.inpReactants)
+		rateConsts = self.network.getRateConstants(self.temperature, potential=self.potential, inputReactants=self.inpReactants)
+		return concs, rateConsts
+
+	def testStructure(self):
+		self.assertEqual(tuple(self.varNames), self.testObjA.speciesNames)
+		self.assertEqual([0,1,3], self.testObjA.channelIndices.tolist())
+		self.assertEqual( (3,1), self.testObjA.reactantIndices.shape )
+
+	def testRatesOfChangeMatchFullNetwork(self):
+		concs, rateConsts = self._getFullValues()
+		foldedConsts = self.testObjA.getFoldedRateConstants(rateConsts, concs)
+		expVals = self.network.getRatesOfChange(concs, rateConsts)[self.varIndices]
+		actVals = self.testObjA.getRatesOfChange(concs[self.varIndices], foldedConsts)
+		self.assertTrue( np.allclose(expVals, actVals, rtol=1e-12, atol=0) )
+
+	def testJacobianMatchesFullNetwork(self):
+		concs, rateConsts = self._getFullValues()
+		foldedConsts = self.testObjA.getFoldedRateConstants(rateConsts, concs)
+		expVals = tCode.JacobianCalculator(self.network, self.varIndices).getJacobianFromWorkBuffer(self.network.createWorkBuffer(concs), rateConsts)
+		actVals = self.testObjA.getJacobian(concs[self.varIndices], foldedConsts)
+		self.assertTrue( np.allclose(expVals, actVals, rtol=1e-12, atol=0) )
+
+	def testFoldedRateConstantsFromConditions(self):
+		concs, rateConsts = self._getFullValues()
+		expVals = self.testObjA.getFoldedRateConstants(rateConsts, concs)
+		actVals = self.testObjA.getRateConstants(self.temperature, potential=self.potential, inputReactants=self.inpReactants)
+		actLogVals = self.testObjA.getLogRateConstants(self.temperature, potential=self.potential, inputReactants=self.inpReactants)
+		self.assertTrue( np.allclose(expVals, actVals, rtol=1e-12, atol=0) )
+		self.assertTrue( np.allclose(np.log(expVals), actLogVals, rtol=1e-12, atol=0) )
+
+	def testPotentialRateConstantsIncludeReservoirs(self):
+		potentials = [-0.2, 0.1]
+		potentialRateConsts = tCode.PotentialRateConstants(self.testObjA, self.temperature, inputReactants=self.inpReactants)
+		expVals = [self.testObjA.getRateConstants(self.temperature, potential=x, inputReactants=self.inpReactants) for x in potentials]
+		actVals = potentialRateConsts.getRateConstants(potentials)
+		self.assertTrue( np.allclose(expVals, actVals, rtol=1e-12, atol=0) )
+
+
+class TestRateConstantCache(unittest.TestCase):
+
+	def setUp(self):
+		self.maxSize = 2
+		self.temperature = 300
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A"], ["B"], 0.4, 20, nElecTransfer=-1)
+		reactionB = _FixedConcTafelReaction(["B"], ["A"], 0.5, 30)
+		self.network = tCode.CompiledReactionNetwork([reactionA, reactionB])
+		self.inpReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","X"], [0.2,0.8,3])]
+		self.testObjA = tCode.RateConstantCache(self.network, maxSize=self.maxSize)
+
+	def _runTestFunct(self, potential):
+		return self.testObjA.getRateConstants(self.temperature, potential=potential, inputReactants=self.inpReactants)
+
+	def testValuesMatchNetwork(self):
+		expVals = self.network.getRateConstants(self.temperature, potential=0.2, inputReactants=self.inpReactants)
+		actVals = self._runTestFunct(0.2)
+		self.assertTrue( np.allclose(expVals, actVals) )
+
+	def testHitsAndMissesCounted(self):
+		for pot in [0.1, 0.2, 0.1, 0.1, 0.2]:
+			self._runTestFunct(pot)
+		expStats = {"hits":3, "misses":2, "size":2, "maxSize":self.maxSize}
+		self.assertEqual(expStats, self.testObjA.getStats())
+
+	def testClearForgetsLastLookup(self):
+		self._runTestFunct(0.1)
+		self.testObjA.clear()
+		self._runTestFunct(0.1)
+		self.assertEqual({"hits":0, "misses":1, "size":1, "maxSize":self.maxSize}, self.testObjA.getStats())
+
+	def testLeastRecentlyUsedEvicted(self):
+		for pot in [0.1, 0.2, 0.1, 0.3]: #0.2 is now the least recently used
+			self._runTestFunct(pot)
+		self._runTestFunct(0.1)
+		self.assertEqual(3, self.testObjA.misses)
+		self._runTestFunct(0.2)
+		self.assertEqual(4, self.testObjA.misses)
+
+	def testSpectatorConcChangeIsCacheMiss(self):
+		expFirst = self._runTestFunct(0.1)[1]
+		self.inpReactants[2].conc *= 2
+		actSecond = self._runTestFunct(0.1)[1]
+		self.assertEqual(2, self.testObjA.misses)
+		self.assertAlmostEqual(2*expFirst, actSecond)
+
+	def testParameterChangeDropsCachedValues(self):
+		expFirst = self._runTestFunct(0.1)[0]
+		self.network.reactions[0].barrier += 0.1
+		actSecond = self._runTestFunct(0.1)[0]
+		self.assertEqual(2, self.testObjA.misses)
+		self.assertLess(actSecond, expFirst)
+
+	def testVariableConcChangeIsCacheHit(self):
+		self._runTestFunct(0.1)
+		self.inpReactants[0].conc *= 2
+		self._runTestFunct(0.1)
+		self.assertEqual(1, self.testObjA.hits)
+
+	def testCachedValuesReadOnly(self):
+		outVals = self._runTestFunct(0.1)
+		with self.assertRaises(ValueError):
+			outVals[0] = 2
+
+
+class TestPotentialRateConstants(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.potentials = [-0.2, 0.1, 0.35]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A"], ["B"], 0.4, 20, nElecTransfer=-1, symFactor=0.3)
+		reactionB = _FixedConcTafelReaction(["B"], ["A"], 0.5, 30)
+		self.network = tCode.CompiledReactionNetwork([reactionA, reactionB])
+		self.inpReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","X"], [0.2,0.8,3])]
+		self.testObjA = tCode.PotentialRateConstants(self.network, self.temperature, inputReactants=self.inpReactants)
+
+	def _getExpVals(self):
+		return np.array([self.network.getRateConstants(self.temperature, potential=x, inputReactants=self.inpReactants) for x in self.potentials])
+
+	def testMatchesNetworkAtEachPotential(self):
+		expVals = self._getExpVals()
+		actVals = self.testObjA.getRateConstants(self.potentials)
+		self.assertTrue( np.allclose(expVals, actVals, rtol=1e-12, atol=0) )
+
+	def testFloatPotentialGivesVector(self):
+		expVals = self._getExpVals()[1]
+		actVals = self.testObjA.getRateConstants(self.potentials[1])
+		self.assertEqual(expVals.shape, actVals.shape)
+		self.assertTrue( np.allclose(expVals, actVals, rtol=1e-12, atol=0) )
+
+	def testWritesIntoBuffer(self):
+		outBuffer = np.zeros( (len(self.potentials), self.network.nChannels) )
+		actVals = self.testObjA.getLogRateConstants(self.potentials, out=outBuffer)
+		self.assertTrue(actVals is outBuffer)
+		self.assertTrue( np.allclose(np.log(self._getExpVals()), outBuffer) )
+
+
+class TestJacobianCalculator(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.potential = 0.1
+		self.concs = [0.3, 0.6, 0.2, 0.5]
+		self.varIndices = [0,2,3]
+		self.sparse = False
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B","B"], ["C"], 0.4, 20, nElecTransfer=-1)
+		reactionB = coreHelp.BetterReactionTemplate(["C","D"], ["A","A"], 0.5, 30, nElecTransfer=2)
+		reactionC = coreHelp.BetterReactionTemplate(["D"], ["B"], 0.45, 30)
+		self.network = tCode.CompiledReactionNetwork([reactionA, reactionB, reactionC])
+		self.rateConsts = self.network.getRateConstants(self.temperature, potential=self.potential)
+		self.testObjA = tCode.JacobianCalculator(self.network, self.varIndices, sparse=self.sparse)
+
+	def _getNumericalJacobian(self, stepSize=1e-7):
+		outJacobian = np.zeros( (len(self.varIndices), len(self.varIndices)) )
+		for colIdx, specIdx in enumerate(self.varIndices):
+			upConcs, downConcs = np.array(self.concs), np.array(self.concs)
+			upConcs[specIdx] += stepSize
+			downConcs[specIdx] -= stepSize
+			upRates = self.network.getRatesOfChange(upConcs, self.rateConsts)[self.varIndices]
+			downRates = self.network.getRatesOfChange(downConcs, self.rateConsts)[self.varIndices]
+			outJacobian[:,colIdx] = (upRates-downRates) / (2*stepSize)
+		return outJacobian
+
+	def _runTestFunct(self):
+		workBuffer = self.network.createWorkBuffer(self.concs)
+		return self.testObjA.getJacobianFromWorkBuffer(workBuffer, self.rateConsts)
+
+	def testDenseMatchesNumerical(self):
+		expJacobian = self._getNumericalJacobian()
+		actJacobian = self._runTestFunct()
+		self.assertTrue( np.allclose(expJacobian, actJacobian, rtol=1e-5, atol=1e-8) )
+
+	def testSparseMatchesDense(self):
+		expJacobian = self._runTestFunct()
+		self.sparse = True
+		self.createTestObjs()
+		actJacobian = self._runTestFunct()
+		self.assertTrue( np.allclose(expJacobian, actJacobian.toarray()) )
+
+	def testSparsityPattern(self):
+		#Variable species are A, C, D. [A] only enters the rate of the first reaction, which doesnt change D
+		expPattern = [ [1,1,1],
+		               [1,1,1],
+		               [0,1,1] ]
+		actPattern = self.testObjA.sparsity.toarray()
+		self.assertEqual(expPattern, actPattern.tolist())
+
@@ -0,0 +1,114 @@
+
+import unittest
+import unittest.mock as mock
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.compiled_network as compiledHelp
+import simple_reactions_lib.core.continuation as tCode
+import simple_reactions_lib.core.steady_state as steadyHelp
+
+
+class TestSolveAtParams(unittest.TestCase):
+	""" Potential-dependent adsorption A + free <-> A_ads; coverage has an analytic (Langmuir) form at every potential """
+
+	def setUp(self):
+		self.temperature = 300
+		self.params = np.linspace(-0.4, 0.2, 31)
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		adsorb = coreHelp.BetterReactionTemplate(["A","free"], ["A_ads"], 0.5, 1e13, nElecTransfer=-1)
+		desorb = coreHelp.BetterReactionTemplate(["A_ads"], ["A","free"], 0.55, 1e13, nElecTransfer=1)
+		self.network = compiledHelp.CompiledReactionNetwork([adsorb, desorb])
+		concDict = {"A":0.1, "free":1, "A_ads":0}
+		self.concs = np.array([concDict[x] for x in self.network.speciesNames])
+		varIndices = [self.network.speciesIndices[x] for x in ["free","A_ads"]]
+		self.solver = steadyHelp.SteadyStateSolver(self.network, varIndices)
+		self.testObjA = tCode.SteadyStateContinuation(self.solver, self._getRateConsts)
+
+	def _getRateConsts(self, potential):
+		return self.network.getRateConstants(self.temperature, potential=potential)
+
+	def _getExpCoverages(self):
+		outVals = list()
+		for potential in self.params:
+			kAds, kDes = self._getRateConsts(potential)
+			outVals.append( 0.1*kAds / (0.1*kAds + kDes) )
+		return np.array(outVals)
+
+	def testMatchesAnalyticCoverages(self):
+		expCoverages = self._getExpCoverages()
+		outConcs, info = self.testObjA.solveAtParams(self.concs, self.params)
+		actCoverages = outConcs[:, self.network.speciesIndices["A_ads"]]
+		self.assertTrue( np.all(info["converged"]) )
+		self.assertTrue( np.allclose(expCoverages, actCoverages, rtol=1e-6) )
+
+	def testFewerNewtonIterationsThanIndependentSolves(self):
+		nIndependent = sum( [self.solver.solve(self.concs, self._getRateConsts(x))[1]["nIter"] for x in self.params] )
+		outConcs, info = self.testObjA.solveAtParams(self.concs, self.params)
+		self.assertLess(info["nNewtonIter"], nIndependent)
+
+	def testLargeJumpSubdivided(self):
+		self.params = [-0.4, 0.4]
+		outConcs, info = self.testObjA.solveAtParams(self.concs, self.params)
+		self.assertTrue( np.all(info["converged"]) )
+		self.assertTrue( np.allclose(self._getExpCoverages(), outConcs[:, self.network.speciesIndices["A_ads"]], rtol=1e-6) )
+
+	def testSingularJacobianEndsSweep(self):
+		with mock.patch.object(self.solver, "getResidualJacobian", return_value=np.zeros((2,2))):
+			outConcs, info = self.testObjA.solveAtParams(self.concs, self.params)
+		self.assertEqual( [True] + [False]*(len(self.params)-1), list(info["converged"]) )
+		self.assertTrue( np.all(np.isnan(outConcs[1:])) )
+
+
+class TestTraceBranchAroundFolds(unittest.TestCase):
+	""" Schlogl model. Rates are k1[X]^2 - k2[X]^3 - k3[X] + p, so steady states satisfy p = k2X^3 - k1X^2 + k3X; an S-shaped curve with folds near p=0.636 and p=0.364 """
+
+	def setUp(self):
+		self.startParam, self.endParam = 0.2, 0.8
+		self.rateConsts = [3, 1, 2.5]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		autocatalysis = coreHelp.BetterReactionTemplate(["A","X","X"], ["X","X","X"], 0, 1)
+		reverseCatalysis = coreHelp.BetterReactionTemplate(["X","X","X"], ["A","X","X"], 0, 1)
+		decay = coreHelp.BetterReactionTemplate(["X"], ["B"], 0, 1)
+		feed = coreHelp.BetterReactionTemplate(["B"], ["X"], 0, 1)
+		self.network = compiledHelp.CompiledReactionNetwork([autocatalysis, reverseCatalysis, decay, feed])
+		self.concs = np.ones(self.network.nSpecies)
+		self.xIdx = self.network.speciesIndices["X"]
+		self.concs[self.xIdx] = 0.1
+		self.solver = steadyHelp.SteadyStateSolver(self.network, [self.xIdx])
+		self.testObjA = tCode.SteadyStateContinuation(self.solver, lambda param: np.array(self.rateConsts + [param], dtype=float), maxStep=0.05)
+
+	def _runTestFunct(self):
+		return self.testObjA.traceBranch(self.concs, self.startParam, self.endParam)
+
+	def testAllPointsAreSteadyStates(self):
+		params, outConcs, info = self._runTestFunct()
+		kOne, kTwo, kThree = self.rateConsts
+		xVals = outConcs[:,self.xIdx]
+		expParams = kTwo*xVals**3 - kOne*xVals**2 + kThree*xVals
+		self.assertTrue( np.allclose(expParams, params, atol=1e-7) )
+
+	def testFollowsBothFolds(self):
+		params, outConcs, info = self._runTestFunct()
+		self.assertTrue(info["reachedEnd"])
+		self.assertGreater(np.max(params[:-1]), 0.6)
+		paramSteps = np.diff(params)
+		self.assertTrue( np.any(paramSteps < 0) )
+		self.assertGreater(outConcs[-1,self.xIdx], 1.5) #Upper branch
+
+	def testSingularJacobianStopsBranch(self):
+		with mock.patch.object(self.solver, "getResidualJacobian", return_value=np.zeros((1,1))):
+			params, outConcs, info = self._runTestFunct()
+		self.assertEqual([self.startParam], list(params))
+		self.assertFalse(info["reachedEnd"])
+
+	def testSingularTangentStopsBranch(self):
+		with mock.patch.object(tCode.SteadyStateContinuation, "_getArclengthTangent", return_value=None):
+			params, outConcs, info = self._runTestFunct()
+		self.assertEqual(2, len(params))
+		self.assertFalse(info["reachedEnd"])
@@ -0,0 +1,76 @@
+
+import unittest
+
+import numpy as np
+import scipy.linalg as linAlgHelp
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.compiled_network as compiledHelp
+import simple_reactions_lib.core.ensemble as tCode
+
+
+class TestEnsembleRatesFunction(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.potentials = [-0.2, 0.0, 0.3]
+		self.varNames = ["A","C","D"]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B","B"], ["C"], 0.4, 20, nElecTransfer=-1)
+		reactionB = coreHelp.BetterReactionTemplate(["C","D"], ["A","A"], 0.5, 30, nElecTransfer=2)
+		reactionC = coreHelp.BetterReactionTemplate(["D"], ["B"], 0.45, 30)
+		self.network = compiledHelp.CompiledReactionNetwork([reactionA, reactionB, reactionC])
+		self.varIndices = [self.network.speciesIndices[x] for x in self.varNames]
+		self.rateConsts = np.array([self.network.getRateConstants(self.temperature, potential=x) for x in self.potentials])
+		self.concs = np.array([ [0.3, 0.6, 0.2, 0.5], [0.1, 0.2, 0.3, 0.4], [0.9, 0.1, 0.4, 0.2] ])
+		self.testObjA = tCode.EnsembleRatesFunction(self.network, self.varIndices, self.rateConsts, self.concs)
+		self.state = self.testObjA.getStateFromConcs(self.concs)
+
+	def testRatesMatchEachMember(self):
+		expRates = [self.network.getRatesOfChange(concs, rateConsts)[self.varIndices] for concs,rateConsts in zip(self.concs, self.rateConsts)]
+		actRates = self.testObjA(0, self.state)
+		self.assertTrue( np.allclose(np.concatenate(expRates), actRates) )
+
+	def testJacobianIsBlockDiagonalOfMemberJacobians(self):
+		expBlocks = list()
+		for concs, rateConsts in zip(self.concs, self.rateConsts):
+			jacCalculator = compiledHelp.JacobianCalculator(self.network, self.varIndices, sparse=False)
+			expBlocks.append( jacCalculator.getJacobianFromWorkBuffer(self.network.createWorkBuffer(concs), rateConsts) )
+		expJacobian = linAlgHelp.block_diag(*expBlocks)
+		actJacobian = self.testObjA.jacobian(0, self.state).toarray()
+		self.assertTrue( np.allclose(expJacobian, actJacobian) )
+
+	def testStateRoundTrip(self):
+		actConcs = self.testObjA.getConcsFromState(self.state)
+		self.assertTrue( np.allclose(self.concs, actConcs) )
+
+
+class TestEnsembleIntegrator(unittest.TestCase):
+	""" A+B <-> C with [B] fixed; each member has a different potential so a different equilibrium """
+
+	def setUp(self):
+		self.temperature = 300
+		self.potentials = np.linspace(-0.1, 0.1, 5)
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.7, 1e13, nElecTransfer=-1)
+		reactionB = coreHelp.BetterReactionTemplate(["C"], ["A","B"], 0.75, 1e13, nElecTransfer=1)
+		self.network = compiledHelp.CompiledReactionNetwork([reactionA, reactionB])
+		varIndices = [self.network.speciesIndices[x] for x in ["A","C"]]
+		concDict = {"A":1, "B":0.5, "C":0}
+		self.concs = np.array([concDict[x] for x in self.network.speciesNames])
+		self.rateConsts = np.array([self.network.getRateConstants(self.temperature, potential=x) for x in self.potentials])
+		self.testObjA = tCode.EnsembleIntegrator(self.network, varIndices, solverOptions={"rtol":1e-8, "atol":1e-12})
+
+	def testReachesEachMembersEquilibrium(self):
+		outConcs = self.testObjA.integrate(self.concs, self.rateConsts, 1e3)
+		idxA, idxB, idxC = [self.network.speciesIndices[x] for x in ["A","B","C"]]
+		for rateConsts, concs in zip(self.rateConsts, outConcs):
+			expRatio = 0.5*rateConsts[0]/rateConsts[1]
+			self.assertAlmostEqual(expRatio, concs[idxC]/concs[idxA], places=4)
+			self.assertAlmostEqual(1, concs[idxA]+concs[idxC])
+			self.assertEqual(0.5, concs[idxB])
+
@@ -0,0 +1,215 @@
+
+import copy
+import math
+import unittest
+import unittest.mock as mock
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.fixed_step as tCode
+
+
+class TestEngineMatchesLegacyController(unittest.TestCase):
+
+	def setUp(self):
+		self.timeStep = 1e-3
+		self.nSteps = 50
+		self.potential = 0.1
+		self.useSpeciesState = False
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		forward = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.6, 1e11, nElecTransfer=1)
+		backward = coreHelp.BetterReactionTemplate(["C"], ["A","B"], 0.65, 1e11, nElecTransfer=-1)
+		self.reactions = [coreHelp.NetReactionTemplate(forward, backward),
+		                  coreHelp.BetterReactionTemplate(["C","X"], ["D"], 0.6, 1e11)] #X is not in startReactants so is ignored
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C","D","E"], [1,0.5,0.1,0,2])]
+		self.constantConcReactants = [coreHelp.ChemSpeciesStd("B",0.4), coreHelp.ChemSpeciesStd("E",3)]
+		if self.useSpeciesState:
+			self.startReactants = coreHelp.SpeciesState.fromSpecies(self.startReactants)
+
+	def _getController(self, useCompiledEngine):
+		args = [copy.deepcopy(self.startReactants), self.reactions, self.timeStep]
+		kwargs = {"potential":self.potential, "constantConcReactants":self.constantConcReactants, "useCompiledEngine":useCompiledEngine}
+		return coreHelp.ReactionControllerStandard(*args, **kwargs)
+
+	def _runTestFunct(self, useCompiledEngine):
+		controller = self._getController(useCompiledEngine)
+		controller.doNextNSteps(self.nSteps)
+		return controller
+
+	def _checkMatchesLegacy(self):
+		expController, actController = self._runTestFunct(False), self._runTestFunct(True)
+		self.assertEqual(expController.step, actController.step)
+		for exp,act in zip(expController.currentReactants, actController.currentReactants):
+			self.assertEqual(exp.name, act.name)
+			self.assertAlmostEqual(exp.conc, act.conc, places=12)
+
+	def testMatchesLegacy_speciesList(self):
+		self._checkMatchesLegacy()
+
+	def testMatchesLegacy_speciesState(self):
+		self.useSpeciesState = True
+		self.createTestObjs()
+		self._checkMatchesLegacy()
+
+	def testReservoirConcChangeBetweenRunsMatchesLegacy(self):
+		expController, actController = self._getController(False), self._getController(True)
+		for controller in [expController, actController]:
+			controller.doNextNSteps(self.nSteps)
+			controller.constantConcReactants = [coreHelp.ChemSpeciesStd("B",0.2), coreHelp.ChemSpeciesStd("E",3)]
+			controller.doNextNSteps(self.nSteps)
+		for exp,act in zip(expController.currentReactants, actController.currentReactants):
+			self.assertAlmostEqual(exp.conc, act.conc, places=12)
+		self.assertEqual(0.2, [x.conc for x in actController.currentReactants if x.name=="B"][0])
+
+	def testReservoirSpeciesClamped(self):
+		actController = self._runTestFunct(True)
+		concDict = {x.name:x.conc for x in actController.currentReactants}
+		self.assertEqual(0.4, concDict["B"])
+		self.assertEqual(3, concDict["E"])
+
+	def testReactantsOnlySyncedWhenObserved(self):
+		controller = self._getController(True)
+		reactantA = controller.currentReactants[0]
+		observedConcs = list()
+		controller.observers.add(lambda x: observedConcs.append(reactantA.conc), stride=10)
+		with mock.patch.object(tCode.FixedStepEngine, "syncToReactants", wraps=controller._getEngine().syncToReactants) as mockSync:
+			controller.doNextNSteps(self.nSteps)
+		self.assertEqual(5, mockSync.call_count)
+		self.assertEqual(5, len(set(observedConcs)))
+
+	def testExternalConcChangesPickedUp(self):
+		controller = self._getController(True)
+		controller.doNextNSteps(1)
+		controller.currentReactants[3].conc = 5
+		controller.doNextNSteps(1)
+		self.assertGreater(controller.currentReactants[3].conc, 5)
+
+	def testRecompiledWhenReactionsChange(self):
+		controller = self._runTestFunct(True)
+		startEngine = controller._engine
+		controller.reactions = self.reactions[:1]
+		controller.doNextNSteps(1)
+		self.assertFalse(startEngine is controller._engine)
+
+	def testLegacyPathUsedForOtherReactionTypes(self):
+		reaction = mock.Mock()
+		reaction.getChangesInReactants.side_effect = lambda *args, **kwargs: {"A":0.1}
+		controller = coreHelp.ReactionControllerStandard(copy.deepcopy(self.startReactants), [reaction], self.timeStep)
+		controller.doNextNSteps(2)
+		self.assertAlmostEqual(1.2, controller.currentReactants[0].conc)
+		self.assertTrue(controller._engine is None)
+
+
+class _ConcDependentTafelReaction(coreHelp.ChemReactionTemplate):
+	""" Tafel factor is [tafelSpecies]; stands in for a Nernst shift depending on a concentration """
+
+	def __init__(self, reactants, products, barrier, prefactor, tafelSpecies):
+		super().__init__(reactants, products, barrier, prefactor)
+		self.tafelSpecies = tafelSpecies
+
+	def _getTafelFactor(self, inputReactants, temperature, pH, potential):
+		return [x.conc for x in inputReactants if x.name==self.tafelSpecies][0]
+
+
+class TestEngineFallbacks(unittest.TestCase):
+
+	def setUp(self):
+		self.timeStep = 1e-2
+		self.nSteps = 20
+		self.tafelSpecies = "B"
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.reactions = [_ConcDependentTafelReaction(["A"], ["B"], 0, 2, self.tafelSpecies), coreHelp.BetterReactionTemplate(["B"], ["A"], 0, 1)]
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","X"], [1,0.2,0.5])]
+
+	def _getController(self, useCompiledEngine=True, **kwargs):
+		return coreHelp.ReactionControllerStandard(copy.deepcopy(self.startReactants), self.reactions, self.timeStep, useCompiledEngine=useCompiledEngine, **kwargs)
+
+	def _checkMatchesLegacy(self, **kwargs):
+		expController, actController = self._getController(useCompiledEngine=False, **kwargs), self._getController(**kwargs)
+		for controller in [expController, actController]:
+			controller.doNextNSteps(self.nSteps)
+		for exp,act in zip(expController.currentReactants, actController.currentReactants):
+			self.assertAlmostEqual(exp.conc, act.conc, places=12)
+		return actController
+
+	def testConcDependentRateConstantsUseLegacyPath(self):
+		actController = self._checkMatchesLegacy()
+		self.assertTrue(actController._getEngine() is None)
+
+	def testSpectatorDependentRateConstantsUseEngine(self):
+		self.tafelSpecies = "X"
+		self.createTestObjs()
+		actController = self._checkMatchesLegacy()
+		self.assertTrue(actController._getEngine() is actController._engine)
+
+	def testCallbackUsesLegacyPath(self):
+		self.tafelSpecies = "X"
+		self.createTestObjs()
+		with mock.patch.object(tCode.FixedStepEngine, "run") as mockRun:
+			self._checkMatchesLegacy(callbackFunct=lambda x: None)
+		mockRun.assert_not_called()
+
+	def testImplicitModeRecalculatesConcDependentRateConstants(self):
+		controller = self._getController(stepMode="backwardEuler")
+		engine = controller._getEngine()
+		self.assertTrue( controller._hasConcDependentRateConstants(engine) )
+		with mock.patch.object(engine.network, "getRateConstants", wraps=engine.network.getRateConstants) as mockGetRateConsts:
+			controller.doNextNSteps(self.nSteps)
+		self.assertEqual(self.nSteps, mockGetRateConsts.call_count)
+
+
+class TestImplicitStepModes(unittest.TestCase):
+	""" A <-> B (k_f=1, k_b=2) has [A](t) = [A]_eq + ([A]_0-[A]_eq)*exp(-3t) """
+
+	def setUp(self):
+		self.endTime = 1
+		self.stepModes = ["backwardEuler", "trbdf2"]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.reactions = [coreHelp.BetterReactionTemplate(["A"], ["B"], 0, 1), coreHelp.BetterReactionTemplate(["B"], ["A"], 0, 2)]
+		self.startReactants = [coreHelp.ChemSpeciesStd("A",1), coreHelp.ChemSpeciesStd("B",0)]
+
+	def _getError(self, stepMode, nSteps):
+		controller = coreHelp.ReactionControllerStandard(copy.deepcopy(self.startReactants), self.reactions, self.endTime/nSteps, stepMode=stepMode)
+		controller.doNextNSteps(nSteps)
+		expConcA = (2/3) + (1/3)*math.exp(-3*self.endTime)
+		return abs(controller.currentReactants[0].conc - expConcA)
+
+	def testOrderOfAccuracy(self):
+		expOrders = [1,2]
+		for stepMode, expOrder in zip(self.stepModes, expOrders):
+			errorRatio = self._getError(stepMode, 20) / self._getError(stepMode, 40)
+			self.assertAlmostEqual(2**expOrder, errorRatio, delta=0.3*(2**expOrder))
+
+	def testStableForVeryLargeSteps(self):
+		for stepMode in self.stepModes:
+			controller = coreHelp.ReactionControllerStandard(copy.deepcopy(self.startReactants), self.reactions, 1e6, stepMode=stepMode)
+			controller.doNextNSteps(3)
+			concA, concB = [x.conc for x in controller.currentReactants]
+			self.assertAlmostEqual(2/3, concA)
+			self.assertAlmostEqual(1/3, concB)
+
+	def testClampedSpeciesHeldFixed(self):
+		self.reactions = [coreHelp.BetterReactionTemplate(["A","C"], ["B"], 0, 1), coreHelp.BetterReactionTemplate(["B"], ["A","C"], 0, 2)]
+		self.startReactants.append( coreHelp.ChemSpeciesStd("C",0.5) )
+		for stepMode in self.stepModes:
+			controller = coreHelp.ReactionControllerStandard(copy.deepcopy(self.startReactants), self.reactions, 1e3, stepMode=stepMode, constantConcReactants=[self.startReactants[-1]])
+			controller.doNextNSteps(5)
+			concA, concB, concC = [x.conc for x in controller.currentReactants]
+			self.assertEqual(0.5, concC)
+			self.assertAlmostEqual(0.25, concB/concA)
+
+	def testInvalidStepModeRaises(self):
+		controller = coreHelp.ReactionControllerStandard(copy.deepcopy(self.startReactants), self.reactions, 1, stepMode="fake")
+		with self.assertRaises(ValueError):
+			controller.doNextNSteps(1)
+
+	def testImplicitModeNeedsCompiledEngine(self):
+		controller = coreHelp.ReactionControllerStandard(copy.deepcopy(self.startReactants), self.reactions, 1, stepMode="trbdf2", useCompiledEngine=False)
+		with self.assertRaises(ValueError):
+			controller.doNextNSteps(1)
+
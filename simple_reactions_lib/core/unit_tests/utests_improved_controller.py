@@ -4,7 +4,10 @@ import itertools as it
 import unittest
 import unittest.mock as mock
 
+import numpy as np
+
 import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.waveforms as waveHelp
 import simple_reactions_lib.core.improved_controller as tCode
 
 
@@ -45,6 +48,16 @@ class TestReactionControllerImproved(unittest.TestCase):
 		actReactants = self.testObjA.currentReactants
 		self.assertEqual(expReactants, actReactants)
 
+	def testMoveForwardSplitsAtPotentialJumps(self):
+		self.testObjA.potential = waveHelp.StepWaveform(0.1, [2, 5], [0.2, 0.3])
+		self.testObjA.moveForwardByT(3)
+		self.testObjA.moveForwardByT(4)
+		actSteps = [x[0][1] for x in self.propagator.propagate.call_args_list]
+		actPots = [x[1]["potential"].getPotential(0) for x in self.propagator.propagate.call_args_list]
+		self.assertTrue( np.allclose([2,1,2,2], actSteps) )
+		self.assertTrue( np.allclose([0.1,0.2,0.2,0.3], actPots) )
+		self.assertAlmostEqual(0.3, self.testObjA.getCurrentPotential())
+
 
 class TestPropagatorTemplate(unittest.TestCase):
 
@@ -119,6 +132,76 @@ class TestPropagatorTemplate(unittest.TestCase):
 		self.assertEqual(expOutReactants, self.inputReactants) #self.inputReactants SHOULD have been updated with new concs
 	
 
+	@mock.patch("simple_reactions_lib.core.improved_controller.ConcsPropagatorTemplate._propagateVectorisedFunctionToNextTimeStep")
+	def testPropagate_speciesState(self, mockPropagateToNextTimeStep):
+		newMgConc, newOConc = self.mgStartConc+10, self.oStartConc+12
+		mockPropagateToNextTimeStep.side_effect = lambda *args,**kwargs: [newMgConc,newOConc]
+		inpState = coreHelp.SpeciesState.fromSpecies(self.inputReactants)
+		expConcs = [newMgConc, self.hStartConc, newOConc]
+
+		self.testObjA.propagate( inpState, self.step, temperature=self.temp, potential=self.potential)
+
+		self.assertEqual(expConcs, inpState.concs.tolist())
+
+
+class TestCompiledRatesFunction(unittest.TestCase):
+
+	def setUp(self):
+		self.temp = 300
+		self.potential = -0.2
+		self.variableConcSpecies = ["A","C"]
+		self.startConcs = [0.2, 0.5, 0.3]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.4, 20, nElecTransfer=-1)
+		reactionB = coreHelp.BetterReactionTemplate(["C","C"], ["A","B"], 0.5, 30, nElecTransfer=2)
+		self.reactions = [reactionA, reactionB]
+		self.inputReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C"], self.startConcs)]
+		self.rateCalculator = tCode.CompiledRateCalculator(self.reactions)
+		self.testObjA = tCode.ConcsPropagatorTemplate(self.rateCalculator, self.variableConcSpecies)
+
+	def _getExpRates(self, concA, concC):
+		inpReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C"], [concA, self.startConcs[1], concC])]
+		rateDict = tCode.RateCalculatorStandard(self.reactions).getRates(inpReactants, temperature=self.temp, potential=self.potential)
+		return [rateDict["A"], rateDict["C"]]
+
+	def testCompiledFunctionUsedForCompiledCalculator(self):
+		funct = self.testObjA.getFunctToPropagate(self.inputReactants, self.temp, self.potential)
+		self.assertTrue( isinstance(funct, tCode.CompiledRatesFunction) )
+
+	@mock.patch("simple_reactions_lib.core.improved_controller.copy.deepcopy")
+	def testMatchesStandardRatesWithoutCopying(self, mockDeepCopy):
+		funct = self.testObjA.getFunctToPropagate(self.inputReactants, self.temp, self.potential)
+		for concA, concC in [[0.2,0.3], [0.6,0.1]]:
+			expVals = self._getExpRates(concA, concC)
+			actVals = funct(0, np.array([concA,concC]))
+			for exp,act in it.zip_longest(expVals, actVals):
+				self.assertAlmostEqual(exp,act)
+		mockDeepCopy.assert_not_called()
+
+	def testReturnedArraysIndependent(self):
+		""" Integrators hold onto returned derivatives, so each call needs its own output array """
+		funct = self.testObjA.getFunctToPropagate(self.inputReactants, self.temp, self.potential)
+		outA = funct(0, np.array([0.2,0.3]))
+		expA = outA.copy()
+		funct(0, np.array([0.6,0.1]))
+		self.assertEqual(expA.tolist(), outA.tolist())
+
+	def testFoldedReservoirsMatchUnfolded(self):
+		unfoldedCalculator = tCode.CompiledRateCalculator(self.reactions, foldReservoirSpecies=False)
+		unfoldedObj = tCode.ConcsPropagatorTemplate(unfoldedCalculator, self.variableConcSpecies)
+		for concB in [0.5, 2.0]:
+			self.startConcs[1] = concB
+			self.createTestObjs()
+			folded = self.testObjA.getFunctToPropagate(self.inputReactants, self.temp, self.potential)
+			unfolded = unfoldedObj.getFunctToPropagate(self.inputReactants, self.temp, self.potential)
+			self.assertEqual(2, folded.network.nSpecies)
+			for concs in [np.array([0.2,0.3]), np.array([0.6,0.1])]:
+				self.assertTrue( np.allclose(unfolded(0,concs), folded(0,concs), rtol=1e-12, atol=0) )
+				self.assertTrue( np.allclose(unfolded.jacobian(0,concs), folded.jacobian(0,concs), rtol=1e-12, atol=0) )
+				self.assertTrue( np.allclose(self._getExpRates(*concs), folded(0,concs)) )
+
 
 class TestPropagatorStandard(unittest.TestCase):
 
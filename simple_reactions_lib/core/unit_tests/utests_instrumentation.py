@@ -0,0 +1,220 @@
+
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.integrate as integrateHelp
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.propagators as propHelp
+import simple_reactions_lib.core.instrumentation as tCode
+
+
+class TestInstrumentedSolvers(unittest.TestCase):
+
+	def setUp(self):
+		self.method = "Radau"
+		self.tSpan = [0, 10]
+		self.y0 = [1.0, 0.0, 0.0]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		#Robertson problem; stiff enough that implicit solvers factorise repeatedly
+		def _rates(time, y):
+			return np.array([-0.04*y[0] + 1e4*y[1]*y[2], 0.04*y[0] - 1e4*y[1]*y[2] - 3e7*y[1]**2, 3e7*y[1]**2])
+		self.rates = _rates
+
+	def _runTestFunct(self):
+		solverStats = tCode.SolverStats()
+		solverClass = tCode.getInstrumentedSolverClass(self.method)
+		outObj = integrateHelp.solve_ivp(self.rates, self.tSpan, self.y0, method=solverClass, solverStats=solverStats)
+		return outObj, solverStats
+
+	def _checkCountsMatchSolveIVP(self):
+		expObj = integrateHelp.solve_ivp(self.rates, self.tSpan, self.y0, method=self.method)
+		actObj, solverStats = self._runTestFunct()
+		self.assertEqual( [expObj.nfev, expObj.njev, expObj.nlu], [solverStats.nfev, solverStats.njev, solverStats.nlu] )
+		self.assertTrue( np.allclose(expObj.y[:,-1], actObj.y[:,-1]) )
+		return solverStats
+
+	def testCountsMatchSolveIVP_Radau(self):
+		solverStats = self._checkCountsMatchSolveIVP()
+		self.assertEqual( len(integrateHelp.solve_ivp(self.rates, self.tSpan, self.y0, method="Radau").t)-1, solverStats.nAcceptedSteps )
+		self.assertGreater(solverStats.rhsWallTime, 0)
+
+	def testCountsMatchSolveIVP_BDF(self):
+		self.method = "BDF"
+		self._checkCountsMatchSolveIVP()
+
+	def testRejectionsNotCountedForLSODA(self):
+		self.method = "LSODA"
+		solverStats = self._checkCountsMatchSolveIVP()
+		self.assertIsNone(solverStats.nRejectedSteps)
+		self.assertTrue( all([isinstance(x, int) for x in [solverStats.nfev, solverStats.njev, solverStats.nlu]]) )
+
+	def testRejectionsCounted(self):
+		""" A first step far too large for an explicit method must be cut back, so at least one accepted step follows a rejection """
+		solverStats = tCode.SolverStats()
+		solverClass = tCode.getInstrumentedSolverClass("DOP853")
+		integrateHelp.solve_ivp(lambda time,y: -50*y, [0,1], [1.0], method=solverClass, solverStats=solverStats, first_step=0.2)
+		self.assertGreater(solverStats.nRejectedSteps, 0)
+
+	def testCountsAddToThoseAlreadyInSolverStats(self):
+		""" A solver replacing another part way through an integration (given the same solverStats) carries the counts on """
+		expObj = integrateHelp.solve_ivp(self.rates, self.tSpan, self.y0, method=self.method)
+		startStats = tCode.SolverStats(nfev=7, njev=3, nlu=5)
+		solverClass = tCode.getInstrumentedSolverClass(self.method)
+		integrateHelp.solve_ivp(self.rates, self.tSpan, self.y0, method=solverClass, solverStats=startStats)
+		self.assertEqual( [expObj.nfev+7, expObj.njev+3, expObj.nlu+5], [startStats.nfev, startStats.njev, startStats.nlu] )
+
+	def testSolverClassCached(self):
+		self.assertIs( tCode.getInstrumentedSolverClass("Radau"), tCode.getInstrumentedSolverClass(integrateHelp.Radau) )
+
+
+class TestInstrumentedPropagators(unittest.TestCase):
+
+	def setUp(self):
+		self.timeStep = 0.5
+		self.temperature = 300
+		self.potential = 0.05
+		self.variableConcSpecies = ["A","C"]
+		self.solverOptions = {"rtol":1e-8, "atol":1e-12}
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.7, 1e13, nElecTransfer=1)
+		reactionB = coreHelp.BetterReactionTemplate(["C"], ["A","B"], 0.75, 1e13)
+		self.reactions = [reactionA, reactionB]
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C"], [1,0.5,0])]
+		self.rateCalculator = contrHelp.CompiledRateCalculator(self.reactions)
+		self.testObj = propHelp.ConcsPropagator_Radau(self.rateCalculator, self.variableConcSpecies, solverOptions=self.solverOptions)
+		self.instrumentation = tCode.Instrumentation()
+
+	def _runTestFunct(self, nCalls=1):
+		currReactants = [coreHelp.ChemSpeciesStd(x.name, x.conc) for x in self.startReactants]
+		for unused in range(nCalls):
+			self.testObj.propagate(currReactants, self.timeStep, temperature=self.temperature, potential=self.potential)
+		return currReactants
+
+	def testNothingRecordedByDefault(self):
+		self.assertIsNone(self.testObj.instrumentation)
+		self._runTestFunct()
+		self.assertEqual(list(), self.instrumentation.solverCalls)
+
+	def testEnableAttachesToRateCalculator(self):
+		tCode.enableInstrumentation(self.testObj, self.instrumentation)
+		self.assertIs(self.instrumentation, self.testObj.instrumentation)
+		self.assertIs(self.instrumentation, self.rateCalculator.instrumentation)
+		tCode.disableInstrumentation(self.testObj)
+		self.assertIsNone(self.testObj.instrumentation)
+		self.assertIsNone(self.rateCalculator.instrumentation)
+
+	def testResultsUnchanged(self):
+		expReactants = self._runTestFunct()
+		tCode.enableInstrumentation(self.testObj, self.instrumentation)
+		actReactants = self._runTestFunct()
+		for exp, act in zip(expReactants, actReactants):
+			self.assertAlmostEqual(exp.conc, act.conc, places=12)
+
+	def testOneCallRecordedPerPropagation(self):
+		tCode.enableInstrumentation(self.testObj, self.instrumentation)
+		self._runTestFunct(nCalls=3)
+		summary = self.instrumentation.getSummary()["solvers"]["ConcsPropagator_Radau"]
+		self.assertEqual(3, summary["nCalls"])
+		self.assertAlmostEqual(3*self.timeStep, summary["timeStep"])
+		self.assertGreater(summary["nfev"], 0)
+		self.assertGreater(summary["nAcceptedSteps"], 0)
+
+	def testPersistentRecordsPerCallCounts(self):
+		self.testObj = propHelp.ConcsPropagator_Persistent(self.rateCalculator, self.variableConcSpecies, method="Radau", solverOptions=self.solverOptions)
+		tCode.enableInstrumentation(self.testObj, self.instrumentation)
+		self._runTestFunct(nCalls=1)
+		expTotal = self.testObj.session.solverStats.nfev
+		currReactants = self._runTestFunct(nCalls=1)
+		self.testObj.propagate(currReactants, self.timeStep, temperature=self.temperature, potential=self.potential)
+		expTotal += self.testObj.session.solverStats.nfev
+		actTotal = sum([x["nfev"] for x in self.instrumentation.solverCalls])
+		self.assertEqual(3, len(self.instrumentation.solverCalls))
+		self.assertEqual(expTotal, actTotal)
+
+	def testStandardRecordsReactionClassTimes(self):
+		rateCalculator = contrHelp.RateCalculatorStandard(self.reactions)
+		concChangesFinder = contrHelp.ConcChangesFinderStandard(rateCalculator, self.variableConcSpecies)
+		self.testObj = contrHelp.ConcsPropagatorStandard(concChangesFinder)
+		self.timeStep = 1e-3
+		tCode.enableInstrumentation(self.testObj, self.instrumentation)
+		self._runTestFunct()
+		summary = self.instrumentation.getSummary()
+		nSteps = summary["solvers"]["ConcsPropagatorStandard"]["nAcceptedSteps"]
+		self.assertGreater(nSteps, 0)
+		self.assertEqual( ["BetterReactionTemplate"], list(summary["reactionClasses"].keys()) )
+		self.assertEqual( 2*nSteps, summary["reactionClasses"]["BetterReactionTemplate"]["nCalls"] )
+
+
+class TestInstrumentationExport(unittest.TestCase):
+
+	def setUp(self):
+		self.maxTraceEvents = 100
+		self.nCalls = 2
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.fakeTime = [0.0]
+		self.testObj = tCode.Instrumentation(maxTraceEvents=self.maxTraceEvents, clock=lambda: self.fakeTime[0])
+		self.solverStats = tCode.SolverStats(nfev=10, njev=2, nlu=3, nAcceptedSteps=5, nRejectedSteps=1)
+
+	def _runTestFunct(self):
+		for unused in range(self.nCalls):
+			startTime = self.testObj.getTime()
+			self.fakeTime[0] += 0.5
+			self.testObj.recordSolverCall("fakeLabel", startTime, self.testObj.getTime(), self.solverStats, method="Radau", timeStep=1.0)
+
+	def testSummaryTotals(self):
+		self._runTestFunct()
+		actSummary = self.testObj.getSummary()["solvers"]["fakeLabel"]
+		self.assertEqual(2, actSummary["nCalls"])
+		self.assertEqual(20, actSummary["nfev"])
+		self.assertEqual(2, actSummary["nRejectedSteps"])
+		self.assertAlmostEqual(1.0, actSummary["wallTime"])
+
+	def testSummaryNoneIfAnyCallCantCountRejections(self):
+		self._runTestFunct()
+		self.solverStats.nRejectedSteps = None
+		self._runTestFunct()
+		self.assertIsNone( self.testObj.getSummary()["solvers"]["fakeLabel"]["nRejectedSteps"] )
+
+	def testChromeTrace(self):
+		self._runTestFunct()
+		outTrace = json.loads( json.dumps(self.testObj.getChromeTrace()) )
+		completeEvents = [x for x in outTrace["traceEvents"] if x["ph"]=="X"]
+		self.assertEqual(2, len(completeEvents))
+		self.assertAlmostEqual(0.5*1e6, completeEvents[1]["ts"])
+		self.assertAlmostEqual(0.5*1e6, completeEvents[1]["dur"])
+		self.assertEqual(10, completeEvents[1]["args"]["nfev"])
+
+	def testWriteChromeTrace(self):
+		self._runTestFunct()
+		with tempfile.TemporaryDirectory() as tempDir:
+			outPath = os.path.join(tempDir, "trace.json")
+			self.testObj.writeChromeTrace(outPath)
+			with open(outPath, "r") as inpFile:
+				self.assertIn("traceEvents", json.load(inpFile))
+
+	def testEventsDroppedBeyondMax(self):
+		self.maxTraceEvents, self.nCalls = 3, 2
+		self.createTestObjs()
+		self._runTestFunct()
+		self.assertEqual(3, len(self.testObj.getChromeTrace()["traceEvents"]))
+		self.assertEqual(1, self.testObj.nDroppedEvents)
+		self.assertEqual(2, self.testObj.getSummary()["solvers"]["fakeLabel"]["nCalls"])
+
+	def testSolverStatsSubtraction(self):
+		otherStats = tCode.SolverStats(nfev=4, njev=1, nlu=1, nAcceptedSteps=2, nRejectedSteps=None)
+		actStats = self.solverStats - otherStats
+		self.assertEqual(6, actStats.nfev)
+		self.assertEqual(3, actStats.nAcceptedSteps)
+		self.assertIsNone(actStats.nRejectedSteps)
+
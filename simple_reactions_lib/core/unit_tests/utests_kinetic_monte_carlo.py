@@ -0,0 +1,203 @@
+
+import unittest
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.compiled_network as compiledHelp
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.propagators as propHelp
+import simple_reactions_lib.core.kinetic_monte_carlo as tCode
+
+
+class TestIndexedPriorityQueue(unittest.TestCase):
+
+	def setUp(self):
+		self.startKeys = [5.0, 2.0, np.inf, 7.0, 1.0, 3.0]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.testObj = tCode.IndexedPriorityQueue(self.startKeys)
+
+	def _checkMinMatchesKeys(self):
+		expIdx = int(np.argmin(self.testObj.keys))
+		actIdx, actKey = self.testObj.getMin()
+		self.assertEqual(self.testObj.keys[expIdx], actKey)
+		self.assertEqual(expIdx, actIdx)
+
+	def testMinOnCreation(self):
+		self._checkMinMatchesKeys()
+
+	def testMinAfterRandomUpdates(self):
+		rng = np.random.default_rng(4)
+		for unused in range(200):
+			idx = int(rng.integers(len(self.startKeys)))
+			newKey = np.inf if rng.random() < 0.1 else float(rng.random())
+			self.testObj.update(idx, newKey)
+			self._checkMinMatchesKeys()
+
+
+class TestStochasticNetwork(unittest.TestCase):
+
+	def setUp(self):
+		self.systemSize = 10
+		self.varNames = ["A","B","C"]
+		self.concs = {"A":1.0, "B":0.5, "C":0.2, "S":0.3}
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","A"], ["B"], 0, 2)
+		reactionB = coreHelp.BetterReactionTemplate(["B","S"], ["C"], 0, 3)
+		reactionC = coreHelp.BetterReactionTemplate(["C"], ["A"], 0, 5)
+		self.network = compiledHelp.CompiledReactionNetwork([reactionA, reactionB, reactionC])
+		self.varIndices = [self.network.speciesIndices[x] for x in self.varNames]
+		self.testObj = tCode.StochasticNetwork(self.network, self.varIndices, self.systemSize)
+		self.allConcs = np.array([self.concs[x] for x in self.network.speciesNames])
+		self.rateConsts = np.array([2.0, 3.0, 5.0])
+
+	def testPropensityConstants(self):
+		""" k/systemSize for the bimolecular channel, k*[S] for B+S (S is a reservoir) and k for the unimolecular one """
+		expVals = [2/self.systemSize, 3*0.3, 5]
+		actVals = self.testObj.getPropensityConstants(self.rateConsts, self.allConcs)
+		self.assertTrue( np.allclose(expVals, actVals) )
+
+	def testPropensitiesUseFallingFactorials(self):
+		propConsts = self.testObj.getPropensityConstants(self.rateConsts, self.allConcs)
+		counts = [1, 4, 2]
+		expVals = [0, propConsts[1]*4, propConsts[2]*2] #Only one A, so 2A cant react
+		actVals = self.testObj.getPropensities(counts, propConsts)
+		self.assertTrue( np.allclose(expVals, actVals) )
+		self.assertTrue( np.allclose(expVals, [self.testObj.getPropensity(x, counts, propConsts) for x in range(3)]) )
+
+	def testPropensitiesForManyCountVectors(self):
+		propConsts = self.testObj.getPropensityConstants(self.rateConsts, self.allConcs)
+		counts = np.array([[10,5,2], [3,0,1]])
+		expVals = [self.testObj.getPropensities(x, propConsts) for x in counts]
+		actVals = self.testObj.getPropensities(counts, propConsts)
+		self.assertTrue( np.allclose(expVals, actVals) )
+
+	def testMatchesMeanFieldRatesForLargeCounts(self):
+		self.systemSize = 1e7
+		self.createTestObjs()
+		propConsts = self.testObj.getPropensityConstants(self.rateConsts, self.allConcs)
+		counts = np.rint(self.allConcs[self.varIndices]*self.systemSize)
+		expVals = self.network.getChannelRates(self.allConcs, self.rateConsts)
+		actVals = self.testObj.getPropensities(counts, propConsts) / self.systemSize
+		self.assertTrue( np.allclose(expVals, actVals, rtol=1e-6) )
+
+	def testDependencyGraph(self):
+		""" 2A->B changes A and B (channels 0 and 1 depend on these), B+S->C changes B and C, C->A changes C and A """
+		expGraph = [(0,1), (1,2), (0,2)]
+		self.assertEqual(expGraph, self.testObj.dependencyGraph)
+
+	def testNonIntegerStoichiometryRaises(self):
+		reaction = coreHelp.BetterReactionTemplate(["A"], ["B"], 0, 1)
+		self.network = compiledHelp.CompiledReactionNetwork([reaction])
+		self.network.stoichMatrix[1,0] = 0.5
+		with self.assertRaises(ValueError):
+			tCode.StochasticNetwork(self.network, [0,1], self.systemSize)
+
+
+class TestStochasticSimulator(unittest.TestCase):
+
+	def setUp(self):
+		self.systemSize = 200
+		self.method = "nextReaction"
+		self.nReplicas = 100
+		self.outputTimes = [0, 0.2, 0.5, 3.0]
+		self.seed = 7
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		#A <-> B with kForward=2, kBackward=1; [A](t) = 1/3 + (2/3)exp(-3t)
+		forwardReaction = coreHelp.BetterReactionTemplate(["A"], ["B"], 0, 2)
+		backwardReaction = coreHelp.BetterReactionTemplate(["B"], ["A"], 0, 1)
+		self.reactions = [coreHelp.NetReactionTemplate(forwardReaction, backwardReaction)]
+		self.startReactants = [coreHelp.ChemSpeciesStd("A",1.0), coreHelp.ChemSpeciesStd("B",0.0)]
+		self.testObj = tCode.StochasticSimulator(self.reactions, ["A","B"], self.systemSize, method=self.method, seed=self.seed)
+
+	def _runTestFunct(self):
+		return self.testObj.simulateReplicas(self.startReactants, self.outputTimes, self.nReplicas)
+
+	def _checkMeanMatchesAnalytic(self):
+		expVals = [1/3 + (2/3)*np.exp(-3*t) for t in self.outputTimes]
+		actVals = self._runTestFunct().getMeanConcs()[:,0]
+		self.assertTrue( np.allclose(expVals, actVals, atol=0.015) )
+
+	def testMeanMatchesAnalytic_nextReaction(self):
+		self._checkMeanMatchesAnalytic()
+
+	def testMeanMatchesAnalytic_tauLeap(self):
+		self.method = "tauLeap"
+		self.createTestObjs()
+		self._checkMeanMatchesAnalytic()
+
+	def testEquilibriumSpreadIsBinomial(self):
+		""" At equilibrium each molecule is A with probability 1/3, so the spread in [A] is sqrt(N*p*(1-p))/N """
+		self.nReplicas, self.outputTimes = 400, [5.0]
+		expVal = np.sqrt(self.systemSize*(1/3)*(2/3)) / self.systemSize
+		actVal = self._runTestFunct().getStdConcs()[-1,0]
+		self.assertAlmostEqual(expVal, actVal, delta=0.2*expVal)
+
+	def testTotalCountConserved(self):
+		for method in tCode.METHODS:
+			self.method = method
+			self.createTestObjs()
+			counts = self._runTestFunct().counts
+			self.assertTrue( np.all(np.sum(counts, axis=2) == self.systemSize) )
+
+	def testSameSeedReproducible(self):
+		for method in tCode.METHODS:
+			self.method = method
+			self.createTestObjs()
+			expCounts = self._runTestFunct().counts
+			self.createTestObjs()
+			actCounts = self._runTestFunct().counts
+			self.assertTrue( np.array_equal(expCounts, actCounts) )
+
+	def testNoEventsWithoutPropensity(self):
+		for method in tCode.METHODS:
+			self.method = method
+			self.createTestObjs()
+			self.startReactants = [coreHelp.ChemSpeciesStd("A",0.0), coreHelp.ChemSpeciesStd("B",0.0)]
+			trajectory = self._runTestFunct()
+			self.assertTrue( np.all(trajectory.counts == 0) )
+			self.assertTrue( np.all(trajectory.nEvents == 0) )
+
+	def testInputReactantsUnchanged(self):
+		self._runTestFunct()
+		self.assertEqual([1.0, 0.0], [x.conc for x in self.startReactants])
+
+	def testUnsortedOutputTimesRaise(self):
+		self.outputTimes = [0.5, 0.2]
+		with self.assertRaises(ValueError):
+			self._runTestFunct()
+
+	def testUnknownMethodRaises(self):
+		self.method = "fake_method"
+		with self.assertRaises(ValueError):
+			self.createTestObjs()
+
+
+class TestKMCPropagator(unittest.TestCase):
+
+	def setUp(self):
+		self.systemSize = 500
+		self.timeStep = 0.1
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0, 4)
+		reactionB = coreHelp.BetterReactionTemplate(["C"], ["A","B"], 0, 1)
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C"], [1,0.5,0])]
+		self.testObj = propHelp.ConcsPropagator_KMC.fromReactions([reactionA, reactionB], ["A","C"], self.systemSize, seed=3)
+		self.controller = contrHelp.ReactionControllerImproved(self.testObj, self.startReactants)
+
+	def testConcsAreMultiplesOfInverseSystemSize(self):
+		self.controller.moveForwardByT(self.timeStep)
+		concs = np.array([x.conc for x in self.controller.currentReactants])
+		self.assertTrue( np.allclose(concs[[0,2]]*self.systemSize, np.rint(concs[[0,2]]*self.systemSize)) )
+		self.assertAlmostEqual(1.0, concs[0]+concs[2])
+		self.assertEqual(0.5, concs[1]) #B is a reservoir species
+		self.assertGreater(concs[2], 0)
+
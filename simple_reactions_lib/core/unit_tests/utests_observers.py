@@ -0,0 +1,151 @@
+
+import math
+import unittest
+import unittest.mock as mock
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.observers as tCode
+
+
+class TestObserverRegistry(unittest.TestCase):
+
+	def setUp(self):
+		self.timeStep = 0.1
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.controller = mock.Mock(time=0.0, step=0)
+		self.testObjA = tCode.ObserverRegistry()
+		self.funct = mock.Mock()
+
+	def _runTestFunct(self, nSteps):
+		""" Steps a fake controller one fixed step at a time, notifying at each; returns the steps at which funct was called """
+		calledSteps = list()
+		self.funct.side_effect = lambda controller: calledSteps.append(controller.step)
+		for step in range(nSteps):
+			self.controller.step, self.controller.time = step, step*self.timeStep
+			self.testObjA.notifyDue(self.controller, step=step)
+		return calledSteps
+
+	def testStrideSchedule(self):
+		self.testObjA.add(self.funct, stride=4)
+		self.assertEqual([0,4,8], self._runTestFunct(10))
+		self.assertEqual(4, self.testObjA.getStepsUntilDue(0, 0.0, self.timeStep))
+		self.assertEqual(1, self.testObjA.getStepsUntilDue(7, 0.7, self.timeStep))
+		self.assertEqual(math.inf, self.testObjA.getTimeUntilDue(0.7))
+
+	def testTimeIntervalSchedule(self):
+		self.testObjA.add(self.funct, timeInterval=0.25)
+		self.assertEqual([0,3,5,8], self._runTestFunct(10))
+		self.assertAlmostEqual(0.1, self.testObjA.getTimeUntilDue(0.9))
+		self.assertEqual(1, self.testObjA.getStepsUntilDue(9, 0.9, self.timeStep))
+
+	def testPredicateCheckedOnlyAtScheduledPoints(self):
+		predicate = mock.Mock(side_effect=lambda controller: controller.step>=4)
+		self.testObjA.add(self.funct, stride=2, predicate=predicate)
+		self.assertEqual([4,6,8], self._runTestFunct(10))
+		self.assertEqual(5, predicate.call_count)
+
+	def testNoObserversNeverDue(self):
+		self.assertEqual(math.inf, self.testObjA.getStepsUntilDue(0, 0.0, self.timeStep))
+		self.assertEqual(math.inf, self.testObjA.getTimeUntilDue(0.0))
+
+
+class TestObserversOnStandardController(unittest.TestCase):
+
+	def setUp(self):
+		self.timeStep = 0.1
+		self.nSteps = 12
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactions = [coreHelp.BetterReactionTemplate(["A"], ["B"], 0.7, 1e11)]
+		startReactants = [coreHelp.ChemSpeciesStd("A",1), coreHelp.ChemSpeciesStd("B",0)]
+		self.testObjA = coreHelp.ReactionControllerStandard(startReactants, reactions, self.timeStep)
+		self.observedSteps = list()
+
+	def _recordStep(self, controller):
+		self.observedSteps.append(controller.step)
+
+	def testStrideObserver(self):
+		self.testObjA.observers.add(self._recordStep, stride=5)
+		self.testObjA.doNextNSteps(self.nSteps)
+		self.assertEqual([0,5,10], self.observedSteps)
+
+	def testStrideContinuesAcrossCalls(self):
+		self.testObjA.observers.add(self._recordStep, stride=5)
+		for idx in range(self.nSteps):
+			self.testObjA.doNextNSteps(1)
+		self.assertEqual([0,5,10], self.observedSteps)
+
+	def testTimeIntervalObserver(self):
+		self.testObjA.observers.add(self._recordStep, timeInterval=0.35)
+		self.testObjA.doNextNSteps(self.nSteps)
+		self.assertEqual([0,4,7,11], self.observedSteps)
+
+	def testPredicateOnlyCalledAtScheduledPoints(self):
+		predicate = mock.Mock(side_effect=lambda controller: controller.step>=5)
+		self.testObjA.observers.add(self._recordStep, stride=2, predicate=predicate)
+		self.testObjA.doNextNSteps(self.nSteps)
+		self.assertEqual(6, predicate.call_count)
+		self.assertEqual([6,8,10], self.observedSteps)
+
+	def testStepsRunUninterruptedBetweenObservations(self):
+		self.testObjA.observers.add(self._recordStep, stride=5)
+		with mock.patch.object(self.testObjA, "_doUninterruptedSteps", wraps=self.testObjA._doUninterruptedSteps) as mockSteps:
+			self.testObjA.doNextNSteps(self.nSteps)
+		self.assertEqual([5,5,2], [x[0][0] for x in mockSteps.call_args_list])
+
+	def testRemovedObserverNotCalled(self):
+		observer = self.testObjA.observers.add(self._recordStep, stride=5)
+		self.testObjA.observers.remove(observer)
+		self.testObjA.doNextNSteps(self.nSteps)
+		self.assertEqual(list(), self.observedSteps)
+
+	def testResetRestartsTimeSchedule(self):
+		self.testObjA.observers.add(self._recordStep, timeInterval=0.35)
+		self.testObjA.doNextNSteps(2)
+		self.testObjA.reset()
+		self.testObjA.doNextNSteps(2)
+		self.assertEqual([0,0], self.observedSteps)
+		self.assertEqual(0.2, self.testObjA.time)
+
+	def testInvalidSchedulesRaise(self):
+		with self.assertRaises(ValueError):
+			self.testObjA.observers.add(self._recordStep, stride=2, timeInterval=0.1)
+		with self.assertRaises(ValueError):
+			self.testObjA.observers.add(self._recordStep, stride=0)
+
+
+class TestObserversOnImprovedController(unittest.TestCase):
+
+	def setUp(self):
+		self.timeInterval = 0.25
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.propagator = mock.Mock()
+		self.testObjA = contrHelp.ReactionControllerImproved(self.propagator, [coreHelp.ChemSpeciesStd("A",1)])
+		self.observedTimes = list()
+
+	def _recordTime(self, controller):
+		self.observedTimes.append(controller.time)
+
+	def testPropagationSplitAtObservationTimes(self):
+		self.testObjA.observers.add(self._recordTime, timeInterval=self.timeInterval)
+		self.testObjA.moveForwardByT(0.6)
+		self.assertEqual([0,0.25,0.5], self.observedTimes)
+		actSteps = [x[0][1] for x in self.propagator.propagate.call_args_list]
+		for exp,act in zip([0.25,0.25,0.1], actSteps):
+			self.assertAlmostEqual(exp, act)
+		self.assertAlmostEqual(0.6, self.testObjA.time)
+
+	def testOnePropagateCallWithoutObservers(self):
+		self.testObjA.moveForwardByT(0.6)
+		self.assertEqual(1, self.propagator.propagate.call_count)
+
+	def testStrideNotAllowed(self):
+		with self.assertRaises(ValueError):
+			self.testObjA.observers.add(self._recordTime, stride=2)
+
@@ -0,0 +1,123 @@
+
+import math
+import unittest
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.core_units as unitHelp
+import simple_reactions_lib.core.compiled_network as compiledHelp
+import simple_reactions_lib.core.polarisation as tCode
+
+
+class _QuadraticTafelReaction(coreHelp.ChemReactionTemplate):
+	""" Rate constant isnt linear in potential (in log space), so cant be extrapolated """
+
+	def __init__(self, reactants, products):
+		self.reactants = reactants
+		self.products = products
+		self.barrier = 0.6
+		self.prefactor = 1e13
+		self.nElecTransfer = -2
+
+	def _getTafelFactor(self, inputReactants, temperature, pH, potential):
+		return math.exp(potential**2)
+
+
+class TestPolarisationCurve(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.potentials = np.linspace(-0.3, 0.3, 7)
+		self.symFactor = 0.4
+		self.currentFactor = unitHelp.FARADAY_CONST
+		self.concDict = {"A":0.2, "free":0.5, "A_ads":0.3, "B":1.0}
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		#Reduction A+free->A_ads (1 electron), oxidation A_ads->B+free (2 electrons) and a chemical step
+		reduction = coreHelp.BetterReactionTemplate(["A","free"], ["A_ads"], 0.5, 1e13, nElecTransfer=1, symFactor=self.symFactor)
+		oxidation = coreHelp.BetterReactionTemplate(["A_ads"], ["B","free"], 0.6, 1e13, nElecTransfer=-2, symFactor=self.symFactor)
+		chemical = coreHelp.BetterReactionTemplate(["A_ads"], ["A","free"], 0.7, 1e13)
+		self.reactions = [reduction, oxidation, chemical]
+		self.network = compiledHelp.CompiledReactionNetwork(self.reactions)
+		self.concs = np.array([self.concDict[x] for x in self.network.speciesNames])
+
+	def _runTestFunct(self):
+		return tCode.PolarisationCurve.fromConcs(self.network, self.potentials, self.concs, self.temperature, currentFactor=self.currentFactor)
+
+	def _getExpChannelCurrents(self):
+		outVals = list()
+		for potential in self.potentials:
+			rates = self.network.getChannelRates(self.concs, self.network.getRateConstants(self.temperature, potential=potential))
+			outVals.append( [-1*x.nElecTransfer*self.currentFactor*rate for x,rate in zip(self.reactions, rates)] )
+		return np.array(outVals)
+
+	def testCurrentsMatchLoopOverPotentials(self):
+		expVals = self._getExpChannelCurrents()
+		actCurve = self._runTestFunct()
+		self.assertTrue( np.allclose(expVals, actCurve.channelCurrents) )
+		self.assertTrue( np.allclose(expVals.sum(axis=1), actCurve.currents) )
+		self.assertTrue( np.allclose(expVals[:,1], actCurve.anodicCurrents) )
+		self.assertTrue( np.allclose(expVals[:,0], actCurve.cathodicCurrents) )
+		self.assertTrue( np.allclose(expVals, actCurve.reactionCurrents) )
+		self.assertTrue( np.all(actCurve.reactionCurrents[:,2]==0) )
+
+	def testNetReactionCurrentsSumChannels(self):
+		forward, backward = self.reactions[:2]
+		backward.reactants, backward.products = forward.products, forward.reactants
+		self.reactions = [coreHelp.NetReactionTemplate(forward, backward)]
+		self.network = compiledHelp.CompiledReactionNetwork(self.reactions)
+		self.concs = np.array([self.concDict[x] for x in self.network.speciesNames])
+		actCurve = self._runTestFunct()
+		self.assertTrue( np.allclose(actCurve.currents, actCurve.reactionCurrents[:,0]) )
+		self.assertTrue( np.all(actCurve.anodicCurrents>0) )
+		self.assertTrue( np.all(actCurve.cathodicCurrents<0) )
+
+	def testTafelSlopesMatchAnalytic(self):
+		""" k ~ exp(-nElecTransfer*symFactor*F*E/RT) with fixed concentrations, so dE/dlog10|i| = -ln(10)*RT/(nElecTransfer*symFactor*F) """
+		actCurve = self._runTestFunct()
+		tafelFactor = math.log(10)*unitHelp.IDEAL_GAS_R_JOULES*self.temperature / (self.symFactor*unitHelp.FARADAY_CONST)
+		self.assertTrue( np.allclose(-1*tafelFactor, actCurve.getTafelSlopes("cathodic")) )
+		self.assertTrue( np.allclose(tafelFactor/2, actCurve.getTafelSlopes(1)) )
+		self.assertTrue( np.all(np.isnan(actCurve.getTafelSlopes(2))) )
+
+	def testPerPointConcsAndNaNRows(self):
+		self.concs = np.tile(self.concs, (len(self.potentials),1))
+		self.concs[2] = np.nan
+		actCurve = self._runTestFunct()
+		self.assertTrue( np.all(np.isnan(actCurve.currents[2])) )
+		self.assertTrue( np.all(np.isfinite(actCurve.currents[[0,1,3,4,5,6]])) )
+
+	def testInvalidInputsRaise(self):
+		actCurve = self._runTestFunct()
+		for which in ["fake_currents", 3]:
+			with self.assertRaises(ValueError):
+				actCurve.getCurrents(which)
+		self.potentials = [0.1]
+		with self.assertRaises(ValueError):
+			self._runTestFunct().getTafelSlopes()
+
+
+class TestGetRateConstantsAlongPotential(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 310
+		self.potentials = [-0.5, 0.1, 0.0, 0.4]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A"], ["B"], 0.5, 1e13, refPot=0.2, nElecTransfer=1, symFactor=0.3)
+		reactionB = _QuadraticTafelReaction(["B"], ["C"])
+		self.network = compiledHelp.CompiledReactionNetwork([reactionA, reactionB])
+
+	def testMatchesPerPotentialEvaluation(self):
+		expVals = [self.network.getRateConstants(self.temperature, potential=x) for x in self.potentials]
+		actVals = tCode.getRateConstantsAlongPotential(self.network, self.potentials, self.temperature)
+		self.assertTrue( np.allclose(expVals, actVals, rtol=1e-12) )
+
+	def testCurrentFactorsFromElectronTransfers(self):
+		expVals = [-1*unitHelp.FARADAY_CONST, 2*unitHelp.FARADAY_CONST]
+		actVals = tCode.getChannelCurrentFactors(self.network)
+		self.assertTrue( np.allclose(expVals, actVals) )
+
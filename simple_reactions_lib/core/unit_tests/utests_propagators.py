@@ -0,0 +1,398 @@
+
+import unittest
+import unittest.mock as mock
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.core_units as unitHelp
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.instrumentation as instrHelp
+import simple_reactions_lib.core.waveforms as waveHelp
+import simple_reactions_lib.core.propagators as tCode
+
+
+class TestImplicitPropagatorsUseAnalyticJacobian(unittest.TestCase):
+
+	def setUp(self):
+		self.timeStep = 0.5
+		self.temperature = 300
+		self.variableConcSpecies = ["A","C"]
+		self.solverOptions = None
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.7, 1e13)
+		reactionB = coreHelp.BetterReactionTemplate(["C"], ["A","B"], 0.75, 1e13)
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C"], [1,0.5,0])]
+		self.rateCalculator = contrHelp.CompiledRateCalculator([reactionA, reactionB])
+		args = [self.rateCalculator, self.variableConcSpecies]
+		self.testObjs = [tCode.ConcsPropagator_Radau(*args, solverOptions=self.solverOptions),
+		                 tCode.ConcsPropagator_BDF(*args, solverOptions=self.solverOptions)]
+
+	def testJacobianPassedToSolver(self):
+		for testObj in self.testObjs:
+			with mock.patch("simple_reactions_lib.core.propagators.integrateHelp.solve_ivp", wraps=tCode.integrateHelp.solve_ivp) as mockSolveIVP:
+				testObj.propagate(self.startReactants, self.timeStep, temperature=self.temperature)
+				args, kwargs = mockSolveIVP.call_args
+				self.assertEqual(args[0].jacobian, kwargs["jac"])
+
+	def testUserJacobianNotOverwritten(self):
+		self.solverOptions = {"jac":None}
+		self.createTestObjs()
+		for testObj in self.testObjs:
+			with mock.patch("simple_reactions_lib.core.propagators.integrateHelp.solve_ivp", wraps=tCode.integrateHelp.solve_ivp) as mockSolveIVP:
+				testObj.propagate(self.startReactants, self.timeStep, temperature=self.temperature)
+				args, kwargs = mockSolveIVP.call_args
+				self.assertEqual(None, kwargs["jac"])
+
+	def testReachesExpectedEquilibrium(self):
+		""" A+B <-> C with [B] fixed; at equilibrium [C]/[A] = [B]*k_f/k_b """
+		rateConsts = self.rateCalculator.network.getRateConstants(self.temperature)
+		expRatio = 0.5*rateConsts[0]/rateConsts[1]
+		for testObj in self.testObjs:
+			currReactants = [coreHelp.ChemSpeciesStd(x.name, x.conc) for x in self.startReactants]
+			testObj.propagate(currReactants, 1e3, temperature=self.temperature)
+			concA, concB, concC = [x.conc for x in currReactants]
+			self.assertAlmostEqual(expRatio, concC/concA, places=3)
+			self.assertAlmostEqual(1, concA+concC)
+
+
+class TestAutoPropagator(unittest.TestCase):
+	""" A->B is slow (k~0.4); B+B->C is fast, so the system becomes stiff once B builds up """
+
+	def setUp(self):
+		self.timeStep = 5
+		self.temperature = 300
+		self.variableConcSpecies = ["A","B","C"]
+		self.solverOptions = {"rtol":1e-8, "atol":1e-12}
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.slowReaction = coreHelp.BetterReactionTemplate(["A"], ["B"], 0.8, 1e13)
+		self.fastReaction = coreHelp.BetterReactionTemplate(["B","B"], ["C"], 0.4, 1e13)
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C"], [1,0,0])]
+		self.setPropagator([self.slowReaction, self.fastReaction])
+
+	def setPropagator(self, reactions):
+		self.rateCalculator = contrHelp.CompiledRateCalculator(reactions)
+		self.testObjA = tCode.ConcsPropagator_Auto(self.rateCalculator, self.variableConcSpecies, solverOptions=self.solverOptions)
+
+	def _runTestFunct(self, propagator=None):
+		propagator = self.testObjA if propagator is None else propagator
+		currReactants = [coreHelp.ChemSpeciesStd(x.name, x.conc) for x in self.startReactants]
+		propagator.propagate(currReactants, self.timeStep, temperature=self.temperature)
+		return [x.conc for x in currReactants]
+
+	def _getRadauConcs(self):
+		propagator = tCode.ConcsPropagator_Radau(self.rateCalculator, self.variableConcSpecies, solverOptions={"rtol":1e-10, "atol":1e-14})
+		return self._runTestFunct(propagator)
+
+	def testNonStiffUsesExplicitMethod(self):
+		self.variableConcSpecies = ["A","B"]
+		self.setPropagator([self.slowReaction])
+		rateConst = self.slowReaction.getRateConstant(None, self.temperature)
+		actConcs = self._runTestFunct()
+		self.assertEqual("DOP853", self.testObjA.lastMethod)
+		self.assertEqual(0, self.testObjA.nSwitches)
+		self.assertAlmostEqual(np.exp(-rateConst*self.timeStep), actConcs[0])
+
+	def testStiffStartUsesImplicitMethod(self):
+		self.startReactants[1].conc = 0.1
+		expConcs = self._getRadauConcs()
+		actConcs = self._runTestFunct()
+		self.assertEqual("Radau", self.testObjA.lastMethod)
+		self.assertEqual(0, self.testObjA.nSwitches)
+		self.assertTrue( np.allclose(expConcs, actConcs, rtol=1e-6, atol=1e-12) )
+
+	def testSwitchesWhenStiffnessDevelops(self):
+		instrumentation = instrHelp.Instrumentation()
+		instrHelp.enableInstrumentation(self.testObjA, instrumentation)
+		expConcs = self._getRadauConcs()
+		actConcs = self._runTestFunct()
+		self.assertEqual(1, self.testObjA.nSwitches)
+		self.assertEqual("Radau", self.testObjA.lastMethod)
+		self.assertEqual("Radau", instrumentation.solverCalls[-1]["method"])
+		self.assertTrue( all([x["method"]=="DOP853" for x in instrumentation.solverCalls[:-1]]) )
+		self.assertTrue( np.allclose(expConcs, actConcs, rtol=1e-6, atol=1e-12) )
+
+	def testSpectralRadiusWithoutAnalyticJacobian(self):
+		concs = np.array([0.5, 0.2, 0.1])
+		inpReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(self.variableConcSpecies, concs)]
+		compiledFunct = self.rateCalculator.getRatesFunction(inpReactants, self.variableConcSpecies, temperature=self.temperature)
+		standardCalc = contrHelp.RateCalculatorStandard([self.slowReaction, self.fastReaction])
+		standardFunct = tCode.ConcsPropagator_Radau(standardCalc, self.variableConcSpecies).getFunctToPropagate(inpReactants, self.temperature, 0)
+		expVal = tCode.getSpectralRadius(compiledFunct, 0, concs)
+		actVal = tCode.getSpectralRadius(standardFunct, 0, concs)
+		self.assertAlmostEqual(1, actVal/expVal, places=5)
+
+	def testUnknownExplicitMethodRaises(self):
+		with self.assertRaises(ValueError):
+			tCode.ConcsPropagator_Auto(self.rateCalculator, self.variableConcSpecies, explicitMethod="Radau")
+
+
+class TestPersistentPropagator(unittest.TestCase):
+
+	def setUp(self):
+		self.timeStep = 0.05
+		self.nSteps = 20
+		self.temperature = 300
+		self.potential = 0
+		self.variableConcSpecies = ["A","C"]
+		self.solverOptions = {"rtol":1e-8, "atol":1e-10}
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.7, 1e13, nElecTransfer=1)
+		reactionB = coreHelp.BetterReactionTemplate(["C"], ["A","B"], 0.75, 1e13)
+		self.currReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C"], [1,0.5,0])]
+		self.rateCalculator = contrHelp.CompiledRateCalculator([reactionA, reactionB])
+		self.testObjA = tCode.ConcsPropagator_Persistent(self.rateCalculator, self.variableConcSpecies, solverOptions=self.solverOptions)
+
+	def _runTestFunct(self):
+		for idx in range(self.nSteps):
+			self.testObjA.propagate(self.currReactants, self.timeStep, temperature=self.temperature, potential=self.potential)
+
+	def testManySmallStepsMatchOneLargeStep(self):
+		expReactants = [coreHelp.ChemSpeciesStd(x.name, x.conc) for x in self.currReactants]
+		tCode.ConcsPropagator_Radau(self.rateCalculator, self.variableConcSpecies, solverOptions=self.solverOptions).propagate(expReactants, self.timeStep*self.nSteps, temperature=self.temperature)
+		self._runTestFunct()
+		for exp,act in zip(expReactants, self.currReactants):
+			self.assertAlmostEqual(exp.conc, act.conc, places=6)
+
+	def testSessionKeptBetweenCalls(self):
+		self.testObjA.propagate(self.currReactants, self.timeStep, temperature=self.temperature)
+		expSession = self.testObjA.session
+		self._runTestFunct()
+		self.assertTrue(expSession is self.testObjA.session)
+		self.assertAlmostEqual(self.timeStep*(self.nSteps+1), self.testObjA.session.time)
+
+	def testNewSessionOnPotentialChange(self):
+		self._runTestFunct()
+		startSession = self.testObjA.session
+		self.potential += 0.1
+		self._runTestFunct()
+		self.assertFalse(startSession is self.testObjA.session)
+
+	def testNewSessionWhenConcsChangedExternally(self):
+		self._runTestFunct()
+		startSession = self.testObjA.session
+		self.currReactants[0].conc = 1
+		self._runTestFunct()
+		self.assertFalse(startSession is self.testObjA.session)
+
+	def testResetSession(self):
+		self._runTestFunct()
+		self.testObjA.resetSession()
+		self.assertTrue(self.testObjA.session is None)
+
+class TestGetLastRatesOfChange(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.7, 1e13)
+		reactionB = coreHelp.BetterReactionTemplate(["C"], ["A","B"], 0.75, 1e13)
+		self.currReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C"], [1,0.5,0])]
+		self.rateCalculator = contrHelp.CompiledRateCalculator([reactionA, reactionB])
+		self.testObjA = tCode.ConcsPropagator_DOP853(self.rateCalculator, ["A","C"])
+
+	def testMatchesRatesAtFinalConcs(self):
+		self.testObjA.propagate(self.currReactants, 1e-3, temperature=self.temperature)
+		expRates = self.rateCalculator.getRates(self.currReactants, temperature=self.temperature)
+		actRates = self.testObjA.getLastRatesOfChange(self.currReactants)
+		self.assertEqual(["A","C"], sorted(actRates.keys()))
+		for key in actRates.keys():
+			self.assertAlmostEqual(expRates[key], actRates[key])
+
+	def testNoneIfConcsChangedAfterPropagating(self):
+		self.testObjA.propagate(self.currReactants, 1e-3, temperature=self.temperature)
+		self.currReactants[0].conc = 2
+		self.assertTrue( self.testObjA.getLastRatesOfChange(self.currReactants) is None )
+
+	def testNoneBeforePropagating(self):
+		self.assertTrue( self.testObjA.getLastRatesOfChange(self.currReactants) is None )
+
+
+class TestLogConcsPropagation(unittest.TestCase):
+
+	def setUp(self):
+		self.timeStep = 0.5
+		self.temperature = 300
+		self.potential = 0.05
+		self.variableConcSpecies = ["A","C","D"]
+		self.startConcs = [1,0.5,1e-3,0]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		#A+C+D is conserved, so one of them is a pivot
+		reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.7, 1e13, nElecTransfer=1)
+		reactionB = coreHelp.BetterReactionTemplate(["C","C"], ["A","B","A","B"], 0.75, 1e13)
+		reactionC = coreHelp.BetterReactionTemplate(["C"], ["D"], 0.72, 1e13)
+		self.reactions = [reactionA, reactionB, reactionC]
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C","D"], self.startConcs)]
+		self.rateCalculator = contrHelp.CompiledRateCalculator(self.reactions, logConcs=True)
+		self.testObjA = self.rateCalculator.getRatesFunction(self.startReactants, self.variableConcSpecies, self.temperature, self.potential)
+
+	def _getLinearRates(self, concs):
+		inpReactants = [self.startReactants[1]] + [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(self.variableConcSpecies, concs)]
+		rateDict = self.rateCalculator.getRates(inpReactants, temperature=self.temperature, potential=self.potential)
+		return np.array([rateDict[name] for name in self.variableConcSpecies])
+
+	def _runPropagation(self, logConcs, method="Radau", timeStep=None):
+		timeStep = self.timeStep if timeStep is None else timeStep
+		rateCalculator = contrHelp.CompiledRateCalculator(self.reactions, logConcs=logConcs)
+		propagator = tCode.ConcsPropagator_Persistent(rateCalculator, self.variableConcSpecies, method=method, solverOptions={"rtol":1e-10, "atol":1e-16})
+		currReactants = [coreHelp.ChemSpeciesStd(x.name, x.conc) for x in self.startReactants]
+		propagator.propagate(currReactants, timeStep, temperature=self.temperature, potential=self.potential)
+		return propagator, currReactants
+
+	def testRatesAreLogDerivativesExceptForLinearSpecies(self):
+		concs = np.array([0.3, 0.02, 0])
+		linRates = self._getLinearRates(concs)
+		expRates = np.array([linRates[1]/concs[1], linRates[2]])
+		actRates = self.testObjA(0, self.testObjA.getStateFromConcs(concs))
+		self.assertTrue( np.allclose(expRates, actRates, rtol=1e-12, atol=0) )
+
+	def testJacobianMatchesNumerical(self):
+		state, stepSize = self.testObjA.getStateFromConcs(np.array([0.3, 0.02, 0])), 1e-6 #[ln([C]), [D]]
+		state[1] = 0.01
+		expJacobian = np.zeros((2,2))
+		for idx in range(2):
+			upState, downState = state.copy(), state.copy()
+			upState[idx] += stepSize
+			downState[idx] -= stepSize
+			expJacobian[:,idx] = (self.testObjA(0, upState) - self.testObjA(0, downState)) / (2*stepSize)
+		actJacobian = self.testObjA.jacobian(0, state)
+		self.assertTrue( np.allclose(expJacobian, actJacobian, rtol=1e-6, atol=0) )
+
+	def testBasisFromConcs(self):
+		actState = self.testObjA.getStateFromConcs(np.array([0.1, 0.5, 0]))
+		self.assertEqual([1], self.testObjA.pivots.tolist())
+		self.assertEqual([0,2], self.testObjA.freePositions.tolist())
+		self.assertEqual([True,False], self.testObjA.logMask.tolist())
+		self.assertTrue( np.allclose([np.log(0.1), 0], actState) )
+
+	def testConservedTotalExactForAnyState(self):
+		state = self.testObjA.getStateFromConcs(np.array([0.5, 0.3, 0.2]))
+		actConcs = self.testObjA.getConcsFromState(state + np.array([-3.0, 0.4]))
+		self.assertAlmostEqual(1, np.sum(actConcs), places=14)
+
+	def testBasisMarginNegativeOnceSpeciesOutgrowsPivot(self):
+		state = self.testObjA.getStateFromConcs(np.array([0.9, 0.1, 0]))
+		self.assertGreater(self.testObjA.getBasisMargin(state), 0)
+		self.assertLess(self.testObjA.getBasisMargin(np.array([np.log(0.995), 0])), 0)
+
+	def testStateTolerances(self):
+		self.testObjA.getStateFromConcs(np.array([0.5, 0.3, 0]))
+		actRtol, actAtol = self.testObjA.getStateTolerances(1e-4, np.array([1e-9, 2e-9, 3e-9]))
+		self.assertEqual(1e-4, actRtol)
+		self.assertTrue( np.allclose([1e-4, 3e-9], actAtol) )
+
+	def testMatchesLinearConcs(self):
+		unused, expReactants = self._runPropagation(False)
+		unused, actReactants = self._runPropagation(True)
+		for exp, act in zip(expReactants, actReactants):
+			self.assertAlmostEqual(exp.conc, act.conc, places=7)
+
+	def testMatchesLinearConcs_nonPersistentPropagator(self):
+		unused, expReactants = self._runPropagation(False)
+		propagator = tCode.ConcsPropagator_BDF(self.rateCalculator, self.variableConcSpecies, solverOptions={"rtol":1e-10, "atol":1e-16})
+		actReactants = [coreHelp.ChemSpeciesStd(x.name, x.conc) for x in self.startReactants]
+		propagator.propagate(actReactants, self.timeStep, temperature=self.temperature, potential=self.potential)
+		for exp, act in zip(expReactants, actReactants):
+			self.assertAlmostEqual(exp.conc, act.conc, places=7)
+
+	def testMatchesLinearConcsAcrossBasisChanges(self):
+		""" A (the starting pivot) ends up far below D over this time, so each propagator has to move to a new basis """
+		timeStep = 50
+		unused, expReactants = self._runPropagation(False, timeStep=timeStep)
+		propagators = [ tCode.ConcsPropagator_Persistent(self.rateCalculator, self.variableConcSpecies, solverOptions={"rtol":1e-10, "atol":1e-16}),
+		                tCode.ConcsPropagator_Radau(self.rateCalculator, self.variableConcSpecies, solverOptions={"rtol":1e-10, "atol":1e-16}),
+		                tCode.ConcsPropagator_Auto(self.rateCalculator, self.variableConcSpecies, solverOptions={"rtol":1e-10, "atol":1e-16}) ]
+		for propagator in propagators:
+			actReactants = [coreHelp.ChemSpeciesStd(x.name, x.conc) for x in self.startReactants]
+			with mock.patch.object(contrHelp.LogConcsRatesFunction, "getStateFromConcs", autospec=True, side_effect=contrHelp.LogConcsRatesFunction.getStateFromConcs) as mockedConvert:
+				propagator.propagate(actReactants, timeStep, temperature=self.temperature, potential=self.potential)
+			self.assertGreater(mockedConvert.call_count, 1)
+			for exp, act in zip(expReactants, actReactants):
+				self.assertAlmostEqual(exp.conc, act.conc, places=7)
+
+	def testLastRatesAreConcRates(self):
+		concs = np.array([0.3, 0.02, 0.01])
+		state = self.testObjA.getStateFromConcs(concs)
+		self.testObjA(0, state)
+		actRates = self.testObjA.getLastRates( self.testObjA.getConcsFromState(state) )
+		self.assertTrue( np.allclose(self._getLinearRates(concs), actRates, rtol=1e-12, atol=1e-15) )
+
+	def testCodegenWithLogConcsRaises(self):
+		with self.assertRaises(ValueError):
+			contrHelp.CompiledRateCalculator(self.reactions, codegenBackend="python", logConcs=True)
+
+
+class TestWaveformPropagation(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.startPot, self.endPot, self.sweepRate = 0, -0.1, 0.05
+		self.nSteps = 8
+		self.solverOptions = {"rtol":1e-10, "atol":1e-12}
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.reactions = [coreHelp.BetterReactionTemplate(["A"], ["B"], 0.8, 1e13, nElecTransfer=1)]
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B"], [1,0])]
+		self.rateCalculator = contrHelp.CompiledRateCalculator(self.reactions)
+		self.waveform = waveHelp.LinearSweep(self.startPot, self.endPot, self.sweepRate)
+
+	def _getController(self, propagator, potential):
+		return contrHelp.ReactionControllerImproved(propagator, self.startReactants, temperature=self.temperature, potential=potential)
+
+	def _getExpConcA(self, time):
+		#k = k0*exp(-aE) with E = startPot - sweepRate*t, so ln[A] = -k0*(exp(a*sweepRate*t)-1)/(a*sweepRate)
+		startRateConst = self.rateCalculator.network.getRateConstants(self.temperature, potential=self.startPot)[0]
+		tafelSlope = 0.5*unitHelp.FARADAY_CONST / (self.temperature*unitHelp.IDEAL_GAS_R_JOULES)
+		return np.exp( -startRateConst*(np.exp(tafelSlope*self.sweepRate*time)-1) / (tafelSlope*self.sweepRate) )
+
+	def _runSteps(self, controller):
+		timeStep = self.waveform.endTime / self.nSteps
+		for idx in range(self.nSteps):
+			controller.moveForwardByT(timeStep)
+
+	def testLinearSweepMatchesAnalytic(self):
+		propagators = [ tCode.ConcsPropagator_Persistent(self.rateCalculator, ["A","B"], solverOptions=self.solverOptions),
+		                tCode.ConcsPropagator_BDF(self.rateCalculator, ["A","B"], solverOptions=self.solverOptions),
+		                tCode.ConcsPropagator_Persistent(contrHelp.CompiledRateCalculator(self.reactions, logConcs=True), ["A","B"], solverOptions=self.solverOptions) ]
+		expConc = self._getExpConcA(self.waveform.endTime)
+		for propagator in propagators:
+			controller = self._getController(propagator, self.waveform)
+			self._runSteps(controller)
+			self.assertAlmostEqual(1, controller.currentReactants[0].conc/expConc, places=6)
+
+	def testPersistentSessionKeptAcrossSweep(self):
+		propagator = tCode.ConcsPropagator_Persistent(self.rateCalculator, ["A","B"], solverOptions=self.solverOptions)
+		controller = self._getController(propagator, self.waveform)
+		controller.moveForwardByT(1e-3)
+		expSession = propagator.session
+		self._runSteps(controller)
+		self.assertTrue(expSession is propagator.session)
+
+	def testStepWaveformMatchesManualPotentialChanges(self):
+		stepTimes, stepPots = [0.3, 0.7], [-0.05, -0.1]
+		waveform = waveHelp.StepWaveform(self.startPot, stepTimes, stepPots)
+		expController = self._getController(tCode.ConcsPropagator_Radau(self.rateCalculator, ["A","B"], solverOptions=self.solverOptions), self.startPot)
+		for timeStep, pot in zip([0.3, 0.4, 0.3], stepPots + [stepPots[-1]]):
+			expController.moveForwardByT(timeStep)
+			expController.potential = pot
+
+		propagator = tCode.ConcsPropagator_Persistent(self.rateCalculator, ["A","B"], solverOptions=self.solverOptions)
+		propagator.propagate(self.startReactants, 1.0, temperature=self.temperature, potential=waveform)
+		for exp, act in zip(expController.currentReactants, self.startReactants):
+			self.assertAlmostEqual(exp.conc, act.conc, places=8)
+
+	def testKMCRaises(self):
+		propagator = tCode.ConcsPropagator_KMC.fromReactions(self.reactions, ["A","B"], 100)
+		with self.assertRaises(ValueError):
+			propagator.propagate(self.startReactants, 1, temperature=self.temperature, potential=self.waveform)
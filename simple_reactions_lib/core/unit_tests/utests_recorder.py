@@ -0,0 +1,147 @@
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.propagators as propHelp
+import simple_reactions_lib.core.recorder as tCode
+
+
+class TestTrajectoryRecorder(unittest.TestCase):
+
+	def setUp(self):
+		self.outDir = tempfile.mkdtemp()
+		self.speciesNames = ["A","B"]
+		self.nFluxes = 0
+		self.chunkSize = 4
+		self.nSamples = 10
+		self.createTestObjs()
+
+	def tearDown(self):
+		shutil.rmtree(self.outDir)
+
+	def createTestObjs(self):
+		self.testObjA = tCode.TrajectoryRecorder(self.outDir, self.speciesNames, nFluxes=self.nFluxes, chunkSize=self.chunkSize)
+		self.times = np.arange(self.nSamples)*0.5
+		self.concs = np.array([ [x, 2*x] for x in range(self.nSamples) ], dtype=float)
+		self.fluxes = np.array([ [-x]*self.nFluxes for x in range(self.nSamples) ], dtype=float).reshape(self.nSamples, self.nFluxes)
+
+	def _runTestFunct(self):
+		with self.testObjA as recorder:
+			for time, concs, fluxes in zip(self.times, self.concs, self.fluxes):
+				recorder.record(time, concs, fluxes=fluxes)
+		return tCode.loadTrajectory(self.outDir)
+
+	def testRoundTripOverSeveralChunks(self):
+		actTraj = self._runTestFunct()
+		self.assertEqual(self.nSamples, len(actTraj))
+		self.assertTrue( np.allclose(self.times, actTraj.times) )
+		self.assertTrue( np.allclose(self.concs, actTraj.concs) )
+		self.assertTrue( np.allclose(self.concs[:,1], actTraj.getConcs("B")) )
+		self.assertTrue(actTraj.fluxes is None)
+
+	def testFluxesRecorded(self):
+		self.nFluxes = 2
+		self.createTestObjs()
+		actTraj = self._runTestFunct()
+		self.assertTrue( np.allclose(self.fluxes, actTraj.fluxes) )
+
+	def testOnlyFlushedSamplesVisibleMidRun(self):
+		for time, concs in zip(self.times[:6], self.concs[:6]):
+			self.testObjA.record(time, concs)
+		actTraj = tCode.loadTrajectory(self.outDir)
+		self.assertEqual(self.chunkSize, len(actTraj))
+		self.assertTrue( np.allclose(self.concs[:self.chunkSize], actTraj.concs) )
+
+	def testArraysAreMemoryMapped(self):
+		actTraj = self._runTestFunct()
+		self.assertTrue( isinstance(actTraj.concs, np.memmap) )
+		self.assertFalse(actTraj.concs.flags.writeable)
+
+	def testFilesAreStandardNpy(self):
+		self._runTestFunct()
+		actConcs = np.load(self.testObjA._filePaths["concs"])
+		self.assertTrue( np.allclose(self.concs, actConcs) )
+
+
+class TestRecordFromController(unittest.TestCase):
+
+	def setUp(self):
+		self.outDir = tempfile.mkdtemp()
+		self.timeStep = 0.1
+		self.nSteps = 5
+		self.createTestObjs()
+
+	def tearDown(self):
+		shutil.rmtree(self.outDir)
+
+	def createTestObjs(self):
+		self.reactions = [coreHelp.BetterReactionTemplate(["A"], ["B"], 0.7, 1e11)]
+		startReactants = [coreHelp.ChemSpeciesStd("A",1), coreHelp.ChemSpeciesStd("B",0)]
+		self.recorder = tCode.TrajectoryRecorder(self.outDir, ["B","A"], nFluxes=1, chunkSize=2)
+		self.controller = coreHelp.ReactionControllerStandard(startReactants, self.reactions, self.timeStep, callbackFunct=self.recorder)
+
+	def testRecordsEveryStepAsCallback(self):
+		self.controller.doNextNSteps(self.nSteps)
+		self.recorder.flush()
+		actTraj = tCode.loadTrajectory(self.outDir)
+		self.assertTrue( np.allclose(np.arange(self.nSteps)*self.timeStep, actTraj.times) )
+		self.assertEqual(0, actTraj.concs[0][0])
+		self.assertEqual(1, actTraj.concs[0][1])
+
+	def testFluxesMatchReactionRates(self):
+		self.controller.doNextNSteps(self.nSteps)
+		self.recorder.recordController(self.controller)
+		self.recorder.flush()
+		expFlux = self.reactions[0].getReactionRate(self.controller.currentReactants, self.controller.temperature)
+		self.assertAlmostEqual(expFlux, tCode.loadTrajectory(self.outDir).fluxes[-1][0])
+
+
+class TestFluxesFromImprovedController(unittest.TestCase):
+
+	def setUp(self):
+		self.outDir = tempfile.mkdtemp()
+		self.potential = -0.1
+		self.createTestObjs()
+
+	def tearDown(self):
+		shutil.rmtree(self.outDir)
+
+	def createTestObjs(self):
+		forward = coreHelp.BetterReactionTemplate(["A","H"], ["B"], 0.7, 1e11, nElecTransfer=1)
+		backward = coreHelp.BetterReactionTemplate(["B"], ["A","H"], 0.75, 1e11, nElecTransfer=-1)
+		self.reactions = [coreHelp.NetReactionTemplate(forward, backward), coreHelp.BetterReactionTemplate(["B"], ["C"], 0.8, 1e12)]
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C","H"], [1,0,0,0.5])]
+		self.recorder = tCode.TrajectoryRecorder(self.outDir, ["A","B","C"], nFluxes=len(self.reactions))
+
+	def _getController(self, rateCalculator):
+		propagator = propHelp.ConcsPropagator_BDF(rateCalculator, ["A","B","C"])
+		return contrHelp.ReactionControllerImproved(propagator, self.startReactants, potential=self.potential)
+
+	def _getExpFluxes(self, controller):
+		return [x.getReactionRate(controller.currentReactants, controller.temperature, potential=self.potential) for x in self.reactions]
+
+	def testFluxesMatchReactionRates(self):
+		for rateCalculator in [contrHelp.CompiledRateCalculator(self.reactions), contrHelp.RateCalculatorStandard(self.reactions)]:
+			controller = self._getController(rateCalculator)
+			controller.moveForwardByT(1e-3)
+			expFluxes = self._getExpFluxes(controller)
+			actFluxes = tCode.getReactionFluxes(controller)
+			self.assertTrue( np.allclose(expFluxes, actFluxes, rtol=1e-12, atol=0) )
+
+	def testRecordController(self):
+		controller = self._getController(contrHelp.CompiledRateCalculator(self.reactions))
+		controller.moveForwardByT(1e-3)
+		self.recorder.recordController(controller)
+		self.recorder.flush()
+		actFluxes = tCode.loadTrajectory(self.outDir).fluxes[-1]
+		self.assertTrue( np.allclose(self._getExpFluxes(controller), actFluxes) )
+
+	def testNoRateCalculatorRaisesTypeError(self):
+		controller = contrHelp.ReactionControllerImproved(None, self.startReactants)
+		with self.assertRaises(TypeError):
+			tCode.getReactionFluxes(controller)
@@ -0,0 +1,196 @@
+
+import unittest
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.core_units as unitHelp
+import simple_reactions_lib.core.compiled_network as compiledHelp
+import simple_reactions_lib.core.steady_state as steadyHelp
+import simple_reactions_lib.core.sensitivity as tCode
+
+
+class TestSteadyStateSensitivities(unittest.TestCase):
+
+	def setUp(self):
+		self.kForward, self.kBackward, self.kOut = 3.0, 2.0, 5.0
+		self.concA = 0.4
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		#A <-> X -> B with A and B fixed; [X] = kForward*[A] / (kBackward+kOut) at steady state
+		forwardReaction = coreHelp.BetterReactionTemplate(["A"], ["X"], 0, self.kForward)
+		backwardReaction = coreHelp.BetterReactionTemplate(["X"], ["A"], 0, self.kBackward)
+		outReaction = coreHelp.BetterReactionTemplate(["X"], ["B"], 0, self.kOut)
+		self.reactions = [coreHelp.NetReactionTemplate(forwardReaction, backwardReaction), outReaction]
+		self.network = compiledHelp.CompiledReactionNetwork(self.reactions)
+		self.varIndices = [self.network.speciesIndices["X"]]
+		self.solver = steadyHelp.SteadyStateSolver(self.network, self.varIndices)
+		self.rateConsts = np.array([getattr(x, "prefactor") for x in self.network.channels])
+		self.concs = np.zeros(self.network.nSpecies)
+		self.concs[self.network.speciesIndices["A"]] = self.concA
+		self.concs[self.varIndices[0]] = self.kForward*self.concA / (self.kBackward+self.kOut)
+		self.logRateConstDerivs = {"prefactor":1/self.rateConsts}
+
+	def _runTestFunct(self):
+		return tCode.getSteadyStateSensitivities(self.solver, self.concs, self.rateConsts, logRateConstDerivs=self.logRateConstDerivs)
+
+	def _getChannelIdx(self, rateConst):
+		return [idx for idx,val in enumerate(self.rateConsts) if val==rateConst][0]
+
+	def testConcSensitivitiesMatchAnalytic(self):
+		concX, totalOut = self.concs[self.varIndices[0]], self.kBackward + self.kOut
+		expVals = {self.kForward:concX, self.kBackward:-concX*self.kBackward/totalOut, self.kOut:-concX*self.kOut/totalOut}
+		actVals = self._runTestFunct().getConcSensitivities()[0]
+		for rateConst, expVal in expVals.items():
+			self.assertAlmostEqual(expVal, actVals[self._getChannelIdx(rateConst)])
+
+	def testPrefactorSensitivitiesUseChainRule(self):
+		result = self._runTestFunct()
+		expVals = result.getConcSensitivities() / self.rateConsts
+		actVals = result.getConcSensitivities("prefactor")
+		self.assertTrue( np.allclose(expVals, actVals) )
+
+	def testUnavailableParameterRaises(self):
+		with self.assertRaises(ValueError):
+			self._runTestFunct().getConcSensitivities("barrier")
+
+	def testDegreesOfRateControlMatchAnalytic(self):
+		""" Scaling both channels of A<->X leaves K fixed; the flux kOut*kForward*[A]/(kBackward+kOut) then has DRC kOut/(kBackward+kOut) for that step """
+		totalOut = self.kBackward + self.kOut
+		expVals = [self.kOut/totalOut, self.kBackward/totalOut]
+		actVals = self._runTestFunct().getDegreesOfRateControl( tCode.getFluxWeights(self.network, 1) )
+		self.assertTrue( np.allclose(expVals, actVals) )
+		self.assertAlmostEqual(1, sum(actVals))
+
+	def testDegreesOfRateControlSameForSpeciesFlux(self):
+		result = self._runTestFunct()
+		expVals = result.getDegreesOfRateControl( tCode.getFluxWeights(self.network, 1) )
+		actVals = result.getDegreesOfRateControl( tCode.getFluxWeights(self.network, "B") )
+		self.assertTrue( np.allclose(expVals, actVals) )
+
+	def testDegreesOfRateControlNaNForZeroFlux(self):
+		self.concA = 0
+		self.createTestObjs()
+		actVals = self._runTestFunct().getDegreesOfRateControl( tCode.getFluxWeights(self.network, 1) )
+		self.assertTrue( np.all(np.isnan(actVals)) )
+
+	def testResidualLogRateConstantDerivatives(self):
+		""" Should match a central difference of the residual in ln(k) """
+		expVals, stepSize = np.zeros( (len(self.varIndices), self.network.nChannels) ), 1e-6
+		totals = self.solver.conservationMatrix @ self.concs[self.varIndices]
+		for idx in range(self.network.nChannels):
+			upConsts, downConsts = np.array(self.rateConsts), np.array(self.rateConsts)
+			upConsts[idx] *= np.exp(stepSize)
+			downConsts[idx] *= np.exp(-stepSize)
+			expVals[:,idx] = (self.solver.getResidual(self.concs, upConsts, totals) - self.solver.getResidual(self.concs, downConsts, totals)) / (2*stepSize)
+		actVals = self.solver.getResidualLogRateConstantDerivatives(self.concs, self.rateConsts)
+		self.assertTrue( np.allclose(expVals, actVals) )
+
+
+class TestTransientSensitivities(unittest.TestCase):
+
+	def setUp(self):
+		self.kForward, self.kOut = 3.0, 5.0
+		self.concA = 0.4
+		self.outputTimes = [0, 0.1, 0.3, 10]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		#A -> X -> B with A fixed; [X](t) = kForward*[A]*(1-exp(-kOut*t))/kOut
+		forwardReaction = coreHelp.BetterReactionTemplate(["A"], ["X"], 0, self.kForward)
+		outReaction = coreHelp.BetterReactionTemplate(["X"], ["B"], 0, self.kOut)
+		self.network = compiledHelp.CompiledReactionNetwork([forwardReaction, outReaction])
+		self.varIndices = [self.network.speciesIndices[x] for x in ["X","B"]]
+		self.rateConsts = np.array([self.kForward, self.kOut])
+		self.concs = np.zeros(self.network.nSpecies)
+		self.concs[self.network.speciesIndices["A"]] = self.concA
+		self.solverOptions = {"rtol":1e-10, "atol":1e-14}
+
+	def _runTestFunct(self):
+		return tCode.getTransientSensitivities(self.network, self.varIndices, self.concs, self.rateConsts, self.outputTimes, solverOptions=self.solverOptions)
+
+	def _getExpConcX(self, kForward, kOut):
+		outputTimes = np.array(self.outputTimes)
+		return kForward*self.concA*(1-np.exp(-kOut*outputTimes))/kOut
+
+	def testConcsAndSensitivitiesMatchAnalytic(self):
+		expConcs = self._getExpConcX(self.kForward, self.kOut)
+		stepSize = 1e-6
+		expSensOut = (self._getExpConcX(self.kForward, self.kOut*np.exp(stepSize)) - self._getExpConcX(self.kForward, self.kOut*np.exp(-stepSize))) / (2*stepSize)
+		actConcs, actSens = self._runTestFunct()
+		self.assertTrue( np.allclose(expConcs, actConcs[:,self.network.speciesIndices["X"]]) )
+		self.assertTrue( np.allclose(self.concA, actConcs[:,self.network.speciesIndices["A"]]) )
+		self.assertTrue( np.allclose(expConcs, actSens[:,0,0]) ) #[X] is linear in kForward
+		self.assertTrue( np.allclose(expSensOut, actSens[:,0,1]) )
+
+	def testSelectedChannelsOnly(self):
+		expSens = self._runTestFunct()[1][:,:,[1]]
+		actSens = tCode.getTransientSensitivities(self.network, self.varIndices, self.concs, self.rateConsts, self.outputTimes, channelIndices=[1], solverOptions=self.solverOptions)[1]
+		self.assertEqual( (len(self.outputTimes), len(self.varIndices), 1), actSens.shape )
+		self.assertTrue( np.allclose(expSens, actSens) )
+
+
+class TestParameterHelpers(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.potential = -0.2
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","free"], ["A_ads"], 0.5, 1e13, nElecTransfer=-1)
+		reactionB = coreHelp.BetterReactionTemplate(["A_ads"], ["B","free"], 0.7, 1e12)
+		self.network = compiledHelp.CompiledReactionNetwork([reactionA, reactionB])
+
+	def _getLogRateConsts(self, channel, **kwargs):
+		return np.log(channel.getRateConstant(None, self.temperature, potential=self.potential, **kwargs))
+
+	def testBarrierAndPrefactorDerivatives(self):
+		expBarrier = -1/(unitHelp.BOLTZ_EV*self.temperature)
+		actBarrier = tCode.getLogRateConstantDerivatives(self.network, "barrier", self.temperature, potential=self.potential)
+		actPrefactor = tCode.getLogRateConstantDerivatives(self.network, "prefactor", self.temperature, potential=self.potential)
+		self.assertTrue( np.allclose(expBarrier, actBarrier) )
+		self.assertTrue( np.allclose([1/x.prefactor for x in self.network.channels], actPrefactor) )
+
+	def testSymFactorDerivativeMatchesTafelExponent(self):
+		""" Only the electrochemical channel depends on symFactor: dln(k)/d(symFactor) = -nElecTransfer*eta/kT for k ~ exp(-symFactor*nElecTransfer*eta/kT) """
+		stepSize = 1e-5
+		channel = self.network.channels[0]
+		startSymFactor = channel.symFactor
+		channel.symFactor = startSymFactor + stepSize
+		upVal = self._getLogRateConsts(channel)
+		channel.symFactor = startSymFactor - stepSize
+		downVal = self._getLogRateConsts(channel)
+		channel.symFactor = startSymFactor
+		actVals = tCode.getLogRateConstantDerivatives(self.network, "symFactor", self.temperature, potential=self.potential)
+		self.assertAlmostEqual( (upVal-downVal)/(2*stepSize), actVals[0], places=5 )
+		self.assertAlmostEqual(0, actVals[1])
+
+	def testUnknownParameterRaises(self):
+		with self.assertRaises(ValueError):
+			tCode.getLogRateConstantDerivatives(self.network, "fake_param", self.temperature)
+
+	def testFluxWeights(self):
+		expSpecies, expReaction = [0,1], [0,1]
+		actSpecies = tCode.getFluxWeights(self.network, "B")
+		actReaction = tCode.getFluxWeights(self.network, 1)
+		self.assertTrue( np.allclose(expSpecies, actSpecies) )
+		self.assertTrue( np.allclose(expReaction, actReaction) )
+
+	def testInvalidFluxRaises(self):
+		for flux in ["fake_species", 2]:
+			with self.assertRaises(ValueError):
+				tCode.getFluxWeights(self.network, flux)
+
+	def testChannelRateJacobian(self):
+		concsByName = {"A":0.3, "free":0.6, "A_ads":0.1, "B":0.0}
+		concs = np.array([concsByName[x] for x in self.network.speciesNames])
+		varIndices = [self.network.speciesIndices[x] for x in ["free","A_ads"]]
+		rateConsts = np.array([2.0, 7.0])
+		expVals = np.zeros((2,2))
+		expVals[0, 0] = rateConsts[0]*concsByName["A"]
+		expVals[1, 1] = rateConsts[1]
+		actVals = tCode.getChannelRateJacobian(self.network, varIndices, concs, rateConsts)
+		self.assertTrue( np.allclose(expVals, actVals) )
+
@@ -0,0 +1,75 @@
+
+import unittest
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.compiled_network as compiledHelp
+import simple_reactions_lib.core.steady_state as tCode
+
+
+class TestSteadyStateSolver(unittest.TestCase):
+	""" Langmuir-type adsorption A + free <-> A_ads followed by A_ads -> B + free; sites are conserved """
+
+	def setUp(self):
+		self.temperature = 300
+		self.concA = 0.1
+		self.startCoverage = 0
+		self.variableSpecies = ["free", "A_ads"]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		adsorb = coreHelp.BetterReactionTemplate(["A","free"], ["A_ads"], 0.5, 1e13)
+		desorb = coreHelp.BetterReactionTemplate(["A_ads"], ["A","free"], 0.6, 1e13)
+		react = coreHelp.BetterReactionTemplate(["A_ads"], ["B","free"], 0.65, 1e13)
+		self.network = compiledHelp.CompiledReactionNetwork([adsorb, desorb, react])
+		self.rateConsts = self.network.getRateConstants(self.temperature)
+		concDict = {"A":self.concA, "free":1-self.startCoverage, "A_ads":self.startCoverage, "B":0}
+		self.concs = np.array([concDict[x] for x in self.network.speciesNames])
+		self.varIndices = [self.network.speciesIndices[x] for x in self.variableSpecies]
+		self.testObjA = tCode.SteadyStateSolver(self.network, self.varIndices)
+
+	def _getExpCoverage(self):
+		kAds, kDes, kReact = self.rateConsts
+		return kAds*self.concA / (kAds*self.concA + kDes + kReact)
+
+	def _runTestFunct(self):
+		return self.testObjA.solve(self.concs, self.rateConsts)
+
+	def testMatchesAnalyticSteadyState(self):
+		expCoverage = self._getExpCoverage()
+		outConcs, info = self._runTestFunct()
+		actCoverage = outConcs[self.network.speciesIndices["A_ads"]]
+		self.assertTrue(info["converged"])
+		self.assertAlmostEqual(1, expCoverage/actCoverage)
+
+	def testSiteConservationDetected(self):
+		expMatrix = np.array([[1,1]]) / np.sqrt(2)
+		actMatrix = self.testObjA.conservationMatrix
+		self.assertEqual( (1,2), actMatrix.shape )
+		self.assertTrue( np.allclose(expMatrix, np.abs(actMatrix)) )
+
+	def testSitesConserved(self):
+		outConcs, info = self._runTestFunct()
+		totalSites = sum( [outConcs[idx] for idx in self.varIndices] )
+		self.assertAlmostEqual(1, totalSites)
+
+	def testFixedSpeciesUnchanged(self):
+		outConcs, info = self._runTestFunct()
+		for name in ["A","B"]:
+			idx = self.network.speciesIndices[name]
+			self.assertEqual(self.concs[idx], outConcs[idx])
+
+	def testStartingAtSteadyStateNeedsNoFactorisations(self):
+		self.startCoverage = self._getExpCoverage()
+		self.createTestObjs()
+		self.concs = self._runTestFunct()[0]
+		outConcs, info = self._runTestFunct()
+		self.assertTrue(info["converged"])
+		self.assertLessEqual(info["nLU"], 1)
+
+	def testNotConvergedWhenOutOfIterations(self):
+		self.testObjA.maxIter = 1
+		outConcs, info = self._runTestFunct()
+		self.assertFalse(info["converged"])
+
@@ -0,0 +1,83 @@
+
+import unittest
+
+import numpy as np
+
+import simple_reactions_lib.core.waveforms as tCode
+
+
+class TestPiecewiseLinearWaveforms(unittest.TestCase):
+
+	def setUp(self):
+		self.times = [0, 1, 1, 3]
+		self.potentials = [0.0, 0.2, -0.1, 0.3]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.testObjA = tCode.PiecewiseLinearWaveform(self.times, self.potentials)
+
+	def testInterpolatesAndHoldsEnds(self):
+		inpTimes = [-1, 0.5, 2, 3, 10]
+		expVals = [0.0, 0.1, 0.1, 0.3, 0.3]
+		actVals = self.testObjA.getPotential(inpTimes)
+		self.assertTrue( np.allclose(expVals, actVals) )
+		self.assertAlmostEqual(0.1, self.testObjA.getPotential(0.5))
+
+	def testRepeatedTimeIsJump(self):
+		self.assertEqual([1], list(self.testObjA.getDiscontinuities()))
+		self.assertAlmostEqual(-0.1, self.testObjA.getPotential(1))
+		self.assertAlmostEqual(0.2, self.testObjA.getPotential(1-1e-12), places=6)
+		self.assertAlmostEqual(1, self.testObjA.getTimeUntilDiscontinuity(0))
+		self.assertEqual(np.inf, self.testObjA.getTimeUntilDiscontinuity(1))
+
+	def testUnsortedOrMismatchedRaise(self):
+		for times, potentials in [([0,2,1], [0,0,0]), ([0,1], [0]), ([], [])]:
+			with self.assertRaises(ValueError):
+				tCode.PiecewiseLinearWaveform(times, potentials)
+
+	def testLinearSweep(self):
+		testObj = tCode.LinearSweep(-0.2, 0.3, 0.05, startTime=2)
+		expVals = [-0.2, -0.2, 0.05, 0.3, 0.3]
+		actVals = testObj.getPotential([0, 2, 7, 12, 20])
+		self.assertTrue( np.allclose(expVals, actVals) )
+		self.assertAlmostEqual(12, testObj.endTime)
+
+	def testCyclicVoltammetry(self):
+		testObj = tCode.CyclicVoltammetry(0.0, [0.5, -0.5], 0.1, nCycles=2)
+		self.assertAlmostEqual(20, testObj.cycleTime)
+		self.assertAlmostEqual(40, testObj.endTime)
+		expVals = [0.0, 0.5, 0.0, -0.5, 0.0, 0.5, 0.0]
+		actVals = testObj.getPotential([0, 5, 10, 15, 20, 25, 40])
+		self.assertTrue( np.allclose(expVals, actVals) )
+		self.assertEqual(0, len(testObj.getDiscontinuities()))
+
+
+class TestStepWaveform(unittest.TestCase):
+
+	def setUp(self):
+		self.startPotential = -0.1
+		self.stepTimes = [1, 4]
+		self.stepPotentials = [0.2, 0.5]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		self.testObjA = tCode.StepWaveform(self.startPotential, self.stepTimes, self.stepPotentials)
+
+	def testPotentials(self):
+		expVals = [-0.1, 0.2, 0.2, 0.5, 0.5]
+		actVals = self.testObjA.getPotential([0.5, 1, 3.9, 4, 100])
+		self.assertTrue( np.allclose(expVals, actVals) )
+
+	def testShiftedWaveform(self):
+		shiftedObj = self.testObjA.getShifted(2).getShifted(1)
+		self.assertIs(self.testObjA, shiftedObj.baseWaveform)
+		self.assertAlmostEqual(3, shiftedObj.timeOffset)
+		self.assertAlmostEqual(0.5, shiftedObj.getPotential(1))
+		self.assertEqual([-2, 1], list(shiftedObj.getDiscontinuities()))
+		self.assertAlmostEqual(1, shiftedObj.getTimeUntilDiscontinuity(0))
+
+	def testNonIncreasingStepTimesRaise(self):
+		self.stepTimes = [1, 1]
+		with self.assertRaises(ValueError):
+			self.createTestObjs()
+
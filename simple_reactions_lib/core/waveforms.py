@@ -0,0 +1,186 @@
+
+""" Time-dependent potential programs (linear sweeps, cyclic voltammetry, steps and arbitrary piecewise-linear tables)
+
+A waveform can be used anywhere a (float) potential is accepted by ReactionControllerImproved and the ConcsPropagatorTemplate propagators; the potential (and hence every Tafel factor) is then evaluated at the current time inside the function being integrated, so one adaptive integration can cover a whole sweep. Times are in the same units as rate constants (usually seconds) and measured from controller.time=0 (i.e. from the last reset)
+
+"""
+
+import numpy as np
+
+
+class PotentialWaveform():
+	""" Base class for potential programs E(t) """
+
+	def getPotential(self, time):
+		""" Gets the potential at time; works on floats or arrays of times """
+		raise NotImplementedError("")
+
+	def getDiscontinuities(self):
+		""" Gets the (sorted) times at which the potential jumps. Controllers end propagation steps at these, so integrators never step across a jump """
+		return np.zeros(0)
+
+	def getTimeUntilDiscontinuity(self, time):
+		""" Gets the time from time until the next jump strictly after it; inf if there are none """
+		jumpTimes = self.getDiscontinuities()
+		nextIdx = np.searchsorted(jumpTimes, time, side="right")
+		return float(jumpTimes[nextIdx] - time) if nextIdx < len(jumpTimes) else np.inf
+
+	def getShifted(self, timeOffset):
+		""" Gets a waveform w for which w.getPotential(t) == self.getPotential(t+timeOffset); propagators are given these, since they always start from t=0 """
+		return ShiftedWaveform(self, timeOffset)
+
+
+class ShiftedWaveform(PotentialWaveform):
+	""" A waveform with its time origin moved; see PotentialWaveform.getShifted
+
+	Attributes:
+		baseWaveform: (PotentialWaveform) Never itself a ShiftedWaveform; offsets of nested shifts are added
+		timeOffset: (float)
+
+	"""
+
+	def __init__(self, baseWaveform, timeOffset):
+		if isinstance(baseWaveform, ShiftedWaveform):
+			baseWaveform, timeOffset = baseWaveform.baseWaveform, baseWaveform.timeOffset + timeOffset
+		self.baseWaveform = baseWaveform
+		self.timeOffset = timeOffset
+
+	def getPotential(self, time):
+		return self.baseWaveform.getPotential( np.add(time, self.timeOffset) )
+
+	def getDiscontinuities(self):
+		return self.baseWaveform.getDiscontinuities() - self.timeOffset
+
+
+class PiecewiseLinearWaveform(PotentialWaveform):
+	""" Potential interpolated linearly between (time, potential) points, and held at the first/last value outside them
+
+	Attributes:
+		times: (float array) Sorted times of each point
+		potentials: (float array) Potential at each point
+
+	"""
+
+	def __init__(self, times, potentials):
+		""" Initializer
+
+		Args:
+			times: (iter of float) Sorted (non-decreasing) times. A repeated time gives a jump from the first to the second potential listed at it
+			potentials: (iter of float) Potential at each time
+
+		Raises:
+			ValueError: If lengths differ, no points are given or times are not sorted
+
+		"""
+		self.times = np.array(times, dtype=float)
+		self.potentials = np.array(potentials, dtype=float)
+		if (len(self.times) != len(self.potentials)) or (len(self.times) == 0):
+			raise ValueError("Need the same (non-zero) number of times and potentials; got {} and {}".format(len(self.times), len(self.potentials)))
+		if np.any(np.diff(self.times) < 0):
+			raise ValueError("times must be sorted")
+
+	@property
+	def endTime(self):
+		return float(self.times[-1])
+
+	def getPotential(self, time):
+		outVals = np.interp(time, self.times, self.potentials)
+		jumpTimes = self.getDiscontinuities()
+		if len(jumpTimes) > 0:
+			#np.interp gives the mean at repeated times; potentials take their later value from a jump onwards
+			atJump = np.isin(time, jumpTimes)
+			if np.any(atJump):
+				lastIndices = np.searchsorted(self.times, time, side="right") - 1
+				outVals = np.where(atJump, self.potentials[np.maximum(lastIndices,0)], outVals)
+		return float(outVals) if np.ndim(outVals) == 0 else outVals
+
+	def getDiscontinuities(self):
+		repeated = np.nonzero(np.diff(self.times) == 0)[0]
+		return np.unique(self.times[repeated])
+
+
+class LinearSweep(PiecewiseLinearWaveform):
+	""" Ramp from startPotential to endPotential at a fixed sweep rate, then held at endPotential """
+
+	def __init__(self, startPotential, endPotential, sweepRate, startTime=0):
+		""" Initializer
+
+		Args:
+			startPotential: (float) Held until startTime
+			endPotential: (float)
+			sweepRate: (float) Magnitude of dE/dt (e.g. V/s); the sign comes from the start/end potentials
+			startTime: (float) Time the sweep starts
+
+		"""
+		self.startPotential = startPotential
+		self.endPotential = endPotential
+		self.sweepRate = sweepRate
+		sweepTime = abs(endPotential-startPotential) / sweepRate
+		super().__init__([startTime, startTime+sweepTime], [startPotential, endPotential])
+
+
+class CyclicVoltammetry(PiecewiseLinearWaveform):
+	""" Triangle waveform: from startPotential through each vertex potential in turn and back to startPotential, repeated nCycles times, all at one sweep rate. Held at startPotential afterwards """
+
+	def __init__(self, startPotential, vertexPotentials, sweepRate, nCycles=1):
+		""" Initializer
+
+		Args:
+			startPotential: (float)
+			vertexPotentials: (iter of float) Turning points within one cycle, e.g. [upper, lower] for a standard CV starting between them
+			sweepRate: (float) Magnitude of dE/dt (e.g. V/s)
+			nCycles: (int)
+
+		"""
+		self.startPotential = startPotential
+		self.vertexPotentials = list(vertexPotentials)
+		self.sweepRate = sweepRate
+		self.nCycles = nCycles
+		cyclePotentials = [startPotential] + self.vertexPotentials
+		potentials = cyclePotentials*nCycles + [startPotential]
+		times = np.concatenate( [[0], np.cumsum(np.abs(np.diff(potentials))/sweepRate)] )
+		super().__init__(times, potentials)
+
+	@property
+	def cycleTime(self):
+		return self.endTime / self.nCycles
+
+
+class StepWaveform(PotentialWaveform):
+	""" Piecewise-constant potential: startPotential until stepTimes[0], then stepPotentials[i] from stepTimes[i] until the next step
+
+	Attributes:
+		startPotential: (float)
+		stepTimes: (float array) Sorted
+		stepPotentials: (float array)
+
+	"""
+
+	def __init__(self, startPotential, stepTimes, stepPotentials):
+		""" Initializer
+
+		Args:
+			startPotential: (float)
+			stepTimes: (iter of float) Strictly increasing times of each step
+			stepPotentials: (iter of float) Potential from each step onwards
+
+		Raises:
+			ValueError: If lengths differ or stepTimes are not strictly increasing
+
+		"""
+		self.startPotential = startPotential
+		self.stepTimes = np.array(stepTimes, dtype=float)
+		self.stepPotentials = np.array(stepPotentials, dtype=float)
+		if len(self.stepTimes) != len(self.stepPotentials):
+			raise ValueError("Need the same number of stepTimes and stepPotentials; got {} and {}".format(len(self.stepTimes), len(self.stepPotentials)))
+		if np.any(np.diff(self.stepTimes) <= 0):
+			raise ValueError("stepTimes must be strictly increasing")
+		self._allPotentials = np.concatenate( [[startPotential], self.stepPotentials] )
+
+	def getPotential(self, time):
+		outVals = self._allPotentials[ np.searchsorted(self.stepTimes, time, side="right") ]
+		return float(outVals) if np.ndim(outVals) == 0 else outVals
+
+	def getDiscontinuities(self):
+		return self.stepTimes
+
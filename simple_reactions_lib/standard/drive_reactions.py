@@ -1,4 +1,17 @@
 
+import math
+
+import numpy as np
+
+from ..core import compiled_network as compiledHelp
+from ..core import continuation as continuationHelp
+from ..core import core_classes as coreHelp
+from ..core import core_units as unitHelp
+from ..core import improved_controller as contrHelp
+from ..core import polarisation as polHelp
+from ..core import sensitivity as sensHelp
+from ..core import steady_state as steadyHelp
+
 
 def runControllerUntilSteadyState(controller, steadySpeciesNames, nStepsPerCheck, tolerancePerStep):
 	""" Run the reaction controller until the specified reactants reach a steady state; determined by their change per step
@@ -29,5 +42,339 @@ def _isCurrentStepConverged(controller, steadySpeciesName, tolerancePerStep):
 	
 
 
+def runUntilSteadyState(controller, rTol=1e-6, aTol=1e-15, startTime=1e-6, growthFactor=2, maxTime=1e8):
+	""" Runs a ReactionControllerImproved (with any propagator) forward in time until its variable species reach a steady state. Each outer iteration integrates over a horizon growthFactor times longer than the last, so reaching time T takes O(log T) iterations
+
+	Convergence is checked per species on d[X]/dt, so tolerances are per unit time and do not depend on the horizon: |d[X]/dt| <= aTol + rTol*|[X]|. The rates are taken from the propagators last right-hand-side evaluation when available (see ConcsPropagatorBase.getLastRatesOfChange); otherwise (e.g. for Radau and BDF) they are evaluated once at the current concentrations with the propagators rate calculator
+
+	Args:
+		controller: (ReactionControllerImproved)
+		rTol: (float) Relative tolerance per unit time
+		aTol: (float) Absolute tolerance per unit time
+		startTime: (float) Length of the first horizon
+		growthFactor: (float) Each horizon is this many times longer than the last
+		maxTime: (float) Give up once this much time has been simulated
+
+	Returns
+		info: (dict) "nIter" (number of horizons), "time" (total time simulated), "nReusedRates" (number of checks using the integrators own rates)
+
+	Raises:
+		ValueError: If no steady state is reached within maxTime, or the propagator has no rate calculator (e.g. ConcsPropagator_KMC)
+
+	"""
+	unusedReactions, variableSpecies, unusedPH, rateCalculator = _getSteadyStateProblem(controller)
+	presentNames = [x.name for x in controller.currentReactants]
+	variableSpecies = [x for x in variableSpecies if x in presentNames]
+	info = {"nIter":0, "time":0.0, "nReusedRates":0}
+	horizon = startTime
+	while info["time"] < maxTime:
+		controller.moveForwardByT(horizon)
+		info["nIter"] += 1
+		info["time"] += horizon
+		endConcs = _getNamedConcs(controller.currentReactants, variableSpecies)
+
+		rateDict = controller.propagator.getLastRatesOfChange(controller.currentReactants)
+		if rateDict is None:
+			rateDict = rateCalculator.getRates(controller.currentReactants, temperature=controller.temperature, potential=controller.getCurrentPotential())
+		else:
+			info["nReusedRates"] += 1
+		rates = np.array([rateDict[x] for x in variableSpecies])
+
+		if np.all( np.abs(rates) <= aTol + rTol*np.abs(endConcs) ):
+			return info
+		horizon *= growthFactor
+
+	raise ValueError("Steady state not reached after simulating {} time units".format(info["time"]))
+
+
+def solveSteadyState(controller, rTol=1e-8, aTol=1e-15, maxIter=200, maxBursts=10, burstTime=None, maxStepsPerBurst=1000):
+	""" Sets the controllers current concentrations to a steady state, found by solving d[X]/dt=0 directly (see core.steady_state.SteadyStateSolver) rather than by time-stepping. Conserved totals (e.g. surface sites) are taken from the current concentrations. If the solve fails, the controller is run forward for a short burst and the solve retried from there
+	
+	Args:
+		controller: (ReactionControllerStandard or ReactionControllerImproved) For the standard controller everything except constantConcReactants may vary; for the improved controller only propagator.variableConcSpecies may vary
+		rTol: (float) Relative tolerance on the concentrations
+		aTol: (float) Absolute tolerance on the concentrations
+		maxIter: (int) Maximum number of iterations per solve attempt
+		maxBursts: (int) Maximum number of integration bursts to try if the solve fails
+		burstTime: (Optional, float) Time to integrate for in each burst. Default is based on the timescales found by the failed solve
+		maxStepsPerBurst: (int) Maximum number of steps per burst for ReactionControllerStandard
+ 
+	Returns
+		info: (dict) Output of SteadyStateSolver.solve for the final attempt, plus "nBursts"
+ 
+	Raises:
+		ValueError: If no steady state is found after maxBursts bursts, or the propagator has no rate calculator (e.g. ConcsPropagator_KMC)
+	"""
+	network, varIndices, pH = _getCompiledSteadyStateProblem(controller)
+	solver = steadyHelp.SteadyStateSolver(network, varIndices, rTol=rTol, aTol=aTol, maxIter=maxIter)
+
+	nBursts = 0
+	while True:
+		inpReactants, conditions = controller.currentReactants, _getConditions(controller)
+		rateConsts = network.getRateConstants(conditions["temperature"], potential=conditions["potential"], pH=pH, inputReactants=inpReactants)
+		outConcs, info = solver.solve(network.getConcsFromReactants(inpReactants), rateConsts)
+		info["nBursts"] = nBursts
+		if info["converged"]:
+			_setControllerConcs(controller, network, varIndices, outConcs)
+			return info
+
+		if nBursts >= maxBursts:
+			raise ValueError("Steady state not found after {} integration bursts".format(nBursts))
+		_runIntegrationBurst(controller, info, burstTime, maxStepsPerBurst)
+		nBursts += 1
+
+
+def getSteadyStatesAlongParam(controller, paramValues, paramName="potential", rTol=1e-8, aTol=1e-15):
+	""" Gets steady states for a series of values of one condition (e.g. a potential grid), using natural-parameter continuation (see core.continuation.SteadyStateContinuation.solveAtParams). Each point starts from the last steady state plus a tangent predictor, rather than from the start reactants. The controller is not modified
+	
+	Args:
+		controller: (ReactionControllerStandard or ReactionControllerImproved) Its current concentrations are the starting guess for the first value, and set conserved totals
+		paramValues: (iter of float) Values of the condition; closely spaced values are cheapest
+		paramName: (str) "potential", "temperature" or "pH" (pH only for ReactionControllerStandard, since the improved controller ignores it)
+		rTol: (float) Relative tolerance on the concentrations
+		aTol: (float) Absolute tolerance on the concentrations
+ 
+	Returns
+		outConcs: (nValues x nReactants float array) Steady-state concentrations, with species ordered as controller.currentReactants. Rows are NaN from the first value where no steady state was found
+ 
+	"""
+	continuation, network = _getContinuation(controller, paramName, rTol, aTol)
+	startConcs = network.getConcsFromReactants(controller.currentReactants)
+	netConcs, info = continuation.solveAtParams(startConcs, paramValues)
+	return _getReactantConcsFromNetworkConcs(controller, network, netConcs)
+
+
+def traceSteadyStateBranch(controller, endValue, paramName="potential", initialStep=None, maxStep=None, maxPoints=1000, rTol=1e-8, aTol=1e-15):
+	""" Follows the branch of steady states from the controllers current condition to endValue using pseudo-arclength continuation (see core.continuation.SteadyStateContinuation.traceBranch). Step sizes adapt to how hard each point was to find, and folds (where the branch turns back on itself) are followed. The controller is not modified
+	
+	Args:
+		controller: (ReactionControllerStandard or ReactionControllerImproved) Its current condition is the start of the branch
+		endValue: (float) Stop once the branch passes this value of the condition
+		paramName: (str) "potential", "temperature" or "pH" (pH only for ReactionControllerStandard)
+		initialStep: (Optional, float) Arclength of the first step
+		maxStep: (Optional, float) Largest arclength step allowed
+		maxPoints: (int) Maximum number of points on the branch
+		rTol: (float) Relative tolerance on the concentrations
+		aTol: (float) Absolute tolerance on the concentrations
+ 
+	Returns
+		paramValues: (float array) Value of the condition at each point; not monotonic if the branch folds
+		outConcs: (nPoints x nReactants float array) Steady-state concentrations, with species ordered as controller.currentReactants
+ 
+	"""
+	continuation, network = _getContinuation(controller, paramName, rTol, aTol)
+	continuation.maxStep = continuation.maxStep if maxStep is None else maxStep
+	startConcs = network.getConcsFromReactants(controller.currentReactants)
+	startValue = _getConditions(controller)[paramName]
+	paramValues, netConcs, info = continuation.traceBranch(startConcs, startValue, endValue, initialStep=initialStep, maxPoints=maxPoints)
+	return paramValues, _getReactantConcsFromNetworkConcs(controller, network, netConcs)
+
+
+def getSteadyStateSensitivities(controller, paramNames=sensHelp.PARAMETER_NAMES, rTol=1e-8, aTol=1e-15):
+	""" Finds the steady state from the controllers current concentrations (without modifying the controller), then its sensitivity to the rate constant and parameters of every reaction channel in one pass (see core.sensitivity.getSteadyStateSensitivities)
+	
+	Args:
+		controller: (ReactionControllerStandard or ReactionControllerImproved)
+		paramNames: (iter of str) Parameters to allow sensitivities for; any of core.sensitivity.PARAMETER_NAMES
+		rTol: (float) Relative tolerance on the steady-state concentrations
+		aTol: (float) Absolute tolerance on the steady-state concentrations
+ 
+	Returns
+		result: (SensitivityResult) e.g. result.getConcSensitivities("barrier") gives d[X]/d(barrier) for each variable species and channel (result.network.channels)
+ 
+	Raises:
+		ValueError: If no steady state is found
+	"""
+	network, varIndices, pH = _getCompiledSteadyStateProblem(controller)
+	solver = steadyHelp.SteadyStateSolver(network, varIndices, rTol=rTol, aTol=aTol)
+	inpReactants = controller.currentReactants
+	currKwargs = {"potential":_getConditions(controller)["potential"], "pH":pH, "inputReactants":inpReactants}
+	rateConsts = network.getRateConstants(controller.temperature, **currKwargs)
+	outConcs, info = solver.solve(network.getConcsFromReactants(inpReactants), rateConsts)
+	if not info["converged"]:
+		raise ValueError("Steady state not found; try solveSteadyState(controller) first")
+	logRateConstDerivs = {name:sensHelp.getLogRateConstantDerivatives(network, name, controller.temperature, **currKwargs) for name in paramNames}
+	return sensHelp.getSteadyStateSensitivities(solver, outConcs, rateConsts, logRateConstDerivs=logRateConstDerivs)
+
+
+def getDegreesOfRateControlAlongParam(controller, paramValues, flux, paramName="potential", rTol=1e-8, aTol=1e-15):
+	""" Gets the Campbell degree of rate control of every reaction at steady states along a series of values of one condition (e.g. a potential grid). Steady states are found by continuation, as in getSteadyStatesAlongParam, and each only needs one extra factorisation. The controller is not modified
+	
+	Args:
+		controller: (ReactionControllerStandard or ReactionControllerImproved) Its current concentrations are the starting guess for the first value, and set conserved totals
+		paramValues: (iter of float) Values of the condition
+		flux: (str or int) The rate being controlled; a species name (its net rate of production) or an index into the controllers reactions (the net rate of that reaction). See core.sensitivity.getFluxWeights
+		paramName: (str) "potential", "temperature" or "pH" (pH only for ReactionControllerStandard)
+		rTol: (float) Relative tolerance on the concentrations
+		aTol: (float) Absolute tolerance on the concentrations
+ 
+	Returns
+		degreesOfRateControl: (nValues x nReactions float array) Reactions are ordered as the controllers reactions. Rows are NaN where no steady state was found (or the flux is zero)
+ 
+	"""
+	continuation, network = _getContinuation(controller, paramName, rTol, aTol)
+	fluxWeights = sensHelp.getFluxWeights(network, flux)
+	startConcs = network.getConcsFromReactants(controller.currentReactants)
+	netConcs, info = continuation.solveAtParams(startConcs, paramValues)
+
+	outVals = np.full( (len(netConcs), len(network.reactions)), np.nan )
+	for idx, (paramVal, concs) in enumerate(zip(paramValues, netConcs)):
+		if np.any(np.isnan(concs)):
+			continue
+		rateConsts = continuation.rateConstsFunct(paramVal)
+		result = sensHelp.getSteadyStateSensitivities(continuation.steadyStateSolver, concs, rateConsts)
+		outVals[idx] = result.getDegreesOfRateControl(fluxWeights)
+	return outVals
+
+
+def getPolarisationCurve(controller, potentials, currentFactor=unitHelp.FARADAY_CONST, rTol=1e-8, aTol=1e-15):
+	""" Gets steady-state currents along a potential grid. Steady states come from continuation (as in getSteadyStatesAlongParam), then currents at every potential from one vectorised evaluation of the channel fluxes (see core.polarisation.PolarisationCurve). The controller is not modified
+	
+	Args:
+		controller: (ReactionControllerStandard or ReactionControllerImproved) Its current concentrations are the starting guess for the first potential, and set conserved totals
+		potentials: (iter of float) Closely spaced values are cheapest
+		currentFactor: (float) Charge per electron per unit of rate (see core.polarisation.PolarisationCurve.fromConcs)
+		rTol: (float) Relative tolerance on the concentrations
+		aTol: (float) Absolute tolerance on the concentrations
+ 
+	Returns
+		polarisationCurve: (PolarisationCurve) e.g. .currents, .anodicCurrents, .reactionCurrents and .getTafelSlopes(). Currents are NaN where no steady state was found
+ 
+	"""
+	continuation, network = _getContinuation(controller, "potential", rTol, aTol)
+	startConcs = network.getConcsFromReactants(controller.currentReactants)
+	netConcs, info = continuation.solveAtParams(startConcs, potentials)
+	conditions = _getConditions(controller)
+	kwargs = {"pH":conditions["pH"], "inputReactants":controller.currentReactants, "currentFactor":currentFactor}
+	return polHelp.PolarisationCurve.fromConcs(network, potentials, netConcs, conditions["temperature"], **kwargs)
+
+
+def runPotentialProgram(controller, waveform, sampleInterval, endTime=None, currentFactor=unitHelp.FARADAY_CONST):
+	""" Runs a controller under a time-dependent potential (e.g. a linear sweep or cyclic voltammogram; see core.waveforms), recording the current against potential. The potential is evaluated inside the integration, so with ConcsPropagator_Persistent the whole program is one adaptive integration (interpolated at each sample). Currents are found from all samples at once when the run ends
+	
+	Args:
+		controller: (ReactionControllerImproved) Runs from controller.time (waveform times are controller times) and is left at endTime with its original potential
+		waveform: (PotentialWaveform)
+		sampleInterval: (float) Simulated time between samples
+		endTime: (Optional, float) Controller time to run to; default is waveform.endTime (e.g. the end of the last CV cycle)
+		currentFactor: (float) Charge per electron per unit of rate (see core.polarisation.PolarisationCurve.fromConcs)
+ 
+	Returns
+		times: (float array) Controller time of each sample
+		polarisationCurve: (PolarisationCurve) Potential and currents at each sample, in time order
+ 
+	Raises:
+		ValueError: If controller is a ReactionControllerStandard, or endTime is not given and the waveform has no endTime
+	"""
+	if isinstance(controller, coreHelp.ReactionControllerStandard):
+		raise ValueError("Potential programs need a ReactionControllerImproved")
+	endTime = getattr(waveform, "endTime", None) if endTime is None else endTime
+	if endTime is None:
+		raise ValueError("endTime must be given for waveforms without an endTime")
+
+	network = _getCompiledSteadyStateProblem(controller)[0]
+	times, netConcs = list(), list()
+	def _record(inpController):
+		times.append(inpController.time)
+		netConcs.append( network.getConcsFromReactants(inpController.currentReactants) )
+
+	startPotential = controller.potential
+	controller.potential = waveform
+	observer = controller.observers.add(_record, timeInterval=sampleInterval)
+	try:
+		controller.moveForwardByT(endTime-controller.time)
+		if times[-1] < controller.time:
+			_record(controller)
+	finally:
+		controller.observers.remove(observer)
+		controller.potential = startPotential
+
+	times = np.array(times)
+	kwargs = {"inputReactants":controller.currentReactants, "currentFactor":currentFactor}
+	curve = polHelp.PolarisationCurve.fromConcs(network, waveform.getPotential(times), np.array(netConcs), controller.temperature, **kwargs)
+	return times, curve
+
+
+def _getContinuation(controller, paramName, rTol, aTol):
+	if paramName not in ("potential", "temperature", "pH"):
+		raise ValueError("paramName must be potential, temperature or pH; not {}".format(paramName))
+	if paramName == "pH" and not isinstance(controller, coreHelp.ReactionControllerStandard):
+		raise ValueError("pH is only used by ReactionControllerStandard")
+
+	network, varIndices, pH = _getCompiledSteadyStateProblem(controller)
+	conditions = _getConditions(controller)
+	inpReactants = controller.currentReactants
+
+	def _getRateConsts(paramVal):
+		currConditions = dict(conditions)
+		currConditions[paramName] = paramVal
+		return network.getRateConstants(currConditions["temperature"], potential=currConditions["potential"], pH=currConditions["pH"], inputReactants=inpReactants)
+
+	solver = steadyHelp.SteadyStateSolver(network, varIndices, rTol=rTol, aTol=aTol)
+	return continuationHelp.SteadyStateContinuation(solver, _getRateConsts), network
+
+
+def _getConditions(controller):
+	""" Temperature, potential and pH the controller is currently at. For ReactionControllerImproved the potential is the value at controller.time, so a PotentialWaveform gives the instantaneous potential """
+	if isinstance(controller, coreHelp.ReactionControllerStandard):
+		return {"temperature":controller.temperature, "potential":controller.potential, "pH":controller.pH}
+	return {"temperature":controller.temperature, "potential":controller.getCurrentPotential(), "pH":0}
+
+
+def _getReactantConcsFromNetworkConcs(controller, network, netConcs):
+	netConcs = np.array(netConcs, dtype=float).reshape(-1, network.nSpecies)
+	outConcs = np.zeros( (len(netConcs), len(controller.currentReactants)) )
+	for idx, reactant in enumerate(controller.currentReactants):
+		netIdx = network.speciesIndices.get(reactant.name)
+		outConcs[:,idx] = reactant.conc if netIdx is None else netConcs[:,netIdx]
+	outConcs[ np.isnan(netConcs).any(axis=1) ] = np.nan
+	return outConcs
+
+
+def _getCompiledSteadyStateProblem(controller):
+	""" Returns the compiled network, network indices of variable species and pH """
+	reactions, variableSpecies, pH, rateCalculator = _getSteadyStateProblem(controller)
+	network = rateCalculator.network if isinstance(rateCalculator, contrHelp.CompiledRateCalculator) else compiledHelp.CompiledReactionNetwork(reactions)
+	varIndices = [network.speciesIndices[x] for x in variableSpecies if x in network.speciesIndices]
+	return network, varIndices, pH
+
+
+def _getSteadyStateProblem(controller):
+	""" Returns reactions, names of variable species, pH and rate calculator (None for standard controller) """
+	if isinstance(controller, coreHelp.ReactionControllerStandard):
+		fixedNames = [x.name for x in controller.constantConcReactants] if controller.constantConcReactants is not None else list()
+		variableSpecies = [x.name for x in controller.currentReactants if x.name not in fixedNames]
+		return controller.reactions, variableSpecies, controller.pH, None
+
+	propagator = controller.propagator
+	if hasattr(propagator, "concChangesFinder"):
+		rateCalculator, variableSpecies = propagator.concChangesFinder.rateCalculator, propagator.concChangesFinder.variableConcSpecies
+	elif hasattr(propagator, "rateCalculator"):
+		rateCalculator, variableSpecies = propagator.rateCalculator, propagator.variableConcSpecies
+	else:
+		raise ValueError("{} is not supported; the propagator needs a rate calculator (e.g. not a kinetic Monte Carlo propagator)".format(type(propagator).__name__))
+	return rateCalculator.reactions, variableSpecies, 0, rateCalculator
+
+
+def _runIntegrationBurst(controller, info, burstTime, maxStepsPerBurst):
+	if burstTime is None:
+		burstTime = max(info["pseudoTime"], 1e3*info["timeScale"]) if math.isfinite(info["timeScale"]) else 1
+
+	if isinstance(controller, coreHelp.ReactionControllerStandard):
+		nSteps = min( maxStepsPerBurst, max(1, math.ceil(burstTime/controller.timeStep)) )
+		controller.doNextNSteps(nSteps)
+	else:
+		controller.moveForwardByT(burstTime)
+
+
+def _getNamedConcs(inputReactants, names):
+	concDict = {x.name:x.conc for x in inputReactants}
+	return np.array([concDict[x] for x in names], dtype=float)
+
 
+def _setControllerConcs(controller, network, varIndices, concs):
+	steadyConcs = {network.speciesNames[idx]:concs[idx] for idx in varIndices}
+	for reactant in controller.currentReactants:
+		if reactant.name in steadyConcs:
+			reactant.conc = float(steadyConcs[reactant.name])
 
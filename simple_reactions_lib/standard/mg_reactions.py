@@ -96,9 +96,12 @@ class OHAssistedDissolution_Taylor2016(coreObjs.ChemReactionTemplate):
 		prefactor = -1 * unitHelp.NERNST_PREFACTOR_LOG10 * (temperature/self.electronsLost)
 
 		#We keep the constant mg2+ concentration with inputReactants, separate from "mg_2+" that gets generated in the simulation
-		for reactant in inputReactants:
-			if reactant.name=="fixed_mg_2+":
-				mg2PlusConc = reactant.conc
+		if isinstance(inputReactants, coreObjs.SpeciesState):
+			mg2PlusConc = inputReactants.getConc("fixed_mg_2+")
+		else:
+			for reactant in inputReactants:
+				if reactant.name=="fixed_mg_2+":
+					mg2PlusConc = reactant.conc
 
 		#Figure out the lnQ part of the nernst equation
 		protonConc = 10**(-1*pH)
@@ -0,0 +1,159 @@
+
+""" Run a reaction network to steady state over a grid of conditions, optionally spread over a process pool """
+
+import concurrent.futures
+import itertools as it
+import math
+import os
+
+import numpy as np
+
+from ..core import compiled_network as compiledHelp
+from ..core import core_classes as coreHelp
+from ..core import ensemble as ensembleHelp
+from . import drive_reactions as driveHelp
+
+
+#Set once per worker process by _initWorker, so the network is only pickled once per worker rather than once per task
+_WORKER_STATE = dict()
+
+
+class SweepRunner():
+	""" Finds steady-state concentrations for every condition (potential, temperature, pH) in a grid. Each condition starts from startReactants (as if controller.reset() were called), so results do not depend on how the grid is split between workers
+
+	Attributes:
+		reactions: (list of ChemReactionTemplate objects)
+		startReactants: (list of ChemSpeciesStd objects)
+		variableConcSpecies: (list of str) Names of species whose concentrations may vary; all others are held at their starting values
+		speciesNames: (tuple of str) Names of startReactants; this is the order of the species axis in results
+		nWorkers: (int) Maximum number of worker processes. 1 means run in this process, as does any grid which fits in one chunk
+		chunkSize: (int or None) Number of conditions sent to a worker at a time. None means split the grid into ~4 chunks per worker
+		timeStep: (float) Step size for ReactionControllerStandard; only used for the short integration bursts made if a steady-state solve fails
+		solverKwargs: (dict) Keyword arguments passed to drive_reactions.solveSteadyState
+
+	"""
+
+	def __init__(self, reactions, startReactants, variableConcSpecies, nWorkers=None, chunkSize=None, timeStep=1e-6, solverKwargs=None):
+		""" Initializer
+
+		Args:
+			reactions: (iter of ChemReactionTemplate objects)
+			startReactants: (iter of ChemSpeciesStd objects)
+			variableConcSpecies: (iter of str) Names of species whose concentrations may vary
+			nWorkers: (Optional, int) Number of worker processes; default is os.cpu_count()
+			chunkSize: (Optional, int) Number of conditions sent to a worker at a time
+			timeStep: (float) Only used for integration bursts when a steady-state solve fails
+			solverKwargs: (Optional, dict) Keyword arguments for drive_reactions.solveSteadyState (e.g. rTol, maxBursts)
+
+		"""
+		self.reactions = list(reactions)
+		self.startReactants = list(startReactants)
+		self.variableConcSpecies = list(variableConcSpecies)
+		self.speciesNames = tuple([x.name for x in self.startReactants])
+		self.nWorkers = (os.cpu_count() or 1) if nWorkers is None else nWorkers
+		self.chunkSize = chunkSize
+		self.timeStep = timeStep
+		self.solverKwargs = dict() if solverKwargs is None else solverKwargs
+
+	def run(self, conditions):
+		""" Get steady-state concentrations for every condition
+
+		Args:
+			conditions: (nConditions x 3 array-like) Each row is (potential, temperature, pH); see getConditionGrid
+
+		Returns
+			outConcs: (nConditions x nSpecies float array) Steady-state concentrations, species ordered as self.speciesNames. Rows are NaN for any condition where no steady state was found
+
+		"""
+		conditions = np.array(conditions, dtype=float).reshape(-1,3)
+		chunks = self._getChunks(conditions)
+		initArgs = self._getWorkerInitArgs()
+
+		nWorkers = min(self.nWorkers, len(chunks)) #Starting a worker costs ~10s of ms (see benchmarks/sweep_scaling.py), so never start one without a chunk for it
+		if nWorkers <= 1:
+			_initWorker(*initArgs)
+			outChunks = [_runChunk(x) for x in chunks]
+		else:
+			with concurrent.futures.ProcessPoolExecutor(max_workers=nWorkers, initializer=_initWorker, initargs=initArgs) as executor:
+				outChunks = list( executor.map(_runChunk, chunks) )
+
+		if len(outChunks) == 0:
+			return np.zeros( (0,len(self.speciesNames)) )
+		return np.concatenate(outChunks, axis=0)
+
+	def runForTime(self, conditions, time, method="BDF", solverOptions=None):
+		""" Get concentrations after integrating every condition for a fixed time. Unlike run() all conditions are integrated together in this process, as one ensemble (see core.ensemble.EnsembleIntegrator), so there is one solve_ivp call rather than one per condition
+
+		Args:
+			conditions: (nConditions x 3 array-like) Each row is (potential, temperature, pH); see getConditionGrid
+			time: (float) Time to integrate each condition for, starting from startReactants
+			method: (str) solve_ivp method; implicit methods (BDF, Radau) use a block-diagonal analytic Jacobian
+			solverOptions: (Optional, dict) Extra keyword arguments for solve_ivp (e.g. rtol, atol)
+
+		Returns
+			outConcs: (nConditions x nSpecies float array) Concentrations after time, species ordered as self.speciesNames
+
+		Raises:
+			ValueError: If the integration fails
+
+		"""
+		conditions = np.array(conditions, dtype=float).reshape(-1,3)
+		network = compiledHelp.CompiledReactionNetwork(self.reactions)
+		varIndices = [network.speciesIndices[x] for x in self.variableConcSpecies if x in network.speciesIndices]
+		rateConstCache = compiledHelp.RateConstantCache(network, maxSize=len(conditions)+1)
+		rateConsts = [rateConstCache.getRateConstants(temp, potential=pot, pH=pH, inputReactants=self.startReactants) for pot,temp,pH in conditions]
+
+		integrator = ensembleHelp.EnsembleIntegrator(network, varIndices, method=method, solverOptions=solverOptions)
+		netConcs = integrator.integrate(network.getConcsFromReactants(self.startReactants), rateConsts, time)
+
+		outConcs = np.tile( [x.conc for x in self.startReactants], (len(conditions),1) ).astype(float)
+		for idx, name in enumerate(self.speciesNames):
+			if name in network.speciesIndices:
+				outConcs[:,idx] = netConcs[:,network.speciesIndices[name]]
+		return outConcs
+
+	def _getChunks(self, conditions):
+		nConds = len(conditions)
+		chunkSize = max(1, math.ceil(nConds / (4*self.nWorkers))) if self.chunkSize is None else self.chunkSize
+		return [conditions[idx:idx+chunkSize] for idx in range(0, nConds, chunkSize)]
+
+	def _getWorkerInitArgs(self):
+		return (self.reactions, self.startReactants, self.variableConcSpecies, self.timeStep, self.solverKwargs)
+
+
+def getConditionGrid(potentials, temperatures=(300,), pHs=(0,)):
+	""" Gets every combination of the input values, with potential varying fastest
+
+	Args:
+		potentials: (iter of float)
+		temperatures: (iter of float)
+		pHs: (iter of float)
+
+	Returns
+		conditions: (nConditions x 3 float array) Each row is (potential, temperature, pH)
+
+	"""
+	outRows = [ [pot, temp, pH] for pH, temp, pot in it.product(pHs, temperatures, potentials) ]
+	return np.array(outRows, dtype=float).reshape(-1,3)
+
+
+def _initWorker(reactions, startReactants, variableConcSpecies, timeStep, solverKwargs):
+	fixedReactants = [x for x in startReactants if x.name not in variableConcSpecies]
+	controller = coreHelp.ReactionControllerStandard(startReactants, reactions, timeStep, constantConcReactants=fixedReactants)
+	_WORKER_STATE["controller"] = controller
+	_WORKER_STATE["solverKwargs"] = solverKwargs
+
+
+def _runChunk(conditions):
+	controller, solverKwargs = _WORKER_STATE["controller"], _WORKER_STATE["solverKwargs"]
+	outConcs = np.full( (len(conditions), len(controller.startReactants)), np.nan )
+	for idx, (potential, temperature, pH) in enumerate(conditions):
+		controller.reset()
+		controller.potential, controller.temperature, controller.pH = potential, temperature, pH
+		try:
+			driveHelp.solveSteadyState(controller, **solverKwargs)
+		except ValueError:
+			continue
+		outConcs[idx] = [x.conc for x in controller.currentReactants]
+	return outConcs
+
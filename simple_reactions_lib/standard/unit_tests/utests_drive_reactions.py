@@ -2,6 +2,13 @@
 import unittest
 import unittest.mock as mock
 
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.core_units as unitHelp
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.propagators as propHelp
+import simple_reactions_lib.core.waveforms as waveHelp
 import simple_reactions_lib.standard.drive_reactions as tCode
 
 
@@ -41,4 +48,299 @@ class TestDriveUntilSteadyState(unittest.TestCase):
 		self.assertEqual(expIdx, actIdx)
 
 
+class TestSolveSteadyState(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.concA = 0.1
+		self.maxBursts = 2
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		adsorb = coreHelp.BetterReactionTemplate(["A","free"], ["A_ads"], 0.5, 1e13)
+		desorb = coreHelp.BetterReactionTemplate(["A_ads"], ["A","free"], 0.6, 1e13)
+		self.reactions = [adsorb, desorb]
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","free","A_ads"], [self.concA,1,0])]
+		fixedReactants = [coreHelp.ChemSpeciesStd("A", self.concA)]
+		self.controllerStandard = coreHelp.ReactionControllerStandard(self.startReactants, self.reactions, 1e-8, temperature=self.temperature, constantConcReactants=fixedReactants)
+		propagator = propHelp.ConcsPropagator_Radau(contrHelp.CompiledRateCalculator(self.reactions), ["free","A_ads"])
+		self.controllerImproved = contrHelp.ReactionControllerImproved(propagator, self.startReactants, temperature=self.temperature)
+
+	def _getExpCoverage(self):
+		kAds, kDes = [x.getRateConstant(None, self.temperature) for x in self.reactions]
+		return kAds*self.concA / (kAds*self.concA + kDes)
+
+	def _runTestFunct(self, controller):
+		return tCode.solveSteadyState(controller, maxBursts=self.maxBursts)
+
+	def testExpectedCoverageForBothControllers(self):
+		expCoverage = self._getExpCoverage()
+		for controller in [self.controllerStandard, self.controllerImproved]:
+			self._runTestFunct(controller)
+			actConcs = {x.name:x.conc for x in controller.currentReactants}
+			self.assertAlmostEqual(expCoverage, actConcs["A_ads"])
+			self.assertAlmostEqual(1-expCoverage, actConcs["free"])
+			self.assertEqual(self.concA, actConcs["A"])
+
+	@mock.patch("simple_reactions_lib.core.steady_state.SteadyStateSolver.solve")
+	def testIntegrationBurstsUsedWhenSolveFails(self, mockSolve):
+		notConverged = {"converged":False, "pseudoTime":1e-6, "timeScale":1e-9}
+		converged = {"converged":True}
+		mockSolve.side_effect = [ [None, notConverged], [None, notConverged], [mock.MagicMock(), converged] ]
+		self.controllerImproved.moveForwardByT = mock.Mock()
+		info = self._runTestFunct(self.controllerImproved)
+		self.assertEqual(2, info["nBursts"])
+		self.assertEqual(2, self.controllerImproved.moveForwardByT.call_count)
+
+	@mock.patch("simple_reactions_lib.core.steady_state.SteadyStateSolver.solve")
+	def testRaisesIfNeverConverged(self, mockSolve):
+		mockSolve.return_value = [None, {"converged":False, "pseudoTime":1e-6, "timeScale":1e-9}]
+		self.controllerStandard.doNextNSteps = mock.Mock()
+		with self.assertRaises(ValueError):
+			self._runTestFunct(self.controllerStandard)
+		self.assertEqual(self.maxBursts, self.controllerStandard.doNextNSteps.call_count)
+
+
+class TestSteadyStateContinuation(unittest.TestCase):
+
+	def setUp(self):
+		self.temperature = 300
+		self.concA = 0.1
+		self.potentials = [-0.2, -0.15, -0.1, -0.05]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		adsorb = coreHelp.BetterReactionTemplate(["A","free"], ["A_ads"], 0.5, 1e13, nElecTransfer=-1)
+		desorb = coreHelp.BetterReactionTemplate(["A_ads"], ["A","free"], 0.55, 1e13, nElecTransfer=1)
+		self.reactions = [adsorb, desorb]
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","free","A_ads","spectator"], [self.concA,1,0,4])]
+		fixedReactants = [x for x in self.startReactants if x.name in ["A","spectator"]]
+		self.controller = coreHelp.ReactionControllerStandard(self.startReactants, self.reactions, 1e-8, temperature=self.temperature, potential=self.potentials[0], constantConcReactants=fixedReactants)
+
+	def _getExpCoverage(self, potential):
+		kAds, kDes = [x.getRateConstant(None, self.temperature, potential=potential) for x in self.reactions]
+		return kAds*self.concA / (kAds*self.concA + kDes)
+
+	def testSteadyStatesAlongPotential(self):
+		expCoverages = [self._getExpCoverage(x) for x in self.potentials]
+		actConcs = tCode.getSteadyStatesAlongParam(self.controller, self.potentials)
+		self.assertEqual( (len(self.potentials), len(self.startReactants)), actConcs.shape )
+		for exp, act in zip(expCoverages, actConcs[:,2]):
+			self.assertAlmostEqual(exp, act)
+		self.assertTrue( np.allclose(4, actConcs[:,3]) )
+
+	def testControllerNotModified(self):
+		tCode.getSteadyStatesAlongParam(self.controller, self.potentials)
+		self.assertEqual(self.potentials[0], self.controller.potential)
+		self.assertEqual(0, self.controller.currentReactants[2].conc)
+
+	def testTraceBranchEndsAtEndValue(self):
+		paramVals, actConcs = tCode.traceSteadyStateBranch(self.controller, self.potentials[-1])
+		self.assertEqual(self.potentials[0], paramVals[0])
+		self.assertGreaterEqual(paramVals[-1], self.potentials[-1])
+		for potential, coverage in zip(paramVals, actConcs[:,2]):
+			self.assertAlmostEqual(self._getExpCoverage(potential), coverage)
+
+	def testUnknownParamRaises(self):
+		with self.assertRaises(ValueError):
+			tCode.getSteadyStatesAlongParam(self.controller, self.potentials, paramName="pressure")
+
+
+class TestSteadyStateSensitivities(unittest.TestCase):
+	""" A+free <-> A_ads, A_ads -> B+free with A and B fixed; coverage is kAds[A]/(kAds[A]+kDes+kOut) """
+
+	def setUp(self):
+		self.temperature = 300
+		self.concA = 0.1
+		self.potentials = [-0.2, -0.1, 0.0]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		adsorb = coreHelp.BetterReactionTemplate(["A","free"], ["A_ads"], 0.5, 1e13, nElecTransfer=-1)
+		desorb = coreHelp.BetterReactionTemplate(["A_ads"], ["A","free"], 0.55, 1e13, nElecTransfer=1)
+		react = coreHelp.BetterReactionTemplate(["A_ads"], ["B","free"], 0.6, 1e13)
+		self.reactions = [adsorb, desorb, react]
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","free","A_ads","B"], [self.concA,1,0,0])]
+		fixedReactants = [x for x in self.startReactants if x.name in ["A","B"]]
+		self.controller = coreHelp.ReactionControllerStandard(self.startReactants, self.reactions, 1e-8, temperature=self.temperature, potential=self.potentials[0], constantConcReactants=fixedReactants)
+
+	def _getRateTerms(self, potential):
+		kAds, kDes, kOut = [x.getRateConstant(None, self.temperature, potential=potential) for x in self.reactions]
+		return kAds*self.concA, kDes, kOut
+
+	def testCoverageSensitivitiesMatchAnalytic(self):
+		adsTerm, kDes, kOut = self._getRateTerms(self.potentials[0])
+		totalTerm = adsTerm + kDes + kOut
+		coverage = adsTerm / totalTerm
+		expVals = [coverage*(1-adsTerm/totalTerm), -coverage*kDes/totalTerm, -coverage*kOut/totalTerm]
+		result = tCode.getSteadyStateSensitivities(self.controller)
+		actVals = result.getConcSensitivities()[list(result.varIndices).index(result.network.speciesIndices["A_ads"])]
+		self.assertTrue( np.allclose(expVals, actVals) )
+		self.assertEqual(0, self.controller.currentReactants[2].conc)
+
+	def testDegreesOfRateControlAlongPotential(self):
+		expVals = list()
+		for potential in self.potentials:
+			adsTerm, kDes, kOut = self._getRateTerms(potential)
+			totalTerm = adsTerm + kDes + kOut
+			expVals.append( [1-adsTerm/totalTerm, -kDes/totalTerm, 1-kOut/totalTerm] )
+		actVals = tCode.getDegreesOfRateControlAlongParam(self.controller, self.potentials, "B")
+		self.assertTrue( np.allclose(expVals, actVals) )
+		self.assertTrue( np.allclose(1, np.sum(actVals, axis=1)) )
+
+
+class TestGetPolarisationCurve(unittest.TestCase):
+	""" A+free <-> A_ads (electrochemical), A_ads -> B+free; the net current at steady state is F*kOut*coverage """
+
+	def setUp(self):
+		self.temperature = 300
+		self.concA = 0.1
+		self.potentials = np.linspace(-0.2, 0.0, 5)
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		adsorb = coreHelp.BetterReactionTemplate(["A","free"], ["A_ads"], 0.5, 1e13, nElecTransfer=-1)
+		desorb = coreHelp.BetterReactionTemplate(["A_ads"], ["A","free"], 0.55, 1e13, nElecTransfer=1)
+		react = coreHelp.BetterReactionTemplate(["A_ads"], ["B","free"], 0.6, 1e13)
+		self.reactions = [adsorb, desorb, react]
+		startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","free","A_ads","B"], [self.concA,1,0,0])]
+		rateCalculator = contrHelp.CompiledRateCalculator(self.reactions)
+		propagator = propHelp.ConcsPropagator_BDF(rateCalculator, ["free","A_ads"])
+		self.controller = contrHelp.ReactionControllerImproved(propagator, startReactants, temperature=self.temperature, potential=self.potentials[0])
+
+	def testNetCurrentMatchesAnalytic(self):
+		expVals = list()
+		for potential in self.potentials:
+			kAds, kDes, kOut = [x.getRateConstant(None, self.temperature, potential=potential) for x in self.reactions]
+			coverage = kAds*self.concA / (kAds*self.concA + kDes + kOut)
+			expVals.append( unitHelp.FARADAY_CONST*kOut*coverage )
+		actCurve = tCode.getPolarisationCurve(self.controller, self.potentials)
+		self.assertTrue( np.allclose(expVals, actCurve.currents) )
+		self.assertTrue( np.allclose(actCurve.currents, actCurve.anodicCurrents + actCurve.cathodicCurrents) )
+		self.assertEqual(0, self.controller.currentReactants[2].conc)
+
+	def testSteadyStateAtInstantaneousWaveformPotential(self):
+		self.controller.potential = waveHelp.CyclicVoltammetry(-0.1, [0.1, -0.2], 0.5)
+		self.controller.time = 0.2 #Potential is 0.0 here
+		kAds, kDes, kOut = [x.getRateConstant(None, self.temperature, potential=0.0) for x in self.reactions]
+		expCoverage = kAds*self.concA / (kAds*self.concA + kDes + kOut)
+		tCode.solveSteadyState(self.controller)
+		self.assertAlmostEqual(expCoverage, self.controller.currentReactants[2].conc)
+		actConcs = tCode.getSteadyStatesAlongParam(self.controller, [self.temperature], paramName="temperature")
+		self.assertAlmostEqual(expCoverage, actConcs[0][2])
+		self.assertIsNotNone( tCode.getSteadyStateSensitivities(self.controller) )
+
+
+class TestRunPotentialProgram(unittest.TestCase):
+	""" A+free <-> A_ads (electrochemical) only, starting at equilibrium; every electron goes into adsorbed A, so the integrated current is F*(change in coverage) """
+
+	def setUp(self):
+		self.temperature = 300
+		self.concA = 0.1
+		self.startPotential = -0.1
+		self.sampleInterval = 0.01
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		adsorb = coreHelp.BetterReactionTemplate(["A","free"], ["A_ads"], 0.5, 1e13, nElecTransfer=-1)
+		desorb = coreHelp.BetterReactionTemplate(["A_ads"], ["A","free"], 0.55, 1e13, nElecTransfer=1)
+		kAds, kDes = [x.getRateConstant(None, self.temperature, potential=self.startPotential) for x in [adsorb, desorb]]
+		self.startCoverage = kAds*self.concA / (kAds*self.concA + kDes)
+		startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","free","A_ads"], [self.concA,1-self.startCoverage,self.startCoverage])]
+		rateCalculator = contrHelp.CompiledRateCalculator([adsorb, desorb])
+		propagator = propHelp.ConcsPropagator_Persistent(rateCalculator, ["free","A_ads"], solverOptions={"rtol":1e-10, "atol":1e-12})
+		self.controller = contrHelp.ReactionControllerImproved(propagator, startReactants, temperature=self.temperature, potential=self.startPotential)
+		self.waveform = waveHelp.CyclicVoltammetry(-0.1, [0.1, -0.2], 0.5)
+
+	def _runTestFunct(self):
+		return tCode.runPotentialProgram(self.controller, self.waveform, self.sampleInterval)
+
+	def testSamplesAndPotentials(self):
+		actTimes, actCurve = self._runTestFunct()
+		expTimes = np.linspace(0, self.waveform.endTime, len(actTimes))
+		self.assertTrue( np.allclose(expTimes, actTimes) )
+		self.assertAlmostEqual(self.sampleInterval, actTimes[1]-actTimes[0])
+		self.assertTrue( np.allclose(self.waveform.getPotential(actTimes), actCurve.potentials) )
+
+	def testIntegratedCurrentMatchesCoverage(self):
+		self.sampleInterval = 1e-3
+		actTimes, actCurve = tCode.runPotentialProgram(self.controller, self.waveform, self.sampleInterval, endTime=0.4)
+		self.assertAlmostEqual(0.4, actTimes[-1])
+		expCharge = unitHelp.FARADAY_CONST * (self.controller.currentReactants[2].conc - self.startCoverage)
+		actCharge = np.sum( np.diff(actTimes) * (actCurve.currents[1:]+actCurve.currents[:-1]) / 2 )
+		self.assertAlmostEqual(1, actCharge/expCharge, places=3)
+
+	def testControllerStateRestored(self):
+		self._runTestFunct()
+		self.assertEqual(self.startPotential, self.controller.potential)
+		self.assertAlmostEqual(self.waveform.endTime, self.controller.time)
+		self.assertEqual(0, len(self.controller.observers))
+
+	def testStandardControllerRaises(self):
+		controller = coreHelp.ReactionControllerStandard(self.controller.startReactants, list(), 1e-3)
+		with self.assertRaises(ValueError):
+			tCode.runPotentialProgram(controller, self.waveform, self.sampleInterval)
+
+
+class TestRunUntilSteadyState(unittest.TestCase):
+	""" A+B <-> C with [B] fixed; at equilibrium [C]/[A] = [B]*k_f/k_b """
+
+	def setUp(self):
+		self.temperature = 300
+		self.rTol = 1e-6
+		self.startTime = 1e-6
+		self.growthFactor = 2
+		self.maxTime = 1e8
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		reactionA = coreHelp.BetterReactionTemplate(["A","B"], ["C"], 0.7, 1e13)
+		reactionB = coreHelp.BetterReactionTemplate(["C"], ["A","B"], 0.75, 1e13)
+		startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","B","C"], [1,0.5,0])]
+		self.rateCalculator = contrHelp.CompiledRateCalculator([reactionA, reactionB])
+		propagator = propHelp.ConcsPropagator_DOP853(self.rateCalculator, ["A","C"], aTol=1e-12, rTol=1e-10)
+		self.controller = contrHelp.ReactionControllerImproved(propagator, startReactants, temperature=self.temperature)
+
+	def _runTestFunct(self):
+		kwargs = {"rTol":self.rTol, "startTime":self.startTime, "growthFactor":self.growthFactor, "maxTime":self.maxTime}
+		return tCode.runUntilSteadyState(self.controller, **kwargs)
+
+	def testReachesEquilibrium(self):
+		rateConsts = self.rateCalculator.network.getRateConstants(self.temperature)
+		expRatio = 0.5*rateConsts[0]/rateConsts[1]
+		self._runTestFunct()
+		concA, concB, concC = [x.conc for x in self.controller.currentReactants]
+		self.assertAlmostEqual(expRatio, concC/concA, places=4)
+
+	def testHorizonsGrowGeometrically(self):
+		info = self._runTestFunct()
+		self.assertAlmostEqual(self.startTime*(self.growthFactor**info["nIter"] - 1), info["time"])
+		self.assertLess(info["nIter"], 40)
+
+	def testIntegratorRatesReused(self):
+		with mock.patch.object(self.rateCalculator.network, "getRatesOfChange", wraps=self.rateCalculator.network.getRatesOfChange) as mockRates:
+			info = self._runTestFunct()
+		self.assertEqual(info["nIter"], info["nReusedRates"])
+		mockRates.assert_not_called()
+
+	def testInstantaneousRatesUsedWithoutIntegratorRates(self):
+		with mock.patch.object(propHelp.ConcsPropagator_DOP853, "getLastRatesOfChange", return_value=None):
+			with mock.patch.object(self.rateCalculator, "getRates", wraps=self.rateCalculator.getRates) as mockGetRates:
+				info = self._runTestFunct()
+		self.assertEqual(0, info["nReusedRates"])
+		self.assertEqual(info["nIter"], mockGetRates.call_count)
+		rateDict = self.rateCalculator.getRates(self.controller.currentReactants, temperature=self.temperature)
+		for reactant in self.controller.currentReactants:
+			if reactant.name in ["A","C"]:
+				self.assertLessEqual( abs(rateDict[reactant.name]), 1e-15 + self.rTol*reactant.conc )
+
+	def testKMCPropagatorRaisesValueError(self):
+		propagator = propHelp.ConcsPropagator_KMC.fromReactions(self.rateCalculator.reactions, ["A","C"], 100)
+		self.controller = contrHelp.ReactionControllerImproved(propagator, self.controller.startReactants, temperature=self.temperature)
+		with self.assertRaises(ValueError):
+			self._runTestFunct()
 
+	def testRaisesIfNotReachedByMaxTime(self):
+		self.maxTime = 1e-3
+		with self.assertRaises(ValueError):
+			self._runTestFunct()
@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.core_units as unitHelp
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.instrumentation as instrHelp
+import simple_reactions_lib.core.propagators as propHelp
+import simple_reactions_lib.standard.my_mg_reactions_net_rates as tCode
+
+
+class TestLogConcsAtPolarisedPotentials(unittest.TestCase):
+	""" Regression test: integrating ln([X]) (CompiledRateCalculator(logConcs=True)) on the net-rates model at strongly cathodic potentials used to fail outright (Radau step size collapse) or cost ~60 times the RHS calls of the linear form, with the site total drifting """
+
+	def setUp(self):
+		self.temperature = 300
+		self.timeStep = 1e4
+		self.potentials = [-1.6, -1.4]
+		self.variableConcSpecies = ["free", "h_ads", "oh_ads"]
+		self.surfaceStarts = [ [1.0, 0.0, 0.0], [0.5, 0.3, 0.2] ]
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		prefactor = (unitHelp.BOLTZ_EV*self.temperature) / 4.135667696e-15
+		self.reactions = [ tCode.TafelReactionNet(1.26, prefactor, 0.23),
+		                   tCode.Heyrovsky_waterAssistedNet(0.28, prefactor, -1.07),
+		                   tCode.VolmerReactionNet(0.66, prefactor, -1.37),
+		                   tCode.OHAssistedDissolutionReaction_twoElectronXferNet(1.6, prefactor, -2.0),
+		                   tCode.WaterAssistReaction_twoElectronXferNet(1.6, prefactor, -2.0),
+		                   tCode.HydrogenBulkDiffusionNet(0.53, prefactor, 0.15),
+		                   tCode.CathodicOHDesorption(0.9+0.4, prefactor, 0.9) ]
+		self.fixedConcs = [ ["mg2+",2e-5], ["h+",1e-7], ["oh-",1e-7], ["h2",1e-5], ["h_diffused",1e-5] ]
+
+	def _runTestFunct(self, logConcs, surfaceConcs, potential):
+		propagator = propHelp.ConcsPropagator_Radau(contrHelp.CompiledRateCalculator(self.reactions, logConcs=logConcs), self.variableConcSpecies)
+		instrumentation = instrHelp.Instrumentation()
+		instrHelp.enableInstrumentation(propagator, instrumentation)
+		startConcs = list(zip(self.variableConcSpecies, surfaceConcs)) + self.fixedConcs
+		currReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in startConcs]
+		propagator.propagate(currReactants, self.timeStep, temperature=self.temperature, potential=potential)
+		outConcs = np.array([x.conc for x in currReactants[:len(self.variableConcSpecies)]])
+		return outConcs, instrumentation.solverCalls[0]["nfev"]
+
+	def testCheaperThanLinearConcsAndSitesConserved(self):
+		for potential in self.potentials:
+			for surfaceConcs in self.surfaceStarts:
+				expConcs, linearNfev = self._runTestFunct(False, surfaceConcs, potential)
+				actConcs, logNfev = self._runTestFunct(True, surfaceConcs, potential)
+				self.assertLessEqual(logNfev, linearNfev)
+				self.assertAlmostEqual(1, np.sum(actConcs), places=12)
+				self.assertTrue( np.allclose(expConcs, actConcs, rtol=1e-3, atol=1e-6) )
+
+
+if __name__ == '__main__':
+	unittest.main()
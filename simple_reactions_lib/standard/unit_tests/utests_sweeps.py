@@ -0,0 +1,111 @@
+
+import copy
+import unittest
+import unittest.mock as mock
+
+import numpy as np
+
+import simple_reactions_lib.core.core_classes as coreHelp
+import simple_reactions_lib.core.improved_controller as contrHelp
+import simple_reactions_lib.core.propagators as propHelp
+import simple_reactions_lib.standard.drive_reactions as driveHelp
+import simple_reactions_lib.standard.sweeps as tCode
+
+
+class TestGetConditionGrid(unittest.TestCase):
+
+	def testPotentialVariesFastest(self):
+		expGrid = [ [-0.1, 300, 7], [0.1, 300, 7],
+		            [-0.1, 310, 7], [0.1, 310, 7] ]
+		actGrid = tCode.getConditionGrid([-0.1, 0.1], temperatures=[300,310], pHs=[7])
+		self.assertEqual(expGrid, actGrid.tolist())
+
+
+class TestSweepRunner(unittest.TestCase):
+
+	def setUp(self):
+		self.nWorkers = 1
+		self.chunkSize = 2
+		self.conditions = tCode.getConditionGrid([-0.2, -0.1, 0.0], temperatures=[300, 320])
+		self.createTestObjs()
+
+	def createTestObjs(self):
+		adsorb = coreHelp.BetterReactionTemplate(["A","free"], ["A_ads"], 0.5, 1e13, nElecTransfer=-1)
+		desorb = coreHelp.BetterReactionTemplate(["A_ads"], ["A","free"], 0.6, 1e13, nElecTransfer=1)
+		self.reactions = [adsorb, desorb]
+		self.startReactants = [coreHelp.ChemSpeciesStd(name,conc) for name,conc in zip(["A","free","A_ads"], [0.1,1,0])]
+		self.variableSpecies = ["free", "A_ads"]
+		self.testObjA = tCode.SweepRunner(self.reactions, self.startReactants, self.variableSpecies, nWorkers=self.nWorkers, chunkSize=self.chunkSize)
+
+	def _getExpConcs(self):
+		outConcs = list()
+		fixedReactants = [x for x in self.startReactants if x.name not in self.variableSpecies]
+		for potential, temperature, pH in self.conditions:
+			controller = coreHelp.ReactionControllerStandard(copy.deepcopy(self.startReactants), self.reactions, 1e-6, temperature=temperature, pH=pH, potential=potential, constantConcReactants=fixedReactants)
+			driveHelp.solveSteadyState(controller)
+			outConcs.append( [x.conc for x in controller.currentReactants] )
+		return np.array(outConcs)
+
+	def _runTestFunct(self):
+		return self.testObjA.run(self.conditions)
+
+	def testSerialMatchesIndividualSolves(self):
+		expConcs = self._getExpConcs()
+		actConcs = self._runTestFunct()
+		self.assertEqual( (len(self.conditions), len(self.startReactants)), actConcs.shape )
+		self.assertTrue( np.allclose(expConcs, actConcs) )
+
+	def testProcessPoolMatchesSerial(self):
+		expConcs = self._runTestFunct()
+		self.nWorkers = 2
+		self.createTestObjs()
+		actConcs = self._runTestFunct()
+		self.assertTrue( np.allclose(expConcs, actConcs) )
+
+	@mock.patch("simple_reactions_lib.standard.sweeps.concurrent.futures.ProcessPoolExecutor")
+	def testNetworkSentOnceAndConditionsChunked(self, mockExecutorClass):
+		self.nWorkers = 2
+		self.createTestObjs()
+		mockExecutor = mockExecutorClass.return_value.__enter__.return_value
+		mockExecutor.map.side_effect = lambda funct, chunks: [np.zeros((len(x),3)) for x in chunks]
+		self._runTestFunct()
+
+		initArgs = mockExecutorClass.call_args[1]["initargs"]
+		self.assertEqual(self.reactions, initArgs[0])
+		chunks = mockExecutor.map.call_args[0][1]
+		self.assertEqual([2,2,2], [len(x) for x in chunks])
+		self.assertEqual(self.conditions.tolist(), np.concatenate(chunks).tolist())
+
+	@mock.patch("simple_reactions_lib.standard.sweeps.concurrent.futures.ProcessPoolExecutor")
+	def testPoolOnlyUsedForMultipleChunks(self, mockExecutorClass):
+		self.nWorkers, self.chunkSize = 4, len(self.conditions)
+		self.createTestObjs()
+		expConcs = self._getExpConcs()
+		actConcs = self._runTestFunct()
+		mockExecutorClass.assert_not_called()
+		self.assertTrue( np.allclose(expConcs, actConcs) )
+
+		self.chunkSize = 4 #Two chunks, so only two workers are worth starting
+		self.createTestObjs()
+		mockExecutor = mockExecutorClass.return_value.__enter__.return_value
+		mockExecutor.map.side_effect = lambda funct, chunks: [np.zeros((len(x),3)) for x in chunks]
+		self._runTestFunct()
+		self.assertEqual(2, mockExecutorClass.call_args[1]["max_workers"])
+
+	def testRunForTimeMatchesIndividualControllers(self):
+		time, expConcs = 1e-3, list()
+		solverOptions = {"rtol":1e-8, "atol":1e-12}
+		for potential, temperature, pH in self.conditions:
+			propagator = propHelp.ConcsPropagator_BDF(contrHelp.CompiledRateCalculator(self.reactions), self.variableSpecies, solverOptions=solverOptions)
+			controller = contrHelp.ReactionControllerImproved(propagator, self.startReactants, temperature=temperature, potential=potential)
+			controller.moveForwardByT(time)
+			expConcs.append( [x.conc for x in controller.currentReactants] )
+		actConcs = self.testObjA.runForTime(self.conditions, time, solverOptions=solverOptions)
+		self.assertTrue( np.allclose(expConcs, actConcs, rtol=1e-5, atol=1e-10) )
+
+	@mock.patch("simple_reactions_lib.standard.drive_reactions.solveSteadyState")
+	def testFailedConditionsAreNaN(self, mockSolve):
+		mockSolve.side_effect = ValueError("")
+		actConcs = self._runTestFunct()
+		self.assertTrue( np.all(np.isnan(actConcs)) )
+